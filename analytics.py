@@ -0,0 +1,268 @@
+import os
+import shutil
+from datetime import datetime
+
+from sqlalchemy import select
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:  # Optional, only needed for `flask export-analytics`
+    pa = None
+    ds = None
+    pq = None
+
+from app import db
+from models import Task, Route, Message, Log, LogIpAddress, LogUserAgent, Document
+
+# Partition written for rows without a timestamp
+UNKNOWN_PARTITION = 'unknown'
+
+
+def _tables():
+    """
+    Exported tables: name -> (model, select, partition column, partition field, [(field, arrow type)])
+
+    Enum and low-cardinality string columns are dictionary-encoded. Message
+    bodies and stored file paths are left out; BI only needs the metadata.
+    company_id is not stored in the files: it is the company_id=N directory
+    partition, and a file column of the same name would clash with it.
+    """
+    category = pa.dictionary(pa.int32(), pa.string())
+    timestamp = pa.timestamp('us')
+
+    return {
+        'tasks': (
+            Task,
+            select(
+                Task.id, Task.title, Task.status, Task.created_at, Task.updated_at,
+                Task.deadline, Task.creator_id, Task.assignee_id
+            ),
+            Task.created_at,
+            'created_at',
+            [
+                ('id', pa.int64()), ('title', pa.string()), ('status', category),
+                ('created_at', timestamp), ('updated_at', timestamp), ('deadline', timestamp),
+                ('creator_id', pa.int64()), ('assignee_id', pa.int64())
+            ]
+        ),
+        'routes': (
+            Route,
+            # Route has no creation time of its own; partition by its task's
+            select(
+                Route.id, Route.start_point, Route.end_point, Route.distance,
+                Route.estimated_time, Route.start_time, Route.end_time, Route.status,
+                Route.driver_id, Route.task_id, Task.created_at.label('task_created_at')
+            ).join(Task, Route.task_id == Task.id),
+            Task.created_at,
+            'task_created_at',
+            [
+                ('id', pa.int64()), ('start_point', pa.string()), ('end_point', pa.string()),
+                ('distance', pa.float64()), ('estimated_time', pa.int32()),
+                ('start_time', timestamp), ('end_time', timestamp), ('status', category),
+                ('driver_id', pa.int64()), ('task_id', pa.int64()),
+                ('task_created_at', timestamp)
+            ]
+        ),
+        'messages': (
+            Message,
+            select(
+                Message.id, Message.sent_at, Message.is_read, Message.sender_id,
+                Message.recipient_id, Message.task_id
+            ),
+            Message.sent_at,
+            'sent_at',
+            [
+                ('id', pa.int64()), ('sent_at', timestamp), ('is_read', pa.bool_()),
+                ('sender_id', pa.int64()), ('recipient_id', pa.int64()),
+                ('task_id', pa.int64())
+            ]
+        ),
+        'logs': (
+            Log,
+            select(
+                Log.id, Log.action_type, Log.description, Log.timestamp,
+                LogIpAddress.value.label('ip_address'), LogUserAgent.value.label('user_agent'),
+                Log.user_id
+            ).outerjoin(LogIpAddress, Log.ip_address_id == LogIpAddress.id)
+            .outerjoin(LogUserAgent, Log.user_agent_id == LogUserAgent.id),
+            Log.timestamp,
+            'timestamp',
+            [
+                ('id', pa.int64()), ('action_type', category), ('description', pa.string()),
+                ('timestamp', timestamp), ('ip_address', category), ('user_agent', category),
+                ('user_id', pa.int64())
+            ]
+        ),
+        'documents': (
+            Document,
+            select(
+                Document.id, Document.title, Document.file_type, Document.size,
+                Document.uploaded_at, Document.document_category, Document.uploader_id,
+                Document.task_id, Document.route_id
+            ),
+            Document.uploaded_at,
+            'uploaded_at',
+            [
+                ('id', pa.int64()), ('title', pa.string()), ('file_type', category),
+                ('size', pa.int64()), ('uploaded_at', timestamp), ('document_category', category),
+                ('uploader_id', pa.int64()), ('task_id', pa.int64()), ('route_id', pa.int64())
+            ]
+        )
+    }
+
+
+EXPORT_TABLES = ('tasks', 'routes', 'messages', 'logs', 'documents')
+
+
+def month_start(value):
+    """
+    First moment of the month containing value
+    """
+    return datetime(value.year, value.month, 1)
+
+
+def _partition_key(value):
+    return value.strftime('%Y-%m') if value else UNKNOWN_PARTITION
+
+
+def _column_value(value):
+    # Enums are exported by value
+    return value.value if hasattr(value, 'value') and not isinstance(value, (str, bytes)) else value
+
+
+class _PartitionWriter:
+    """
+    Writes one table's rows into month=YYYY-MM/part-0.parquet files
+
+    Rows arrive ordered by the partition column, so only one Parquet file is
+    open at a time.
+    """
+
+    def __init__(self, table_dir, schema):
+        self.table_dir = table_dir
+        self.schema = schema
+        self.partitions = []
+        self._key = None
+        self._writer = None
+
+    def write(self, key, rows):
+        if key != self._key:
+            self.close()
+            partition_dir = os.path.join(self.table_dir, f'month={key}')
+            # Partitions are always rewritten whole, see export_company_analytics
+            shutil.rmtree(partition_dir, ignore_errors=True)
+            os.makedirs(partition_dir)
+            self._writer = pq.ParquetWriter(
+                os.path.join(partition_dir, 'part-0.parquet'),
+                self.schema,
+                compression='snappy'
+            )
+            self._key = key
+            self.partitions.append(key)
+
+        columns = [
+            pa.array([_column_value(row[index]) for row in rows], type=field.type)
+            for index, field in enumerate(self.schema)
+        ]
+        self._writer.write_batch(pa.record_batch(columns, schema=self.schema))
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+def export_company_analytics(company_id, output_dir, since=None, tables=EXPORT_TABLES, batch_size=10000):
+    """
+    Export a company's operational data as month-partitioned Parquet files
+
+    Files are laid out Hive-style as
+    {output_dir}/{table}/company_id={id}/month=YYYY-MM/part-0.parquet so BI
+    tools can prune by company and month; company_id and month are read
+    from the directory names, e.g. pq.read_table(f'{output_dir}/tasks').
+    Each exported table is opened that way once as a check. Rows are read in batches with a
+    server-side cursor and written one record batch at a time, so memory use
+    does not depend on table size. since is rounded down to the start of its
+    month, so every partition that is written is complete and replaces the
+    previous export of that month.
+
+    Args:
+        company_id: ID of the company to export
+        output_dir: Root directory of the export
+        since: Optional datetime; only months from this one onwards are exported
+        tables: Names of the tables to export (see EXPORT_TABLES)
+        batch_size: Rows fetched and written per batch
+
+    Returns:
+        Dictionary of table name -> {'rows': count, 'partitions': [month keys]}
+    """
+    if pa is None:
+        raise RuntimeError('pyarrow is required for analytics exports (pip install pyarrow)')
+
+    table_specs = _tables()
+    unknown = [name for name in tables if name not in table_specs]
+    if unknown:
+        raise ValueError(f"Unknown analytics tables: {', '.join(unknown)}")
+
+    summary = {}
+    for name in tables:
+        model, query, partition_column, partition_field, fields = table_specs[name]
+        schema = pa.schema([pa.field(key, arrow_type) for key, arrow_type in fields])
+        partition_index = schema.get_field_index(partition_field)
+
+        query = query.where(model.company_id == company_id)
+        if since is not None:
+            query = query.where(partition_column >= month_start(since))
+        query = query.order_by(partition_column, model.id)
+
+        table_dir = os.path.join(output_dir, name, f'company_id={company_id}')
+        if since is None:
+            # A full export replaces everything, including months that no longer have rows
+            shutil.rmtree(table_dir, ignore_errors=True)
+        os.makedirs(table_dir, exist_ok=True)
+
+        writer = _PartitionWriter(table_dir, schema)
+        row_count = 0
+        try:
+            result = db.session.execute(query.execution_options(yield_per=batch_size))
+            for batch in result.partitions():
+                # Split the batch where the month changes
+                start = 0
+                for index in range(1, len(batch) + 1):
+                    if index == len(batch) or \
+                            _partition_key(batch[index][partition_index]) != \
+                            _partition_key(batch[start][partition_index]):
+                        writer.write(_partition_key(batch[start][partition_index]), batch[start:index])
+                        start = index
+                row_count += len(batch)
+        finally:
+            writer.close()
+
+        verify_export(os.path.join(output_dir, name))
+        summary[name] = {'rows': row_count, 'partitions': writer.partitions}
+
+    return summary
+
+
+def verify_export(table_root):
+    """
+    Check that an exported table reads back as one Hive-partitioned dataset
+
+    Discovering the dataset unifies the schemas of all companies' files with
+    the partition columns, which is where mismatches show up.
+
+    Args:
+        table_root: {output_dir}/{table} directory
+
+    Raises:
+        RuntimeError: If the files can't be read together
+    """
+    try:
+        ds.dataset(table_root, format='parquet', partitioning='hive').head(1)
+    except (pa.ArrowException, ValueError) as e:
+        raise RuntimeError(
+            f'Analytics export in {table_root} does not read back ({str(e)}); '
+            f'files from older exports may need a full re-export'
+        ) from e
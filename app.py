@@ -5,6 +5,12 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from flask_login import LoginManager
 from jinja2_filters import register_filters
+from audit import AuditLogWriter
+from pubsub import EventBus
+from jobs import JobQueue
+from geocoding import Geocoder
+from tracking import TrackWriter
+from route_optimizer import RouteOptimizer
 
 
 from config import config
@@ -16,6 +22,12 @@ login_manager = LoginManager()
 login_manager.login_view = 'auth.login'
 login_manager.login_message = 'Please log in to access this page.'
 login_manager.login_message_category = 'info'
+audit_writer = AuditLogWriter()
+event_bus = EventBus()
+job_queue = JobQueue()
+geocoder = Geocoder()
+track_writer = TrackWriter()
+route_optimizer = RouteOptimizer()
 
 
 def create_app(config_name='default'):
@@ -26,6 +38,13 @@ def create_app(config_name='default'):
     db.init_app(app)
     migrate.init_app(app, db)
     login_manager.init_app(app)
+    audit_writer.init_app(app)
+    event_bus.init_app(app)
+    job_queue.init_app(app)
+    geocoder.init_app(app)
+    # After event_bus, whose broker shares last known positions between workers
+    track_writer.init_app(app)
+    route_optimizer.init_app(app)
 
     # Register custom Jinja2 filters
     register_filters(app)
@@ -62,11 +81,17 @@ def create_app(config_name='default'):
     # Import models to ensure they are registered with SQLAlchemy
     from models import users, operations
 
-    # Set up user loader
+    # Set up user loader backed by the in-process user cache
+    from user_cache import UserCache
+    user_cache = UserCache(app)
+
     @login_manager.user_loader
     def load_user(user_id):
-        from models.users import User
-        return User.query.get(int(user_id))
+        return user_cache.load(int(user_id))
+
+    # Resolve role and company once per request
+    from tenant import init_tenant_context
+    init_tenant_context(app)
 
     # Register error handlers
     register_error_handlers(app)
@@ -104,6 +129,9 @@ def create_app(config_name='default'):
     from views.operator import operator as operator_blueprint
     app.register_blueprint(operator_blueprint)
 
+    from views.jobs import jobs as jobs_blueprint
+    app.register_blueprint(jobs_blueprint)
+
     return app
 
 
@@ -0,0 +1,308 @@
+import atexit
+import os
+import queue
+import socket
+import threading
+import time
+from datetime import datetime
+
+
+class LookupCache:
+    """
+    In-process map of log lookup values (IP addresses, user agents) to ids
+
+    Only ids from committed transactions are added, so a rolled back insert
+    can never leave an id in the cache that doesn't exist. The cache is
+    cleared when it grows past max_size; the values repeat so much that it
+    refills within a few batches.
+    """
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self._ids = {}
+        self._lock = threading.Lock()
+
+    def ids_for(self, connection, model, values):
+        """
+        Resolve values to ids, querying the lookup table only for unknown ones
+
+        Args:
+            connection: SQLAlchemy connection of the current transaction
+            model: Lookup model (LogIpAddress or LogUserAgent)
+            values: Iterable of strings
+
+        Returns:
+            Dictionary of value -> id
+        """
+        values = {value for value in values if value}
+        with self._lock:
+            ids = {value: self._ids[value] for value in values if value in self._ids}
+
+        missing = values - ids.keys()
+        if missing:
+            ids.update(model.ids_for(connection, missing))
+        return ids
+
+    def remember(self, ids):
+        """
+        Add ids resolved in a transaction that has been committed
+        """
+        with self._lock:
+            if len(self._ids) + len(ids) > self.max_size:
+                self._ids.clear()
+            self._ids.update(ids)
+
+
+class AuditLogWriter:
+    """
+    Buffered writer for audit log entries
+
+    log_action() hands rows to this writer instead of committing them itself.
+    Rows are kept in a bounded in-memory queue and a background thread writes
+    them to the logs table with one multi-row INSERT per batch. A batch is
+    flushed when it reaches AUDIT_LOG_BATCH_SIZE rows or when
+    AUDIT_LOG_FLUSH_INTERVAL seconds have passed, whichever comes first.
+    IP addresses and user agents are stored once in lookup tables and rows
+    reference them by id; ids already seen are served from LookupCache.
+
+    The counters are per process; the background thread stores them in
+    audit_writer_stats whenever they change so they can be read elsewhere.
+    """
+
+    BACKPRESSURE_DROP = 'drop'
+    BACKPRESSURE_BLOCK = 'block'
+
+    def __init__(self, app=None):
+        self.app = None
+        self.enabled = False
+        self.batch_size = 100
+        self.flush_interval = 2.0
+        self.backpressure = self.BACKPRESSURE_DROP
+        self.block_timeout = 0.5
+
+        self._ip_address_ids = LookupCache()
+        self._user_agent_ids = LookupCache()
+
+        self._queue = None
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'enqueued': 0,
+            'flushed': 0,
+            'dropped': 0,
+            'failed': 0,
+            'batches': 0
+        }
+        self._published_stats = None
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Configure the writer from application settings
+
+        Args:
+            app: Flask application instance
+        """
+        self.app = app
+        self.enabled = app.config.get('AUDIT_LOG_ASYNC', True)
+        self.batch_size = max(1, int(app.config.get('AUDIT_LOG_BATCH_SIZE', 100)))
+        self.flush_interval = float(app.config.get('AUDIT_LOG_FLUSH_INTERVAL', 2.0))
+        self.backpressure = app.config.get('AUDIT_LOG_BACKPRESSURE', self.BACKPRESSURE_DROP)
+        self.block_timeout = float(app.config.get('AUDIT_LOG_BLOCK_TIMEOUT', 0.5))
+        self._queue = queue.Queue(maxsize=int(app.config.get('AUDIT_LOG_QUEUE_SIZE', 10000)))
+        lookup_cache_size = int(app.config.get('AUDIT_LOG_LOOKUP_CACHE_SIZE', 10000))
+        self._ip_address_ids = LookupCache(lookup_cache_size)
+        self._user_agent_ids = LookupCache(lookup_cache_size)
+
+        app.extensions['audit_writer'] = self
+        atexit.register(self.shutdown)
+
+    def enqueue(self, row):
+        """
+        Add a log row to the write buffer
+
+        Args:
+            row: Dictionary of Log column values
+
+        Returns:
+            True if the row was accepted, False if it was dropped
+        """
+        row.setdefault('timestamp', datetime.utcnow())
+
+        if not self.enabled:
+            # Synchronous mode (testing, CLI): write straight through
+            return self._write_batch([row])
+
+        self._ensure_thread()
+
+        try:
+            if self.backpressure == self.BACKPRESSURE_BLOCK:
+                self._queue.put(row, timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(row)
+        except queue.Full:
+            self._bump('dropped')
+            return False
+
+        self._bump('enqueued')
+        return True
+
+    def flush(self):
+        """
+        Write everything currently in the buffer
+
+        Returns:
+            Number of rows written
+        """
+        written = 0
+        with self._flush_lock:
+            while True:
+                batch = self._drain(self.batch_size)
+                if not batch:
+                    break
+                if self._write_batch(batch):
+                    written += len(batch)
+        return written
+
+    def shutdown(self):
+        """
+        Stop the background thread and flush remaining entries
+        """
+        self._stop_event.set()
+        thread = self._thread
+        if thread is not None and thread.is_alive():
+            thread.join(timeout=max(self.flush_interval * 2, 5))
+        if self._queue is not None:
+            self.flush()
+            if self.enabled:
+                self.publish_stats()
+
+    def publish_stats(self):
+        """
+        Store this process's counters in audit_writer_stats if they changed
+
+        Returns:
+            True if the counters were stored, False otherwise
+        """
+        from app import db
+        from models import AuditWriterStats
+
+        stats = self.stats()
+        if stats == self._published_stats:
+            return False
+
+        with self.app.app_context():
+            try:
+                with db.engine.begin() as connection:
+                    AuditWriterStats.store(connection, self.process_key(), stats)
+            except Exception as e:
+                self.app.logger.error(f"Error storing audit log writer stats: {str(e)}")
+                return False
+
+        self._published_stats = stats
+        return True
+
+    @staticmethod
+    def process_key():
+        """
+        Key of the current process in audit_writer_stats
+        """
+        return f"{socket.gethostname()}:{os.getpid()}"
+
+    def stats(self):
+        """
+        Get writer counters
+
+        Returns:
+            Dictionary with enqueued, flushed, dropped, failed and batches counts
+            plus the current queue depth
+        """
+        with self._stats_lock:
+            result = dict(self._stats)
+        result['pending'] = self._queue.qsize() if self._queue is not None else 0
+        return result
+
+    def _ensure_thread(self):
+        # Started lazily so the reloader parent and forked workers each get their own
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._thread_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name='audit-log-writer', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            deadline = time.monotonic() + self.flush_interval
+            batch = []
+
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self._stop_event.is_set():
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            if batch:
+                with self._flush_lock:
+                    self._write_batch(batch)
+
+            self.publish_stats()
+
+    def _drain(self, limit):
+        batch = []
+        while len(batch) < limit:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write_batch(self, batch):
+        from app import db
+        from models import Log, LogIpAddress, LogUserAgent
+
+        # Use a dedicated connection so the caller's session is never committed or rolled back
+        with self.app.app_context():
+            try:
+                with db.engine.begin() as connection:
+                    # Rows reference IP addresses and user agents by id
+                    ip_address_ids = self._ip_address_ids.ids_for(
+                        connection, LogIpAddress, (row.get('ip_address') for row in batch)
+                    )
+                    user_agent_ids = self._user_agent_ids.ids_for(
+                        connection, LogUserAgent, (row.get('user_agent') for row in batch)
+                    )
+                    connection.execute(Log.__table__.insert().values([
+                        self._encode(row, ip_address_ids, user_agent_ids) for row in batch
+                    ]))
+                self._ip_address_ids.remember(ip_address_ids)
+                self._user_agent_ids.remember(user_agent_ids)
+            except Exception as e:
+                self._bump('failed', len(batch))
+                self.app.logger.error(f"Error writing {len(batch)} audit log entries: {str(e)}")
+                return False
+
+        self._bump('flushed', len(batch))
+        self._bump('batches')
+        return True
+
+    @staticmethod
+    def _encode(row, ip_address_ids, user_agent_ids):
+        encoded = {key: value for key, value in row.items() if key not in ('ip_address', 'user_agent')}
+        encoded['ip_address_id'] = ip_address_ids.get(row.get('ip_address'))
+        encoded['user_agent_id'] = user_agent_ids.get(row.get('user_agent'))
+        return encoded
+
+    def _bump(self, key, amount=1):
+        with self._stats_lock:
+            self._stats[key] += amount
@@ -25,6 +25,96 @@ class Config:
     # Pagination
     DEFAULT_PAGE_SIZE = 10
     MAX_PAGE_SIZE = 100
+    CHAT_PAGE_SIZE = 50  # Messages shown when a chat is opened
+
+    # Cached user loader
+    USER_CACHE_ENABLED = os.environ.get('USER_CACHE_ENABLED', 'true').lower() == 'true'
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 60))  # seconds
+    USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 1024))
+
+    # Server-Sent Events; use a redis:// URL when running several worker processes
+    EVENT_BROKER_URL = os.environ.get('EVENT_BROKER_URL', 'memory://')
+    EVENT_STREAM_HEARTBEAT = 15  # seconds between keep-alive comments
+    EVENT_STREAM_MAX_DURATION = 300  # seconds before the client is asked to reconnect
+
+    # Audit log buffering
+    AUDIT_LOG_ASYNC = os.environ.get('AUDIT_LOG_ASYNC', 'true').lower() == 'true'
+    AUDIT_LOG_BATCH_SIZE = int(os.environ.get('AUDIT_LOG_BATCH_SIZE', 100))
+    AUDIT_LOG_FLUSH_INTERVAL = float(os.environ.get('AUDIT_LOG_FLUSH_INTERVAL', 2.0))  # seconds
+    AUDIT_LOG_QUEUE_SIZE = int(os.environ.get('AUDIT_LOG_QUEUE_SIZE', 10000))
+    # 'drop' discards new entries when the queue is full, 'block' waits up to AUDIT_LOG_BLOCK_TIMEOUT first
+    AUDIT_LOG_BACKPRESSURE = os.environ.get('AUDIT_LOG_BACKPRESSURE', 'drop')
+    AUDIT_LOG_BLOCK_TIMEOUT = float(os.environ.get('AUDIT_LOG_BLOCK_TIMEOUT', 0.5))  # seconds
+    # Known IP address and user agent ids kept in memory per process
+    AUDIT_LOG_LOOKUP_CACHE_SIZE = int(os.environ.get('AUDIT_LOG_LOOKUP_CACHE_SIZE', 10000))
+
+    # Audit log partitions: months kept in the database (including the current one);
+    # `flask archive-logs` moves older months to compressed files in LOG_ARCHIVE_FOLDER
+    LOG_RETENTION_MONTHS = int(os.environ.get('LOG_RETENTION_MONTHS', 6))
+    LOG_PARTITIONS_AHEAD = int(os.environ.get('LOG_PARTITIONS_AHEAD', 2))  # PostgreSQL partitions created in advance
+    LOG_ARCHIVE_FOLDER = os.environ.get('LOG_ARCHIVE_FOLDER') or os.path.join(BASE_DIR, 'instance/log_archive')
+
+    # Driver GPS ingestion: pings are buffered in memory and written to driver_positions in bulk
+    GPS_INGEST_ASYNC = os.environ.get('GPS_INGEST_ASYNC', 'true').lower() == 'true'
+    GPS_BATCH_SIZE = int(os.environ.get('GPS_BATCH_SIZE', 1000))  # rows per INSERT
+    GPS_FLUSH_INTERVAL = float(os.environ.get('GPS_FLUSH_INTERVAL', 1.0))  # seconds
+    GPS_QUEUE_SIZE = int(os.environ.get('GPS_QUEUE_SIZE', 100000))  # pings buffered per process
+    GPS_MAX_PINGS_PER_REQUEST = int(os.environ.get('GPS_MAX_PINGS_PER_REQUEST', 500))
+    GPS_MAX_PING_AGE = int(os.environ.get('GPS_MAX_PING_AGE', 86400))  # seconds, pings sent after being offline
+    GPS_MAX_CLOCK_SKEW = int(os.environ.get('GPS_MAX_CLOCK_SKEW', 300))  # seconds a device clock may run ahead
+    GPS_MAX_SPEED = float(os.environ.get('GPS_MAX_SPEED', 250.0))  # km/h, faster pings are rejected
+    GPS_TRACK_RETENTION_DAYS = int(os.environ.get('GPS_TRACK_RETENTION_DAYS', 90))  # including today
+    GPS_PARTITIONS_AHEAD = int(os.environ.get('GPS_PARTITIONS_AHEAD', 3))  # PostgreSQL daily partitions
+    # Completed route tracks keep one ping per bucket before Douglas-Peucker simplification
+    GPS_TRACK_BUCKET_SECONDS = float(os.environ.get('GPS_TRACK_BUCKET_SECONDS', 5.0))
+    # Seconds after completion, or after late pings arrive, before a route's track is (re)built
+    GPS_TRACK_BUILD_DELAY = int(os.environ.get('GPS_TRACK_BUILD_DELAY', 60))
+
+    # Route distance and ETA, computed from the start, waypoint and end coordinates
+    ROUTE_DETOUR_FACTOR = float(os.environ.get('ROUTE_DETOUR_FACTOR', 1.3))  # road distance / straight-line distance
+    ROUTE_DEFAULT_SPEED = float(os.environ.get('ROUTE_DEFAULT_SPEED', 50.0))  # km/h until a company model is fitted
+    ROUTE_DEFAULT_STOP_MINUTES = float(os.environ.get('ROUTE_DEFAULT_STOP_MINUTES', 10.0))  # per waypoint
+    ROUTE_SPEED_MODEL_MIN_ROUTES = int(os.environ.get('ROUTE_SPEED_MODEL_MIN_ROUTES', 20))  # completed routes to fit
+    ROUTE_SPEED_MODEL_MAX_ROUTES = int(os.environ.get('ROUTE_SPEED_MODEL_MAX_ROUTES', 5000))  # most recent ones used
+
+    # Waypoint order optimization: 'haversine', or 'osrm' for road distances from a local OSRM server
+    ROUTE_DISTANCE_PROVIDER = os.environ.get('ROUTE_DISTANCE_PROVIDER', 'haversine')
+    OSRM_URL = os.environ.get('OSRM_URL', 'http://localhost:5000')
+    OSRM_PROFILE = os.environ.get('OSRM_PROFILE', 'driving')
+    ROUTE_DISTANCE_TIMEOUT = float(os.environ.get('ROUTE_DISTANCE_TIMEOUT', 10.0))  # seconds
+    ROUTE_OPTIMIZER_TIME_BUDGET = float(os.environ.get('ROUTE_OPTIMIZER_TIME_BUDGET', 2.0))  # seconds per request
+    ROUTE_OPTIMIZER_MAX_STOPS = int(os.environ.get('ROUTE_OPTIMIZER_MAX_STOPS', 200))
+
+    # Geocoding: 'nominatim', or 'file' to read GEOCODING_FILE without network access
+    GEOCODING_PROVIDER = os.environ.get('GEOCODING_PROVIDER', 'nominatim')
+    GEOCODING_FILE = os.environ.get('GEOCODING_FILE') or os.path.join(BASE_DIR, 'instance/geocoding.json')
+    NOMINATIM_URL = os.environ.get('NOMINATIM_URL', 'https://nominatim.openstreetmap.org')
+    GEOCODING_USER_AGENT = os.environ.get('GEOCODING_USER_AGENT', 'Logistics CRM')
+    GEOCODING_TIMEOUT = float(os.environ.get('GEOCODING_TIMEOUT', 5.0))  # seconds
+    # Provider calls per process; Nominatim's usage policy allows one request per second
+    GEOCODING_MAX_CONCURRENCY = int(os.environ.get('GEOCODING_MAX_CONCURRENCY', 1))
+    GEOCODING_RATE_LIMIT = float(os.environ.get('GEOCODING_RATE_LIMIT', 1.0))  # requests per second, 0 = unlimited
+    GEOCODING_BATCH_LIMIT = int(os.environ.get('GEOCODING_BATCH_LIMIT', 100))  # items per batch request
+    GEOCODING_BATCH_WORKERS = int(os.environ.get('GEOCODING_BATCH_WORKERS', 8))  # threads resolving one batch
+    # Seconds a batch request waits for the provider; the rest is returned as pending (keep below the server timeout)
+    GEOCODING_BATCH_TIME_BUDGET = float(os.environ.get('GEOCODING_BATCH_TIME_BUDGET', 20.0))
+    GEOCODE_CACHE_SIZE = int(os.environ.get('GEOCODE_CACHE_SIZE', 2048))  # in-memory entries per process
+    GEOCODE_CACHE_TTL = int(os.environ.get('GEOCODE_CACHE_TTL', 30 * 86400))  # seconds
+    GEOCODE_NEGATIVE_CACHE_TTL = int(os.environ.get('GEOCODE_NEGATIVE_CACHE_TTL', 86400))  # seconds, for misses
+
+    # Background jobs, processed by `flask run-worker`
+    JOBS_ASYNC = os.environ.get('JOBS_ASYNC', 'true').lower() == 'true'
+    JOB_WORKER_CONCURRENCY = int(os.environ.get('JOB_WORKER_CONCURRENCY', 2))
+    JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', 1.0))  # seconds
+    JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 3))
+    JOB_RETRY_DELAY = int(os.environ.get('JOB_RETRY_DELAY', 30))  # seconds, doubled after each failure
+    JOB_LOCK_TIMEOUT = int(os.environ.get('JOB_LOCK_TIMEOUT', 600))  # seconds without a worker heartbeat before a running job is requeued
+    JOB_RESULT_TTL = int(os.environ.get('JOB_RESULT_TTL', 3600))  # seconds finished jobs and reports are kept
+    JOB_ARTIFACT_FOLDER = os.path.join(BASE_DIR, 'instance/reports')
+
+    # Columnar analytics exports (`flask export-analytics`, requires pyarrow)
+    ANALYTICS_EXPORT_FOLDER = os.environ.get('ANALYTICS_EXPORT_FOLDER') or os.path.join(BASE_DIR, 'instance/analytics')
+    ANALYTICS_EXPORT_BATCH_SIZE = int(os.environ.get('ANALYTICS_EXPORT_BATCH_SIZE', 10000))
 
 
 class DevelopmentConfig(Config):
@@ -56,6 +146,14 @@ class TestingConfig(Config):
     SERVER_NAME = 'localhost.localdomain'
     # Disable CSRF in testing
     WTF_CSRF_ENABLED = False
+    # Write audit log entries synchronously so tests can assert on them
+    AUDIT_LOG_ASYNC = False
+    # Run background jobs inline when they are enqueued
+    JOBS_ASYNC = False
+    # Geocode from a local file instead of the network
+    GEOCODING_PROVIDER = 'file'
+    # Store GPS pings before the ingest request returns
+    GPS_INGEST_ASYNC = False
 
 
 config = {
@@ -0,0 +1,605 @@
+import asyncio
+import json
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta
+from urllib.parse import unquote_plus
+
+import requests
+
+# Longest address or URL accepted, matches GeocodeCacheEntry.query_key
+MAX_QUERY_LENGTH = 512
+
+KIND_ADDRESS = 'address'
+KIND_URL = 'url'
+
+# Hosts of shortened Google Maps links that have to be expanded over the network
+SHORT_URL_HOSTS = ('goo.gl', 'maps.app.goo.gl')
+
+
+class GeocodingError(Exception):
+    """
+    Lookup failed (provider unreachable, bad response); the result is not cached
+    """
+
+
+class GeocodingTimeout(GeocodingError):
+    """
+    The provider was not called: a batch's time budget ran out, or the lookup
+    was restricted to the caches
+    """
+
+
+def normalize_address(address):
+    """
+    Canonical form of an address used as cache key
+
+    Unicode is NFKC-normalized and case-folded, and whitespace and the
+    spacing around commas are collapsed, so trivially different spellings
+    share one cache entry.
+    """
+    address = unicodedata.normalize('NFKC', address or '').casefold()
+    address = re.sub(r'\s*,\s*', ', ', address)
+    address = re.sub(r'\s+', ' ', address)
+    return address.strip(' ,')
+
+
+def is_short_maps_url(url):
+    return any(host in url for host in SHORT_URL_HOSTS)
+
+
+def is_maps_url(value):
+    return 'google.com/maps' in value or is_short_maps_url(value)
+
+
+class GeocodingProvider:
+    """
+    Interface of a geocoding backend
+
+    Providers are looked up by name from GEOCODING_PROVIDER; register new
+    ones with Geocoder.register_provider().
+    """
+
+    name = None
+
+    # Limits the Geocoder enforces on calls to this provider, None for unlimited
+    max_concurrency = None
+    requests_per_second = None
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Build the provider from application settings
+        """
+        return cls()
+
+    def geocode(self, address):
+        """
+        Resolve an address
+
+        Args:
+            address: Address as entered by the user
+
+        Returns:
+            Dictionary with lat, lng and display_name, or None if not found
+
+        Raises:
+            GeocodingError: The lookup could not be completed
+        """
+        raise NotImplementedError
+
+    def expand_url(self, url):
+        """
+        Follow the redirects of a shortened maps URL
+
+        Args:
+            url: Short URL
+
+        Returns:
+            Final URL
+
+        Raises:
+            GeocodingError: The URL could not be expanded
+        """
+        raise NotImplementedError
+
+
+class NominatimProvider(GeocodingProvider):
+    """
+    OpenStreetMap Nominatim over HTTP; short URLs are expanded with a HEAD request
+    """
+
+    name = 'nominatim'
+
+    def __init__(self, base_url='https://nominatim.openstreetmap.org', user_agent='Logistics CRM', timeout=5.0,
+                 max_concurrency=1, requests_per_second=1.0):
+        self.base_url = base_url.rstrip('/')
+        self.user_agent = user_agent
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency or None
+        self.requests_per_second = requests_per_second or None
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            base_url=config.get('NOMINATIM_URL', 'https://nominatim.openstreetmap.org'),
+            user_agent=config.get('GEOCODING_USER_AGENT', 'Logistics CRM'),
+            timeout=float(config.get('GEOCODING_TIMEOUT', 5.0)),
+            max_concurrency=int(config.get('GEOCODING_MAX_CONCURRENCY', 1)),
+            requests_per_second=float(config.get('GEOCODING_RATE_LIMIT', 1.0))
+        )
+
+    def geocode(self, address):
+        try:
+            response = requests.get(
+                f'{self.base_url}/search',
+                params={'format': 'json', 'q': address, 'limit': 1},
+                headers={'User-Agent': self.user_agent},
+                timeout=self.timeout
+            )
+        except requests.RequestException as e:
+            raise GeocodingError(f'Geocoding request failed: {str(e)}')
+
+        if response.status_code != 200:
+            raise GeocodingError(f'Geocoding API error: {response.status_code}')
+
+        data = response.json()
+        if not data:
+            return None
+        return {
+            'lat': float(data[0]['lat']),
+            'lng': float(data[0]['lon']),
+            'display_name': data[0].get('display_name')
+        }
+
+    def expand_url(self, url):
+        try:
+            response = requests.head(
+                url,
+                allow_redirects=True,
+                headers={'User-Agent': self.user_agent},
+                timeout=self.timeout
+            )
+        except requests.RequestException as e:
+            raise GeocodingError(f'Error expanding shortened URL: {str(e)}')
+        return response.url
+
+
+class FileProvider(GeocodingProvider):
+    """
+    Offline provider reading a JSON file, for tests and air-gapped installs
+
+    The file looks like:
+
+        {
+            "addresses": {"Plac Defilad 1, Warszawa": {"lat": 52.23, "lng": 21.01, "display_name": "..."}},
+            "urls": {"https://maps.app.goo.gl/abc": "https://www.google.com/maps/@52.23,21.01,15z"}
+        }
+
+    Addresses are matched after normalize_address(); unknown addresses are
+    not found and unknown URLs are returned unchanged.
+    """
+
+    name = 'file'
+
+    def __init__(self, path):
+        self.path = path
+        self._addresses = None
+        self._urls = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config['GEOCODING_FILE'])
+
+    def _load(self):
+        with self._lock:
+            if self._addresses is None:
+                try:
+                    with open(self.path, encoding='utf-8') as f:
+                        data = json.load(f)
+                except FileNotFoundError:
+                    data = {}
+                except ValueError as e:
+                    raise GeocodingError(f'Invalid geocoding file {self.path}: {str(e)}')
+
+                self._addresses = {
+                    normalize_address(address): dict(result, display_name=result.get('display_name') or address)
+                    for address, result in data.get('addresses', {}).items()
+                }
+                self._urls = dict(data.get('urls', {}))
+
+    def geocode(self, address):
+        self._load()
+        result = self._addresses.get(normalize_address(address))
+        if result is None:
+            return None
+        return {
+            'lat': float(result['lat']),
+            'lng': float(result['lng']),
+            'display_name': result['display_name']
+        }
+
+    def expand_url(self, url):
+        self._load()
+        return self._urls.get(url, url)
+
+
+class _MemoryCache:
+    """
+    Thread-safe LRU of recent results with per-entry expiry
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, now):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[2] <= now:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, found, values, expires_at):
+        with self._lock:
+            self._entries[key] = (found, values, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class _RateLimiter:
+    """
+    Spaces calls at least 1 / rate seconds apart across threads
+    """
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self, deadline=None):
+        """
+        Claim the next free slot and return how many seconds to wait for it
+
+        Returns None without claiming a slot if the next one is after
+        deadline (a time.monotonic() value).
+        """
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            if deadline is not None and slot > deadline:
+                return None
+            self._next = slot + self.interval
+            return slot - now
+
+
+class Geocoder:
+    """
+    Cached geocoding in front of a pluggable provider
+
+    Results go through three levels: an in-process LRU, the geocode_cache
+    table shared by all processes, and the provider. Addresses that are not
+    found are cached for GEOCODE_NEGATIVE_CACHE_TTL, found ones for
+    GEOCODE_CACHE_TTL; provider errors are not cached. Concurrent lookups of
+    the same query in one process are coalesced into a single provider call.
+
+    Provider calls are limited per process to the provider's max_concurrency
+    and requests_per_second; cache hits are not limited.
+    """
+
+    PROVIDERS = {
+        NominatimProvider.name: NominatimProvider,
+        FileProvider.name: FileProvider
+    }
+
+    def __init__(self, app=None):
+        self.app = None
+        self.provider = None
+        self.ttl = timedelta(days=30)
+        self.negative_ttl = timedelta(days=1)
+        self._memory = _MemoryCache(2048)
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+        self._provider_slots = None
+        self._limiter = _RateLimiter(None)
+        self.batch_limit = 100
+        self.batch_workers = 8
+        self.batch_time_budget = 20.0
+        # Deadline of the batch the current worker thread is resolving, and
+        # whether the current thread may only read the caches
+        self._batch = threading.local()
+
+        if app is not None:
+            self.init_app(app)
+
+    @classmethod
+    def register_provider(cls, provider_class):
+        """
+        Make a provider selectable with GEOCODING_PROVIDER
+
+        Args:
+            provider_class: GeocodingProvider subclass with a unique name
+        """
+        cls.PROVIDERS[provider_class.name] = provider_class
+        return provider_class
+
+    def init_app(self, app):
+        """
+        Configure the geocoder from application settings
+
+        Args:
+            app: Flask application instance
+        """
+        self.app = app
+        name = app.config.get('GEOCODING_PROVIDER', NominatimProvider.name)
+        if name not in self.PROVIDERS:
+            raise ValueError(f"Unknown geocoding provider '{name}'")
+
+        self.provider = self.PROVIDERS[name].from_config(app.config)
+        self.ttl = timedelta(seconds=int(app.config.get('GEOCODE_CACHE_TTL', 30 * 86400)))
+        self.negative_ttl = timedelta(seconds=int(app.config.get('GEOCODE_NEGATIVE_CACHE_TTL', 86400)))
+        self._memory = _MemoryCache(int(app.config.get('GEOCODE_CACHE_SIZE', 2048)))
+        if self.provider.max_concurrency:
+            self._provider_slots = threading.BoundedSemaphore(self.provider.max_concurrency)
+        self._limiter = _RateLimiter(self.provider.requests_per_second)
+        self.batch_limit = int(app.config.get('GEOCODING_BATCH_LIMIT', 100))
+        self.batch_workers = int(app.config.get('GEOCODING_BATCH_WORKERS', 8))
+        self.batch_time_budget = float(app.config.get('GEOCODING_BATCH_TIME_BUDGET', 20.0))
+
+        app.extensions['geocoder'] = self
+
+    def geocode(self, address):
+        """
+        Resolve an address to coordinates
+
+        Args:
+            address: Address as entered by the user
+
+        Returns:
+            Dictionary with lat, lng and display_name, or None if not found
+
+        Raises:
+            GeocodingError: The provider failed or the address is too long
+        """
+        query = normalize_address(address)
+        if not query:
+            return None
+        if len(query) > MAX_QUERY_LENGTH:
+            raise GeocodingError('Address is too long')
+
+        return self._lookup(KIND_ADDRESS, query, lambda: self._call_provider(self.provider.geocode, address.strip()))
+
+    def expand_url(self, url):
+        """
+        Expand a shortened Google Maps URL; other URLs are returned unchanged
+
+        Args:
+            url: Maps URL
+
+        Returns:
+            Final URL
+
+        Raises:
+            GeocodingError: The URL could not be expanded
+        """
+        url = (url or '').strip()
+        if not is_short_maps_url(url):
+            return url
+        if len(url) > MAX_QUERY_LENGTH:
+            raise GeocodingError('URL is too long')
+
+        result = self._lookup(KIND_URL, url, lambda: {'resolved_url': self._call_provider(self.provider.expand_url, url)})
+        return result['resolved_url'] if result else url
+
+    def resolve_many(self, items, time_budget=None):
+        """
+        Resolve a batch of addresses and Google Maps URLs concurrently
+
+        Items run on a pool of GEOCODING_BATCH_WORKERS threads driven by an
+        asyncio event loop, so cached items return immediately while misses
+        wait for the provider limits. Duplicates are resolved once.
+
+        With a time budget, items whose provider call could not start within
+        it are returned with pending set instead of waiting for the rate
+        limit, so a request stays under the server's timeout; the caller
+        resubmits them.
+
+        Args:
+            items: List of addresses or Google Maps URLs
+            time_budget: Optional seconds to spend waiting for the provider
+
+        Returns:
+            List in input order of dictionaries with success and lat, lng and
+            display_name, or success False and error (and pending True)
+        """
+        deadline = time.monotonic() + time_budget if time_budget else None
+        return asyncio.run(self._resolve_all(items, deadline))
+
+    def resolve_cached(self, items):
+        """
+        Resolve addresses and Google Maps URLs from the caches only
+
+        Nothing is sent to the provider and no cache entry is written, so it
+        can run inside a request that holds a database transaction. Items
+        that are not cached yet are returned with pending set.
+
+        Args:
+            items: List of addresses or Google Maps URLs
+
+        Returns:
+            List in input order of dictionaries shaped like resolve_many's
+        """
+        self._batch.cached_only = True
+        try:
+            return [self._resolve_safely(item) for item in items]
+        finally:
+            self._batch.cached_only = False
+
+    async def _resolve_all(self, items, deadline):
+        loop = asyncio.get_running_loop()
+        workers = max(1, min(self.batch_workers, len(items)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='geocode') as executor:
+            return await asyncio.gather(*(
+                loop.run_in_executor(executor, self._resolve_in_context, item, deadline) for item in items
+            ))
+
+    def _resolve_in_context(self, item, deadline=None):
+        # Worker threads need their own context for db.engine
+        with self.app.app_context():
+            self._batch.deadline = deadline
+            try:
+                return self._resolve_safely(item)
+            finally:
+                self._batch.deadline = None
+
+    def _resolve_safely(self, item):
+        try:
+            return self._resolve(item)
+        except GeocodingTimeout:
+            return {'success': False, 'pending': True, 'error': 'Not looked up yet, try again'}
+        except GeocodingError as e:
+            return {'success': False, 'error': str(e)}
+        except Exception as e:
+            self.app.logger.error(f"Error geocoding batch item: {str(e)}")
+            return {'success': False, 'error': 'Geocoding failed'}
+
+    def _resolve(self, item):
+        if not isinstance(item, str) or not item.strip():
+            return {'success': False, 'error': 'No address provided'}
+
+        address = item.strip()
+        if is_maps_url(address):
+            from utils import extract_coordinates_from_maps_url
+
+            result = extract_coordinates_from_maps_url(address)
+            if result.get('success'):
+                return {'success': True, 'lat': result['lat'], 'lng': result['lng'], 'display_name': None}
+            if not result.get('place'):
+                return {'success': False, 'error': result.get('error', 'Coordinates not found in URL')}
+            # Place links carry a name but no coordinates
+            address = unquote_plus(result['place'])
+
+        values = self.geocode(address)
+        if values is None:
+            return {'success': False, 'error': 'Location not found'}
+        return dict(values, success=True)
+
+    def _call_provider(self, call, *args):
+        deadline = getattr(self._batch, 'deadline', None)
+        slots = self._provider_slots
+        if slots is not None:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            if not slots.acquire(timeout=timeout):
+                raise GeocodingTimeout('Batch time budget exceeded')
+        try:
+            delay = self._limiter.reserve(deadline)
+            if delay is None:
+                raise GeocodingTimeout('Batch time budget exceeded')
+            if delay > 0:
+                time.sleep(delay)
+            return call(*args)
+        finally:
+            if slots is not None:
+                slots.release()
+
+    def _lookup(self, kind, query, fetch):
+        key = (kind, query)
+        entry = self._memory.get(key, datetime.utcnow())
+        if entry is not None:
+            return entry[1] if entry[0] else None
+
+        if getattr(self._batch, 'cached_only', False):
+            entry = self._fetch_stored(kind, query, datetime.utcnow())
+            if entry is None:
+                raise GeocodingTimeout('Not in the geocode cache')
+            found, values, expires_at = entry
+            self._memory.set(key, found, values, expires_at)
+            return values if found else None
+
+        # Only the first caller for a key does the work; the others wait for its result
+        with self._inflight_lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._inflight[key] = future
+
+        if not owner:
+            return future.result()
+
+        try:
+            result = self._load(kind, query, fetch)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._inflight_lock:
+                self._inflight.pop(key, None)
+
+    def _load(self, kind, query, fetch):
+        now = datetime.utcnow()
+        entry = self._fetch_stored(kind, query, now)
+        if entry is not None:
+            found, values, expires_at = entry
+            self._memory.set((kind, query), found, values, expires_at)
+            return values if found else None
+
+        values = fetch()
+        expires_at = now + (self.ttl if values is not None else self.negative_ttl)
+        self._store(kind, query, values, expires_at)
+        self._memory.set((kind, query), values is not None, values, expires_at)
+        return values
+
+    def _fetch_stored(self, kind, query, now):
+        from app import db
+        from models import GeocodeCacheEntry
+
+        try:
+            with db.engine.connect() as connection:
+                return GeocodeCacheEntry.fetch(connection, self.provider.name, kind, query, now)
+        except Exception as e:
+            # The cache table is an optimization; fall through to the provider
+            self.app.logger.error(f"Error reading geocode cache: {str(e)}")
+            return None
+
+    def _store(self, kind, query, values, expires_at):
+        from app import db
+        from models import GeocodeCacheEntry
+
+        try:
+            # Own transaction, so the caller's session is never committed
+            with db.engine.begin() as connection:
+                GeocodeCacheEntry.store(connection, self.provider.name, kind, query, values, expires_at)
+        except Exception as e:
+            self.app.logger.error(f"Error writing geocode cache: {str(e)}")
+
+    def purge_expired(self):
+        """
+        Delete expired entries from the geocode_cache table
+
+        Returns:
+            Number of entries deleted
+        """
+        from app import db
+        from models import GeocodeCacheEntry
+
+        self._memory.clear()
+        with db.engine.begin() as connection:
+            return GeocodeCacheEntry.purge_expired(connection, datetime.utcnow())
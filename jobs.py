@@ -0,0 +1,557 @@
+import os
+import signal
+import socket
+import threading
+import traceback
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+
+
+class JobQueue:
+    """
+    Durable job queue backed by the jobs table
+
+    Code registers handlers by name with @job_queue.handler('name') and
+    calls enqueue() to schedule work. Workers started with
+    `flask run-worker` claim due jobs, run the handler and record the
+    outcome. Failed jobs are retried with an exponential delay until
+    max_attempts is reached. With JOBS_ASYNC disabled (testing) jobs run
+    inline when they are enqueued.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.enabled = False
+        self.max_attempts = 3
+        self.retry_delay = 30
+        self.lock_timeout = 600
+        self.result_ttl = 3600
+        self.artifact_folder = None
+        self.handlers = {}
+        self.shared_with = {}
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Configure the queue from application settings
+
+        Args:
+            app: Flask application instance
+        """
+        self.app = app
+        self.enabled = app.config.get('JOBS_ASYNC', True)
+        self.max_attempts = max(1, int(app.config.get('JOB_MAX_ATTEMPTS', 3)))
+        self.retry_delay = float(app.config.get('JOB_RETRY_DELAY', 30))
+        self.lock_timeout = float(app.config.get('JOB_LOCK_TIMEOUT', 600))
+        self.result_ttl = float(app.config.get('JOB_RESULT_TTL', 3600))
+        self.artifact_folder = app.config.get('JOB_ARTIFACT_FOLDER') or \
+            os.path.join(app.instance_path, 'jobs')
+
+        app.extensions['job_queue'] = self
+
+    def handler(self, name, shared_with=None):
+        """
+        Register a job handler
+
+        The handler is called with the Job inside an application context and
+        may return a JSON-serializable result.
+
+        Args:
+            name: Job name used with enqueue()
+            shared_with: Roles of the job's company, besides the requester
+                and admins, that may see the job and download its file; an
+                iterable of UserRole or a callable taking the Job
+        """
+        def decorator(func):
+            self.handlers[name] = func
+            if shared_with is not None:
+                self.shared_with[name] = shared_with
+            return func
+        return decorator
+
+    def shared_roles(self, job):
+        """
+        Get the roles of the job's company that may access a job
+
+        Args:
+            job: Job instance
+
+        Returns:
+            Tuple of UserRole, empty if only the requester and admins may
+        """
+        shared_with = self.shared_with.get(job.name)
+        if callable(shared_with):
+            shared_with = shared_with(job)
+        return tuple(shared_with or ())
+
+    def enqueue(self, name, payload=None, dedup_key=None, max_attempts=None,
+                user_id=None, company_id=None, delay=None, reuse_result=True,
+                dedup_running=True):
+        """
+        Add a job to the queue
+
+        If dedup_key is given and a job with the same key is queued or
+        running, that job is returned instead of creating a new one. With
+        reuse_result a job that succeeded within JOB_RESULT_TTL is returned too.
+        Without dedup_running only a queued job is reused, so work requested
+        while the job runs gets one follow-up job.
+
+        Args:
+            name: Registered handler name
+            payload: JSON-serializable handler arguments
+            dedup_key: Optional key identifying identical work
+            max_attempts: Attempts before the job is marked failed
+            user_id: ID of the user who requested the job
+            company_id: ID of the company the job belongs to
+            delay: Optional seconds to wait before the job may run
+            reuse_result: Return a recent successful job with the same dedup_key
+            dedup_running: Return a running job with the same dedup_key
+
+        Returns:
+            Job instance
+        """
+        from app import db
+        from models import Job
+
+        if name not in self.handlers:
+            raise ValueError(f"No job handler registered for '{name}'")
+
+        if dedup_key:
+            existing = self.find_reusable(dedup_key, reuse_result, dedup_running)
+            if existing is not None:
+                return existing
+
+        job = Job(
+            name=name,
+            payload=payload or {},
+            dedup_key=dedup_key,
+            max_attempts=max_attempts or self.max_attempts,
+            run_at=datetime.utcnow() + timedelta(seconds=delay or 0),
+            user_id=user_id,
+            company_id=company_id
+        )
+        db.session.add(job)
+
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Another request queued the same dedup_key first
+            db.session.rollback()
+            existing = self.find_reusable(dedup_key)
+            if existing is None:
+                raise
+            return existing
+
+        if not self.enabled:
+            self.run_inline(job.id)
+            job = db.session.get(Job, job.id)
+
+        return job
+
+    def find_reusable(self, dedup_key, reuse_result=True, dedup_running=True):
+        """
+        Find an active or recently succeeded job with the given dedup key
+
+        Args:
+            dedup_key: Dedup key
+            reuse_result: Also consider jobs that succeeded within JOB_RESULT_TTL
+            dedup_running: Also consider running jobs, not only queued ones
+
+        Returns:
+            Job instance or None
+        """
+        from models import Job, JobStatus
+
+        active = [JobStatus.QUEUED, JobStatus.RUNNING] if dedup_running else [JobStatus.QUEUED]
+        job = Job.query.filter(
+            Job.dedup_key == dedup_key,
+            Job.status.in_(active)
+        ).first()
+        if job is not None or not reuse_result:
+            return job
+
+        fresh_after = datetime.utcnow() - timedelta(seconds=self.result_ttl)
+        job = Job.query.filter(
+            Job.dedup_key == dedup_key,
+            Job.status == JobStatus.SUCCEEDED,
+            Job.finished_at >= fresh_after
+        ).order_by(Job.finished_at.desc()).first()
+
+        # A cached artifact that has been cleaned up can't be reused
+        if job is not None and job.artifact_path and not os.path.exists(job.artifact_path):
+            return None
+        return job
+
+    def claim(self, worker_id):
+        """
+        Lock the next due job for a worker
+
+        Args:
+            worker_id: Name of the claiming worker
+
+        Returns:
+            Claimed Job or None if nothing is due
+        """
+        from app import db
+        from models import Job, JobStatus
+
+        now = datetime.utcnow()
+        candidates = db.session.query(Job.id).filter(
+            Job.status == JobStatus.QUEUED,
+            Job.run_at <= now
+        ).order_by(Job.run_at, Job.id).limit(1)
+
+        if db.engine.dialect.name == 'postgresql':
+            # Let concurrent workers skip rows another worker is claiming
+            candidates = candidates.with_for_update(skip_locked=True)
+
+        job_id = candidates.scalar()
+        if job_id is None:
+            db.session.rollback()
+            return None
+
+        # Only one worker can move the job out of QUEUED
+        claimed = db.session.execute(
+            update(Job).where(
+                Job.id == job_id,
+                Job.status == JobStatus.QUEUED
+            ).values(
+                status=JobStatus.RUNNING,
+                locked_by=worker_id,
+                locked_at=now,
+                started_at=now,
+                attempts=Job.attempts + 1
+            )
+        ).rowcount
+        db.session.commit()
+
+        if not claimed:
+            return None
+        return db.session.get(Job, job_id)
+
+    def run(self, job):
+        """
+        Run a claimed job and record success, retry or failure
+
+        Args:
+            job: Job in the RUNNING state
+
+        Returns:
+            True if the handler succeeded
+        """
+        from app import db
+        from models import Job, JobStatus
+
+        job_id = job.id
+        handler = self.handlers.get(job.name)
+
+        try:
+            if handler is None:
+                raise ValueError(f"No job handler registered for '{job.name}'")
+
+            result = handler(job)
+
+            job.status = JobStatus.SUCCEEDED
+            job.result = result
+            job.error = None
+            job.finished_at = datetime.utcnow()
+            job.locked_by = None
+            db.session.commit()
+            return True
+        except Exception as e:
+            db.session.rollback()
+            self.app.logger.error(f"Job {job_id} ({job.name}) failed: {str(e)}")
+            self.app.logger.error(traceback.format_exc())
+
+            job = db.session.get(Job, job_id)
+            job.error = str(e)
+            job.locked_by = None
+
+            if job.attempts < job.max_attempts:
+                # Retry after retry_delay, doubled for every failed attempt
+                delay = self.retry_delay * (2 ** (job.attempts - 1))
+                job.status = JobStatus.QUEUED
+                job.run_at = datetime.utcnow() + timedelta(seconds=delay)
+            else:
+                job.status = JobStatus.FAILED
+                job.finished_at = datetime.utcnow()
+
+            db.session.commit()
+            return False
+
+    def run_inline(self, job_id):
+        """
+        Run a job in the current thread, retrying immediately on failure
+
+        Args:
+            job_id: ID of a queued job
+        """
+        from app import db
+        from models import Job, JobStatus
+
+        while True:
+            job = db.session.get(Job, job_id)
+            if job is None or job.status != JobStatus.QUEUED:
+                return
+
+            job.status = JobStatus.RUNNING
+            job.attempts += 1
+            job.started_at = datetime.utcnow()
+            job.locked_by = 'inline'
+            job.locked_at = job.started_at
+            db.session.commit()
+
+            if self.run(job):
+                return
+
+    def save_artifact(self, job, filename, mimetype, data):
+        """
+        Store a file produced by a job
+
+        Args:
+            job: Job producing the file
+            filename: Download name shown to the user
+            mimetype: MIME type of the file
+            data: File contents as bytes, or an iterable of bytes chunks
+
+        Returns:
+            Number of bytes written
+        """
+        os.makedirs(self.artifact_folder, exist_ok=True)
+
+        if isinstance(data, (bytes, bytearray)):
+            data = [data]
+
+        extension = os.path.splitext(filename)[1]
+        path = os.path.join(self.artifact_folder, f'job_{job.id}_{uuid.uuid4().hex}{extension}')
+        size = 0
+        try:
+            with open(path, 'wb') as f:
+                # Write chunks as they are produced so large files never sit in memory
+                for chunk in data:
+                    f.write(chunk)
+                    size += len(chunk)
+        except Exception:
+            # Don't leave a truncated file behind for the retry
+            if os.path.exists(path):
+                os.remove(path)
+            raise
+
+        job.artifact_path = path
+        job.artifact_name = filename
+        job.artifact_mimetype = mimetype
+        return size
+
+    def heartbeat(self, job_ids):
+        """
+        Refresh the lock of jobs that are still running
+
+        Workers call this while their jobs run so requeue_stale only picks
+        up jobs whose worker has stopped, however long the job takes.
+
+        Args:
+            job_ids: IDs of the jobs the calling worker is running
+
+        Returns:
+            Number of jobs refreshed
+        """
+        from app import db
+        from models import Job, JobStatus
+
+        if not job_ids:
+            return 0
+
+        refreshed = db.session.execute(
+            update(Job).where(
+                Job.id.in_(list(job_ids)),
+                Job.status == JobStatus.RUNNING
+            ).values(locked_at=datetime.utcnow())
+        ).rowcount
+        db.session.commit()
+        return refreshed
+
+    def requeue_stale(self):
+        """
+        Put back jobs whose worker stopped without finishing them
+
+        Jobs that have already used all their attempts are marked failed
+        instead, so a job that keeps killing its worker is not run forever.
+
+        Returns:
+            Number of jobs requeued
+        """
+        from app import db
+        from models import Job, JobStatus
+
+        now = datetime.utcnow()
+        stale_before = now - timedelta(seconds=self.lock_timeout)
+        stale = (
+            Job.status == JobStatus.RUNNING,
+            Job.locked_at < stale_before
+        )
+
+        failed = db.session.execute(
+            update(Job).where(
+                *stale,
+                Job.attempts >= Job.max_attempts
+            ).values(
+                status=JobStatus.FAILED,
+                error='Worker stopped before the job finished',
+                locked_by=None,
+                finished_at=now
+            )
+        ).rowcount
+        requeued = db.session.execute(
+            update(Job).where(*stale).values(status=JobStatus.QUEUED, locked_by=None, run_at=now)
+        ).rowcount
+        db.session.commit()
+
+        if failed:
+            self.app.logger.error(f"Marked {failed} stale job(s) failed after their last attempt")
+        if requeued:
+            self.app.logger.info(f"Requeued {requeued} stale job(s)")
+        return requeued
+
+    def purge_expired(self):
+        """
+        Delete finished jobs and their artifacts once JOB_RESULT_TTL has passed
+
+        Returns:
+            Number of jobs deleted
+        """
+        from app import db
+        from models import Job, JobStatus
+
+        expired_before = datetime.utcnow() - timedelta(seconds=self.result_ttl)
+        jobs = Job.query.filter(
+            Job.status.in_([JobStatus.SUCCEEDED, JobStatus.FAILED]),
+            Job.finished_at < expired_before
+        ).limit(500).all()
+
+        for job in jobs:
+            if job.artifact_path:
+                try:
+                    os.remove(job.artifact_path)
+                except OSError:
+                    pass
+            db.session.delete(job)
+
+        db.session.commit()
+        return len(jobs)
+
+
+class Worker:
+    """
+    Pool of threads that claim and run jobs until stopped
+    """
+
+    MAINTENANCE_INTERVAL = 60  # seconds between stale-job and cleanup passes
+
+    def __init__(self, app, job_queue, concurrency=2, poll_interval=1.0):
+        self.app = app
+        self.job_queue = job_queue
+        self.concurrency = max(1, concurrency)
+        self.poll_interval = poll_interval
+        self.name = f'{socket.gethostname()}:{os.getpid()}'
+
+        self._stop_event = threading.Event()
+        self._finished_event = threading.Event()
+        self._threads = []
+        self._last_maintenance = 0
+        self._running = {}
+        self._running_lock = threading.Lock()
+
+    def run(self):
+        """
+        Start the worker threads and block until SIGINT/SIGTERM
+        """
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *args: self.stop())
+
+        for index in range(self.concurrency):
+            thread = threading.Thread(
+                target=self._loop,
+                args=(f'{self.name}:{index}',),
+                name=f'job-worker-{index}',
+                daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+        heartbeat = threading.Thread(target=self._heartbeat_loop, name='job-heartbeat', daemon=True)
+        heartbeat.start()
+
+        while not self._stop_event.is_set():
+            self._stop_event.wait(1)
+
+        # Let running jobs finish
+        for thread in self._threads:
+            thread.join()
+        self._finished_event.set()
+        heartbeat.join()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _loop(self, worker_id):
+        from app import db
+
+        while not self._stop_event.is_set():
+            with self.app.app_context():
+                try:
+                    self._maintenance()
+                    job = self.job_queue.claim(worker_id)
+                    if job is not None:
+                        self.app.logger.info(f"Worker {worker_id} running job {job.id} ({job.name})")
+                        with self._running_lock:
+                            self._running[worker_id] = job.id
+                        try:
+                            self.job_queue.run(job)
+                        finally:
+                            with self._running_lock:
+                                self._running.pop(worker_id, None)
+                except Exception as e:
+                    db.session.rollback()
+                    self.app.logger.error(f"Job worker {worker_id} error: {str(e)}")
+                    job = None
+                finally:
+                    db.session.remove()
+
+            if job is None:
+                self._stop_event.wait(self.poll_interval)
+
+    def _heartbeat_loop(self):
+        from app import db
+
+        # Refresh well within JOB_LOCK_TIMEOUT so a slow job never looks stale
+        interval = max(1.0, self.job_queue.lock_timeout / 3)
+
+        # Keeps beating after stop() until the running jobs have finished
+        while not self._finished_event.wait(interval):
+            with self._running_lock:
+                job_ids = list(self._running.values())
+            if not job_ids:
+                continue
+
+            with self.app.app_context():
+                try:
+                    self.job_queue.heartbeat(job_ids)
+                except Exception as e:
+                    db.session.rollback()
+                    self.app.logger.error(f"Job heartbeat error: {str(e)}")
+                finally:
+                    db.session.remove()
+
+    def _maintenance(self):
+        now = datetime.utcnow().timestamp()
+        if now - self._last_maintenance < self.MAINTENANCE_INTERVAL:
+            return
+        self._last_maintenance = now
+
+        self.job_queue.requeue_stale()
+        self.job_queue.purge_expired()
@@ -0,0 +1,704 @@
+import gzip
+import json
+import os
+import re
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import DateTime, bindparam, column, inspect, select, table, text
+from sqlalchemy.schema import AddConstraint, CreateIndex
+
+# Monthly partitions are named logs_YYYY_MM
+PARTITION_NAME = re.compile(r'^logs_(\d{4})_(\d{2})$')
+
+# PostgreSQL: partition receiving rows for months that have no partition yet
+DEFAULT_PARTITION = 'logs_default'
+
+# SQLite: table behind the logs view that receives new rows
+HEAD_TABLE = 'logs_head'
+
+# String columns replaced by lookup table ids: column -> (id column, lookup table)
+LEGACY_LOOKUP_COLUMNS = {
+    'ip_address': ('ip_address_id', 'log_ip_addresses'),
+    'user_agent': ('user_agent_id', 'log_user_agents')
+}
+
+
+def month_start(value):
+    """
+    First moment of the month containing value
+    """
+    return datetime(value.year, value.month, 1)
+
+
+def add_months(month, count):
+    """
+    Start of the month count months after (or before) month
+    """
+    index = month.year * 12 + month.month - 1 + count
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f'logs_{month:%Y_%m}'
+
+
+def partition_month(name):
+    """
+    Month stored in a partition table, or None if name is not a partition
+    """
+    match = PARTITION_NAME.match(name)
+    return datetime(int(match.group(1)), int(match.group(2)), 1) if match else None
+
+
+def _log_table():
+    from models import Log
+    return Log.__table__
+
+
+def _column_list():
+    return ', '.join(f'"{c.name}"' for c in _log_table().columns)
+
+
+def _range_clause(sql):
+    # Typed parameters so SQLite compares timestamps in the format SQLAlchemy stores them
+    return text(sql).bindparams(bindparam('start', type_=DateTime), bindparam('end', type_=DateTime))
+
+
+def _setting(name, default):
+    try:
+        return current_app.config.get(name, default)
+    except RuntimeError:
+        # Outside an application context
+        return default
+
+
+def is_partitioned(connection):
+    """
+    Check whether the logs table has been split into monthly partitions
+
+    Args:
+        connection: SQLAlchemy connection
+
+    Returns:
+        True if partitioning is installed
+    """
+    dialect = connection.dialect.name
+    if dialect == 'postgresql':
+        kind = connection.exec_driver_sql(
+            "SELECT relkind FROM pg_class WHERE oid = to_regclass('logs')"
+        ).scalar()
+        return kind == 'p'
+    if dialect == 'sqlite':
+        kind = connection.exec_driver_sql(
+            "SELECT type FROM sqlite_master WHERE name = 'logs'"
+        ).scalar()
+        return kind == 'view'
+    return False
+
+
+def install(connection, months_ahead=None):
+    """
+    Split the logs table into monthly partitions
+
+    Called when the table is created and by `flask partition-logs` for
+    databases created before partitioning; existing rows are kept.
+
+    On PostgreSQL logs becomes a table partitioned by range of timestamp,
+    with one partition per month plus a default partition for months that
+    don't have one yet. Its primary key becomes (id, timestamp), as
+    PostgreSQL requires the partition key in unique constraints.
+
+    SQLite has no partitioning, so logs becomes a view over logs_head, which
+    receives new rows through an INSTEAD OF trigger, and one logs_YYYY_MM
+    table per closed month (see rotate()). logs_head is an AUTOINCREMENT
+    table, so ids stay unique across all partitions. Running install() on a
+    database partitioned before that rebuilds logs_head.
+
+    Other databases keep a plain table.
+
+    Args:
+        connection: SQLAlchemy connection
+        months_ahead: Future months to create partitions for
+            (default LOG_PARTITIONS_AHEAD)
+    """
+    dialect = connection.dialect.name
+    if dialect not in ('postgresql', 'sqlite'):
+        return
+    if dialect == 'sqlite' and not _has_lookup_id_columns(connection):
+        # The SQLite tables are rebuilt with the model's columns
+        raise RuntimeError('The logs table has no ip_address_id/user_agent_id columns; '
+                           'run `flask migrate-log-lookups` first')
+
+    if is_partitioned(connection):
+        if dialect == 'sqlite' and not _has_autoincrement(connection, HEAD_TABLE):
+            connection.exec_driver_sql('DROP VIEW logs')
+            _create_sqlite_head(connection, HEAD_TABLE)
+            _rebuild_sqlite_view(connection)
+        return
+
+    if dialect == 'postgresql':
+        _install_postgresql(connection)
+        ensure_partitions(connection, months_ahead)
+    else:
+        _create_sqlite_head(connection, 'logs')
+        _rebuild_sqlite_view(connection)
+
+
+def _install_postgresql(connection):
+    log_table = _log_table()
+    sequence = connection.exec_driver_sql("SELECT pg_get_serial_sequence('logs', 'id')").scalar()
+
+    # Keep the id sequence alive while the plain table is replaced
+    connection.exec_driver_sql(f'ALTER SEQUENCE {sequence} OWNED BY NONE')
+    connection.exec_driver_sql('ALTER TABLE logs RENAME TO logs_unpartitioned')
+    connection.exec_driver_sql(
+        'CREATE TABLE logs (LIKE logs_unpartitioned INCLUDING DEFAULTS) PARTITION BY RANGE ("timestamp")'
+    )
+    connection.exec_driver_sql(f'CREATE TABLE {DEFAULT_PARTITION} PARTITION OF logs DEFAULT')
+    connection.exec_driver_sql('INSERT INTO logs SELECT * FROM logs_unpartitioned')
+    connection.exec_driver_sql('DROP TABLE logs_unpartitioned')
+    connection.exec_driver_sql(f'ALTER SEQUENCE {sequence} OWNED BY logs.id')
+
+    connection.exec_driver_sql('ALTER TABLE logs ADD PRIMARY KEY (id, "timestamp")')
+    for constraint in log_table.foreign_key_constraints:
+        connection.execute(AddConstraint(constraint))
+    # Indexes on the parent are created on every partition
+    for index in log_table.indexes:
+        connection.execute(CreateIndex(index))
+
+    # Move any copied rows out of the default partition
+    rotate(connection)
+
+
+def _has_autoincrement(connection, name):
+    sql = connection.exec_driver_sql(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)
+    ).scalar()
+    return sql is not None and 'AUTOINCREMENT' in sql.upper()
+
+
+def _create_sqlite_head(connection, source):
+    # Rows moved out by rotate() would otherwise free their ids for reuse
+    log_table = _log_table()
+    definitions = []
+    for c in log_table.columns:
+        if c.primary_key:
+            definitions.append(f'"{c.name}" INTEGER PRIMARY KEY AUTOINCREMENT')
+        else:
+            not_null = '' if c.nullable else ' NOT NULL'
+            definitions.append(f'"{c.name}" {c.type.compile(dialect=connection.dialect)}{not_null}')
+    for fk in log_table.foreign_keys:
+        definitions.append(f'FOREIGN KEY ("{fk.parent.name}") REFERENCES {fk.column.table.name} ("{fk.column.name}")')
+
+    columns = _column_list()
+    connection.exec_driver_sql(f'CREATE TABLE {HEAD_TABLE}_new ({", ".join(definitions)})')
+    connection.exec_driver_sql(f'INSERT INTO {HEAD_TABLE}_new ({columns}) SELECT {columns} FROM {source}')
+    connection.exec_driver_sql(f'DROP TABLE {source}')
+    connection.exec_driver_sql(f'ALTER TABLE {HEAD_TABLE}_new RENAME TO {HEAD_TABLE}')
+    for index in log_table.indexes:
+        index_columns = ', '.join(f'"{c.name}"' for c in index.columns)
+        connection.exec_driver_sql(f'CREATE INDEX {index.name} ON {HEAD_TABLE} ({index_columns})')
+
+
+def next_sqlite_id(connection):
+    """
+    Reserve the next log id of a partitioned SQLite database
+
+    Rows inserted through the logs view don't report their id (the INSTEAD
+    OF trigger's insert is not the statement's), so ORM inserts take an id
+    from logs_head's AUTOINCREMENT counter first.
+
+    Args:
+        connection: SQLAlchemy connection
+
+    Returns:
+        The id, or None if logs is not partitioned
+    """
+    if not is_partitioned(connection):
+        return None
+
+    reserved = connection.exec_driver_sql(
+        f"UPDATE sqlite_sequence SET seq = seq + 1 WHERE name = '{HEAD_TABLE}'"
+    ).rowcount
+    if not reserved:
+        # logs_head hasn't allocated an id yet
+        connection.exec_driver_sql(
+            f"INSERT INTO sqlite_sequence (name, seq) SELECT '{HEAD_TABLE}', COALESCE(MAX(id), 0) + 1 FROM logs"
+        )
+    return connection.exec_driver_sql(
+        f"SELECT seq FROM sqlite_sequence WHERE name = '{HEAD_TABLE}'"
+    ).scalar()
+
+
+def has_legacy_lookup_columns(connection):
+    """
+    Check whether logs still has the ip_address and user_agent string columns
+    """
+    columns = {c['name'] for c in inspect(connection).get_columns('logs')}
+    return bool(columns & LEGACY_LOOKUP_COLUMNS.keys())
+
+
+def _has_lookup_id_columns(connection):
+    columns = {c['name'] for c in inspect(connection).get_columns('logs')}
+    return all(id_column in columns for id_column, _ in LEGACY_LOOKUP_COLUMNS.values())
+
+
+def migrate_lookup_columns(connection, drop_columns=True):
+    """
+    Move logs.ip_address and logs.user_agent into the lookup tables
+
+    Adds the ip_address_id and user_agent_id columns if needed, stores each
+    distinct value once and points the rows at it. Rows already pointing at
+    a value are left alone, so the migration can be re-run. Works on plain
+    and partitioned tables; on SQLite every table behind the logs view is
+    migrated.
+
+    Args:
+        connection: SQLAlchemy connection inside a transaction
+        drop_columns: Drop the string columns afterwards
+
+    Returns:
+        Dictionary of string column -> number of rows pointed at a lookup value
+    """
+    from models import LogIpAddress, LogUserAgent
+
+    columns = {c['name'] for c in inspect(connection).get_columns('logs')}
+    legacy = [name for name in LEGACY_LOOKUP_COLUMNS if name in columns]
+    counts = dict.fromkeys(legacy, 0)
+    if not legacy:
+        return counts
+
+    LogIpAddress.__table__.create(connection, checkfirst=True)
+    LogUserAgent.__table__.create(connection, checkfirst=True)
+
+    sqlite_view = connection.dialect.name == 'sqlite' and is_partitioned(connection)
+    if sqlite_view:
+        # SQLite can't alter tables a view depends on; the view is rebuilt below
+        connection.exec_driver_sql('DROP VIEW logs')
+        tables = [HEAD_TABLE] + [name for _, name in list_partitions(connection)]
+    else:
+        # PostgreSQL applies changes to a partitioned table to all partitions
+        tables = ['logs']
+
+    for name in legacy:
+        id_column, lookup = LEGACY_LOOKUP_COLUMNS[name]
+        for table_name in tables:
+            if id_column not in columns:
+                connection.exec_driver_sql(
+                    f'ALTER TABLE {table_name} ADD COLUMN {id_column} INTEGER REFERENCES {lookup} (id)'
+                )
+            filled = f"{table_name}.{name} IS NOT NULL AND {table_name}.{name} <> ''"
+            connection.exec_driver_sql(
+                f'INSERT INTO {lookup} (value) SELECT DISTINCT {name} FROM {table_name} WHERE {filled} '
+                f'AND NOT EXISTS (SELECT 1 FROM {lookup} WHERE {lookup}.value = {table_name}.{name})'
+            )
+            counts[name] += connection.exec_driver_sql(
+                f'UPDATE {table_name} SET {id_column} = '
+                f'(SELECT id FROM {lookup} WHERE {lookup}.value = {table_name}.{name}) '
+                f'WHERE {filled} AND {table_name}.{id_column} IS NULL'
+            ).rowcount
+            if drop_columns:
+                connection.exec_driver_sql(f'ALTER TABLE {table_name} DROP COLUMN {name}')
+
+    if sqlite_view:
+        _rebuild_sqlite_view(connection)
+    return counts
+
+
+def uninstall(connection):
+    """
+    Remove the SQLite view and partition tables so logs can be dropped
+
+    PostgreSQL drops partitions together with their parent table.
+
+    Args:
+        connection: SQLAlchemy connection
+    """
+    if connection.dialect.name != 'sqlite' or not is_partitioned(connection):
+        return
+
+    connection.exec_driver_sql('DROP VIEW logs')
+    for _, name in list_partitions(connection):
+        connection.exec_driver_sql(f'DROP TABLE {name}')
+    connection.exec_driver_sql(f'ALTER TABLE {HEAD_TABLE} RENAME TO logs')
+
+
+def list_partitions(connection):
+    """
+    List monthly partitions, oldest first
+
+    The PostgreSQL default partition and the SQLite head table are not
+    included.
+
+    Args:
+        connection: SQLAlchemy connection
+
+    Returns:
+        List of (month, table name) tuples
+    """
+    dialect = connection.dialect.name
+    if dialect == 'postgresql':
+        names = connection.exec_driver_sql(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "WHERE pg_inherits.inhparent = to_regclass('logs')"
+        ).scalars()
+    elif dialect == 'sqlite':
+        names = connection.exec_driver_sql(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE 'logs!_%' ESCAPE '!'"
+        ).scalars()
+    else:
+        return []
+
+    partitions = [(partition_month(name), name) for name in names]
+    return sorted(partition for partition in partitions if partition[0] is not None)
+
+
+def ensure_partition(connection, month):
+    """
+    Create the PostgreSQL partition for a month if it doesn't exist
+
+    Rows for the month that were written to the default partition are
+    moved into the new partition before it is attached.
+
+    Args:
+        connection: SQLAlchemy connection
+        month: Start of the month
+
+    Returns:
+        True if the partition was created
+    """
+    name = partition_name(month)
+    if connection.exec_driver_sql(f"SELECT to_regclass('{name}')").scalar() is not None:
+        return False
+
+    start, end = month, add_months(month, 1)
+    connection.exec_driver_sql(f'CREATE TABLE {name} (LIKE logs INCLUDING DEFAULTS)')
+    connection.execute(_range_clause(
+        f'WITH moved AS ('
+        f'DELETE FROM {DEFAULT_PARTITION} WHERE "timestamp" >= :start AND "timestamp" < :end RETURNING *'
+        f') INSERT INTO {name} SELECT * FROM moved'
+    ), {'start': start, 'end': end})
+    connection.exec_driver_sql(
+        f"ALTER TABLE logs ATTACH PARTITION {name} "
+        f"FOR VALUES FROM ('{start:%Y-%m-%d}') TO ('{end:%Y-%m-%d}')"
+    )
+    return True
+
+
+def ensure_partitions(connection, months_ahead=None, now=None):
+    """
+    Create PostgreSQL partitions for the current month and the next ones
+
+    Args:
+        connection: SQLAlchemy connection
+        months_ahead: Future months to create (default LOG_PARTITIONS_AHEAD)
+        now: Current time (default utcnow)
+
+    Returns:
+        Names of the partitions created
+    """
+    if connection.dialect.name != 'postgresql':
+        return []
+
+    if months_ahead is None:
+        months_ahead = int(_setting('LOG_PARTITIONS_AHEAD', 2))
+    current = month_start(now or datetime.utcnow())
+
+    created = []
+    for offset in range(months_ahead + 1):
+        month = add_months(current, offset)
+        if ensure_partition(connection, month):
+            created.append(partition_name(month))
+    return created
+
+
+def rotate(connection, now=None):
+    """
+    Move rows out of the catch-all table into their month's partition
+
+    On PostgreSQL this empties the default partition; on SQLite it moves
+    closed months out of logs_head, leaving only the current month there.
+
+    Args:
+        connection: SQLAlchemy connection
+        now: Current time (default utcnow)
+
+    Returns:
+        Names of the partitions created
+    """
+    dialect = connection.dialect.name
+    current = month_start(now or datetime.utcnow())
+
+    if dialect == 'postgresql':
+        months = connection.exec_driver_sql(
+            f'SELECT DISTINCT date_trunc(\'month\', "timestamp") FROM {DEFAULT_PARTITION}'
+        ).scalars().all()
+        return [partition_name(month) for month in sorted(months) if ensure_partition(connection, month)]
+
+    if dialect != 'sqlite':
+        return []
+
+    months = connection.execute(
+        text(f'SELECT DISTINCT substr("timestamp", 1, 7) FROM {HEAD_TABLE} WHERE "timestamp" < :current')
+        .bindparams(bindparam('current', type_=DateTime)),
+        {'current': current}
+    ).scalars().all()
+
+    columns = _column_list()
+    existing = {name for _, name in list_partitions(connection)}
+    created = []
+    for key in sorted(months):
+        month = datetime.strptime(key, '%Y-%m')
+        name = partition_name(month)
+        if name not in existing:
+            connection.exec_driver_sql(f'CREATE TABLE {name} AS SELECT {columns} FROM {HEAD_TABLE} WHERE 0')
+            connection.exec_driver_sql(f'CREATE INDEX ix_{name}_timestamp_id ON {name} ("timestamp", id)')
+            connection.exec_driver_sql(f'CREATE INDEX ix_{name}_user_id ON {name} (user_id)')
+            connection.exec_driver_sql(f'CREATE INDEX ix_{name}_company_id ON {name} (company_id)')
+            created.append(name)
+
+        params = {'start': month, 'end': add_months(month, 1)}
+        range_sql = '"timestamp" >= :start AND "timestamp" < :end'
+        connection.execute(_range_clause(
+            f'INSERT INTO {name} ({columns}) SELECT {columns} FROM {HEAD_TABLE} WHERE {range_sql}'
+        ), params)
+        connection.execute(_range_clause(f'DELETE FROM {HEAD_TABLE} WHERE {range_sql}'), params)
+
+    if created:
+        _rebuild_sqlite_view(connection)
+    return created
+
+
+def _rebuild_sqlite_view(connection):
+    columns = [f'"{c.name}"' for c in _log_table().columns]
+    column_list = ', '.join(columns)
+    tables = [HEAD_TABLE] + [name for _, name in reversed(list_partitions(connection))]
+
+    # Dropping the view drops its triggers too
+    connection.exec_driver_sql('DROP VIEW IF EXISTS logs')
+    connection.exec_driver_sql(
+        'CREATE VIEW logs AS ' + ' UNION ALL '.join(f'SELECT {column_list} FROM {name}' for name in tables)
+    )
+    connection.exec_driver_sql(
+        f'CREATE TRIGGER logs_insert INSTEAD OF INSERT ON logs BEGIN '
+        f'INSERT INTO {HEAD_TABLE} ({column_list}) '
+        f'VALUES ({", ".join("NEW." + name for name in columns)}); END'
+    )
+    # Each row is deleted from its month's partition only; rows that arrived
+    # late for a closed month stay in logs_head until the next rotate()
+    deletes = [f'DELETE FROM {HEAD_TABLE} WHERE id = OLD.id;']
+    for month, name in list_partitions(connection):
+        deletes.append(
+            f'DELETE FROM {name} WHERE id = OLD.id '
+            f'AND OLD."timestamp" >= \'{_sqlite_timestamp(month)}\' '
+            f'AND OLD."timestamp" < \'{_sqlite_timestamp(add_months(month, 1))}\';'
+        )
+    connection.exec_driver_sql(
+        'CREATE TRIGGER logs_delete INSTEAD OF DELETE ON logs BEGIN ' + ' '.join(deletes) + ' END'
+    )
+
+
+def _sqlite_timestamp(value):
+    # The format SQLAlchemy stores DateTime values in on SQLite
+    return value.strftime('%Y-%m-%d %H:%M:%S.%f')
+
+
+def archive_path(folder, month, part):
+    return os.path.join(folder, f'{month:%Y-%m}', f'part-{part}.jsonl.gz')
+
+
+def _json_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if hasattr(value, 'value') and not isinstance(value, (str, int, float)):
+        return value.value
+    return value
+
+
+def archive_partition(connection, month, folder, batch_size=10000):
+    """
+    Write one month's log rows to a gzip-compressed JSON Lines file
+
+    Files are written as {folder}/YYYY-MM/part-N.jsonl.gz. A month archived
+    again (rows that arrived late) gets an additional part. The partition
+    itself is left in place; see drop_partition(). IP addresses and user
+    agents are written as strings, so archives don't depend on the lookup
+    tables.
+
+    Args:
+        connection: SQLAlchemy connection
+        month: Start of the month
+        folder: Archive root folder
+        batch_size: Rows fetched per round trip
+
+    Returns:
+        Tuple of (row count, file path)
+    """
+    from models import LogIpAddress, LogUserAgent
+
+    log_table = _log_table()
+    partition = table(partition_name(month), *[column(c.name, c.type) for c in log_table.columns])
+    ip_addresses = LogIpAddress.__table__
+    user_agents = LogUserAgent.__table__
+    query = select(
+        *[c for c in partition.columns if c.name not in ('ip_address_id', 'user_agent_id')],
+        ip_addresses.c.value.label('ip_address'),
+        user_agents.c.value.label('user_agent')
+    ).select_from(
+        partition
+        .outerjoin(ip_addresses, partition.c.ip_address_id == ip_addresses.c.id)
+        .outerjoin(user_agents, partition.c.user_agent_id == user_agents.c.id)
+    ).order_by(partition.c.id)
+
+    part = 0
+    while os.path.exists(archive_path(folder, month, part)):
+        part += 1
+    path = archive_path(folder, month, part)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    count = 0
+    temp_path = path + '.tmp'
+    try:
+        with gzip.open(temp_path, 'wt', encoding='utf-8') as f:
+            result = connection.execution_options(yield_per=batch_size).execute(query)
+            for row in result:
+                f.write(json.dumps({key: _json_value(value) for key, value in row._mapping.items()}))
+                f.write('\n')
+                count += 1
+        # Only complete files get their final name
+        os.replace(temp_path, path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    return count, path
+
+
+def drop_partition(connection, month):
+    """
+    Remove an archived month's partition from the database
+
+    Args:
+        connection: SQLAlchemy connection
+        month: Start of the month
+    """
+    name = partition_name(month)
+    if connection.dialect.name == 'postgresql':
+        connection.exec_driver_sql(f'ALTER TABLE logs DETACH PARTITION {name}')
+        connection.exec_driver_sql(f'DROP TABLE {name}')
+    else:
+        connection.exec_driver_sql(f'DROP TABLE {name}')
+        _rebuild_sqlite_view(connection)
+
+
+def archive_logs(engine, folder, retention_months=None, now=None, dry_run=False):
+    """
+    Archive and drop log partitions older than the retention window
+
+    Closed months are first moved into their own partitions, then every
+    partition older than retention_months (counting the current month) is
+    written to the archive folder and dropped, and partitions for the
+    coming months are created. Each month is archived before it is dropped,
+    in its own transaction.
+
+    Args:
+        engine: SQLAlchemy engine
+        folder: Archive root folder
+        retention_months: Months kept in the database (default LOG_RETENTION_MONTHS)
+        now: Current time (default utcnow)
+        dry_run: Only report the months that would be archived
+
+    Returns:
+        List of {'month', 'partition', 'rows', 'path'} dictionaries
+    """
+    if retention_months is None:
+        retention_months = int(_setting('LOG_RETENTION_MONTHS', 6))
+    now = now or datetime.utcnow()
+    cutoff = add_months(month_start(now), -(max(1, retention_months) - 1))
+
+    with engine.begin() as connection:
+        if not is_partitioned(connection):
+            raise RuntimeError('The logs table is not partitioned; run `flask partition-logs` first')
+        if not dry_run:
+            rotate(connection, now)
+        expired = [(month, name) for month, name in list_partitions(connection) if month < cutoff]
+
+    archived = []
+    for month, name in expired:
+        entry = {'month': month, 'partition': name, 'rows': None, 'path': None}
+        if not dry_run:
+            with engine.connect() as connection:
+                entry['rows'], entry['path'] = archive_partition(connection, month, folder)
+            with engine.begin() as connection:
+                drop_partition(connection, month)
+        archived.append(entry)
+
+    if not dry_run:
+        with engine.begin() as connection:
+            ensure_partitions(connection, now=now)
+
+    return archived
+
+
+def list_archives(folder):
+    """
+    List archived months
+
+    Args:
+        folder: Archive root folder
+
+    Returns:
+        List of (month, [file paths]) tuples, oldest first
+    """
+    if not os.path.isdir(folder):
+        return []
+
+    archives = []
+    for entry in sorted(os.listdir(folder)):
+        try:
+            month = datetime.strptime(entry, '%Y-%m')
+        except ValueError:
+            continue
+        month_folder = os.path.join(folder, entry)
+        paths = sorted(
+            os.path.join(month_folder, name) for name in os.listdir(month_folder)
+            if name.endswith('.jsonl.gz')
+        )
+        if paths:
+            archives.append((month, paths))
+    return archives
+
+
+def iter_archive(folder, start=None, end=None):
+    """
+    Read archived log rows
+
+    Args:
+        folder: Archive root folder
+        start: Optional datetime; only rows at or after it
+        end: Optional datetime; only rows before it
+
+    Yields:
+        Dictionaries of Log column values with timestamps as datetimes
+    """
+    for month, paths in list_archives(folder):
+        if start is not None and add_months(month, 1) <= start:
+            continue
+        if end is not None and month >= end:
+            break
+
+        for path in paths:
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                for line in f:
+                    row = json.loads(line)
+                    if row.get('timestamp'):
+                        row['timestamp'] = datetime.fromisoformat(row['timestamp'])
+                    timestamp = row.get('timestamp')
+                    if start is not None and (timestamp is None or timestamp < start):
+                        continue
+                    if end is not None and (timestamp is None or timestamp >= end):
+                        continue
+                    yield row
@@ -1,6 +1,8 @@
 from models.users import User, UserRole, Admin, CompanyOwner, Manager, Operator, Driver
 from models.operations import (
-    Company, Task, TaskStatus, Route, RouteStatus, Document,
-    Message, Log, ActionType, Statistics, DocumentCategory
+    Company, Task, TaskStatus, Route, RouteStatus, RouteWaypoint, RouteEvent, RouteEventType, Document,
+    Message, UnreadCounter, Log, ActionType, Statistics, DocumentCategory,
+    TaskDailyRollup, RouteDailyRollup, Job, JobStatus, LogIpAddress, LogUserAgent, GeocodeCacheEntry,
+    DriverPosition, RouteTrack, CompanySpeedModel, AuditWriterStats
 )
-
+from models.search import DocumentSearchEntry, SearchTrigram
@@ -1,7 +1,10 @@
 from datetime import datetime
 
 import psycopg2
-from sqlalchemy import Enum, JSON, Text
+from sqlalchemy import Enum, JSON, REAL, Text, case, event, func, inspect, select
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.associationproxy import association_proxy
 import enum
 
 
@@ -35,6 +38,13 @@ class ActionType(enum.Enum):
     ASSIGN = "assign"
 
 
+class JobStatus(enum.Enum):
+    QUEUED = "QUEUED"
+    RUNNING = "RUNNING"
+    SUCCEEDED = "SUCCEEDED"
+    FAILED = "FAILED"
+
+
 class Company(db.Model):
     __tablename__ = 'companies'
 
@@ -94,7 +104,11 @@ class Route(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     start_point = db.Column(db.String(256), nullable=False)
     end_point = db.Column(db.String(256), nullable=False)
-    waypoints = db.Column(JSON, nullable=True)
+    # Coordinates of start_point and end_point, resolved by the geocoder
+    start_lat = db.Column(db.Float, nullable=True)
+    start_lng = db.Column(db.Float, nullable=True)
+    end_lat = db.Column(db.Float, nullable=True)
+    end_lng = db.Column(db.Float, nullable=True)
     distance = db.Column(db.Float, nullable=True)
     estimated_time = db.Column(db.Integer, nullable=True)  # in minutes
     start_time = db.Column(db.DateTime, nullable=True, index=True)
@@ -112,11 +126,195 @@ class Route(db.Model):
     driver = db.relationship('Driver', back_populates='routes')
     task = db.relationship('Task', back_populates='route')
     documents = db.relationship('Document', back_populates='route', cascade='all, delete-orphan')
+    waypoint_rows = db.relationship('RouteWaypoint', back_populates='route', order_by='RouteWaypoint.seq',
+                                    cascade='all, delete-orphan', passive_deletes=True)
+    # Append-only history, never loaded with the route; query it when needed
+    events = db.relationship('RouteEvent', back_populates='route', order_by='RouteEvent.seq', lazy='dynamic',
+                             cascade='all, delete-orphan', passive_deletes=True)
+
+    @property
+    def waypoints(self):
+        """
+        Waypoints in route order as dictionaries, shaped like the JSON they are entered as
+
+        The first unfinished waypoint of a route in progress is marked active.
+        """
+        waypoints = []
+        active = self.status == RouteStatus.IN_PROGRESS
+        for row in self.waypoint_rows:
+            waypoint = row.to_dict()
+            if active and not row.completed:
+                waypoint['active'] = True
+                active = False
+            waypoints.append(waypoint)
+        return waypoints
+
+    @waypoints.setter
+    def waypoints(self, waypoints):
+        # Rows are updated in place by position so (route_id, seq) stays unique during the flush
+        waypoints = waypoints or []
+        rows = self.waypoint_rows
+        for seq, waypoint in enumerate(waypoints):
+            if seq < len(rows):
+                rows[seq].update_from_dict(waypoint)
+            else:
+                row = RouteWaypoint(seq=seq)
+                row.update_from_dict(waypoint)
+                rows.append(row)
+        del rows[len(waypoints):]
 
     def __repr__(self):
         return f'<Route {self.id}: {self.start_point} to {self.end_point}>'
 
 
+class RouteWaypoint(db.Model):
+    __tablename__ = 'route_waypoints'
+
+    # Format of completion_time in the dictionary form, as previously stored in the JSON blob
+    TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+    # Keys with a column of their own; anything else entered by the user is kept in extra
+    FIELDS = ('location', 'type', 'notes', 'lat', 'lng', 'completed', 'completion_time')
+    # Derived or moved to route_events, never stored
+    IGNORED_KEYS = ('active', 'status_updates')
+
+    id = db.Column(db.Integer, primary_key=True)
+    route_id = db.Column(db.Integer, db.ForeignKey('routes.id', ondelete='CASCADE'), nullable=False)
+    seq = db.Column(db.Integer, nullable=False)  # position in the route, from 0
+    location = db.Column(db.String(512), nullable=True)
+    type = db.Column(db.String(32), nullable=True)
+    notes = db.Column(db.Text, nullable=True)
+    lat = db.Column(db.Float, nullable=True)
+    lng = db.Column(db.Float, nullable=True)
+    completed = db.Column(db.Boolean, default=False, nullable=False)
+    completed_at = db.Column(db.DateTime, nullable=True)
+    extra = db.Column(JSON, nullable=True)
+
+    route = db.relationship('Route', back_populates='waypoint_rows')
+
+    __table_args__ = (
+        db.Index('ux_route_waypoints_route_seq', 'route_id', 'seq', unique=True),
+    )
+
+    @staticmethod
+    def _coordinate(value):
+        try:
+            return float(value) if value not in (None, '') else None
+        except (TypeError, ValueError):
+            return None
+
+    def update_from_dict(self, waypoint):
+        """
+        Set the columns from a waypoint dictionary as entered in the route form
+
+        Args:
+            waypoint: Dictionary with location, type, notes, lat, lng, completed and completion_time
+        """
+        if not isinstance(waypoint, dict):
+            waypoint = {'location': str(waypoint)}
+
+        self.location = waypoint.get('location')
+        self.type = waypoint.get('type')
+        self.notes = waypoint.get('notes')
+        self.lat = self._coordinate(waypoint.get('lat'))
+        self.lng = self._coordinate(waypoint.get('lng'))
+        self.completed = bool(waypoint.get('completed', False))
+
+        completed_at = None
+        if self.completed and waypoint.get('completion_time'):
+            try:
+                completed_at = datetime.strptime(waypoint['completion_time'], self.TIME_FORMAT)
+            except (TypeError, ValueError):
+                pass
+        # Keep the recorded time when an edit resubmits the same waypoint
+        if not self.completed:
+            self.completed_at = None
+        elif completed_at is not None or self.completed_at is None:
+            self.completed_at = completed_at
+
+        extra = {key: value for key, value in waypoint.items()
+                 if key not in self.FIELDS and key not in self.IGNORED_KEYS}
+        self.extra = extra or None
+
+    def to_dict(self):
+        """
+        Waypoint as a dictionary, without keys that have no value
+        """
+        waypoint = dict(self.extra or {})
+        for key in ('location', 'type', 'notes', 'lat', 'lng'):
+            value = getattr(self, key)
+            if value is not None:
+                waypoint[key] = value
+        waypoint['completed'] = self.completed
+        if self.completed_at:
+            waypoint['completion_time'] = self.completed_at.strftime(self.TIME_FORMAT)
+        return waypoint
+
+    def __repr__(self):
+        return f'<RouteWaypoint {self.route_id}#{self.seq}: {self.location}>'
+
+
+class RouteEventType(enum.Enum):
+    STATUS_UPDATE = "STATUS_UPDATE"
+    WAYPOINT_COMPLETED = "WAYPOINT_COMPLETED"
+
+
+class RouteEvent(db.Model):
+    """
+    Append-only history of a route: driver status updates and waypoint completions
+    """
+    __tablename__ = 'route_events'
+
+    id = db.Column(db.Integer, primary_key=True)
+    route_id = db.Column(db.Integer, db.ForeignKey('routes.id', ondelete='CASCADE'), nullable=False)
+    seq = db.Column(db.Integer, nullable=False)  # order within the route, from 1
+    event_type = db.Column(Enum(RouteEventType), nullable=False)
+    waypoint_id = db.Column(db.Integer, db.ForeignKey('route_waypoints.id', ondelete='SET NULL'), nullable=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='SET NULL'), nullable=True)
+    message = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    route = db.relationship('Route', back_populates='events')
+    waypoint = db.relationship('RouteWaypoint')
+    user = db.relationship('User')
+
+    __table_args__ = (
+        db.Index('ux_route_events_route_seq', 'route_id', 'seq', unique=True),
+    )
+
+    @classmethod
+    def append(cls, connection, route_id, event_type, message=None, waypoint_id=None, user_id=None,
+               created_at=None):
+        """
+        Append an event, numbering it after the route's last one in the same statement
+
+        Args:
+            connection: SQLAlchemy connection or session
+            route_id: ID of the route
+            event_type: RouteEventType
+            message: Optional text, e.g. the driver's status message
+            waypoint_id: Optional ID of the waypoint the event belongs to
+            user_id: Optional ID of the user who caused the event
+            created_at: Time of the event, defaults to now
+        """
+        next_seq = (
+            select(func.coalesce(func.max(cls.seq), 0) + 1)
+            .where(cls.route_id == route_id)
+            .scalar_subquery()
+        )
+        connection.execute(cls.__table__.insert().values(
+            route_id=route_id,
+            seq=next_seq,
+            event_type=event_type,
+            message=message,
+            waypoint_id=waypoint_id,
+            user_id=user_id,
+            created_at=created_at or datetime.utcnow()
+        ))
+
+    def __repr__(self):
+        return f'<RouteEvent {self.route_id}#{self.seq}: {self.event_type.value}>'
+
+
 class CaseInsensitiveEnum(enum.Enum):
     @classmethod
     def _missing_(cls, value):
@@ -225,19 +423,211 @@ class Message(db.Model):
     recipient = db.relationship('User', foreign_keys=[recipient_id], back_populates='received_messages')
     task = db.relationship('Task', back_populates='messages')
 
+    # Conversation lookups and keyset pagination on (sent_at, id)
+    __table_args__ = (
+        db.Index('ix_messages_conversation', 'sender_id', 'recipient_id', 'sent_at', 'id'),
+    )
+
     def __repr__(self):
         return f'<Message {self.id}>'
 
 
+class UnreadCounter(db.Model):
+    """
+    Number of unread messages a recipient has from each sender
+
+    Kept in step with the messages table in the same transaction: ORM
+    inserts, updates and deletes of Message adjust it through the mapper
+    events below, and bulk read-marking or deletes call adjust() themselves.
+    """
+    __tablename__ = 'unread_counters'
+
+    recipient_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    sender_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    @classmethod
+    def adjust(cls, connection, recipient_id, sender_id, delta):
+        """
+        Add delta to a counter, creating it if needed and never going below zero
+
+        Args:
+            connection: SQLAlchemy connection of the current transaction
+            recipient_id: ID of the recipient
+            sender_id: ID of the sender
+            delta: Amount to add (negative to subtract)
+        """
+        if not delta:
+            return
+
+        table = cls.__table__
+        now = datetime.utcnow()
+        new_count = case((table.c.count + delta < 0, 0), else_=table.c.count + delta)
+        dialect = connection.dialect.name
+
+        if dialect in ('postgresql', 'sqlite'):
+            insert = postgresql_insert if dialect == 'postgresql' else sqlite_insert
+            statement = insert(table).values(
+                recipient_id=recipient_id,
+                sender_id=sender_id,
+                count=max(delta, 0),
+                updated_at=now
+            ).on_conflict_do_update(
+                index_elements=[table.c.recipient_id, table.c.sender_id],
+                set_={'count': new_count, 'updated_at': now}
+            )
+            connection.execute(statement)
+            return
+
+        # Other databases: update, then insert if the row didn't exist
+        result = connection.execute(
+            table.update().where(
+                table.c.recipient_id == recipient_id,
+                table.c.sender_id == sender_id
+            ).values(count=new_count, updated_at=now)
+        )
+        if result.rowcount == 0 and delta > 0:
+            connection.execute(table.insert().values(
+                recipient_id=recipient_id,
+                sender_id=sender_id,
+                count=delta,
+                updated_at=now
+            ))
+
+    def __repr__(self):
+        return f'<UnreadCounter {self.recipient_id}<-{self.sender_id}: {self.count}>'
+
+
+@event.listens_for(Message, 'after_insert')
+def _count_inserted_message(mapper, connection, target):
+    if not target.is_read:
+        UnreadCounter.adjust(connection, target.recipient_id, target.sender_id, 1)
+
+
+@event.listens_for(Message, 'after_update')
+def _count_updated_message(mapper, connection, target):
+    history = inspect(target).attrs.is_read.history
+    if not history.has_changes():
+        return
+    was_read = bool(history.deleted[0]) if history.deleted else False
+    if was_read != bool(target.is_read):
+        UnreadCounter.adjust(connection, target.recipient_id, target.sender_id, -1 if target.is_read else 1)
+
+
+@event.listens_for(Message, 'after_delete')
+def _count_deleted_message(mapper, connection, target):
+    if not target.is_read:
+        UnreadCounter.adjust(connection, target.recipient_id, target.sender_id, -1)
+
+
+class LogLookupMixin:
+    """
+    Distinct string values referenced from log rows by integer id
+
+    Log entries repeat the same few IP addresses and user agents, so each
+    value is stored once and the logs table only keeps its id.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+
+    @classmethod
+    def ids_for(cls, connection, values):
+        """
+        Get ids for values, inserting the ones that are not stored yet
+
+        Args:
+            connection: SQLAlchemy connection of the current transaction
+            values: Iterable of strings; empty values are skipped
+
+        Returns:
+            Dictionary of value -> id
+        """
+        values = {value for value in values if value}
+        if not values:
+            return {}
+
+        table = cls.__table__
+        dialect = connection.dialect.name
+        if dialect in ('postgresql', 'sqlite'):
+            insert = postgresql_insert if dialect == 'postgresql' else sqlite_insert
+            connection.execute(
+                insert(table).on_conflict_do_nothing(index_elements=[table.c.value]),
+                [{'value': value} for value in values]
+            )
+        else:
+            existing = set(connection.execute(
+                select(table.c.value).where(table.c.value.in_(values))
+            ).scalars())
+            if values - existing:
+                connection.execute(table.insert(), [{'value': value} for value in values - existing])
+
+        rows = connection.execute(select(table.c.value, table.c.id).where(table.c.value.in_(values)))
+        return dict(rows.all())
+
+
+class LogIpAddress(LogLookupMixin, db.Model):
+    __tablename__ = 'log_ip_addresses'
+
+    value = db.Column(db.String(64), nullable=False, unique=True)
+
+
+class LogUserAgent(LogLookupMixin, db.Model):
+    __tablename__ = 'log_user_agents'
+
+    value = db.Column(db.String(256), nullable=False, unique=True)
+
+
+class AuditWriterStats(db.Model):
+    """
+    Counters of each process's AuditLogWriter, written by its background thread
+
+    The writer's counters live in process memory; storing them here lets
+    `flask audit-log-stats` report on the web workers from another process.
+    """
+    __tablename__ = 'audit_writer_stats'
+
+    process = db.Column(db.String(128), primary_key=True)  # hostname:pid
+    enqueued = db.Column(db.BigInteger, nullable=False, default=0)
+    flushed = db.Column(db.BigInteger, nullable=False, default=0)
+    dropped = db.Column(db.BigInteger, nullable=False, default=0)
+    failed = db.Column(db.BigInteger, nullable=False, default=0)
+    batches = db.Column(db.BigInteger, nullable=False, default=0)
+    pending = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    COUNTERS = ('enqueued', 'flushed', 'dropped', 'failed', 'batches', 'pending')
+
+    @classmethod
+    def store(cls, connection, process, counters):
+        """
+        Replace the stored counters of a process
+
+        Args:
+            connection: SQLAlchemy connection of the current transaction
+            process: Process key, hostname:pid
+            counters: Dictionary with the COUNTERS
+        """
+        table = cls.__table__
+        values = {name: counters.get(name, 0) for name in cls.COUNTERS}
+        values['updated_at'] = datetime.utcnow()
+        result = connection.execute(table.update().where(table.c.process == process).values(values))
+        if result.rowcount == 0:
+            connection.execute(table.insert().values(process=process, **values))
+
+    def __repr__(self):
+        return f'<AuditWriterStats {self.process}: {self.flushed} flushed, {self.dropped} dropped>'
+
+
 class Log(db.Model):
     __tablename__ = 'logs'
 
     id = db.Column(db.Integer, primary_key=True)
     action_type = db.Column(Enum(ActionType), nullable=False, index=True)
     description = db.Column(db.Text, nullable=False)
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True)
-    ip_address = db.Column(db.String(64), nullable=True)
-    user_agent = db.Column(db.String(256), nullable=True)
+    # Partition key (see log_partitions), so it can't be NULL
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+    ip_address_id = db.Column(db.Integer, db.ForeignKey('log_ip_addresses.id'), nullable=True)
+    user_agent_id = db.Column(db.Integer, db.ForeignKey('log_user_agents.id'), nullable=True)
 
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
 
@@ -247,11 +637,43 @@ class Log(db.Model):
     # Relationships
     company = db.relationship('Company', foreign_keys=[company_id])
     user = db.relationship('User', back_populates='logs')
+    ip_address_entry = db.relationship('LogIpAddress', lazy='joined')
+    user_agent_entry = db.relationship('LogUserAgent', lazy='joined')
+
+    # The stored strings, as before the values moved to lookup tables
+    ip_address = association_proxy('ip_address_entry', 'value')
+    user_agent = association_proxy('user_agent_entry', 'value')
+
+    __table_args__ = (
+        # Keyset pagination order (see LogService.get_paginated_logs)
+        db.Index('ix_logs_timestamp_id', 'timestamp', 'id'),
+    )
 
     def __repr__(self):
         return f'<Log {self.id}: {self.action_type.value}>'
 
 
+@event.listens_for(Log.__table__, 'after_create')
+def _partition_logs(target, connection, **kw):
+    # Split logs into monthly partitions as soon as it exists
+    from log_partitions import install
+    install(connection)
+
+
+@event.listens_for(Log.__table__, 'before_drop')
+def _unpartition_logs(target, connection, **kw):
+    from log_partitions import uninstall
+    uninstall(connection)
+
+
+@event.listens_for(Log, 'before_insert')
+def _reserve_log_id(mapper, connection, target):
+    # Inserts through the SQLite logs view don't report the new row's id
+    if target.id is None and connection.dialect.name == 'sqlite':
+        from log_partitions import next_sqlite_id
+        target.id = next_sqlite_id(connection)
+
+
 class Statistics(db.Model):
     __tablename__ = 'statistics'
 
@@ -268,4 +690,483 @@ class Statistics(db.Model):
     user = db.relationship('User', backref='statistics')
 
     def __repr__(self):
-        return f'<Statistics {self.id}>'
\ No newline at end of file
+        return f'<Statistics {self.id}>'
+
+
+class Job(db.Model):
+    """
+    Background job stored in the database queue
+
+    Workers started with `flask run-worker` claim queued jobs whose run_at
+    has passed. A dedup_key is unique among queued jobs, so the same work is
+    never queued twice, while a running job may have one queued follow-up.
+    Jobs that produce a file keep it on disk and record its location in the
+    artifact_* columns.
+    """
+    __tablename__ = 'jobs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(64), nullable=False, index=True)
+    payload = db.Column(JSON, nullable=False, default=dict)
+    status = db.Column(Enum(JobStatus), default=JobStatus.QUEUED, nullable=False)
+    dedup_key = db.Column(db.String(255), nullable=True, index=True)
+
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=3)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_by = db.Column(db.String(64), nullable=True)
+    locked_at = db.Column(db.DateTime, nullable=True)
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True, index=True)
+
+    result = db.Column(JSON, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+
+    artifact_path = db.Column(db.String(512), nullable=True)
+    artifact_name = db.Column(db.String(256), nullable=True)
+    artifact_mimetype = db.Column(db.String(128), nullable=True)
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='SET NULL'), nullable=True, index=True)
+    company_id = db.Column(db.Integer, db.ForeignKey('companies.id', ondelete='CASCADE'), nullable=True, index=True)
+
+    __table_args__ = (
+        db.Index('ix_jobs_status_run_at', 'status', 'run_at'),
+        db.Index(
+            'ux_jobs_queued_dedup_key', 'dedup_key', unique=True,
+            postgresql_where=db.text("status = 'QUEUED'"),
+            sqlite_where=db.text("status = 'QUEUED'")
+        ),
+    )
+
+    @property
+    def is_finished(self):
+        return self.status in (JobStatus.SUCCEEDED, JobStatus.FAILED)
+
+    def __repr__(self):
+        return f'<Job {self.id}: {self.name} {self.status.value}>'
+
+
+def _upsert_rollup(connection, table, key, deltas):
+    """
+    Add deltas to the rollup row identified by key, creating it if needed
+
+    Args:
+        connection: SQLAlchemy connection of the current transaction
+        table: Rollup table
+        key: Dictionary with the primary key columns
+        deltas: Dictionary of column -> amount to add
+    """
+    deltas = {column: delta for column, delta in deltas.items() if delta}
+    if not deltas:
+        return
+
+    dialect = connection.dialect.name
+
+    if dialect in ('postgresql', 'sqlite'):
+        insert = postgresql_insert if dialect == 'postgresql' else sqlite_insert
+        statement = insert(table).values(**key, **deltas).on_conflict_do_update(
+            index_elements=[table.c[column] for column in key],
+            set_={column: table.c[column] + delta for column, delta in deltas.items()}
+        )
+        connection.execute(statement)
+        return
+
+    # Other databases: update, then insert if the row didn't exist
+    result = connection.execute(
+        table.update().where(
+            *[table.c[column] == value for column, value in key.items()]
+        ).values({column: table.c[column] + delta for column, delta in deltas.items()})
+    )
+    if result.rowcount == 0:
+        connection.execute(table.insert().values(**key, **deltas))
+
+
+def _previous_value(target, attribute):
+    """
+    Get an attribute's value as it was before the current flush
+    """
+    history = inspect(target).attrs[attribute].history
+    if history.deleted:
+        return history.deleted[0]
+    if history.unchanged:
+        return history.unchanged[0]
+    return getattr(target, attribute)
+
+
+def _apply_rollup_change(connection, table, old, new):
+    """
+    Move a row's contribution from its old rollup key to its new one
+
+    Args:
+        connection: SQLAlchemy connection of the current transaction
+        table: Rollup table
+        old: (key, values) before the change, or None
+        new: (key, values) after the change, or None
+    """
+    if old and new and old[0] == new[0]:
+        key = new[0]
+        deltas = {column: new[1][column] - old[1][column] for column in new[1]}
+        _upsert_rollup(connection, table, key, deltas)
+        return
+
+    if old:
+        _upsert_rollup(connection, table, old[0], {column: -value for column, value in old[1].items()})
+    if new:
+        _upsert_rollup(connection, table, new[0], new[1])
+
+
+class TaskDailyRollup(db.Model):
+    """
+    Number of tasks per company, creator, creation day and current status
+
+    Maintained incrementally by the Task mapper events below in the same
+    transaction as the change; rebuild it with `flask backfill-rollups`.
+    """
+    __tablename__ = 'task_daily_rollups'
+
+    company_id = db.Column(db.Integer, db.ForeignKey('companies.id', ondelete='CASCADE'), primary_key=True)
+    creator_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    status = db.Column(Enum(TaskStatus), primary_key=True)
+    task_count = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.Index('ix_task_daily_rollups_company_day', 'company_id', 'day'),
+    )
+
+    @staticmethod
+    def contribution(company_id, creator_id, created_at, status):
+        """
+        Get the (key, values) a task with these attributes adds to the rollup
+        """
+        if company_id is None or creator_id is None or status is None:
+            return None
+
+        day = (created_at or datetime.utcnow()).date()
+        key = {'company_id': company_id, 'creator_id': creator_id, 'day': day, 'status': status}
+        return key, {'task_count': 1}
+
+    def __repr__(self):
+        return f'<TaskDailyRollup {self.company_id}/{self.creator_id} {self.day} {self.status}: {self.task_count}>'
+
+
+class RouteDailyRollup(db.Model):
+    """
+    Route counts, distance and duration per company, driver, start day and status
+
+    Routes without a start_time are not counted. Maintained incrementally
+    by the Route mapper events below; rebuild it with `flask backfill-rollups`.
+    """
+    __tablename__ = 'route_daily_rollups'
+
+    company_id = db.Column(db.Integer, db.ForeignKey('companies.id', ondelete='CASCADE'), primary_key=True)
+    driver_id = db.Column(db.Integer, db.ForeignKey('drivers.id', ondelete='CASCADE'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    status = db.Column(Enum(RouteStatus), primary_key=True)
+    route_count = db.Column(db.Integer, nullable=False, default=0)
+    distance = db.Column(db.Float, nullable=False, default=0)
+    # Routes with both start_time and end_time, and the sum of their durations
+    timed_count = db.Column(db.Integer, nullable=False, default=0)
+    duration_seconds = db.Column(db.Float, nullable=False, default=0)
+
+    __table_args__ = (
+        db.Index('ix_route_daily_rollups_company_day', 'company_id', 'day'),
+    )
+
+    @staticmethod
+    def contribution(company_id, driver_id, start_time, end_time, status, distance):
+        """
+        Get the (key, values) a route with these attributes adds to the rollup
+        """
+        if company_id is None or driver_id is None or start_time is None or status is None:
+            return None
+
+        timed = end_time is not None
+        key = {'company_id': company_id, 'driver_id': driver_id, 'day': start_time.date(), 'status': status}
+        return key, {
+            'route_count': 1,
+            'distance': distance or 0,
+            'timed_count': 1 if timed else 0,
+            'duration_seconds': (end_time - start_time).total_seconds() if timed else 0
+        }
+
+    def __repr__(self):
+        return f'<RouteDailyRollup {self.company_id}/{self.driver_id} {self.day} {self.status}: {self.route_count}>'
+
+
+TASK_ROLLUP_ATTRIBUTES = ('company_id', 'creator_id', 'created_at', 'status')
+ROUTE_ROLLUP_ATTRIBUTES = ('company_id', 'driver_id', 'start_time', 'end_time', 'status', 'distance')
+
+
+def _keep_previous_value(target, value, oldvalue, initiator):
+    pass
+
+
+# Load the old value on assignment, even on expired instances, so the
+# update hooks know which rollup row to move the task or route out of
+for model, attributes in ((Task, TASK_ROLLUP_ATTRIBUTES), (Route, ROUTE_ROLLUP_ATTRIBUTES)):
+    for name in attributes:
+        event.listen(getattr(model, name), 'set', _keep_previous_value, active_history=True)
+
+
+def _rollup_changed(target, attributes):
+    state = inspect(target)
+    return any(state.attrs[name].history.has_changes() for name in attributes)
+
+
+@event.listens_for(Task, 'after_insert')
+def _rollup_inserted_task(mapper, connection, target):
+    new = TaskDailyRollup.contribution(*[getattr(target, name) for name in TASK_ROLLUP_ATTRIBUTES])
+    _apply_rollup_change(connection, TaskDailyRollup.__table__, None, new)
+
+
+@event.listens_for(Task, 'before_update')
+def _rollup_updated_task(mapper, connection, target):
+    if not _rollup_changed(target, TASK_ROLLUP_ATTRIBUTES):
+        return
+    old = TaskDailyRollup.contribution(*[_previous_value(target, name) for name in TASK_ROLLUP_ATTRIBUTES])
+    new = TaskDailyRollup.contribution(*[getattr(target, name) for name in TASK_ROLLUP_ATTRIBUTES])
+    _apply_rollup_change(connection, TaskDailyRollup.__table__, old, new)
+
+
+@event.listens_for(Task, 'before_delete')
+def _rollup_deleted_task(mapper, connection, target):
+    old = TaskDailyRollup.contribution(*[_previous_value(target, name) for name in TASK_ROLLUP_ATTRIBUTES])
+    _apply_rollup_change(connection, TaskDailyRollup.__table__, old, None)
+
+
+@event.listens_for(Route, 'after_insert')
+def _rollup_inserted_route(mapper, connection, target):
+    new = RouteDailyRollup.contribution(*[getattr(target, name) for name in ROUTE_ROLLUP_ATTRIBUTES])
+    _apply_rollup_change(connection, RouteDailyRollup.__table__, None, new)
+
+
+@event.listens_for(Route, 'before_update')
+def _rollup_updated_route(mapper, connection, target):
+    if not _rollup_changed(target, ROUTE_ROLLUP_ATTRIBUTES):
+        return
+    old = RouteDailyRollup.contribution(*[_previous_value(target, name) for name in ROUTE_ROLLUP_ATTRIBUTES])
+    new = RouteDailyRollup.contribution(*[getattr(target, name) for name in ROUTE_ROLLUP_ATTRIBUTES])
+    _apply_rollup_change(connection, RouteDailyRollup.__table__, old, new)
+
+
+@event.listens_for(Route, 'before_delete')
+def _rollup_deleted_route(mapper, connection, target):
+    old = RouteDailyRollup.contribution(*[_previous_value(target, name) for name in ROUTE_ROLLUP_ATTRIBUTES])
+    _apply_rollup_change(connection, RouteDailyRollup.__table__, old, None)
+
+
+class GeocodeCacheEntry(db.Model):
+    """
+    Persistent geocoding results shared by all processes (see geocoding.Geocoder)
+
+    One row per provider, kind ('address' or 'url') and normalized query.
+    Lookups that found nothing are stored too (found is False), so unknown
+    addresses are not sent to the provider again until the entry expires.
+    """
+    __tablename__ = 'geocode_cache'
+
+    id = db.Column(db.Integer, primary_key=True)
+    provider = db.Column(db.String(32), nullable=False)
+    kind = db.Column(db.String(16), nullable=False)
+    # Named query_key because Model.query is the Flask-SQLAlchemy query property
+    query_key = db.Column(db.String(512), nullable=False)
+    found = db.Column(db.Boolean, nullable=False)
+    lat = db.Column(db.Float, nullable=True)
+    lng = db.Column(db.Float, nullable=True)
+    display_name = db.Column(db.String(512), nullable=True)
+    resolved_url = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    __table_args__ = (
+        db.Index('ux_geocode_cache_query', 'provider', 'kind', 'query_key', unique=True),
+    )
+
+    VALUE_COLUMNS = ('lat', 'lng', 'display_name', 'resolved_url')
+
+    @classmethod
+    def fetch(cls, connection, provider, kind, query, now):
+        """
+        Get an unexpired entry
+
+        Args:
+            connection: SQLAlchemy connection
+            provider: Provider name
+            kind: 'address' or 'url'
+            query: Normalized query
+            now: Current time
+
+        Returns:
+            Tuple of (found, values dictionary, expires_at) or None if there is no fresh entry
+        """
+        table = cls.__table__
+        row = connection.execute(
+            select(table).where(
+                table.c.provider == provider,
+                table.c.kind == kind,
+                table.c.query_key == query,
+                table.c.expires_at > now
+            )
+        ).mappings().first()
+        if row is None:
+            return None
+
+        values = {key: row[key] for key in cls.VALUE_COLUMNS if row[key] is not None}
+        return row['found'], values, row['expires_at']
+
+    @classmethod
+    def store(cls, connection, provider, kind, query, values, expires_at):
+        """
+        Insert or replace an entry
+
+        Args:
+            connection: SQLAlchemy connection
+            provider: Provider name
+            kind: 'address' or 'url'
+            query: Normalized query
+            values: Result dictionary, or None for a lookup that found nothing
+            expires_at: When the entry stops being used
+        """
+        table = cls.__table__
+        row = {key: (values or {}).get(key) for key in cls.VALUE_COLUMNS}
+        row.update(found=values is not None, created_at=datetime.utcnow(), expires_at=expires_at)
+        key = {'provider': provider, 'kind': kind, 'query_key': query}
+        dialect = connection.dialect.name
+
+        if dialect in ('postgresql', 'sqlite'):
+            insert = postgresql_insert if dialect == 'postgresql' else sqlite_insert
+            connection.execute(
+                insert(table).values(**key, **row).on_conflict_do_update(
+                    index_elements=[table.c.provider, table.c.kind, table.c.query_key],
+                    set_=row
+                )
+            )
+            return
+
+        connection.execute(table.delete().where(*[table.c[column] == value for column, value in key.items()]))
+        connection.execute(table.insert().values(**key, **row))
+
+    @classmethod
+    def purge_expired(cls, connection, now):
+        """
+        Delete expired entries
+
+        Returns:
+            Number of entries deleted
+        """
+        return connection.execute(cls.__table__.delete().where(cls.__table__.c.expires_at <= now)).rowcount
+
+
+class DriverPosition(db.Model):
+    """
+    GPS pings sent by the driver app
+
+    Kept narrow because the table grows by thousands of rows per second: no
+    surrogate key, single precision coordinates and speed. On PostgreSQL the
+    table is range-partitioned by day on recorded_at (see tracking.py); old
+    days are dropped as whole partitions.
+    """
+    __tablename__ = 'driver_positions'
+
+    driver_id = db.Column(db.Integer, db.ForeignKey('drivers.id', ondelete='CASCADE'), primary_key=True)
+    recorded_at = db.Column(db.DateTime, primary_key=True)
+    route_id = db.Column(db.Integer, db.ForeignKey('routes.id', ondelete='SET NULL'), nullable=True)
+    lat = db.Column(REAL, nullable=False)
+    lng = db.Column(REAL, nullable=False)
+    speed = db.Column(REAL, nullable=True)  # km/h
+
+    __table_args__ = (
+        # Track playback of a route
+        db.Index('ix_driver_positions_route_recorded_at', 'route_id', 'recorded_at'),
+        {'postgresql_partition_by': 'RANGE (recorded_at)'},
+    )
+
+    @classmethod
+    def insert_many(cls, connection, rows):
+        """
+        Insert pings, skipping ones already stored (the app resends unacknowledged batches)
+
+        Args:
+            connection: SQLAlchemy connection
+            rows: List of dictionaries with driver_id, recorded_at, route_id, lat, lng and speed
+        """
+        table = cls.__table__
+        dialect = connection.dialect.name
+
+        if dialect in ('postgresql', 'sqlite'):
+            insert = postgresql_insert if dialect == 'postgresql' else sqlite_insert
+            connection.execute(insert(table).on_conflict_do_nothing(), rows)
+            return
+
+        connection.execute(table.insert(), rows)
+
+    @classmethod
+    def latest(cls, connection, driver_ids, since):
+        """
+        Newest stored ping of each driver
+
+        Args:
+            connection: SQLAlchemy connection
+            driver_ids: List of driver IDs
+            since: Only pings recorded at or after this time (limits the partitions read)
+
+        Returns:
+            Dictionary of driver_id -> dictionary with driver_id, recorded_at, lat, lng, speed and route_id
+        """
+        table = cls.__table__
+        newest = select(table.c.driver_id, func.max(table.c.recorded_at).label('recorded_at')).where(
+            table.c.driver_id.in_(driver_ids),
+            table.c.recorded_at >= since
+        ).group_by(table.c.driver_id).subquery()
+
+        rows = connection.execute(
+            select(table.c.driver_id, table.c.recorded_at, table.c.lat, table.c.lng, table.c.speed, table.c.route_id)
+            .select_from(table.join(newest, (table.c.driver_id == newest.c.driver_id) &
+                                    (table.c.recorded_at == newest.c.recorded_at)))
+        )
+        return {row.driver_id: dict(row._mapping) for row in rows}
+
+
+@event.listens_for(DriverPosition.__table__, 'after_create')
+def _partition_driver_positions(target, connection, **kw):
+    from tracking import ensure_partitions
+    ensure_partitions(connection)
+
+
+class RouteTrack(db.Model):
+    """
+    Pre-simplified GPS track of a completed route, one row per zoom level (see track_geometry.py)
+    """
+    __tablename__ = 'route_tracks'
+
+    route_id = db.Column(db.Integer, db.ForeignKey('routes.id', ondelete='CASCADE'), primary_key=True)
+    level = db.Column(db.SmallInteger, primary_key=True)
+    tolerance = db.Column(db.Float, nullable=False)  # metres
+    point_count = db.Column(db.Integer, nullable=False)
+    polyline = db.Column(db.Text, nullable=False)  # Google encoded polyline
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f'<RouteTrack {self.route_id} level {self.level}: {self.point_count} points>'
+
+
+class CompanySpeedModel(db.Model):
+    """
+    Route duration model of a company, fitted on its completed routes (see route_metrics.py)
+
+    Estimated minutes are distance * minutes_per_km + waypoints * minutes_per_stop.
+    Both are NULL while the company has too few completed routes to fit.
+    """
+    __tablename__ = 'company_speed_models'
+
+    company_id = db.Column(db.Integer, db.ForeignKey('companies.id', ondelete='CASCADE'), primary_key=True)
+    minutes_per_km = db.Column(db.Float, nullable=True)
+    minutes_per_stop = db.Column(db.Float, nullable=True)
+    sample_count = db.Column(db.Integer, nullable=False, default=0)
+    fitted_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f'<CompanySpeedModel {self.company_id}: {self.minutes_per_km} min/km, {self.minutes_per_stop} min/stop>'
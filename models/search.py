@@ -0,0 +1,478 @@
+import re
+from datetime import datetime
+
+from sqlalchemy import DDL, Text, event, func, inspect, literal, literal_column, select, table, column, and_, or_
+
+from app import db
+from models.users import User
+from models.operations import Company, Document, Task
+
+# Longest search accepted, in words; keeps pathological queries cheap
+MAX_SEARCH_TERMS = 10
+
+# Relative weight of title matches against the rest of the indexed text
+TITLE_WEIGHT = 10.0
+
+# FTS5 table kept in step with document_search by the triggers below (SQLite only)
+document_search_fts = table('document_search_fts', column('rowid'), column('title'), column('body'))
+
+
+class DocumentSearchEntry(db.Model):
+    """
+    Denormalized, indexed text of a document
+
+    title holds the document title, body its file type, category, task
+    title and uploader name. On PostgreSQL a generated tsvector column with a
+    GIN index is added when the table is created; on SQLite an external
+    content FTS5 table mirrors the rows through triggers. Rows are written by
+    the mapper events below whenever a document, its task title or its
+    uploader's name changes, and can be rebuilt with `flask reindex-documents`.
+    """
+    __tablename__ = 'document_search'
+
+    document_id = db.Column(db.Integer, db.ForeignKey('documents.id', ondelete='CASCADE'), primary_key=True)
+    company_id = db.Column(db.Integer, nullable=False, index=True)
+    title = db.Column(db.String(128), nullable=False, default='')
+    body = db.Column(Text, nullable=False, default='')
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    @staticmethod
+    def search_terms(text):
+        """
+        Split user input into lowercase words usable in both query syntaxes
+
+        Args:
+            text: Raw search input
+
+        Returns:
+            List of words (at most MAX_SEARCH_TERMS)
+        """
+        return re.findall(r'\w+', (text or '').lower())[:MAX_SEARCH_TERMS]
+
+    @classmethod
+    def match(cls, dialect, terms):
+        """
+        Build the match condition and relevance ordering for a search
+
+        Every term must match, as a prefix, somewhere in the indexed text.
+
+        Args:
+            dialect: Name of the database dialect
+            terms: Words from search_terms()
+
+        Returns:
+            Tuple of (join target or None, join condition, filter, order_by expression)
+        """
+        if dialect == 'postgresql':
+            vector = literal_column('document_search.search_vector')
+            query = func.to_tsquery('simple', ' & '.join(f'{term}:*' for term in terms))
+            return None, None, vector.op('@@')(query), func.ts_rank_cd(vector, query).desc()
+
+        if dialect == 'sqlite':
+            fts = literal_column('document_search_fts')
+            query = ' '.join(f'"{term}"*' for term in terms)
+            return (
+                document_search_fts,
+                document_search_fts.c.rowid == cls.document_id,
+                fts.op('MATCH')(query),
+                # bm25() is lower for better matches
+                func.bm25(fts, TITLE_WEIGHT, 1.0).asc()
+            )
+
+        # Other databases: unindexed substring match, newest first
+        condition = and_(*[
+            or_(cls.title.ilike(f'%{term}%'), cls.body.ilike(f'%{term}%'))
+            for term in terms
+        ])
+        return None, None, condition, None
+
+    @classmethod
+    def refresh(cls, connection, condition):
+        """
+        Rewrite the entries of the documents matching condition
+
+        Args:
+            connection: SQLAlchemy connection of the current transaction
+            condition: Filter on Document, Task or User selecting the documents
+        """
+        rows = connection.execute(
+            select(
+                Document.id, Document.company_id, Document.title, Document.file_type,
+                Document.document_category, Task.title, User.first_name, User.last_name
+            ).outerjoin(
+                Task, Document.task_id == Task.id
+            ).outerjoin(
+                User, Document.uploader_id == User.id
+            ).where(condition)
+        ).all()
+        if not rows:
+            return
+
+        table = cls.__table__
+        now = datetime.utcnow()
+        document_ids = [row[0] for row in rows]
+
+        connection.execute(table.delete().where(table.c.document_id.in_(document_ids)))
+        connection.execute(table.insert(), [
+            {
+                'document_id': document_id,
+                'company_id': company_id,
+                'title': title or '',
+                'body': ' '.join(str(part) for part in (
+                    file_type, category, task_title, first_name, last_name
+                ) if part),
+                'updated_at': now
+            }
+            for (document_id, company_id, title, file_type, category,
+                 task_title, first_name, last_name) in rows
+        ])
+
+    @classmethod
+    def remove(cls, connection, document_id):
+        table = cls.__table__
+        connection.execute(table.delete().where(table.c.document_id == document_id))
+
+    @classmethod
+    def rebuild(cls, connection, company_id=None, batch_size=1000):
+        """
+        Recreate the index from the documents table
+
+        Args:
+            connection: SQLAlchemy connection
+            company_id: Only rebuild this company's documents
+            batch_size: Documents indexed per statement
+
+        Returns:
+            Number of documents indexed
+        """
+        table = cls.__table__
+        delete = table.delete()
+        ids_query = select(Document.id).order_by(Document.id)
+        if company_id:
+            delete = delete.where(table.c.company_id == company_id)
+            ids_query = ids_query.where(Document.company_id == company_id)
+        connection.execute(delete)
+
+        document_ids = connection.execute(ids_query).scalars().all()
+        for start in range(0, len(document_ids), batch_size):
+            cls.refresh(connection, Document.id.in_(document_ids[start:start + batch_size]))
+
+        if connection.dialect.name == 'sqlite' and not company_id:
+            # Also repair any drift between the FTS table and its content table
+            connection.exec_driver_sql("INSERT INTO document_search_fts(document_search_fts) VALUES ('rebuild')")
+
+        return len(document_ids)
+
+    def __repr__(self):
+        return f'<DocumentSearchEntry {self.document_id}>'
+
+
+# PostgreSQL: weighted tsvector kept up to date by the database, with a GIN index
+event.listen(DocumentSearchEntry.__table__, 'after_create', DDL(
+    "ALTER TABLE document_search ADD COLUMN search_vector tsvector GENERATED ALWAYS AS ("
+    "setweight(to_tsvector('simple', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('simple', coalesce(body, '')), 'B')) STORED"
+).execute_if(dialect='postgresql'))
+event.listen(DocumentSearchEntry.__table__, 'after_create', DDL(
+    "CREATE INDEX ix_document_search_vector ON document_search USING GIN (search_vector)"
+).execute_if(dialect='postgresql'))
+
+# SQLite: external content FTS5 table synchronized by triggers
+for statement in (
+    "CREATE VIRTUAL TABLE document_search_fts USING fts5("
+    "title, body, content='document_search', content_rowid='document_id', "
+    "tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER document_search_ai AFTER INSERT ON document_search BEGIN "
+    "INSERT INTO document_search_fts(rowid, title, body) VALUES (new.document_id, new.title, new.body); END",
+    "CREATE TRIGGER document_search_ad AFTER DELETE ON document_search BEGIN "
+    "INSERT INTO document_search_fts(document_search_fts, rowid, title, body) "
+    "VALUES ('delete', old.document_id, old.title, old.body); END",
+    "CREATE TRIGGER document_search_au AFTER UPDATE ON document_search BEGIN "
+    "INSERT INTO document_search_fts(document_search_fts, rowid, title, body) "
+    "VALUES ('delete', old.document_id, old.title, old.body); "
+    "INSERT INTO document_search_fts(rowid, title, body) VALUES (new.document_id, new.title, new.body); END"
+):
+    event.listen(DocumentSearchEntry.__table__, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+event.listen(DocumentSearchEntry.__table__, 'before_drop', DDL(
+    "DROP TABLE IF EXISTS document_search_fts"
+).execute_if(dialect='sqlite'))
+
+
+DOCUMENT_SEARCH_ATTRIBUTES = ('title', 'file_type', 'document_category', 'task_id', 'uploader_id', 'company_id')
+
+
+def _changed(target, attributes):
+    state = inspect(target)
+    return any(state.attrs[name].history.has_changes() for name in attributes)
+
+
+@event.listens_for(Document, 'after_insert')
+def _index_inserted_document(mapper, connection, target):
+    DocumentSearchEntry.refresh(connection, Document.id == target.id)
+
+
+@event.listens_for(Document, 'after_update')
+def _index_updated_document(mapper, connection, target):
+    if _changed(target, DOCUMENT_SEARCH_ATTRIBUTES):
+        DocumentSearchEntry.refresh(connection, Document.id == target.id)
+
+
+@event.listens_for(Document, 'after_delete')
+def _unindex_deleted_document(mapper, connection, target):
+    DocumentSearchEntry.remove(connection, target.id)
+
+
+@event.listens_for(Task, 'after_update')
+def _reindex_task_documents(mapper, connection, target):
+    if _changed(target, ('title',)):
+        DocumentSearchEntry.refresh(connection, Document.task_id == target.id)
+
+
+@event.listens_for(User, 'after_update')
+def _reindex_uploader_documents(mapper, connection, target):
+    if _changed(target, ('first_name', 'last_name')):
+        DocumentSearchEntry.refresh(connection, Document.uploader_id == target.id)
+
+
+# Columns searched by fuzzy people and company search, per entity type
+TRIGRAM_ENTITIES = {
+    'user': (User, ('username', 'email', 'first_name', 'last_name', 'phone')),
+    'company': (Company, ('name', 'legal_name', 'tax_id', 'email', 'phone', 'address'))
+}
+
+# Share of the query's trigrams a row must contain to match
+TRIGRAM_MATCH_THRESHOLD = 0.5
+
+
+def trigrams(text, prefix=False):
+    """
+    Split text into the trigrams pg_trgm would extract
+
+    Each lowercase word is padded with two spaces in front and one behind.
+
+    Args:
+        text: Text to split
+        prefix: Leave out the trailing trigram of the last word so partly
+            typed words still match
+
+    Returns:
+        Set of trigrams
+    """
+    words = re.findall(r'\w+', (text or '').lower())
+    grams = set()
+    for index, word in enumerate(words):
+        padded = f'  {word}' if prefix and index == len(words) - 1 else f'  {word} '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def _searchable_sql(model, columns, qualified=True):
+    """
+    SQL of the lowercased, space-joined search text, as used by the pg_trgm indexes
+    """
+    prefix = f'{model.__tablename__}.' if qualified else ''
+    joined = " || ' ' || ".join(f"coalesce({prefix}{name}, '')" for name in columns)
+    return f'lower({joined})'
+
+
+TRIGRAM_EXTENSION_DDL = 'CREATE EXTENSION IF NOT EXISTS pg_trgm'
+
+
+def trigram_index_ddl(model, columns):
+    """
+    PostgreSQL statement creating the GIN trigram index on a model's search text
+    """
+    return f'CREATE INDEX IF NOT EXISTS ix_{model.__tablename__}_search_trgm ON {model.__tablename__} ' \
+           f'USING GIN (({_searchable_sql(model, columns, qualified=False)}) gin_trgm_ops)'
+
+
+class SearchTrigram(db.Model):
+    """
+    Trigram index of user and company search text for databases without pg_trgm
+
+    On PostgreSQL the GIN trigram indexes on users and companies are used
+    instead and this table stays empty. Elsewhere the mapper events below
+    keep one row per (entity, trigram) and searches rank rows by the share
+    of the query's trigrams they contain.
+    """
+    __tablename__ = 'search_trigrams'
+
+    entity_type = db.Column(db.String(16), primary_key=True)
+    trigram = db.Column(db.String(3), primary_key=True)
+    entity_id = db.Column(db.Integer, primary_key=True)
+
+    @staticmethod
+    def entity_text(row, columns):
+        return ' '.join(str(getattr(row, name)) for name in columns if getattr(row, name))
+
+    @classmethod
+    def refresh(cls, connection, entity_type, entity_id, text):
+        """
+        Replace the trigrams of one entity
+
+        Args:
+            connection: SQLAlchemy connection of the current transaction
+            entity_type: Key of TRIGRAM_ENTITIES
+            entity_id: ID of the user or company
+            text: Searchable text of the entity
+        """
+        cls.remove(connection, entity_type, entity_id)
+        grams = trigrams(text)
+        if grams:
+            connection.execute(cls.__table__.insert(), [
+                {'entity_type': entity_type, 'trigram': gram, 'entity_id': entity_id}
+                for gram in grams
+            ])
+
+    @classmethod
+    def remove(cls, connection, entity_type, entity_id):
+        table = cls.__table__
+        connection.execute(table.delete().where(
+            table.c.entity_type == entity_type,
+            table.c.entity_id == entity_id
+        ))
+
+    @classmethod
+    def rebuild(cls, connection, batch_size=1000):
+        """
+        Recreate the search index for every user and company
+
+        On PostgreSQL this creates the pg_trgm extension and GIN indexes if
+        they are missing; elsewhere it rewrites the search_trigrams table.
+
+        Args:
+            connection: SQLAlchemy connection
+            batch_size: Rows read per round trip
+
+        Returns:
+            Dictionary of entity type -> number of rows indexed
+        """
+        counts = {}
+        if connection.dialect.name == 'postgresql':
+            connection.exec_driver_sql(TRIGRAM_EXTENSION_DDL)
+            for entity_type, (model, columns) in TRIGRAM_ENTITIES.items():
+                connection.exec_driver_sql(trigram_index_ddl(model, columns))
+                counts[entity_type] = connection.execute(select(func.count(model.id))).scalar()
+            return counts
+
+        table = cls.__table__
+        for entity_type, (model, columns) in TRIGRAM_ENTITIES.items():
+            connection.execute(table.delete().where(table.c.entity_type == entity_type))
+            rows = connection.execute(
+                select(model.id, *[getattr(model, name) for name in columns]).execution_options(yield_per=batch_size)
+            )
+
+            counts[entity_type] = 0
+            for batch in rows.partitions():
+                values = [
+                    {'entity_type': entity_type, 'trigram': gram, 'entity_id': row.id}
+                    for row in batch
+                    for gram in trigrams(cls.entity_text(row, columns))
+                ]
+                if values:
+                    connection.execute(table.insert(), values)
+                counts[entity_type] += len(batch)
+        return counts
+
+    @classmethod
+    def match(cls, dialect, entity_type, text):
+        """
+        Build the fuzzy match condition and ranking for a search
+
+        Args:
+            dialect: Name of the database dialect
+            entity_type: Key of TRIGRAM_ENTITIES
+            text: Search input
+
+        Returns:
+            Tuple of (scores subquery or None, filter, score expression), or
+            None when the input has nothing to search for
+        """
+        model, columns = TRIGRAM_ENTITIES[entity_type]
+        normalized = ' '.join(re.findall(r'\w+', (text or '').lower()))
+        if not normalized:
+            return None
+
+        if dialect == 'postgresql':
+            searchable = literal_column(_searchable_sql(model, columns))
+            condition = or_(
+                searchable.contains(normalized, autoescape=True),
+                literal(normalized).op('<%')(searchable)
+            )
+            return None, condition, func.word_similarity(normalized, searchable)
+
+        grams = trigrams(normalized, prefix=True)
+        table = cls.__table__
+        matches = func.count(table.c.trigram)
+        scores = select(
+            table.c.entity_id,
+            (matches * 1.0 / len(grams)).label('score')
+        ).where(
+            table.c.entity_type == entity_type,
+            table.c.trigram.in_(grams)
+        ).group_by(
+            table.c.entity_id
+        ).having(
+            matches >= max(1, round(len(grams) * TRIGRAM_MATCH_THRESHOLD))
+        ).subquery()
+
+        return scores, model.id == scores.c.entity_id, scores.c.score
+
+    @classmethod
+    def apply(cls, query, dialect, entity_type, text):
+        """
+        Restrict a query on a TRIGRAM_ENTITIES model to fuzzy matches
+
+        Args:
+            query: Query or select on the entity's model
+            dialect: Name of the database dialect
+            entity_type: Key of TRIGRAM_ENTITIES
+            text: Search input
+
+        Returns:
+            Tuple of (query, score expression to order by descending, or None
+            when there was nothing to search for)
+        """
+        match = cls.match(dialect, entity_type, text)
+        if match is None:
+            return query, None
+
+        scores, condition, score = match
+        if scores is not None:
+            return query.join(scores, condition), score
+        return query.filter(condition), score
+
+    def __repr__(self):
+        return f'<SearchTrigram {self.entity_type}:{self.entity_id} {self.trigram!r}>'
+
+
+def _index_entity(connection, entity_type, target):
+    if connection.dialect.name == 'postgresql':
+        return
+    columns = TRIGRAM_ENTITIES[entity_type][1]
+    SearchTrigram.refresh(connection, entity_type, target.id, SearchTrigram.entity_text(target, columns))
+
+
+def _listen_for_trigram_changes(entity_type):
+    model, columns = TRIGRAM_ENTITIES[entity_type]
+
+    @event.listens_for(model, 'after_insert')
+    def _index_inserted(mapper, connection, target):
+        _index_entity(connection, entity_type, target)
+
+    @event.listens_for(model, 'after_update')
+    def _index_updated(mapper, connection, target):
+        if _changed(target, columns):
+            _index_entity(connection, entity_type, target)
+
+    @event.listens_for(model, 'after_delete')
+    def _unindex_deleted(mapper, connection, target):
+        if connection.dialect.name != 'postgresql':
+            SearchTrigram.remove(connection, entity_type, target.id)
+
+
+for entity_type, (model, columns) in TRIGRAM_ENTITIES.items():
+    _listen_for_trigram_changes(entity_type)
+    # New databases get the pg_trgm index along with the table
+    for statement in (TRIGRAM_EXTENSION_DDL, trigram_index_ddl(model, columns)):
+        event.listen(model.__table__, 'after_create', DDL(statement).execute_if(dialect='postgresql'))
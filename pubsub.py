@@ -0,0 +1,192 @@
+import json
+import queue
+import threading
+from collections import defaultdict
+
+try:
+    import redis
+except ImportError:  # Optional, only needed for EVENT_BROKER_URL=redis://...
+    redis = None
+
+
+class MemorySubscription:
+    """
+    Subscription to a MemoryBroker channel
+    """
+
+    def __init__(self, broker, channel, max_size):
+        self.broker = broker
+        self.channel = channel
+        self.queue = queue.Queue(maxsize=max_size)
+
+    def get(self, timeout=None):
+        """
+        Wait for the next payload
+
+        Args:
+            timeout: Seconds to wait
+
+        Returns:
+            Decoded payload or None on timeout
+        """
+        try:
+            return json.loads(self.queue.get(timeout=timeout))
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class MemoryBroker:
+    """
+    In-process broker
+
+    Only delivers to subscribers in the same process, so it suits the
+    development server and tests. Use a Redis broker with several workers.
+    """
+
+    def __init__(self, max_queue_size=100):
+        self.max_queue_size = max_queue_size
+        self._subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def publish(self, channel, payload):
+        data = json.dumps(payload)
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+
+        for subscription in subscribers:
+            try:
+                subscription.queue.put_nowait(data)
+            except queue.Full:
+                # Slow client, drop the event rather than block the publisher
+                pass
+
+    def subscribe(self, channel):
+        subscription = MemorySubscription(self, channel, self.max_queue_size)
+        with self._lock:
+            self._subscribers[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.channel)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.channel]
+
+
+class RedisSubscription:
+    """
+    Subscription to a Redis pub/sub channel
+    """
+
+    def __init__(self, pubsub):
+        self.pubsub = pubsub
+
+    def get(self, timeout=None):
+        message = self.pubsub.get_message(ignore_subscribe_messages=True, timeout=timeout or 0)
+        if message is None:
+            return None
+        return json.loads(message['data'])
+
+    def close(self):
+        try:
+            self.pubsub.close()
+        except Exception:
+            pass
+
+
+class RedisBroker:
+    """
+    Broker backed by Redis pub/sub, shared by all worker processes
+    """
+
+    def __init__(self, url):
+        if redis is None:
+            raise RuntimeError("The 'redis' package is required for a redis:// EVENT_BROKER_URL")
+        self.client = redis.Redis.from_url(url)
+
+    def publish(self, channel, payload):
+        self.client.publish(channel, json.dumps(payload))
+
+    def subscribe(self, channel):
+        pubsub = self.client.pubsub()
+        pubsub.subscribe(channel)
+        return RedisSubscription(pubsub)
+
+
+def create_broker(url):
+    """
+    Create a broker from a URL
+
+    Args:
+        url: 'memory://' or a redis:// / rediss:// URL
+
+    Returns:
+        Broker instance
+    """
+    if not url or url.startswith('memory://'):
+        return MemoryBroker()
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisBroker(url)
+    raise ValueError(f"Unsupported event broker URL: {url}")
+
+
+class EventBus:
+    """
+    Per-user event channels used to push updates over Server-Sent Events
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.broker = MemoryBroker()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Create the configured broker
+
+        Args:
+            app: Flask application instance
+        """
+        self.app = app
+        self.broker = create_broker(app.config.get('EVENT_BROKER_URL', 'memory://'))
+        app.extensions['event_bus'] = self
+
+    @staticmethod
+    def user_channel(user_id):
+        return f'crm:user:{user_id}'
+
+    def publish(self, user_id, event, data):
+        """
+        Publish an event to a user's channel
+
+        Publishing never raises, a broker outage must not break the request.
+
+        Args:
+            user_id: ID of the user to notify
+            event: Event name (e.g. 'message', 'unread')
+            data: JSON-serializable payload
+        """
+        try:
+            self.broker.publish(self.user_channel(user_id), {'event': event, 'data': data})
+        except Exception as e:
+            if self.app is not None:
+                self.app.logger.error(f"Error publishing {event} event to user {user_id}: {str(e)}")
+
+    def subscribe(self, user_id):
+        """
+        Subscribe to a user's channel
+
+        Args:
+            user_id: ID of the user
+
+        Returns:
+            Subscription with get(timeout) and close()
+        """
+        return self.broker.subscribe(self.user_channel(user_id))
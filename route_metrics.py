@@ -0,0 +1,111 @@
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+
+# Fitted speeds outside this range (km/h) come from bad timestamps or distances
+MIN_FIT_SPEED = 1.0
+MAX_FIT_SPEED = 150.0
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    """
+    Great-circle distances in kilometres between arrays of points
+    """
+    lat1, lng1, lat2, lng2 = (np.radians(np.asarray(a, dtype=np.float64)) for a in (lat1, lng1, lat2, lng2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def haversine_matrix(lat, lng):
+    """
+    Great-circle distances in kilometres between every pair of points
+    """
+    lat = np.asarray(lat, dtype=np.float64)
+    lng = np.asarray(lng, dtype=np.float64)
+    return haversine_km(lat[:, None], lng[:, None], lat[None, :], lng[None, :])
+
+
+def route_distances(start_lat, start_lng, end_lat, end_lng, waypoint_route, waypoint_lat, waypoint_lng):
+    """
+    Straight-line length of several routes, start through waypoints to end
+
+    All legs of all routes are measured in a single vectorized pass.
+
+    Args:
+        start_lat: Start latitude of each route
+        start_lng: Start longitude of each route
+        end_lat: End latitude of each route
+        end_lng: End longitude of each route
+        waypoint_route: Index into the routes of each waypoint, waypoints of
+            a route in route order
+        waypoint_lat: Waypoint latitudes
+        waypoint_lng: Waypoint longitudes
+
+    Returns:
+        Array with the length of each route in kilometres
+    """
+    count = len(start_lat)
+    if count == 0:
+        return np.zeros(0)
+
+    routes = np.arange(count)
+    waypoint_route = np.asarray(waypoint_route, dtype=np.int64)
+    path = np.concatenate((routes, waypoint_route, routes))
+    position = np.concatenate((np.zeros(count), np.ones(len(waypoint_route)), np.full(count, 2.0)))
+    # lexsort is stable, so waypoints keep their order within a route
+    order = np.lexsort((position, path))
+
+    path = path[order]
+    lat = np.concatenate((start_lat, waypoint_lat, end_lat)).astype(np.float64)[order]
+    lng = np.concatenate((start_lng, waypoint_lng, end_lng)).astype(np.float64)[order]
+
+    legs = haversine_km(lat[:-1], lng[:-1], lat[1:], lng[1:])
+    same_route = path[:-1] == path[1:]
+    return np.bincount(path[:-1][same_route], weights=legs[same_route], minlength=count)
+
+
+def fit_speed_model(distances, stops, minutes, min_routes=20):
+    """
+    Fit route duration as minutes per km driven plus minutes per stop
+
+    Least squares over completed routes; routes with an implausible average
+    speed are left out. When the per-stop term comes out negative, e.g.
+    because stop counts barely vary, only the pace is fitted.
+
+    Args:
+        distances: Distance of each completed route in kilometres
+        stops: Number of waypoints of each route
+        minutes: Actual duration of each route in minutes
+        min_routes: Fewest usable routes to fit a model from
+
+    Returns:
+        Dictionary with minutes_per_km, minutes_per_stop and sample_count,
+        or None if there are too few usable routes
+    """
+    distances = np.asarray(distances, dtype=np.float64)
+    stops = np.asarray(stops, dtype=np.float64)
+    minutes = np.asarray(minutes, dtype=np.float64)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        speed = distances / (minutes / 60)
+    usable = (distances > 0) & (minutes > 0) & (speed >= MIN_FIT_SPEED) & (speed <= MAX_FIT_SPEED)
+    count = int(usable.sum())
+    if count < max(min_routes, 2):
+        return None
+
+    distances, stops, minutes = distances[usable], stops[usable], minutes[usable]
+    (per_km, per_stop), *_ = np.linalg.lstsq(np.column_stack((distances, stops)), minutes, rcond=None)
+    if per_stop < 0 or per_km <= 0:
+        per_km = float(np.dot(distances, minutes) / np.dot(distances, distances))
+        per_stop = 0.0
+
+    return {'minutes_per_km': float(per_km), 'minutes_per_stop': float(per_stop), 'sample_count': count}
+
+
+def estimate_minutes(distances, stops, minutes_per_km, minutes_per_stop):
+    """
+    Estimated route durations in whole minutes
+    """
+    distances = np.asarray(distances, dtype=np.float64)
+    stops = np.asarray(stops, dtype=np.float64)
+    return np.rint(distances * minutes_per_km + stops * minutes_per_stop).astype(np.int64)
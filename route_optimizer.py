@@ -0,0 +1,498 @@
+import time
+
+import numpy as np
+import requests
+
+from route_metrics import haversine_matrix
+
+# Lateness is traded against distance at this rate, in km per minute late,
+# so in practice the optimizer only drives further to be on time
+TIME_WINDOW_PENALTY = 100.0
+
+# Matrix entry used for pairs the road network can't connect, in km
+UNREACHABLE_DISTANCE = 1e6
+
+# Improvements smaller than this (km) are rounding noise
+EPSILON = 1e-9
+
+
+class OptimizationError(Exception):
+    """
+    The stops can't be optimized (too many, distance provider failed)
+    """
+
+
+class DistanceProvider:
+    """
+    Interface of a distance matrix backend
+
+    Providers are looked up by name from ROUTE_DISTANCE_PROVIDER; register
+    new ones with RouteOptimizer.register_provider().
+    """
+
+    name = None
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Build the provider from application settings
+        """
+        return cls()
+
+    def matrix(self, lat, lng):
+        """
+        Travel between every pair of points
+
+        Args:
+            lat: Latitudes
+            lng: Longitudes
+
+        Returns:
+            Tuple (distances in km, durations in minutes or None when the
+            provider doesn't know them), square arrays indexed [from, to]
+
+        Raises:
+            OptimizationError: The matrix could not be computed
+        """
+        raise NotImplementedError
+
+
+class HaversineProvider(DistanceProvider):
+    """
+    Straight-line distances times a detour factor, without any network access
+    """
+
+    name = 'haversine'
+
+    def __init__(self, detour_factor=1.3):
+        self.detour_factor = detour_factor
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(detour_factor=float(config.get('ROUTE_DETOUR_FACTOR', 1.3)))
+
+    def matrix(self, lat, lng):
+        return haversine_matrix(lat, lng) * self.detour_factor, None
+
+
+class OsrmProvider(DistanceProvider):
+    """
+    Road distances and durations from the table service of a local OSRM server
+    """
+
+    name = 'osrm'
+
+    def __init__(self, base_url='http://localhost:5000', profile='driving', timeout=10.0):
+        self.base_url = base_url.rstrip('/')
+        self.profile = profile
+        self.timeout = timeout
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            base_url=config.get('OSRM_URL', 'http://localhost:5000'),
+            profile=config.get('OSRM_PROFILE', 'driving'),
+            timeout=float(config.get('ROUTE_DISTANCE_TIMEOUT', 10.0))
+        )
+
+    def matrix(self, lat, lng):
+        coordinates = ';'.join(f'{point_lng:.6f},{point_lat:.6f}' for point_lat, point_lng in zip(lat, lng))
+        try:
+            response = requests.get(
+                f'{self.base_url}/table/v1/{self.profile}/{coordinates}',
+                params={'annotations': 'distance,duration'},
+                timeout=self.timeout
+            )
+        except requests.RequestException as e:
+            raise OptimizationError(f'Distance request failed: {str(e)}')
+
+        if response.status_code != 200:
+            raise OptimizationError(f'Distance API error: {response.status_code}')
+
+        try:
+            data = response.json()
+        except ValueError:
+            raise OptimizationError('Distance API returned an invalid response')
+        if not isinstance(data, dict):
+            raise OptimizationError('Distance API returned an invalid response')
+        if data.get('code') != 'Ok':
+            raise OptimizationError(f"Distance API error: {data.get('message') or data.get('code')}")
+
+        # Metres and seconds; null where no road connects the points
+        try:
+            distances = np.array(data['distances'], dtype=np.float64) / 1000
+            durations = np.array(data['durations'], dtype=np.float64) / 60
+        except (KeyError, TypeError, ValueError):
+            raise OptimizationError('Distance API response has no distance table')
+        size = len(lat)
+        if distances.shape != (size, size) or durations.shape != (size, size):
+            raise OptimizationError('Distance API response has no distance table')
+        unreachable = np.isnan(distances) | np.isnan(durations)
+        distances[unreachable] = UNREACHABLE_DISTANCE
+        durations[unreachable] = UNREACHABLE_DISTANCE
+        return distances, durations
+
+
+class PathCost:
+    """
+    Cost of candidate paths, each a row of node indices from start to end
+
+    Without time windows the cost is the distance driven. With them, every
+    minute a stop is reached after its window closes adds TIME_WINDOW_PENALTY;
+    arriving early means waiting until the window opens.
+    """
+
+    def __init__(self, distances, durations=None, earliest=None, latest=None, service=None):
+        self.distances = distances
+        self.durations = durations
+        self.earliest = earliest
+        self.latest = latest
+        self.service = service
+
+    @property
+    def has_windows(self):
+        return self.latest is not None
+
+    def distance(self, paths):
+        return self.distances[paths[:, :-1], paths[:, 1:]].sum(axis=1)
+
+    def lateness(self, paths):
+        """
+        Minutes each path reaches stops after their windows close, summed
+        """
+        legs = self.durations[paths[:, :-1], paths[:, 1:]]
+        clock = np.zeros(len(paths))
+        late = np.zeros(len(paths))
+        # One step per stop, all candidate paths at once
+        for step in range(legs.shape[1]):
+            node = paths[:, step + 1]
+            arrival = clock + legs[:, step]
+            late += np.maximum(arrival - self.latest[node], 0.0)
+            clock = np.maximum(arrival, self.earliest[node]) + self.service[node]
+        return late
+
+    def __call__(self, paths):
+        cost = self.distance(paths)
+        if self.has_windows:
+            cost = cost + TIME_WINDOW_PENALTY * self.lateness(paths)
+        return cost
+
+
+def nearest_neighbour(distances):
+    """
+    Path from the start (first node) always driving to the closest unvisited stop, then to the end (last node)
+    """
+    count = len(distances)
+    visited = np.zeros(count, dtype=bool)
+    visited[0] = visited[-1] = True
+    path = [0]
+    for _ in range(count - 2):
+        current = int(np.argmin(np.where(visited, np.inf, distances[path[-1]])))
+        visited[current] = True
+        path.append(current)
+    path.append(count - 1)
+    return np.array(path)
+
+
+def two_opt_pass(path, cost, best_cost, deadline):
+    """
+    Reverse stretches of the path while that shortens it
+
+    Returns:
+        Tuple (path, cost, improved)
+    """
+    if cost.has_windows:
+        return _two_opt_scored(path, cost, best_cost, deadline)
+
+    # Distance only: every reversal is scored at once from the legs it changes
+    distances = cost.distances
+    first = np.arange(1, len(path) - 1)[:, None]
+    last = first.T
+    improved = False
+    while len(path) > 3 and time.perf_counter() < deadline:
+        forward = distances[path[:-1], path[1:]]
+        # Legs inside the stretch are driven backwards once reversed, which matters for asymmetric matrices
+        reversal = np.concatenate(([0.0], np.cumsum(distances[path[1:], path[:-1]] - forward)))
+        delta = (distances[path[first - 1], path[last]] + distances[path[first], path[last + 1]]
+                 - forward[first - 1] - forward[last] + reversal[last] - reversal[first])
+        delta[last <= first] = np.inf
+
+        best = np.unravel_index(int(np.argmin(delta)), delta.shape)
+        if delta[best] >= -EPSILON:
+            break
+        i, j = best[0] + 1, best[1] + 1
+        path = np.concatenate((path[:i], path[i:j + 1][::-1], path[j + 1:]))
+        best_cost += delta[best]
+        improved = True
+    return path, best_cost, improved
+
+
+def or_opt_pass(path, cost, best_cost, deadline, max_length=3):
+    """
+    Move runs of up to max_length consecutive stops, as is or reversed, while that shortens the path
+
+    Returns:
+        Tuple (path, cost, improved)
+    """
+    if cost.has_windows:
+        return _or_opt_scored(path, cost, best_cost, deadline, max_length)
+
+    # Distance only: every move is scored at once from the legs it changes
+    distances = cost.distances
+    improved = False
+    while time.perf_counter() < deadline:
+        forward = distances[path[:-1], path[1:]]
+        reversal = np.concatenate(([0.0], np.cumsum(distances[path[1:], path[:-1]] - forward)))
+        # Insertion into the leg leaving path[after]
+        after = np.arange(len(path) - 1)[None, :]
+
+        best_delta, best_move = -EPSILON, None
+        for length in range(1, min(max_length, len(path) - 3) + 1):
+            first = np.arange(1, len(path) - length)[:, None]
+            last = first + length - 1
+            removal = forward[first - 1] + forward[last] - distances[path[first - 1], path[last + 1]]
+            as_is = distances[path[after], path[first]] + distances[path[last], path[after + 1]] - forward[after]
+            flipped = (distances[path[after], path[last]] + distances[path[first], path[after + 1]] - forward[after]
+                       + reversal[last] - reversal[first])
+            # Legs touching the run itself are not insertion points
+            inside = (after >= first - 1) & (after <= last)
+            for reverse, insertion in ((False, as_is), (True, flipped)):
+                if reverse and length == 1:
+                    continue
+                delta = np.where(inside, np.inf, insertion - removal)
+                index = int(np.argmin(delta))
+                if delta.flat[index] < best_delta:
+                    row, column = np.unravel_index(index, delta.shape)
+                    best_delta, best_move = delta.flat[index], (int(first[row, 0]), length, int(column), reverse)
+
+        if best_move is None:
+            break
+        i, length, k, reverse = best_move
+        segment = path[i:i + length][::-1] if reverse else path[i:i + length]
+        if k < i:
+            path = np.concatenate((path[:k + 1], segment, path[k + 1:i], path[i + length:]))
+        else:
+            path = np.concatenate((path[:i], path[i + length:k + 1], segment, path[k + 1:]))
+        best_cost += best_delta
+        improved = True
+    return path, best_cost, improved
+
+
+def _two_opt_scored(path, cost, best_cost, deadline):
+    # With time windows moves can't be scored locally; all reversals from one position are scored as whole paths
+    positions = np.arange(len(path))
+    improved = False
+    for first in range(1, len(path) - 2):
+        if time.perf_counter() > deadline:
+            break
+        last = np.arange(first + 1, len(path) - 1)[:, None]
+        reversed_stretch = (positions >= first) & (positions <= last)
+        candidates = path[np.where(reversed_stretch, first + last - positions, positions)]
+
+        costs = cost(candidates)
+        best = int(np.argmin(costs))
+        if costs[best] < best_cost - EPSILON:
+            path, best_cost, improved = candidates[best], costs[best], True
+    return path, best_cost, improved
+
+
+def _or_opt_scored(path, cost, best_cost, deadline, max_length):
+    positions = np.arange(len(path))[None, :]
+    improved = False
+    for length in range(1, max_length + 1):
+        for first in range(1, len(path) - length):
+            if time.perf_counter() > deadline:
+                return path, best_cost, improved
+            segment = path[first:first + length]
+            rest = np.concatenate((path[:first], path[first + length:]))
+
+            # Insert after rest[after], keeping the end last; after == first - 1 is the current place
+            after = np.arange(len(rest) - 1)
+            after = after[after != first - 1][:, None]
+            if not len(after):
+                continue
+            in_segment = (positions > after) & (positions <= after + length)
+            rest_index = np.where(positions <= after, positions, positions - length).clip(0, len(rest) - 1)
+            segment_index = (positions - after - 1).clip(0, length - 1)
+
+            candidates = np.where(in_segment, segment[segment_index], rest[rest_index])
+            if length > 1:
+                candidates = np.concatenate((candidates, np.where(in_segment, segment[::-1][segment_index],
+                                                                  rest[rest_index])))
+
+            costs = cost(candidates)
+            best = int(np.argmin(costs))
+            if costs[best] < best_cost - EPSILON:
+                path, best_cost, improved = candidates[best], costs[best], True
+    return path, best_cost, improved
+
+
+def optimize_path(cost, time_budget, initial=None):
+    """
+    Nearest neighbour, then 2-opt and Or-opt passes until none improves or the time budget runs out
+
+    Args:
+        cost: PathCost of the problem; node 0 is the start, the last node the end
+        time_budget: Seconds to spend improving
+        initial: Optional path to start from if it beats nearest neighbour
+
+    Returns:
+        Tuple (path, number of improvement passes)
+    """
+    deadline = time.perf_counter() + time_budget
+    starts = [nearest_neighbour(cost.distances)]
+    if initial is not None:
+        starts.append(np.asarray(initial))
+    if cost.has_windows:
+        # Earliest deadline first, stops without a deadline in nearest-neighbour order after them
+        by_deadline = np.argsort(cost.latest[starts[0][1:-1]], kind='stable')
+        starts.append(np.concatenate(([0], starts[0][1:-1][by_deadline], [len(cost.distances) - 1])))
+    start_costs = cost(np.array(starts))
+    best = int(np.argmin(start_costs))
+    path, best_cost = starts[best], start_costs[best]
+
+    passes = 0
+    while time.perf_counter() < deadline:
+        passes += 1
+        path, best_cost, two_opt_improved = two_opt_pass(path, cost, best_cost, deadline)
+        path, best_cost, or_opt_improved = or_opt_pass(path, cost, best_cost, deadline)
+        if not (two_opt_improved or or_opt_improved):
+            break
+    return path, passes
+
+
+def optimize_order(distances, durations=None, windows=None, service_minutes=0.0, time_budget=2.0):
+    """
+    Order the stops of an open route with fixed start and end
+
+    Args:
+        distances: Distance matrix in km over start, the stops in input order, end
+        durations: Matching matrix of driving minutes, needed with windows
+        windows: Optional (earliest, latest) minutes after departure per stop,
+            either may be None
+        service_minutes: Minutes spent at each stop
+        time_budget: Seconds to spend improving
+
+    Returns:
+        Dictionary with order (stop indices in visiting order), distance,
+        original_distance (input order), late_stops, passes and elapsed
+        seconds
+    """
+    started = time.perf_counter()
+    count = len(distances)
+    stops = count - 2
+    original = np.arange(count)
+
+    cost = PathCost(distances)
+    if windows and any(window is not None and any(bound is not None for bound in window) for window in windows):
+        bounds = [window or (None, None) for window in windows]
+        earliest = np.array([0.0] + [-np.inf if low is None else low for low, _ in bounds] + [-np.inf])
+        latest = np.array([np.inf] + [np.inf if high is None else high for _, high in bounds] + [np.inf])
+        service = np.full(count, float(service_minutes))
+        service[0] = service[-1] = 0.0
+        cost = PathCost(distances, durations, earliest, latest, service)
+
+    if stops <= 1:
+        path, passes = original, 0
+    else:
+        path, passes = optimize_path(cost, time_budget, initial=original)
+
+    late_stops = 0
+    if cost.has_windows:
+        legs = durations[path[:-1], path[1:]]
+        clock = 0.0
+        for node, leg in zip(path[1:-1], legs[:-1]):
+            arrival = clock + leg
+            late_stops += int(arrival > cost.latest[node] + EPSILON)
+            clock = max(arrival, cost.earliest[node]) + cost.service[node]
+
+    return {
+        'order': [int(node) - 1 for node in path[1:-1]],
+        'distance': float(cost.distance(path[None])[0]),
+        'original_distance': float(cost.distance(original[None])[0]),
+        'late_stops': late_stops,
+        'passes': passes,
+        'elapsed': time.perf_counter() - started
+    }
+
+
+class RouteOptimizer:
+    """
+    Reorders the waypoints of a route to shorten it
+
+    Distances come from a pluggable DistanceProvider chosen with
+    ROUTE_DISTANCE_PROVIDER; the search stops after
+    ROUTE_OPTIMIZER_TIME_BUDGET seconds with the best order found.
+    """
+
+    PROVIDERS = {
+        HaversineProvider.name: HaversineProvider,
+        OsrmProvider.name: OsrmProvider
+    }
+
+    def __init__(self, app=None):
+        self.provider = HaversineProvider()
+        self.time_budget = 2.0
+        self.max_stops = 200
+
+        if app is not None:
+            self.init_app(app)
+
+    @classmethod
+    def register_provider(cls, provider_class):
+        """
+        Make a provider selectable with ROUTE_DISTANCE_PROVIDER
+
+        Args:
+            provider_class: DistanceProvider subclass with a unique name
+        """
+        cls.PROVIDERS[provider_class.name] = provider_class
+        return provider_class
+
+    def init_app(self, app):
+        """
+        Configure the optimizer from application settings
+
+        Args:
+            app: Flask application instance
+        """
+        name = app.config.get('ROUTE_DISTANCE_PROVIDER', HaversineProvider.name)
+        if name not in self.PROVIDERS:
+            raise ValueError(f"Unknown distance provider '{name}'")
+
+        self.provider = self.PROVIDERS[name].from_config(app.config)
+        self.time_budget = float(app.config.get('ROUTE_OPTIMIZER_TIME_BUDGET', 2.0))
+        self.max_stops = int(app.config.get('ROUTE_OPTIMIZER_MAX_STOPS', 200))
+
+        app.extensions['route_optimizer'] = self
+
+    def optimize(self, start, end, stops, windows=None, minutes_per_km=1.2, service_minutes=0.0, time_budget=None):
+        """
+        Find a shorter order for the stops between a fixed start and end
+
+        Args:
+            start: (lat, lng) of the start
+            end: (lat, lng) of the end
+            stops: List of (lat, lng) in their current order
+            windows: Optional (earliest, latest) minutes after departure per stop
+            minutes_per_km: Driving pace, when the provider has no durations
+            service_minutes: Minutes spent at each stop
+            time_budget: Seconds to spend, at most ROUTE_OPTIMIZER_TIME_BUDGET
+
+        Returns:
+            Dictionary as returned by optimize_order
+
+        Raises:
+            OptimizationError: Too many stops, or the distances could not be computed
+        """
+        if len(stops) > self.max_stops:
+            raise OptimizationError(f'At most {self.max_stops} stops can be optimized at once')
+
+        points = np.array([start] + list(stops) + [end], dtype=np.float64)
+        distances, durations = self.provider.matrix(points[:, 0], points[:, 1])
+        if durations is None:
+            durations = distances * minutes_per_km
+
+        budget = self.time_budget if time_budget is None else min(time_budget, self.time_budget)
+        return optimize_order(distances, durations, windows=windows, service_minutes=service_minutes,
+                              time_budget=budget)
@@ -0,0 +1,182 @@
+import json
+from datetime import datetime
+
+from sqlalchemy import column, exists, inspect, select, table, text
+
+# Column of the routes table that used to hold waypoints and status updates as one JSON array
+LEGACY_COLUMN = 'waypoints'
+
+# Columns added to routes for computed distances and ETAs
+COORDINATE_COLUMNS = ('start_lat', 'start_lng', 'end_lat', 'end_lng')
+
+
+def has_legacy_column(connection):
+    return LEGACY_COLUMN in {c['name'] for c in inspect(connection).get_columns('routes')}
+
+
+def _parse_time(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
+    except (TypeError, ValueError):
+        return None
+
+
+def explode_waypoints(route_id, waypoints):
+    """
+    Turn a legacy waypoints array into route_waypoints column values and events
+
+    Args:
+        route_id: ID of the route
+        waypoints: List of waypoint dictionaries, possibly with status_updates
+
+    Returns:
+        Tuple (rows, events): column dictionaries for route_waypoints in route
+        order, and (waypoint seq, event type, message, created_at) tuples in
+        chronological order
+    """
+    from models import RouteWaypoint, RouteEventType
+
+    rows = []
+    events = []
+    for seq, waypoint in enumerate(waypoints):
+        row = RouteWaypoint(route_id=route_id, seq=seq)
+        row.update_from_dict(waypoint)
+        rows.append({c.key: getattr(row, c.key) for c in RouteWaypoint.__table__.columns if c.key != 'id'})
+
+        if not isinstance(waypoint, dict):
+            continue
+        for update in waypoint.get('status_updates') or []:
+            if isinstance(update, dict) and update.get('message'):
+                events.append((seq, RouteEventType.STATUS_UPDATE, update['message'],
+                               _parse_time(update.get('timestamp'))))
+        if row.completed:
+            events.append((seq, RouteEventType.WAYPOINT_COMPLETED, None, row.completed_at))
+
+    # Events without a time keep their relative order after the dated ones
+    events.sort(key=lambda event: (event[3] is None, event[3] or datetime.min))
+    return rows, events
+
+
+def migrate_waypoints(connection, batch_size=500, drop_column=True):
+    """
+    Move the legacy routes.waypoints JSON into route_waypoints and route_events
+
+    Routes that already have waypoint rows are skipped, so the migration can
+    be re-run after an interruption. Status updates are attributed to the
+    route's driver, the only user who could post them.
+
+    Args:
+        connection: SQLAlchemy connection inside a transaction
+        batch_size: Routes read per query
+        drop_column: Drop routes.waypoints afterwards, unless some value could not be read
+
+    Returns:
+        Dictionary with the number of routes, waypoints and events migrated and
+        of routes skipped because their value is not a JSON array
+    """
+    from models import RouteWaypoint, RouteEvent
+
+    counts = {'routes': 0, 'waypoints': 0, 'events': 0, 'skipped': 0}
+    if not has_legacy_column(connection):
+        return counts
+
+    RouteWaypoint.__table__.create(connection, checkfirst=True)
+    RouteEvent.__table__.create(connection, checkfirst=True)
+
+    routes = table('routes', column('id'), column('driver_id'), column(LEGACY_COLUMN))
+    waypoint_table = RouteWaypoint.__table__
+    pending = select(routes.c.id, routes.c.driver_id, routes.c[LEGACY_COLUMN]).where(
+        routes.c[LEGACY_COLUMN].isnot(None),
+        ~exists().where(waypoint_table.c.route_id == routes.c.id)
+    ).order_by(routes.c.id).limit(batch_size)
+
+    last_id = 0
+    while True:
+        batch = connection.execute(pending.where(routes.c.id > last_id)).all()
+        if not batch:
+            break
+        last_id = batch[-1].id
+
+        waypoint_rows = []
+        route_events = {}
+        for route_id, driver_id, waypoints in batch:
+            # PostgreSQL returns the decoded JSON, SQLite the text
+            if isinstance(waypoints, str):
+                try:
+                    waypoints = json.loads(waypoints)
+                except ValueError:
+                    waypoints = None
+            if not isinstance(waypoints, list):
+                counts['skipped'] += 1
+                continue
+            if not waypoints:
+                continue
+
+            rows, events = explode_waypoints(route_id, waypoints)
+            waypoint_rows.extend(rows)
+            route_events[route_id] = (driver_id, events)
+            counts['routes'] += 1
+
+        if not waypoint_rows:
+            continue
+        connection.execute(waypoint_table.insert(), waypoint_rows)
+        counts['waypoints'] += len(waypoint_rows)
+
+        waypoint_ids = {
+            (row.route_id, row.seq): row.id
+            for row in connection.execute(
+                select(waypoint_table.c.id, waypoint_table.c.route_id, waypoint_table.c.seq)
+                .where(waypoint_table.c.route_id.in_(list(route_events)))
+            )
+        }
+
+        event_rows = [
+            {
+                'route_id': route_id,
+                'seq': seq,
+                'event_type': event_type,
+                'waypoint_id': waypoint_ids.get((route_id, waypoint_seq)),
+                'user_id': driver_id,
+                'message': message,
+                'created_at': created_at or datetime.utcnow()
+            }
+            for route_id, (driver_id, events) in route_events.items()
+            for seq, (waypoint_seq, event_type, message, created_at) in enumerate(events, start=1)
+        ]
+        if event_rows:
+            connection.execute(RouteEvent.__table__.insert(), event_rows)
+            counts['events'] += len(event_rows)
+
+    if drop_column and not counts['skipped']:
+        connection.execute(text(f'ALTER TABLE routes DROP COLUMN {LEGACY_COLUMN}'))
+
+    return counts
+
+
+def missing_coordinate_columns(connection):
+    columns = {c['name'] for c in inspect(connection).get_columns('routes')}
+    return [name for name in COORDINATE_COLUMNS if name not in columns]
+
+
+def add_coordinate_columns(connection):
+    """
+    Add the start and end coordinate columns to a routes table created before them
+
+    The company_speed_models table is created as well. The new columns stay
+    empty until the points are geocoded.
+
+    Args:
+        connection: SQLAlchemy connection inside a transaction
+
+    Returns:
+        Names of the columns added
+    """
+    from models import Route, CompanySpeedModel
+
+    missing = missing_coordinate_columns(connection)
+    for name in missing:
+        column_type = Route.__table__.c[name].type.compile(dialect=connection.dialect)
+        connection.execute(text(f'ALTER TABLE routes ADD COLUMN {name} {column_type}'))
+
+    CompanySpeedModel.__table__.create(connection, checkfirst=True)
+    return missing
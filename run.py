@@ -1,9 +1,13 @@
 import os
 from dotenv import load_dotenv
-from app import create_app, db
+from app import create_app, db, audit_writer, job_queue
 from models import User, UserRole, Admin, CompanyOwner, Manager, Operator, Driver
 from models import Company, Task, TaskStatus, Route, RouteStatus, Document, Log, ActionType, Statistics
 import datetime
+import importlib
+
+import click
+import time
 
 # Load environment variables from .env file if it exists
 dotenv_path = os.path.join(os.path.dirname(__file__), '.env')
@@ -121,6 +125,714 @@ def create_test_data():
         print(error_msg)
 
 
+@app.cli.command('audit-log-stats')
+@click.option('--hours', type=int, default=24, help='Only show processes that reported within this many hours')
+def audit_log_stats(hours):
+    """Flush buffered audit log entries and show the writer counters of every process"""
+    app.logger.info("Starting audit-log-stats command")
+    try:
+        from models import AuditWriterStats
+        written = audit_writer.flush()
+        print(f'Flushed {written} pending entries.')
+
+        # Each web and worker process stores its own counters; this process's are in memory only
+        since = datetime.datetime.utcnow() - datetime.timedelta(hours=hours)
+        rows = AuditWriterStats.query.filter(AuditWriterStats.updated_at >= since) \
+            .order_by(AuditWriterStats.updated_at.desc()).all()
+        if not rows:
+            print(f'No audit log writer reported in the last {hours} hour(s).')
+            return
+
+        totals = dict.fromkeys(AuditWriterStats.COUNTERS, 0)
+        for row in rows:
+            counters = ', '.join(f'{key} {getattr(row, key)}' for key in AuditWriterStats.COUNTERS)
+            print(f'{row.process} (updated {row.updated_at:%Y-%m-%d %H:%M:%S}): {counters}')
+            for key in totals:
+                totals[key] += getattr(row, key)
+
+        print(f'Total over {len(rows)} process(es):')
+        for key, value in totals.items():
+            print(f'{key}: {value}')
+    except Exception as e:
+        error_msg = f'Error reading audit log stats: {str(e)}'
+        app.logger.error(error_msg)
+        print(error_msg)
+
+
+@app.cli.command('reconcile-unread-counters')
+@click.option('--dry-run', is_flag=True, help='Only report drift, do not rebuild the counters')
+def reconcile_unread_counters(dry_run):
+    """Rebuild unread message counters from the messages table and report drift"""
+    app.logger.info("Starting reconcile-unread-counters command")
+    try:
+        from services import MessageService
+        drift = MessageService.reconcile_unread_counters(apply=not dry_run)
+
+        if not drift:
+            print('Unread counters are in sync.')
+            return
+
+        print(f'{len(drift)} counter(s) out of sync:')
+        for recipient_id, sender_id, stored, actual in drift:
+            print(f'  recipient {recipient_id} <- sender {sender_id}: stored {stored}, actual {actual}')
+
+        msg = 'Dry run, counters left unchanged.' if dry_run else 'Counters rebuilt from messages.'
+        app.logger.info(f'{len(drift)} unread counter(s) drifted. {msg}')
+        print(msg)
+    except Exception as e:
+        error_msg = f'Error reconciling unread counters: {str(e)}'
+        app.logger.error(error_msg)
+        print(error_msg)
+
+
+@app.cli.command('backfill-rollups')
+@click.option('--company-id', type=int, default=None, help='Only rebuild this company')
+def backfill_rollups(company_id):
+    """Rebuild the daily task and route rollups from the raw tables"""
+    app.logger.info("Starting backfill-rollups command")
+    try:
+        from services import StatisticsService
+        task_rows, route_rows = StatisticsService.rebuild_rollups(company_id)
+
+        scope = f'company {company_id}' if company_id else 'all companies'
+        msg = f'Rebuilt rollups for {scope}: {task_rows} task rows, {route_rows} route rows.'
+        app.logger.info(msg)
+        print(msg)
+    except Exception as e:
+        error_msg = f'Error backfilling rollups: {str(e)}'
+        app.logger.error(error_msg)
+        print(error_msg)
+
+
+def _load_job_handlers():
+    """Import the modules that register job handlers with @job_queue.handler"""
+    importlib.import_module('services')
+
+
+@app.cli.command('run-worker')
+@click.option('--concurrency', type=int, default=None, help='Number of worker threads')
+@click.option('--poll-interval', type=float, default=None, help='Seconds to wait when the queue is empty')
+def run_worker(concurrency, poll_interval):
+    """Process background jobs until interrupted"""
+    from jobs import Worker
+    _load_job_handlers()
+
+    concurrency = concurrency or app.config['JOB_WORKER_CONCURRENCY']
+    poll_interval = poll_interval or app.config['JOB_POLL_INTERVAL']
+
+    app.logger.info(f"Starting job worker with {concurrency} thread(s)")
+    print(f'Job worker started with {concurrency} thread(s), handlers: {", ".join(sorted(job_queue.handlers))}')
+    print('Press Ctrl+C to stop.')
+
+    Worker(app, job_queue, concurrency=concurrency, poll_interval=poll_interval).run()
+
+    app.logger.info("Job worker stopped")
+    print('Job worker stopped.')
+
+
+@app.cli.command('migrate-job-dedup-index')
+def migrate_job_dedup_index():
+    """Replace the queued-or-running dedup index of an existing jobs table"""
+    app.logger.info("Starting migrate-job-dedup-index command")
+    try:
+        from sqlalchemy import inspect, text
+        from models import Job
+
+        with db.engine.begin() as connection:
+            existing = {index['name'] for index in inspect(connection).get_indexes('jobs')}
+            if 'ux_jobs_queued_dedup_key' in existing:
+                print('Job dedup index is already up to date.')
+                return
+            if 'ux_jobs_active_dedup_key' in existing:
+                connection.execute(text('DROP INDEX ux_jobs_active_dedup_key'))
+
+            index = next(i for i in Job.__table__.indexes if i.name == 'ux_jobs_queued_dedup_key')
+            index.create(connection)
+
+        message = 'Job dedup_key is now unique among queued jobs only'
+        print(message)
+        app.logger.info(message)
+    except Exception as e:
+        error_msg = f'Error migrating job dedup index: {str(e)}'
+        app.logger.error(error_msg)
+        print(error_msg)
+
+
+@app.cli.command('enqueue-statistics')
+@click.option('--company-id', type=int, default=None, help='Only this company (defaults to all companies)')
+def enqueue_statistics(company_id):
+    """Queue statistics recomputation jobs for companies"""
+    app.logger.info("Starting enqueue-statistics command")
+    try:
+        _load_job_handlers()
+
+        query = Company.query
+        if company_id:
+            query = query.filter(Company.id == company_id)
+
+        queued = 0
+        for company in query.all():
+            job_queue.enqueue(
+                'statistics.update_company',
+                {'company_id': company.id},
+                dedup_key=f'statistics:company:{company.id}',
+                company_id=company.id,
+                reuse_result=False
+            )
+            queued += 1
+
+        msg = f'Queued statistics jobs for {queued} companies.'
+        app.logger.info(msg)
+        print(msg)
+    except Exception as e:
+        error_msg = f'Error queueing statistics jobs: {str(e)}'
+        app.logger.error(error_msg)
+        print(error_msg)
+
+
+def _legacy_company_counts(company_id):
+    """Per-status count() queries the dashboards ran before StatisticsService.get_company_overview"""
+    counts = {
+        'managers': Manager.query.filter_by(company_id=company_id).count(),
+        'operators': Operator.query.filter_by(company_id=company_id).count(),
+        'drivers': Driver.query.filter_by(company_id=company_id).count()
+    }
+
+    task_query = Task.query.filter_by(company_id=company_id)
+    counts['tasks'] = task_query.count()
+    for status in TaskStatus:
+        counts[f'tasks_{status.name.lower()}'] = task_query.filter_by(status=status).count()
+
+    route_query = Route.query.filter_by(company_id=company_id)
+    counts['routes'] = route_query.count()
+    for status in RouteStatus:
+        counts[f'routes_{status.name.lower()}'] = route_query.filter_by(status=status).count()
+
+    return counts
+
+
+@app.cli.command('benchmark-dashboard-queries')
+@click.option('--company-id', type=int, default=None, help='Company to aggregate (defaults to the first one)')
+@click.option('--iterations', type=int, default=20, help='Number of runs to average')
+def benchmark_dashboard_queries(company_id, iterations):
+    """Compare query count and time of per-status count() calls with the one-pass aggregation"""
+    app.logger.info("Starting benchmark-dashboard-queries command")
+    try:
+        from services import StatisticsService
+        from utils import count_queries
+
+        if company_id is None:
+            company = Company.query.order_by(Company.id).first()
+            if not company:
+                print('No companies found, create test data first.')
+                return
+            company_id = company.id
+
+        candidates = [
+            ('per-status count()', lambda: _legacy_company_counts(company_id)),
+            ('get_company_overview', lambda: StatisticsService.get_company_overview(company_id))
+        ]
+
+        print(f'Company {company_id}, {iterations} iterations')
+        print(f'{"method":<24}{"queries":>10}{"avg ms":>12}')
+        for name, run_once in candidates:
+            with count_queries(db.engine) as counter:
+                run_once()
+
+            started = time.perf_counter()
+            for _ in range(iterations):
+                run_once()
+            elapsed_ms = (time.perf_counter() - started) * 1000 / max(iterations, 1)
+
+            print(f'{name:<24}{counter["count"]:>10}{elapsed_ms:>12.2f}')
+            app.logger.info(f'{name}: {counter["count"]} queries, {elapsed_ms:.2f} ms')
+    except Exception as e:
+        error_msg = f'Error running dashboard benchmark: {str(e)}'
+        app.logger.error(error_msg)
+        print(error_msg)
+
+
+def _synthetic_report_rows(row_count):
+    """Rows shaped like the tasks report, generated lazily"""
+    yield ['Task ID', 'Title', 'Status', 'Created At', 'Deadline', 'Creator', 'Assignee']
+    created_at = datetime.datetime(2024, 1, 1, 8, 0)
+    for index in range(row_count):
+        yield [
+            index + 1,
+            f'Delivery #{index + 1} to warehouse {index % 97}',
+            TaskStatus.COMPLETED.value if index % 3 else TaskStatus.NEW.value,
+            created_at + datetime.timedelta(minutes=index),
+            created_at + datetime.timedelta(days=2, minutes=index),
+            'Jane Operator',
+            f'Driver {index % 50}'
+        ]
+
+
+def _buffered_csv(rows):
+    """The previous export path: the whole file held in memory before sending"""
+    from utils import iter_csv
+
+    yield b''.join(iter_csv(rows))
+
+
+@app.cli.command('benchmark-report-export')
+@click.option('--rows', 'row_counts', type=int, multiple=True, help='Row counts to test (repeatable)')
+def benchmark_report_export(row_counts):
+    """Compare peak memory and throughput of buffered CSV, streamed CSV and streamed XLSX exports"""
+    app.logger.info("Starting benchmark-report-export command")
+    try:
+        import tracemalloc
+        from utils import iter_csv
+        from xlsx import iter_xlsx
+
+        encoders = [
+            ('csv (buffered)', _buffered_csv),
+            ('csv (streamed)', iter_csv),
+            ('xlsx (streamed)', iter_xlsx)
+        ]
+
+        print(f'{"format":<18}{"rows":>10}{"size KB":>12}{"peak KB":>12}{"rows/s":>12}')
+        for row_count in row_counts or (10000, 100000):
+            for name, encode in encoders:
+                size = 0
+                tracemalloc.start()
+                started = time.perf_counter()
+                for chunk in encode(_synthetic_report_rows(row_count)):
+                    size += len(chunk)
+                elapsed = time.perf_counter() - started
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+
+                rate = row_count / elapsed if elapsed else 0
+                print(f'{name:<18}{row_count:>10}{size / 1024:>12.0f}{peak / 1024:>12.0f}{rate:>12.0f}')
+                app.logger.info(f'{name} {row_count} rows: {size} bytes, peak {peak} bytes, {rate:.0f} rows/s')
+    except Exception as e:
+        error_msg = f'Error running report export benchmark: {str(e)}'
+        app.logger.error(error_msg)
+        print(error_msg)
+
+
+@app.cli.command('export-analytics')
+@click.option('--company', 'company_id', type=int, required=True, help='Company to export')
+@click.option('--since', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+              help='Export months from this date on (YYYY-MM-DD); everything when omitted')
+@click.option('--output', default=None, help='Export root (defaults to ANALYTICS_EXPORT_FOLDER)')
+@click.option('--table', 'tables', multiple=True, help='Table to export (repeatable, defaults to all)')
+def export_analytics(company_id, since, output, tables):
+    """Write tasks, routes, messages, logs and documents as month-partitioned Parquet files"""
+    app.logger.info("Starting export-analytics command")
+    try:
+        from analytics import export_company_analytics, EXPORT_TABLES
+
+        if not db.session.get(Company, company_id):
+            print(f'Company {company_id} not found.')
+            return
+
+        output = output or app.config['ANALYTICS_EXPORT_FOLDER']
+        started = time.perf_counter()
+        summary = export_company_analytics(
+            company_id,
+            output,
+            since=since,
+            tables=tables or EXPORT_TABLES,
+            batch_size=app.config.get('ANALYTICS_EXPORT_BATCH_SIZE', 10000)
+        )
+        elapsed = time.perf_counter() - started
+
+        for table, table_summary in summary.items():
+            print(f"{table:<12}{table_summary['rows']:>10} rows in {len(table_summary['partitions'])} partition(s)")
+        print(f'Exported company {company_id} to {output} in {elapsed:.1f}s')
+        app.logger.info(f'Analytics export for company {company_id} finished in {elapsed:.1f}s')
+    except Exception as e:
+        error_msg = f'Error exporting analytics: {str(e)}'
+        app.logger.error(error_msg)
+        print(error_msg)
+
+
+@app.cli.command('reindex-documents')
+@click.option('--company-id', type=int, default=None, help='Only reindex this company (defaults to all)')
+def reindex_documents(company_id):
+    """Rebuild the full-text document search index"""
+    app.logger.info("Starting reindex-documents command")
+    try:
+        from services import DocumentSearchService
+
+        # Creates document_search and its FTS table/index if they don't exist yet
+        db.create_all()
+
+        started = time.perf_counter()
+        indexed = DocumentSearchService.reindex(company_id)
+        elapsed = time.perf_counter() - started
+
+        message = f'Indexed {indexed} document(s) in {elapsed:.1f}s'
+        print(message)
+        app.logger.info(message)
+    except Exception as e:
+        error_msg = f'Error reindexing documents: {str(e)}'
+        app.logger.error(error_msg)
+        print(error_msg)
+
+
+@app.cli.command('reindex-people')
+def reindex_people():
+    """Rebuild the fuzzy search index for users and companies"""
+    app.logger.info("Starting reindex-people command")
+    try:
+        from models import SearchTrigram
+
+        db.create_all()
+
+        started = time.perf_counter()
+        counts = SearchTrigram.rebuild(db.session.connection())
+        db.session.commit()
+        elapsed = time.perf_counter() - started
+
+        message = f"Indexed {counts.get('user', 0)} user(s) and {counts.get('company', 0)} " \
+                  f"company(ies) in {elapsed:.1f}s"
+        print(message)
+        app.logger.info(message)
+    except Exception as e:
+        db.session.rollback()
+        error_msg = f'Error reindexing people search: {str(e)}'
+        app.logger.error(error_msg)
+        print(error_msg)
+
+
+@app.cli.command('partition-logs')
+def partition_logs():
+    """Split an existing logs table into monthly partitions (new databases are partitioned on creation)"""
+    app.logger.info("Starting partition-logs command")
+    try:
+        from log_partitions import install, is_partitioned, list_partitions
+
+        with db.engine.begin() as connection:
+            if is_partitioned(connection):
+                # Brings SQLite databases partitioned by older versions up to date
+                install(connection)
+                print('The logs table is already partitioned.')
+                return
+            install(connection)
+            partitions = list_partitions(connection)
+
+        message = f'Partitioned logs into {len(partitions)} monthly partition(s)'
+        print(message)
+        app.logger.info(message)
+    except Exception as e:
+        error_msg = f'Error partitioning logs: {str(e)}'
+        app.logger.error(error_msg)
+        print(error_msg)
+
+
+@app.cli.command('migrate-log-lookups')
+@click.option('--keep-columns', is_flag=True, help='Keep the legacy logs.ip_address and logs.user_agent columns')
+def migrate_log_lookups(keep_columns):
+    """Move IP addresses and user agents of existing log rows into their lookup tables (run before partition-logs)"""
+    app.logger.info("Starting migrate-log-lookups command")
+    try:
+        from log_partitions import has_legacy_lookup_columns, migrate_lookup_columns
+
+        with db.engine.begin() as connection:
+            if not has_legacy_lookup_columns(connection):
+                print('Log IP addresses and user agents are already migrated.')
+                return
+            counts = migrate_lookup_columns(connection, drop_columns=not keep_columns)
+
+        message = ', '.join(f'{count} row(s) with a {name}' for name, count in counts.items())
+        print(f'Migrated {message}.')
+        app.logger.info(f'Migrated log lookups: {message}')
+    except Exception as e:
+        error_msg = f'Error migrating log lookups: {str(e)}'
+        app.logger.error(error_msg)
+        print(error_msg)
+
+
+@app.cli.command('archive-logs')
+@click.option('--retention-months', type=int, default=None,
+              help='Months kept in the database, including the current one (defaults to LOG_RETENTION_MONTHS)')
+@click.option('--output', default=None, help='Archive folder (defaults to LOG_ARCHIVE_FOLDER)')
+@click.option('--dry-run', is_flag=True, help='Only list the months that would be archived')
+def archive_logs(retention_months, output, dry_run):
+    """Move log partitions past the retention window to compressed JSON Lines files; run monthly"""
+    app.logger.info("Starting archive-logs command")
+    try:
+        from log_partitions import archive_logs as archive_log_partitions
+
+        output = output or app.config['LOG_ARCHIVE_FOLDER']
+        started = time.perf_counter()
+        archived = archive_log_partitions(
+            db.engine,
+            output,
+            retention_months=retention_months,
+            dry_run=dry_run
+        )
+        elapsed = time.perf_counter() - started
+
+        for entry in archived:
+            if dry_run:
+                print(f"{entry['month']:%Y-%m}  would archive {entry['partition']}")
+            else:
+                print(f"{entry['month']:%Y-%m}{entry['rows']:>10} rows -> {entry['path']}")
+
+        message = f'Archived {len(archived)} month(s) of logs in {elapsed:.1f}s' if not dry_run \
+            else f'{len(archived)} month(s) of logs past retention'
+        print(message)
+        app.logger.info(message)
+    except Exception as e:
+        error_msg = f'Error archiving logs: {str(e)}'
+        app.logger.error(error_msg)
+        print(error_msg)
+
+
+@app.cli.command('purge-geocode-cache')
+def purge_geocode_cache():
+    """Delete expired geocoding results from the geocode_cache table"""
+    app.logger.info("Starting purge-geocode-cache command")
+    try:
+        from app import geocoder
+
+        deleted = geocoder.purge_expired()
+        message = f'Deleted {deleted} expired geocode cache entr(ies)'
+        print(message)
+        app.logger.info(message)
+    except Exception as e:
+        error_msg = f'Error purging geocode cache: {str(e)}'
+        app.logger.error(error_msg)
+        print(error_msg)
+
+
+@app.cli.command('migrate-route-waypoints')
+@click.option('--batch-size', type=int, default=500, help='Routes migrated per batch')
+@click.option('--keep-column', is_flag=True, help='Keep the legacy routes.waypoints column after migrating')
+def migrate_route_waypoints(batch_size, keep_column):
+    """Move waypoints and status updates from the routes.waypoints JSON column into their own tables"""
+    app.logger.info("Starting migrate-route-waypoints command")
+    try:
+        from route_storage import has_legacy_column, migrate_waypoints
+
+        with db.engine.begin() as connection:
+            if not has_legacy_column(connection):
+                print('Route waypoints are already migrated.')
+                return
+            counts = migrate_waypoints(connection, batch_size=batch_size, drop_column=not keep_column)
+
+        message = (f"Migrated {counts['waypoints']} waypoint(s) and {counts['events']} event(s) "
+                   f"from {counts['routes']} route(s)")
+        print(message)
+        app.logger.info(message)
+        if counts['skipped']:
+            warning = (f"Skipped {counts['skipped']} route(s) whose waypoints are not a JSON array; "
+                       f"the routes.waypoints column was kept")
+            print(warning)
+            app.logger.warning(warning)
+    except Exception as e:
+        error_msg = f'Error migrating route waypoints: {str(e)}'
+        app.logger.error(error_msg)
+        print(error_msg)
+
+
+@app.cli.command('prune-gps-tracks')
+@click.option('--retention-days', type=int, default=None,
+              help='Days of GPS pings kept, including today (defaults to GPS_TRACK_RETENTION_DAYS)')
+def prune_gps_tracks(retention_days):
+    """Create upcoming daily GPS track partitions and drop pings past the retention window; run daily"""
+    app.logger.info("Starting prune-gps-tracks command")
+    try:
+        from tracking import ensure_partitions, drop_expired
+
+        with db.engine.begin() as connection:
+            ensure_partitions(connection)
+            result = drop_expired(connection, retention_days)
+
+        message = f"Dropped {result['partitions']} GPS track partition(s) and deleted {result['rows']} ping(s)"
+        print(message)
+        app.logger.info(message)
+    except Exception as e:
+        error_msg = f'Error pruning GPS tracks: {str(e)}'
+        app.logger.error(error_msg)
+        print(error_msg)
+
+
+@app.cli.command('benchmark-gps-ingest')
+@click.option('--driver-id', type=int, default=None, help='Driver the pings are stored for (defaults to the first one)')
+@click.option('--pings', 'ping_count', type=int, default=50000, help='Number of pings to send')
+@click.option('--batch', 'batch_size', type=int, default=50, help='Pings per ingest request')
+@click.option('--keep', is_flag=True, help='Keep the generated pings instead of deleting them')
+def benchmark_gps_ingest(driver_id, ping_count, batch_size, keep):
+    """Measure GPS ingest throughput: validation and buffering, then until every ping is stored (use a staging database)"""
+    app.logger.info("Starting benchmark-gps-ingest command")
+    try:
+        from app import track_writer
+        from models import DriverPosition
+
+        if driver_id is None:
+            driver = Driver.query.order_by(Driver.id).first()
+            if not driver:
+                print('No drivers found, create test data first.')
+                return
+            driver_id = driver.id
+
+        # 10 ms apart and ending now, so every ping passes validation and lands in today's partitions
+        now = datetime.datetime.utcnow()
+        first = now - datetime.timedelta(milliseconds=10 * ping_count)
+        pings = [
+            {
+                'timestamp': (first + datetime.timedelta(milliseconds=10 * index)).isoformat() + 'Z',
+                'lat': 52.2297 + index * 1e-6,
+                'lng': 21.0122 + index * 1e-6,
+                'speed': 40 + index % 30
+            }
+            for index in range(ping_count)
+        ]
+        chunks = [pings[start:start + batch_size] for start in range(0, ping_count, batch_size)]
+
+        before = track_writer.stats()
+        started = time.perf_counter()
+        for chunk in chunks:
+            track_writer.ingest(driver_id, None, chunk, now=now)
+        ingested = time.perf_counter() - started
+
+        accepted = track_writer.stats()['accepted'] - before['accepted']
+
+        # The background thread may still be writing a batch it took before flush()
+        track_writer.flush()
+        while True:
+            after = track_writer.stats()
+            if (after['flushed'] + after['failed']) - (before['flushed'] + before['failed']) >= accepted:
+                break
+            time.sleep(0.01)
+        stored = time.perf_counter() - started
+
+        flushed = after['flushed'] - before['flushed']
+        print(f'{ping_count} pings in {len(chunks)} request(s) of {batch_size}, '
+              f'{"async" if track_writer.enabled else "sync"} writes')
+        print(f'{"stage":<22}{"pings":>10}{"seconds":>10}{"pings/s":>12}')
+        print(f'{"validate + buffer":<22}{accepted:>10}{ingested:>10.2f}{accepted / ingested if ingested else 0:>12.0f}')
+        print(f'{"stored":<22}{flushed:>10}{stored:>10.2f}{flushed / stored if stored else 0:>12.0f}')
+        print(f'rejected: {after["rejected"] - before["rejected"]}, failed: {after["failed"] - before["failed"]}, '
+              f'batches: {after["batches"] - before["batches"]}')
+        app.logger.info(f'GPS ingest: {accepted} pings buffered in {ingested:.2f} s, {flushed} stored in {stored:.2f} s')
+
+        if not keep:
+            table = DriverPosition.__table__
+            with db.engine.begin() as connection:
+                connection.execute(table.delete().where(
+                    table.c.driver_id == driver_id,
+                    table.c.recorded_at.between(first, now),
+                    table.c.route_id.is_(None)
+                ))
+    except Exception as e:
+        error_msg = f'Error running GPS ingest benchmark: {str(e)}'
+        app.logger.error(error_msg)
+        print(error_msg)
+
+
+@app.cli.command('migrate-route-coordinates')
+def migrate_route_coordinates():
+    """Add the start and end coordinate columns to an existing routes table"""
+    app.logger.info("Starting migrate-route-coordinates command")
+    try:
+        from route_storage import add_coordinate_columns, missing_coordinate_columns
+
+        with db.engine.begin() as connection:
+            if not missing_coordinate_columns(connection):
+                print('Route coordinate columns already exist.')
+                return
+            added = add_coordinate_columns(connection)
+
+        message = f"Added route column(s) {', '.join(added)}"
+        print(message)
+        print('Run `flask recompute-route-metrics --locate` to geocode existing routes.')
+        app.logger.info(message)
+    except Exception as e:
+        error_msg = f'Error migrating route coordinates: {str(e)}'
+        app.logger.error(error_msg)
+        print(error_msg)
+
+
+@app.cli.command('recompute-route-metrics')
+@click.option('--company-id', type=int, default=None, help='Only recompute this company')
+@click.option('--batch-size', type=int, default=5000, help='Routes read and updated per batch')
+@click.option('--locate', is_flag=True, help='Geocode start and end points of routes without coordinates first')
+@click.option('--no-refit', is_flag=True, help='Keep the current speed models instead of refitting them')
+def recompute_route_metrics(company_id, batch_size, locate, no_refit):
+    """Recompute route distances and estimated times from coordinates, then rebuild the route rollups"""
+    app.logger.info("Starting recompute-route-metrics command")
+    try:
+        from services import RouteService, StatisticsService
+
+        if locate:
+            located = RouteService.locate_missing_endpoints(company_id)
+            print(f"Located {located['located']} route endpoint(s), {located['missing']} not found")
+
+        started = time.perf_counter()
+        counts = RouteService.recompute_metrics(company_id, batch_size=batch_size, refit=not no_refit)
+        elapsed = time.perf_counter() - started
+        StatisticsService.rebuild_rollups(company_id)
+
+        message = (f"Recomputed {counts['routes']} route(s) in {elapsed:.2f} s "
+                   f"({counts['routes'] / elapsed if elapsed else 0:.0f} routes/s), "
+                   f"{counts['models']} company speed model(s) fitted")
+        print(message)
+        app.logger.info(message)
+    except Exception as e:
+        error_msg = f'Error recomputing route metrics: {str(e)}'
+        app.logger.error(error_msg)
+        print(error_msg)
+
+
+@app.cli.command('benchmark-route-optimizer')
+@click.option('--stops', default='10,50,200', help='Comma-separated stop counts to optimize')
+@click.option('--runs', type=int, default=3, help='Random routes per stop count')
+@click.option('--time-budget', type=float, default=None,
+              help='Seconds per route (defaults to ROUTE_OPTIMIZER_TIME_BUDGET)')
+@click.option('--time-windows', is_flag=True, help='Give a third of the stops a time window')
+@click.option('--seed', type=int, default=1, help='Random seed for the generated stops')
+def benchmark_route_optimizer(stops, runs, time_budget, time_windows, seed):
+    """Compare nearest neighbour with the full optimizer on random stops in a 40 x 40 km area"""
+    app.logger.info("Starting benchmark-route-optimizer command")
+    try:
+        import numpy as np
+        from app import route_optimizer
+        from route_optimizer import PathCost, nearest_neighbour, optimize_order
+
+        budget = route_optimizer.time_budget if time_budget is None else time_budget
+        rng = np.random.default_rng(seed)
+        print(f'{route_optimizer.provider.name} distances, {budget:.1f} s budget, {runs} run(s) per size')
+        print(f'{"stops":>6}{"input km":>11}{"nearest km":>12}{"optimized km":>14}{"saved":>8}{"late":>6}{"seconds":>9}')
+
+        for count in [int(value) for value in stops.split(',')]:
+            totals = np.zeros(5)
+            for _ in range(runs):
+                # Start and end included; about 0.36 degrees of latitude and 0.59 of longitude are 40 km here
+                lat = 52.05 + rng.random(count + 2) * 0.36
+                lng = 20.72 + rng.random(count + 2) * 0.59
+                distances, durations = route_optimizer.provider.matrix(lat, lng)
+                if durations is None:
+                    durations = distances * 1.2
+
+                windows = None
+                if time_windows:
+                    # Two-hour windows opening over the route's rough duration, ~13 minutes a stop
+                    opens = rng.uniform(0, 13 * count, count)
+                    windows = [(opens[index], opens[index] + 120) if index % 3 == 0 else None
+                               for index in range(count)]
+
+                nearest = PathCost(distances).distance(nearest_neighbour(distances)[None])[0]
+                result = optimize_order(distances, durations, windows=windows, service_minutes=10,
+                                        time_budget=budget)
+                totals += (result['original_distance'], nearest, result['distance'],
+                           result['late_stops'], result['elapsed'])
+
+            original, nearest, optimized, late, elapsed = totals / runs
+            saved = (1 - optimized / original) * 100 if original else 0
+            print(f'{count:>6}{original:>11.1f}{nearest:>12.1f}{optimized:>14.1f}{saved:>7.1f}%{late:>6.1f}{elapsed:>9.3f}')
+            app.logger.info(f'Route optimizer: {count} stops optimized in {elapsed:.3f} s, {saved:.1f}% shorter')
+    except Exception as e:
+        error_msg = f'Error running route optimizer benchmark: {str(e)}'
+        app.logger.error(error_msg)
+        print(error_msg)
+
+
 if __name__ == '__main__':
     # Log startup information
     now = datetime.datetime.now()
@@ -1,17 +1,33 @@
+import json
+import math
+import random
+import tempfile
 import traceback
+import zipfile
 from datetime import datetime
 from flask import current_app
 import os
 from werkzeug.security import generate_password_hash
-from sqlalchemy import func, and_, or_
+import numpy as np
+from sqlalchemy import func, and_, or_, case, tuple_, select, true, update, bindparam, inspect
 from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import aliased
 
-from app import db
+from app import db, job_queue, geocoder, route_optimizer
 from models import (
     User, UserRole, Admin, CompanyOwner, Manager, Operator, Driver,
-    Company, Task, TaskStatus, Route, RouteStatus, Document, Log, ActionType, Message, Statistics
+    Company, Task, TaskStatus, Route, RouteStatus, RouteWaypoint, RouteEvent, RouteEventType, Document, Log, ActionType, Message, Statistics,
+    UnreadCounter, TaskDailyRollup, RouteDailyRollup, DocumentSearchEntry, SearchTrigram,
+    DriverPosition, RouteTrack, CompanySpeedModel
 )
-from utils import log_action, save_profile_image, save_document, delete_file
+from utils import log_action, save_profile_image, save_document, delete_file, iter_csv, keyset_paginate
+from xlsx import iter_xlsx, XLSX_MIMETYPE
+from analytics import export_company_analytics, EXPORT_TABLES
+from log_partitions import list_archives as list_log_archives, iter_archive as iter_log_archive
+from tenant import resolve_company_id
+from track_geometry import simplify_track, level_for_zoom
+from route_metrics import route_distances, fit_speed_model, estimate_minutes
+from route_optimizer import OptimizationError
 
 
 class UserService:
@@ -298,18 +314,10 @@ class UserService:
         """
         search_query = User.query
 
-        # Apply search filters
-        if query:
-            search_term = f"%{query}%"
-            search_query = search_query.filter(
-                or_(
-                    User.username.ilike(search_term),
-                    User.email.ilike(search_term),
-                    User.first_name.ilike(search_term),
-                    User.last_name.ilike(search_term),
-                    User.phone.ilike(search_term)
-                )
-            )
+        # Apply fuzzy search on username, email, names and phone
+        search_query, score = SearchTrigram.apply(
+            search_query, db.session.get_bind().dialect.name, 'user', query
+        )
 
         # Filter by role
         if role:
@@ -358,12 +366,46 @@ class UserService:
                 )
             )
 
-        # Order by username
+        # Order by relevance, then username
+        if score is not None:
+            search_query = search_query.order_by(score.desc())
         search_query = search_query.order_by(User.username)
 
         # Paginate results
         return search_query.paginate(page=page, per_page=per_page)
 
+    @staticmethod
+    def autocomplete_users(query, limit=8):
+        """
+        Best fuzzy matches for a partly typed name, username, email or phone
+
+        Args:
+            query: Search input
+            limit: Maximum number of matches
+
+        Returns:
+            List of dictionaries with id, label, username and role
+        """
+        search_query, score = SearchTrigram.apply(
+            select(User.id, User.username, User.first_name, User.last_name, User.role),
+            db.session.get_bind().dialect.name,
+            'user',
+            query
+        )
+        if score is None:
+            return []
+
+        rows = db.session.execute(search_query.order_by(score.desc(), User.username).limit(limit))
+        return [
+            {
+                'id': user_id,
+                'label': f"{first_name} {last_name}",
+                'username': username,
+                'role': role.value
+            }
+            for user_id, username, first_name, last_name, role in rows
+        ]
+
 
 class CompanyService:
     @staticmethod
@@ -443,26 +485,20 @@ class CompanyService:
             Dictionary with company metrics
         """
         try:
-            # Get company-related statistics
-            manager_count = db_session.query(Manager).filter_by(company_id=company.id).count()
-            operator_count = db_session.query(Operator).filter_by(company_id=company.id).count()
-            driver_count = db_session.query(Driver).filter_by(company_id=company.id).count()
-
-            # Get task and route statistics
-            task_count = db_session.query(Task).filter_by(company_id=company.id).count()
-            completed_tasks = db_session.query(Task).filter_by(
-                company_id=company.id,
-                status=TaskStatus.COMPLETED
-            ).count()
-            in_progress_tasks = db_session.query(Task).filter_by(
-                company_id=company.id,
-                status=TaskStatus.IN_PROGRESS
-            ).count()
-
-            active_routes = db_session.query(Route).filter_by(
-                company_id=company.id,
-                status=RouteStatus.IN_PROGRESS
-            ).count()
+            # Team, task and route counts in one round trip
+            overview = StatisticsService.get_company_overview(company.id, db_session=db_session)
+            tasks = overview['tasks']
+            team = overview['team']
+
+            manager_count = team['managers']
+            operator_count = team['operators']
+            driver_count = team['drivers']
+
+            task_count = tasks['total']
+            completed_tasks = tasks['completed']
+            in_progress_tasks = tasks['in_progress']
+
+            active_routes = overview['routes']['in_progress']
 
             # Calculate completion rate
             completion_rate = (completed_tasks / task_count * 100) if task_count > 0 else 0
@@ -506,25 +542,46 @@ class CompanyService:
         """
         search_query = Company.query
 
-        # Apply search filters
-        if query:
-            search_term = f"%{query}%"
-            search_query = search_query.filter(
-                or_(
-                    Company.name.ilike(search_term),
-                    Company.legal_name.ilike(search_term),
-                    Company.tax_id.ilike(search_term),
-                    Company.email.ilike(search_term),
-                    Company.phone.ilike(search_term)
-                )
-            )
+        # Apply fuzzy search on names, tax ID, email, phone and address
+        search_query, score = SearchTrigram.apply(
+            search_query, db.session.get_bind().dialect.name, 'company', query
+        )
 
-        # Order by name
+        # Order by relevance, then name
+        if score is not None:
+            search_query = search_query.order_by(score.desc())
         search_query = search_query.order_by(Company.name)
 
         # Paginate results
         return search_query.paginate(page=page, per_page=per_page)
 
+    @staticmethod
+    def autocomplete_companies(query, limit=8):
+        """
+        Best fuzzy matches for a partly typed company name, tax ID or contact
+
+        Args:
+            query: Search input
+            limit: Maximum number of matches
+
+        Returns:
+            List of dictionaries with id, label and tax_id
+        """
+        search_query, score = SearchTrigram.apply(
+            select(Company.id, Company.name, Company.tax_id),
+            db.session.get_bind().dialect.name,
+            'company',
+            query
+        )
+        if score is None:
+            return []
+
+        rows = db.session.execute(search_query.order_by(score.desc(), Company.name).limit(limit))
+        return [
+            {'id': company_id, 'label': name, 'tax_id': tax_id}
+            for company_id, name, tax_id in rows
+        ]
+
 
 class TaskService:
     @staticmethod
@@ -637,7 +694,7 @@ class TaskService:
 
     @staticmethod
     def search_tasks(query, company_id=None, status=None, creator_id=None, assignee_id=None,
-                     page=1, per_page=10):
+                     cursor=None, per_page=10):
         """
         Search for tasks with filtering options
 
@@ -647,11 +704,11 @@ class TaskService:
             status: Filter by task status (optional)
             creator_id: Filter by creator user ID (optional)
             assignee_id: Filter by assignee user ID (optional)
-            page: Page number
+            cursor: Cursor from a previous page (optional)
             per_page: Items per page
 
         Returns:
-            Pagination object with task results
+            KeysetPage with task results
         """
         search_query = Task.query
 
@@ -678,14 +735,19 @@ class TaskService:
         if assignee_id:
             search_query = search_query.filter(Task.assignee_id == assignee_id)
 
-        # Order by creation date (newest first)
-        search_query = search_query.order_by(Task.created_at.desc())
-
-        # Paginate results
-        return search_query.paginate(page=page, per_page=per_page)
+        # Newest first
+        return keyset_paginate(
+            search_query,
+            [(Task.created_at, True), (Task.id, True)],
+            cursor=cursor,
+            per_page=per_page
+        )
 
 
 class RouteService:
+    # Sort key for routes that have no start time yet
+    UNSCHEDULED_START_TIME = datetime(9999, 12, 31)
+
     @staticmethod
     def create_route(form, task_id, driver_id, company_id, db_session):
         """
@@ -705,7 +767,7 @@ class RouteService:
             route = Route(
                 start_point=form.start_point.data,
                 end_point=form.end_point.data,
-                waypoints=form.waypoints.data if hasattr(form, 'waypoints') else None,
+                waypoints=RouteService.parse_waypoints(form.waypoints.data) if hasattr(form, 'waypoints') else None,
                 distance=form.distance.data if hasattr(form, 'distance') else None,
                 estimated_time=form.estimated_time.data if hasattr(form, 'estimated_time') else None,
                 start_time=form.start_time.data if hasattr(form, 'start_time') else None,
@@ -714,9 +776,11 @@ class RouteService:
                 task_id=task_id,
                 company_id=company_id
             )
+            RouteService.update_metrics(route)
 
             db_session.add(route)
             db_session.commit()
+            RouteService.schedule_metrics_update(route)
             log_action(ActionType.CREATE, f"Created route from {route.start_point} to {route.end_point}", db_session)
 
             return route
@@ -743,7 +807,9 @@ class RouteService:
             route.end_point = form.end_point.data
 
             if hasattr(form, 'waypoints'):
-                route.waypoints = form.waypoints.data
+                waypoints = RouteService.parse_waypoints(form.waypoints.data)
+                if waypoints is not None:
+                    route.waypoints = waypoints
 
             if hasattr(form, 'distance'):
                 route.distance = form.distance.data
@@ -768,7 +834,9 @@ class RouteService:
                 if route.status == RouteStatus.CANCELLED and route.task.status != TaskStatus.CANCELLED:
                     route.task.status = TaskStatus.CANCELLED
 
+            RouteService.update_metrics(route)
             db_session.commit()
+            RouteService.schedule_metrics_update(route)
             log_action(ActionType.UPDATE, f"Updated route from {route.start_point} to {route.end_point}", db_session)
 
             return route
@@ -778,276 +846,1433 @@ class RouteService:
             raise
 
     @staticmethod
-    def get_active_routes_for_driver(driver_id, page=1, per_page=10):
+    def parse_waypoints(data):
         """
-        Get active routes for a driver
+        Parse the waypoints field of a route form
 
         Args:
-            driver_id: ID of the driver
-            page: Page number
-            per_page: Items per page
+            data: JSON array of waypoint objects as entered by the user
 
         Returns:
-            Pagination object with route results
+            List of waypoint dictionaries, or None if empty or not a valid JSON array
         """
-        route_query = Route.query.filter(
-            Route.driver_id == driver_id,
-            Route.status.in_([RouteStatus.PLANNED, RouteStatus.IN_PROGRESS])
-        ).order_by(Route.start_time)
+        if not data:
+            return None
+        try:
+            waypoints = json.loads(data)
+        except json.JSONDecodeError:
+            return None
+        return waypoints if isinstance(waypoints, list) else None
+
+    @staticmethod
+    def get_waypoint_progress(route):
+        """
+        Count completed waypoints of a route
 
-        return route_query.paginate(page=page, per_page=per_page)
+        Args:
+            route: Route object
 
+        Returns:
+            Dictionary with total, completed and percentage
+        """
+        total = len(route.waypoint_rows)
+        completed = sum(1 for row in route.waypoint_rows if row.completed)
+        return {
+            "total": total,
+            "completed": completed,
+            "percentage": int(completed / total * 100) if total > 0 else 0
+        }
 
-class MessageService:
     @staticmethod
-    def send_message(sender_id, recipient_id, task_id, content, company_id, db_session):
+    def complete_waypoint(route, seq, user_id, db_session):
         """
-        Send a message
+        Mark a waypoint as completed with a single-row update and record the event
 
         Args:
-            sender_id: ID of the sender
-            recipient_id: ID of the recipient
-            task_id: ID of the task the message is related to (optional)
-            content: Message content
-            company_id: ID of the company the message belongs to
+            route: Route object
+            seq: Position of the waypoint in the route, from 0
+            user_id: ID of the driver completing the waypoint
             db_session: SQLAlchemy session
 
         Returns:
-            Created message object
+            Dictionary with all_completed and next_seq (None when no waypoint is left after seq),
+            or None if the route has no such waypoint
         """
         try:
-            message = Message(
-                content=content,
-                is_read=False,
-                sender_id=sender_id,
-                recipient_id=recipient_id,
-                task_id=task_id,
-                company_id=company_id
-            )
+            now = datetime.utcnow()
+            waypoint_id = db_session.execute(
+                select(RouteWaypoint.id).where(RouteWaypoint.route_id == route.id, RouteWaypoint.seq == seq)
+            ).scalar()
+            if waypoint_id is None:
+                return None
+
+            # Completing twice keeps the first completion time
+            updated = db_session.execute(
+                RouteWaypoint.__table__.update()
+                .where(RouteWaypoint.id == waypoint_id, RouteWaypoint.completed == False)
+                .values(completed=True, completed_at=now)
+            ).rowcount
+            if updated:
+                RouteEvent.append(db_session, route.id, RouteEventType.WAYPOINT_COMPLETED,
+                                  waypoint_id=waypoint_id, user_id=user_id, created_at=now)
+
+            open_seqs = db_session.execute(
+                select(RouteWaypoint.seq)
+                .where(RouteWaypoint.route_id == route.id, RouteWaypoint.completed == False)
+                .order_by(RouteWaypoint.seq)
+            ).scalars().all()
 
-            db_session.add(message)
             db_session.commit()
-            log_action(ActionType.CREATE, f"Sent message to user ID {recipient_id}", db_session)
 
-            return message
+            return {
+                'all_completed': not open_seqs,
+                'next_seq': next((s for s in open_seqs if s > seq), None)
+            }
         except Exception as e:
             db_session.rollback()
-            current_app.logger.error(f"Error sending message: {str(e)}")
+            current_app.logger.error(f"Error completing waypoint: {str(e)}")
             raise
 
     @staticmethod
-    def mark_as_read(message, db_session):
+    def add_status_update(route, message, user_id, db_session):
         """
-        Mark a message as read
+        Append a driver status update to the route history
+
+        The update is attached to the first waypoint that is not completed yet,
+        or to the route itself when there is none.
 
         Args:
-            message: Message object
+            route: Route object
+            message: Status message
+            user_id: ID of the driver sending the update
             db_session: SQLAlchemy session
-
-        Returns:
-            Updated message object
         """
         try:
-            message.is_read = True
+            waypoint_id = db_session.execute(
+                select(RouteWaypoint.id)
+                .where(RouteWaypoint.route_id == route.id, RouteWaypoint.completed == False)
+                .order_by(RouteWaypoint.seq)
+                .limit(1)
+            ).scalar()
+
+            RouteEvent.append(db_session, route.id, RouteEventType.STATUS_UPDATE,
+                              message=message, waypoint_id=waypoint_id, user_id=user_id)
             db_session.commit()
-            return message
         except Exception as e:
             db_session.rollback()
-            current_app.logger.error(f"Error marking message as read: {str(e)}")
+            current_app.logger.error(f"Error adding status update: {str(e)}")
             raise
 
     @staticmethod
-    def get_messages_between_users(user1_id, user2_id, page=1, per_page=20):
+    def schedule_completion_jobs(route):
         """
-        Get messages between two users
+        Queue the work that follows a route's completion
 
-        Args:
-            user1_id: ID of first user
-            user2_id: ID of second user
-            page: Page number
-            per_page: Items per page
+        The GPS track is simplified for the map and the company's speed
+        model is refitted. Failing to queue is logged and otherwise ignored,
+        it must not undo the completion.
 
-        Returns:
-            Pagination object with message results
+        Args:
+            route: Route object that was just completed
         """
-        messages_query = Message.query.filter(
-            or_(
-                and_(
-                    Message.sender_id == user1_id,
-                    Message.recipient_id == user2_id
-                ),
-                and_(
-                    Message.sender_id == user2_id,
-                    Message.recipient_id == user1_id
-                )
+        RouteService.schedule_track_build(route.id, route.company_id)
+        try:
+            # Completions while a refit is still queued share it
+            job_queue.enqueue(
+                'routes.fit_speed_model',
+                {'company_id': route.company_id},
+                dedup_key=f'speed-model:{route.company_id}',
+                company_id=route.company_id,
+                reuse_result=False
             )
-        ).order_by(Message.sent_at.desc())
-
-        return messages_query.paginate(page=page, per_page=per_page)
+        except Exception as e:
+            current_app.logger.error(f"Error queueing routes.fit_speed_model for route {route.id}: {str(e)}")
 
     @staticmethod
-    def get_unread_messages_count(user_id):
+    def schedule_track_build(route_id, company_id):
         """
-        Get count of unread messages for a user
+        Queue a (re)build of a completed route's simplified track
 
-        Args:
-            user_id: ID of the user
+        The job runs GPS_TRACK_BUILD_DELAY seconds later, so pings still
+        buffered by the track writers are stored first. Called on completion
+        and by the track writer when pings for a completed route arrive
+        late. Requests while a build is queued share it; a request while a
+        build runs queues one follow-up build, since the running one may
+        have read the positions before the late pings were stored.
 
-        Returns:
-            Count of unread messages
+        Args:
+            route_id: ID of the route
+            company_id: ID of the route's company
         """
-        return Message.query.filter(
-            Message.recipient_id == user_id,
-            Message.is_read == False
-        ).count()
-
+        delay = max(
+            float(current_app.config.get('GPS_TRACK_BUILD_DELAY', 60)),
+            2 * float(current_app.config.get('GPS_FLUSH_INTERVAL', 1.0))
+        )
+        try:
+            job_queue.enqueue(
+                'routes.simplify_track',
+                {'route_id': route_id},
+                dedup_key=f'route-track:{route_id}',
+                company_id=company_id,
+                delay=delay,
+                reuse_result=False,
+                dedup_running=False
+            )
+        except Exception as e:
+            current_app.logger.error(f"Error queueing routes.simplify_track for route {route_id}: {str(e)}")
 
-class AuthService:
     @staticmethod
-    def login_user(user, db_session):
+    def schedule_metrics_update(route):
         """
-        Log user login
+        Queue the geocoding of a route's unlocated endpoints and a metrics recompute
+
+        Saving a route only reads the geocode cache; points that were not
+        cached are looked up by the provider in this job instead, and the
+        distance and estimated time are computed once they are found. Call
+        it after the route is committed. Failing to queue is logged and
+        otherwise ignored.
 
         Args:
-            user: User object
-            db_session: SQLAlchemy session
+            route: Route object that was just saved
         """
+        if route.status == RouteStatus.COMPLETED:
+            return
+        if None not in (route.start_lat, route.start_lng, route.end_lat, route.end_lng):
+            return
+
         try:
-            user.last_login = datetime.utcnow()
-            db_session.commit()  # Исправлено с db_session.session.commit()
-            log_action(ActionType.LOGIN, f"User {user.username} logged in", db_session)
+            # Saves while the job runs may change the points, so they get a follow-up
+            job_queue.enqueue(
+                'routes.update_metrics',
+                {'route_id': route.id},
+                dedup_key=f'route-metrics:{route.id}',
+                company_id=route.company_id,
+                reuse_result=False,
+                dedup_running=False
+            )
         except Exception as e:
-            db_session.rollback()  # Исправлено с db_session.session.rollback()
-            current_app.logger.error(f"Error logging user login: {str(e)}")
+            current_app.logger.error(f"Error queueing routes.update_metrics for route {route.id}: {str(e)}")
 
     @staticmethod
-    def logout_user(user, db_session):
+    def locate_endpoints(route):
         """
-        Log user logout
+        Resolve the coordinates of a route's start and end points from the geocode cache
+
+        Only points without coordinates or whose text changed are looked up,
+        and never with the provider: this runs while the route is saved, and
+        schedule_metrics_update queues the provider lookups. A point that
+        isn't cached or can't be found is left without coordinates.
 
         Args:
-            user: User object
-            db_session: SQLAlchemy session
+            route: Route object, not committed yet
         """
+        state = inspect(route)
+        pending = [
+            name for name in ('start', 'end')
+            if getattr(route, f'{name}_lat') is None or state.attrs[f'{name}_point'].history.has_changes()
+        ]
+        if not pending:
+            return
+
+        for name in pending:
+            setattr(route, f'{name}_lat', None)
+            setattr(route, f'{name}_lng', None)
+
         try:
-            log_action(ActionType.LOGOUT, f"User {user.username} logged out", db_session)
+            results = geocoder.resolve_cached([getattr(route, f'{name}_point') for name in pending])
         except Exception as e:
-            current_app.logger.error(f"Error logging user logout: {str(e)}")
+            current_app.logger.error(f"Error locating route endpoints: {str(e)}")
+            return
 
+        for name, result in zip(pending, results):
+            if result.get('success'):
+                setattr(route, f'{name}_lat', result['lat'])
+                setattr(route, f'{name}_lng', result['lng'])
 
-class LogService:
     @staticmethod
-    def get_recent_logs(limit=100, user_id=None, action_type=None, company_id=None):
+    def get_speed_model(company_id):
         """
-        Get recent log entries with filtering options
+        Get the duration model used for a company's route estimates
 
         Args:
-            limit: Maximum number of logs to return
-            user_id: Filter by user ID (optional)
-            action_type: Filter by action type (optional)
-            company_id: Filter by company ID (optional)
+            company_id: ID of the company
 
         Returns:
-            List of Log objects
+            Tuple (minutes_per_km, minutes_per_stop); the configured defaults
+            until a model has been fitted for the company
         """
-        logs_query = Log.query
-
-        # Apply filters
-        if user_id:
-            logs_query = logs_query.filter(Log.user_id == user_id)
+        model = CompanySpeedModel.query.get(company_id) if company_id else None
+        if model is None or model.minutes_per_km is None:
+            config = current_app.config
+            return 60.0 / config.get('ROUTE_DEFAULT_SPEED', 50.0), config.get('ROUTE_DEFAULT_STOP_MINUTES', 10.0)
+        return model.minutes_per_km, model.minutes_per_stop
 
-        if action_type:
-            logs_query = logs_query.filter(Log.action_type == action_type)
+    @staticmethod
+    def update_metrics(route):
+        """
+        Compute the distance and estimated time of a route from its coordinates
 
-        if company_id:
-            logs_query = logs_query.filter(Log.company_id == company_id)
+        The distance runs from the start through every waypoint that has
+        coordinates to the end, times ROUTE_DETOUR_FACTOR for the roads; the
+        time comes from the company's speed model. A route whose start or
+        end can't be located keeps the values entered on the form, and so
+        does a completed route: its values are what was driven, and the
+        speed model is fitted on them. Endpoints are only read from the
+        geocode cache; see schedule_metrics_update.
 
-        # Order by timestamp (most recent first)
-        logs_query = logs_query.order_by(Log.timestamp.desc())
+        Args:
+            route: Route object, not committed yet
 
-        # Limit results
-        return logs_query.limit(limit).all()
+        Returns:
+            True if the distance and estimated time were computed
+        """
+        RouteService.locate_endpoints(route)
+        if route.status == RouteStatus.COMPLETED:
+            return False
+        if None in (route.start_lat, route.start_lng, route.end_lat, route.end_lng):
+            return False
+
+        located = [row for row in route.waypoint_rows if row.lat is not None and row.lng is not None]
+        distance = route_distances(
+            [route.start_lat], [route.start_lng], [route.end_lat], [route.end_lng],
+            [0] * len(located), [row.lat for row in located], [row.lng for row in located]
+        )[0] * current_app.config.get('ROUTE_DETOUR_FACTOR', 1.3)
+
+        minutes_per_km, minutes_per_stop = RouteService.get_speed_model(route.company_id)
+        route.distance = round(float(distance), 2)
+        route.estimated_time = int(estimate_minutes(distance, len(route.waypoint_rows), minutes_per_km, minutes_per_stop))
+        return True
 
     @staticmethod
-    def get_paginated_logs(page=1, per_page=20, user_id=None, action_type=None, company_id=None):
+    def fit_speed_model(company_id, db_session):
         """
-        Get paginated log entries with filtering options
+        Refit a company's duration model on its most recent completed routes
 
         Args:
-            page: Page number
-            per_page: Items per page
-            user_id: Filter by user ID (optional)
-            action_type: Filter by action type (optional)
-            company_id: Filter by company ID (optional)
+            company_id: ID of the company
+            db_session: SQLAlchemy session
 
         Returns:
-            Pagination object with log results
+            CompanySpeedModel, without coefficients if there were too few usable routes
         """
-        logs_query = Log.query
+        config = current_app.config
 
-        # Apply filters
-        if user_id:
-            logs_query = logs_query.filter(Log.user_id == user_id)
-
-        if action_type:
-            logs_query = logs_query.filter(Log.action_type == action_type)
-
-        if company_id:
-            logs_query = logs_query.filter(Log.company_id == company_id)
-
-        # Order by timestamp (most recent first)
-        logs_query = logs_query.order_by(Log.timestamp.desc())
+        try:
+            stops = select(func.count(RouteWaypoint.id)).where(
+                RouteWaypoint.route_id == Route.id
+            ).correlate(Route).scalar_subquery()
+            rows = db_session.execute(
+                select(Route.distance, Route.start_time, Route.end_time, stops)
+                .where(
+                    Route.company_id == company_id,
+                    Route.status == RouteStatus.COMPLETED,
+                    Route.distance > 0,
+                    Route.start_time.isnot(None),
+                    Route.end_time > Route.start_time
+                )
+                .order_by(Route.end_time.desc())
+                .limit(config.get('ROUTE_SPEED_MODEL_MAX_ROUTES', 5000))
+            ).all()
+
+            fitted = None
+            if rows:
+                distances, start_times, end_times, stop_counts = zip(*rows)
+                minutes = [(end - start).total_seconds() / 60 for start, end in zip(start_times, end_times)]
+                fitted = fit_speed_model(distances, stop_counts, minutes,
+                                         min_routes=config.get('ROUTE_SPEED_MODEL_MIN_ROUTES', 20))
+
+            model = CompanySpeedModel.query.get(company_id) or CompanySpeedModel(company_id=company_id)
+            model.minutes_per_km = fitted['minutes_per_km'] if fitted else None
+            model.minutes_per_stop = fitted['minutes_per_stop'] if fitted else None
+            model.sample_count = fitted['sample_count'] if fitted else 0
+            model.fitted_at = datetime.utcnow()
+            db_session.add(model)
+            db_session.commit()
 
-        # Paginate results
-        return logs_query.paginate(page=page, per_page=per_page)
+            return model
+        except Exception as e:
+            db_session.rollback()
+            current_app.logger.error(f"Error fitting speed model for company {company_id}: {str(e)}")
+            raise
 
     @staticmethod
-    def get_user_logs(user_id, limit=100):
+    def locate_missing_endpoints(company_id=None, db_session=None):
         """
-        Get recent log entries for a specific user
+        Geocode the start and end points of routes that have no coordinates yet
+
+        Each distinct point is resolved once, in batches of GEOCODING_BATCH_LIMIT.
+        Points missing from the geocode cache wait for the provider's rate
+        limit, so the first run over old routes can be slow.
 
         Args:
-            user_id: User ID
-            limit: Maximum number of logs to return
+            company_id: Optional company to locate (all companies if None)
+            db_session: SQLAlchemy session (defaults to db.session)
 
         Returns:
-            List of Log objects
+            Dictionary with the number of distinct points located and not found
         """
-        return Log.query.filter_by(user_id=user_id).order_by(Log.timestamp.desc()).limit(limit).all()
+        db_session = db_session or db.session
+        routes_table = Route.__table__
+        counts = {'located': 0, 'missing': 0}
+
+        try:
+            for name in ('start', 'end'):
+                point = routes_table.c[f'{name}_point']
+                lat = routes_table.c[f'{name}_lat']
+
+                points = select(point).distinct().where(lat.is_(None))
+                if company_id:
+                    points = points.where(routes_table.c.company_id == company_id)
+                points = db_session.execute(points).scalars().all()
+
+                set_coordinates = update(routes_table).where(point == bindparam('point'), lat.is_(None)).values({
+                    f'{name}_lat': bindparam('new_lat'),
+                    f'{name}_lng': bindparam('new_lng')
+                })
+                if company_id:
+                    set_coordinates = set_coordinates.where(routes_table.c.company_id == company_id)
+
+                for start in range(0, len(points), geocoder.batch_limit):
+                    chunk = points[start:start + geocoder.batch_limit]
+                    found = [
+                        {'point': value, 'new_lat': result['lat'], 'new_lng': result['lng']}
+                        for value, result in zip(chunk, geocoder.resolve_many(chunk))
+                        if result.get('success')
+                    ]
+                    if found:
+                        db_session.execute(set_coordinates, found)
+                        db_session.commit()
+                    counts['located'] += len(found)
+                    counts['missing'] += len(chunk) - len(found)
+
+            return counts
+        except Exception as e:
+            db_session.rollback()
+            current_app.logger.error(f"Error locating route endpoints: {str(e)}")
+            raise
 
     @staticmethod
-    def get_action_counts_by_user(company_id=None, days=30):
+    def recompute_metrics(company_id=None, batch_size=5000, refit=True, db_session=None):
         """
-        Get count of actions grouped by user within a time period
+        Recompute the distance and estimated time of every located, unfinished route
+
+        Routes are read and written in batches of batch_size with one
+        statement each way, and the metrics of a whole batch are computed in
+        a single vectorized pass. Updates bypass the ORM, so the route
+        rollups must be rebuilt afterwards. Routes without start or end
+        coordinates and completed routes, whose values the speed model is
+        fitted on, are left alone.
 
         Args:
-            company_id: Filter by company ID (optional)
-            days: Number of days to include
+            company_id: Optional company to recompute (all companies if None)
+            batch_size: Routes per batch
+            refit: Refit the speed models of the companies first
+            db_session: SQLAlchemy session (defaults to db.session)
 
         Returns:
-            List of dictionaries with user_id, username, and action_count
+            Dictionary with the number of routes updated and of companies with a fitted model
         """
-        from sqlalchemy import func
-        from datetime import datetime, timedelta
+        db_session = db_session or db.session
+        config = current_app.config
+        detour = config.get('ROUTE_DETOUR_FACTOR', 1.3)
+        defaults = (60.0 / config.get('ROUTE_DEFAULT_SPEED', 50.0), config.get('ROUTE_DEFAULT_STOP_MINUTES', 10.0))
 
-        # Calculate the start date based on days parameter
-        start_date = datetime.utcnow() - timedelta(days=days)
+        try:
+            if refit:
+                company_ids = [company_id] if company_id else db_session.execute(
+                    select(Route.company_id).distinct()
+                ).scalars().all()
+                for fit_company_id in company_ids:
+                    RouteService.fit_speed_model(fit_company_id, db_session)
+
+            models = {
+                model.company_id: (model.minutes_per_km, model.minutes_per_stop)
+                for model in CompanySpeedModel.query.filter(CompanySpeedModel.minutes_per_km.isnot(None))
+            }
 
-        # Base query
-        query = db.session.query(
-            Log.user_id,
-            User.username,
-            func.count(Log.id).label('action_count')
-        ).join(User, Log.user_id == User.id)
+            located = select(
+                Route.id, Route.company_id, Route.start_lat, Route.start_lng, Route.end_lat, Route.end_lng
+            ).where(
+                Route.start_lat.isnot(None), Route.start_lng.isnot(None),
+                Route.end_lat.isnot(None), Route.end_lng.isnot(None),
+                Route.status != RouteStatus.COMPLETED
+            )
+            if company_id:
+                located = located.where(Route.company_id == company_id)
+            located = located.order_by(Route.id).limit(batch_size)
+
+            routes_table = Route.__table__
+            update_metrics = update(routes_table).where(routes_table.c.id == bindparam('route_id')).values(
+                distance=bindparam('new_distance'),
+                estimated_time=bindparam('new_estimated_time')
+            )
 
-        # Apply filters
-        query = query.filter(Log.timestamp >= start_date)
+            counts = {'routes': 0, 'models': len(models)}
+            last_id = 0
+            while True:
+                batch = db_session.execute(located.where(Route.id > last_id)).all()
+                if not batch:
+                    break
+                last_id = batch[-1].id
+
+                route_ids = np.array([row.id for row in batch], dtype=np.int64)
+                coordinates = np.array([row[2:] for row in batch], dtype=np.float64)
+
+                # Waypoints of unlocated or completed routes in the id range are dropped by the searchsorted match below
+                waypoints = np.array(db_session.execute(
+                    select(RouteWaypoint.route_id, RouteWaypoint.lat, RouteWaypoint.lng)
+                    .where(RouteWaypoint.route_id.between(int(route_ids[0]), int(route_ids[-1])))
+                    .order_by(RouteWaypoint.route_id, RouteWaypoint.seq)
+                ).all(), dtype=np.float64).reshape(-1, 3)
+                waypoint_route = np.searchsorted(route_ids, waypoints[:, 0])
+                in_batch = route_ids[np.minimum(waypoint_route, len(route_ids) - 1)] == waypoints[:, 0]
+                has_coordinates = in_batch & ~np.isnan(waypoints[:, 1]) & ~np.isnan(waypoints[:, 2])
+
+                stops = np.bincount(waypoint_route[in_batch], minlength=len(route_ids))
+                distances = route_distances(
+                    coordinates[:, 0], coordinates[:, 1], coordinates[:, 2], coordinates[:, 3],
+                    waypoint_route[has_coordinates], waypoints[has_coordinates, 1], waypoints[has_coordinates, 2]
+                ) * detour
+
+                rates = np.array([models.get(row.company_id, defaults) for row in batch], dtype=np.float64)
+                minutes = estimate_minutes(distances, stops, rates[:, 0], rates[:, 1])
+
+                db_session.execute(update_metrics, [
+                    {'route_id': route_id, 'new_distance': distance, 'new_estimated_time': estimate}
+                    for route_id, distance, estimate in zip(
+                        route_ids.tolist(), np.round(distances, 2).tolist(), minutes.tolist()
+                    )
+                ])
+                db_session.commit()
+                counts['routes'] += len(batch)
 
-        if company_id:
-            query = query.filter(Log.company_id == company_id)
+            return counts
+        except Exception as e:
+            db_session.rollback()
+            current_app.logger.error(f"Error recomputing route metrics: {str(e)}")
+            raise
 
-        # Group by user and order by count (descending)
-        query = query.group_by(Log.user_id, User.username).order_by(func.count(Log.id).desc())
+    @staticmethod
+    def build_track(route_id, db_session):
+        """
+        Simplify the GPS pings recorded on a route and store one polyline per zoom level
+
+        Args:
+            route_id: ID of the route
+            db_session: SQLAlchemy session
+
+        Returns:
+            Number of pings the track was built from
+        """
+        try:
+            pings = db_session.execute(
+                select(DriverPosition.recorded_at, DriverPosition.lat, DriverPosition.lng)
+                .where(DriverPosition.route_id == route_id)
+                .order_by(DriverPosition.recorded_at)
+            ).all()
+
+            levels = []
+            if pings:
+                times, lats, lngs = zip(*pings)
+                levels = simplify_track(
+                    times, lats, lngs,
+                    bucket_seconds=current_app.config.get('GPS_TRACK_BUCKET_SECONDS', 5.0)
+                )
+
+            # Rebuilt as a whole, e.g. when late pings arrive after completion
+            RouteTrack.query.filter_by(route_id=route_id).delete(synchronize_session=False)
+            for level in levels:
+                db_session.add(RouteTrack(route_id=route_id, **level))
+            db_session.commit()
+
+            return len(pings)
+        except Exception as e:
+            db_session.rollback()
+            current_app.logger.error(f"Error building track for route {route_id}: {str(e)}")
+            raise
+
+    @staticmethod
+    def get_track(route_id, zoom):
+        """
+        Get the pre-simplified track of a route for a map zoom level
+
+        Args:
+            route_id: ID of the route
+            zoom: Map zoom level
+
+        Returns:
+            RouteTrack or None if the route has no track
+        """
+        return RouteTrack.query.filter_by(route_id=route_id, level=level_for_zoom(zoom)).first()
+
+    # Formats accepted for waypoint window_start and window_end
+    WINDOW_TIME_FORMATS = ('%H:%M', '%Y-%m-%dT%H:%M', '%Y-%m-%d %H:%M')
+
+    @staticmethod
+    def parse_window_time(value, departure):
+        """
+        Minutes after departure of a waypoint time window bound
+
+        Args:
+            value: 'HH:MM' on the day of departure, or a date and time
+            departure: Route start time
+
+        Returns:
+            Minutes, None if value is empty
+
+        Raises:
+            OptimizationError: The value is not a time
+        """
+        if value in (None, ''):
+            return None
+        for time_format in RouteService.WINDOW_TIME_FORMATS:
+            try:
+                parsed = datetime.strptime(str(value).strip(), time_format)
+            except ValueError:
+                continue
+            if time_format == '%H:%M':
+                parsed = datetime.combine(departure.date(), parsed.time())
+            return (parsed - departure).total_seconds() / 60
+        raise OptimizationError(f"Invalid time window '{value}', use HH:MM")
+
+    @staticmethod
+    def optimize_waypoints(start_point, end_point, waypoints, company_id, start_time=None, time_budget=None):
+        """
+        Reorder waypoints to shorten the route between a fixed start and end
+
+        Waypoints need lat and lng (the create form's "Locate waypoints"
+        fills them in). A waypoint may carry window_start and window_end;
+        the route then needs a start time, and travel and stop times come
+        from the company's speed model unless the distance provider knows
+        the driving times.
+
+        Args:
+            start_point: Start address or Google Maps URL
+            end_point: End address or Google Maps URL
+            waypoints: List of waypoint dictionaries in their current order
+            company_id: ID of the company whose speed model applies
+            start_time: Departure time, needed for time windows
+            time_budget: Optional seconds to spend searching
+
+        Returns:
+            Dictionary with waypoints (reordered), distance, original_distance,
+            distance_saved (km), late_stops and elapsed (seconds)
+
+        Raises:
+            OptimizationError: The route can't be optimized as given
+        """
+        missing = [
+            str(index + 1) for index, waypoint in enumerate(waypoints)
+            if not isinstance(waypoint, dict) or waypoint.get('lat') in (None, '') or waypoint.get('lng') in (None, '')
+        ]
+        if missing:
+            raise OptimizationError(f"Waypoint(s) {', '.join(missing)} have no coordinates, locate them first")
+
+        stops = []
+        for index, waypoint in enumerate(waypoints):
+            lat, lng = waypoint['lat'], waypoint['lng']
+            try:
+                # Booleans are ints in Python, and float() accepts 'nan' and 'inf'
+                if isinstance(lat, bool) or isinstance(lng, bool):
+                    raise ValueError
+                lat, lng = float(lat), float(lng)
+                if not (math.isfinite(lat) and math.isfinite(lng)):
+                    raise ValueError
+            except (TypeError, ValueError):
+                raise OptimizationError(f'Waypoint {index + 1} coordinates must be numbers')
+            if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+                raise OptimizationError(f'Waypoint {index + 1} coordinates are out of range')
+            stops.append((lat, lng))
+
+        windows = None
+        if any(waypoint.get('window_start') or waypoint.get('window_end') for waypoint in waypoints):
+            if start_time is None:
+                raise OptimizationError('Set a start time to use time windows')
+            windows = [
+                (RouteService.parse_window_time(waypoint.get('window_start'), start_time),
+                 RouteService.parse_window_time(waypoint.get('window_end'), start_time))
+                for waypoint in waypoints
+            ]
+
+        endpoints = geocoder.resolve_many([start_point, end_point])
+        for label, result in zip(('Start', 'End'), endpoints):
+            if not result.get('success'):
+                raise OptimizationError(f"{label} point could not be located: {result.get('error')}")
+
+        minutes_per_km, minutes_per_stop = RouteService.get_speed_model(company_id)
+        result = route_optimizer.optimize(
+            (endpoints[0]['lat'], endpoints[0]['lng']),
+            (endpoints[1]['lat'], endpoints[1]['lng']),
+            stops,
+            windows=windows,
+            minutes_per_km=minutes_per_km,
+            service_minutes=minutes_per_stop,
+            time_budget=time_budget
+        )
+
+        return {
+            'waypoints': [waypoints[index] for index in result['order']],
+            'distance': round(result['distance'], 2),
+            'original_distance': round(result['original_distance'], 2),
+            'distance_saved': round(result['original_distance'] - result['distance'], 2),
+            'late_stops': result['late_stops'],
+            'elapsed': round(result['elapsed'], 3)
+        }
+
+    @staticmethod
+    def get_active_routes_for_driver(driver_id, cursor=None, per_page=10):
+        """
+        Get active routes for a driver, earliest start first
+
+        Routes without a start time sort last.
+
+        Args:
+            driver_id: ID of the driver
+            cursor: Cursor from a previous page (optional)
+            per_page: Items per page
+
+        Returns:
+            KeysetPage with route results
+        """
+        route_query = Route.query.filter(
+            Route.driver_id == driver_id,
+            Route.status.in_([RouteStatus.PLANNED, RouteStatus.IN_PROGRESS])
+        )
+
+        return RouteService.paginate_by_start_time(route_query, cursor, per_page)
+
+    @staticmethod
+    def paginate_by_start_time(route_query, cursor=None, per_page=10, descending=False, count=None):
+        """
+        Keyset-paginate a Route query by start time
+
+        Keyset columns can't be NULL, so routes without a start time are
+        given UNSCHEDULED_START_TIME: last in ascending order, first in
+        descending order.
+
+        Args:
+            route_query: Query on Route without ORDER BY
+            cursor: Cursor from a previous page (optional)
+            per_page: Items per page
+            descending: Latest start first
+            count: None, 'exact' or 'estimate' (see keyset_paginate)
+
+        Returns:
+            KeysetPage with route results
+        """
+        start_time = func.coalesce(Route.start_time, RouteService.UNSCHEDULED_START_TIME)
+        return keyset_paginate(
+            route_query,
+            [(start_time, descending), (Route.id, descending)],
+            cursor=cursor,
+            per_page=per_page,
+            count=count,
+            key=lambda route: [route.start_time or RouteService.UNSCHEDULED_START_TIME, route.id]
+        )
+
+
+class DocumentSearchService:
+    @staticmethod
+    def apply_search(document_query, text):
+        """
+        Restrict a Document query to full-text index matches, best first
+
+        Matches document title, file type, category, task title and uploader
+        name. Uses the tsvector index on PostgreSQL and FTS5 on SQLite.
+
+        Args:
+            document_query: Query on Document to filter
+            text: Search input
+
+        Returns:
+            Filtered query, ordered by relevance where the database supports it
+        """
+        terms = DocumentSearchEntry.search_terms(text)
+        if not terms:
+            return document_query
+
+        dialect = db.session.get_bind().dialect.name
+        join_target, join_condition, condition, rank = DocumentSearchEntry.match(dialect, terms)
+
+        document_query = document_query.join(
+            DocumentSearchEntry, DocumentSearchEntry.document_id == Document.id
+        )
+        if join_target is not None:
+            document_query = document_query.join(join_target, join_condition)
+        document_query = document_query.filter(condition)
+
+        if rank is not None:
+            document_query = document_query.order_by(rank)
+        return document_query
+
+    @staticmethod
+    def reindex(company_id=None, db_session=None):
+        """
+        Rebuild the document search index
+
+        Args:
+            company_id: Only reindex this company's documents
+            db_session: Database session
+
+        Returns:
+            Number of documents indexed
+        """
+        session = db_session or db.session
+        try:
+            indexed = DocumentSearchEntry.rebuild(session.connection(), company_id)
+            session.commit()
+            return indexed
+        except SQLAlchemyError as e:
+            session.rollback()
+            current_app.logger.error(f"Error rebuilding document search index: {str(e)}")
+            raise
+
+
+class MessageService:
+    @staticmethod
+    def send_message(sender_id, recipient_id, task_id, content, company_id, db_session):
+        """
+        Send a message
+
+        Args:
+            sender_id: ID of the sender
+            recipient_id: ID of the recipient
+            task_id: ID of the task the message is related to (optional)
+            content: Message content
+            company_id: ID of the company the message belongs to
+            db_session: SQLAlchemy session
+
+        Returns:
+            Created message object
+        """
+        try:
+            message = Message(
+                content=content,
+                is_read=False,
+                sender_id=sender_id,
+                recipient_id=recipient_id,
+                task_id=task_id,
+                company_id=company_id
+            )
+
+            db_session.add(message)
+            db_session.commit()
+            log_action(ActionType.CREATE, f"Sent message to user ID {recipient_id}", db_session)
+            MessageService.publish_new_message(message)
+
+            return message
+        except Exception as e:
+            db_session.rollback()
+            current_app.logger.error(f"Error sending message: {str(e)}")
+            raise
+
+    @staticmethod
+    def mark_as_read(message, db_session):
+        """
+        Mark a message as read
+
+        Args:
+            message: Message object
+            db_session: SQLAlchemy session
+
+        Returns:
+            Updated message object
+        """
+        try:
+            message.is_read = True
+            db_session.commit()
+            return message
+        except Exception as e:
+            db_session.rollback()
+            current_app.logger.error(f"Error marking message as read: {str(e)}")
+            raise
+
+    @staticmethod
+    def get_messages_between_users(user1_id, user2_id, page=1, per_page=20):
+        """
+        Get messages between two users
+
+        Args:
+            user1_id: ID of first user
+            user2_id: ID of second user
+            page: Page number
+            per_page: Items per page
+
+        Returns:
+            Pagination object with message results
+        """
+        messages_query = Message.query.filter(
+            or_(
+                and_(
+                    Message.sender_id == user1_id,
+                    Message.recipient_id == user2_id
+                ),
+                and_(
+                    Message.sender_id == user2_id,
+                    Message.recipient_id == user1_id
+                )
+            )
+        ).order_by(Message.sent_at.desc())
+
+        return messages_query.paginate(page=page, per_page=per_page)
+
+    @staticmethod
+    def get_conversation(user_id, other_user_id, before=None, since=None, limit=50):
+        """
+        Get one page of the conversation between two users
+
+        Pages are keyed on (sent_at, id) rather than offsets, so loading older
+        history or polling for new messages only touches the rows returned.
+
+        Args:
+            user_id: ID of the current user
+            other_user_id: ID of the other user
+            before: (sent_at, id) cursor, return messages older than it
+            since: (sent_at, id) cursor, return messages newer than it
+            limit: Maximum number of messages to return
+
+        Returns:
+            Tuple of (messages in ascending order, has_more flag). has_more
+            means there are older messages (or, with since, more new ones)
+            beyond this page
+        """
+        messages_query = Message.query.filter(
+            or_(
+                and_(Message.sender_id == user_id, Message.recipient_id == other_user_id),
+                and_(Message.sender_id == other_user_id, Message.recipient_id == user_id)
+            )
+        )
+
+        if since is not None:
+            rows = messages_query.filter(
+                tuple_(Message.sent_at, Message.id) > tuple_(*since)
+            ).order_by(Message.sent_at.asc(), Message.id.asc()).limit(limit + 1).all()
+            return rows[:limit], len(rows) > limit
+
+        if before is not None:
+            messages_query = messages_query.filter(
+                tuple_(Message.sent_at, Message.id) < tuple_(*before)
+            )
+
+        rows = messages_query.order_by(Message.sent_at.desc(), Message.id.desc()).limit(limit + 1).all()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        rows.reverse()
+        return rows, has_more
+
+    @staticmethod
+    def mark_conversation_read(recipient_id, sender_id, db_session):
+        """
+        Mark everything a sender has sent to a recipient as read
+
+        Args:
+            recipient_id: ID of the user reading the messages
+            sender_id: ID of the user who sent them
+            db_session: SQLAlchemy session
+
+        Returns:
+            Number of messages marked as read
+        """
+        try:
+            updated = Message.query.filter(
+                Message.recipient_id == recipient_id,
+                Message.sender_id == sender_id,
+                Message.is_read == False
+            ).update({Message.is_read: True}, synchronize_session=False)
+            UnreadCounter.adjust(db_session.connection(), recipient_id, sender_id, -updated)
+            db_session.commit()
+
+            if updated:
+                MessageService.publish_unread_count(recipient_id)
+            return updated
+        except Exception as e:
+            db_session.rollback()
+            current_app.logger.error(f"Error marking messages as read: {str(e)}")
+            raise
+
+    @staticmethod
+    def serialize_message(message):
+        """
+        Convert a message to a JSON-friendly dict
+
+        Args:
+            message: Message object
+
+        Returns:
+            Dictionary with the message fields used by the chat UI
+        """
+        return {
+            'id': message.id,
+            'content': message.content,
+            'sent_at': message.sent_at.isoformat(),
+            'time': message.sent_at.strftime('%H:%M'),
+            'sender_id': message.sender_id,
+            'recipient_id': message.recipient_id,
+            'task_id': message.task_id,
+            'is_read': message.is_read
+        }
+
+    @staticmethod
+    def publish_new_message(message):
+        """
+        Push a new message to the recipient's and sender's event streams
+
+        The recipient also gets their updated unread count.
+
+        Args:
+            message: Committed Message object
+        """
+        from app import event_bus
+
+        payload = MessageService.serialize_message(message)
+        event_bus.publish(message.recipient_id, 'message', payload)
+        event_bus.publish(message.sender_id, 'message', payload)
+        MessageService.publish_unread_count(message.recipient_id)
+
+    @staticmethod
+    def publish_unread_count(user_id):
+        """
+        Push a user's current unread message count to their event stream
+
+        Args:
+            user_id: ID of the user
+        """
+        from app import event_bus
+
+        event_bus.publish(user_id, 'unread', {'count': MessageService.get_unread_messages_count(user_id)})
+
+    @staticmethod
+    def make_cursor(message):
+        """
+        Build an opaque keyset cursor for a message
+
+        Args:
+            message: Message object
+
+        Returns:
+            Cursor string in the form "<sent_at ISO>,<id>"
+        """
+        return f"{message.sent_at.isoformat()},{message.id}"
+
+    @staticmethod
+    def parse_cursor(value):
+        """
+        Parse a cursor built by make_cursor
+
+        Args:
+            value: Cursor string
+
+        Returns:
+            Tuple of (sent_at, id) or None if the value is missing or malformed
+        """
+        if not value:
+            return None
+        try:
+            sent_at, message_id = value.rsplit(',', 1)
+            return datetime.fromisoformat(sent_at), int(message_id)
+        except ValueError:
+            return None
+
+    @staticmethod
+    def get_unread_messages_count(user_id):
+        """
+        Get count of unread messages for a user
+
+        Args:
+            user_id: ID of the user
+
+        Returns:
+            Count of unread messages
+        """
+        total = db.session.query(func.sum(UnreadCounter.count)).filter(
+            UnreadCounter.recipient_id == user_id
+        ).scalar()
+        return int(total or 0)
+
+    @staticmethod
+    def delete_conversation(user1_id, user2_id, db_session):
+        """
+        Delete all messages between two users and adjust unread counters
+
+        Args:
+            user1_id: ID of first user
+            user2_id: ID of second user
+            db_session: SQLAlchemy session
+
+        Returns:
+            Number of messages deleted
+        """
+        try:
+            deleted = 0
+            connection = db_session.connection()
+
+            # Unread messages first, per direction, so the counters can be adjusted exactly
+            for sender_id, recipient_id in ((user1_id, user2_id), (user2_id, user1_id)):
+                unread_deleted = Message.query.filter(
+                    Message.sender_id == sender_id,
+                    Message.recipient_id == recipient_id,
+                    Message.is_read == False
+                ).delete(synchronize_session=False)
+                UnreadCounter.adjust(connection, recipient_id, sender_id, -unread_deleted)
+                deleted += unread_deleted
+
+            deleted += Message.query.filter(
+                or_(
+                    and_(Message.sender_id == user1_id, Message.recipient_id == user2_id),
+                    and_(Message.sender_id == user2_id, Message.recipient_id == user1_id)
+                )
+            ).delete(synchronize_session=False)
+
+            db_session.commit()
+
+            MessageService.publish_unread_count(user1_id)
+            MessageService.publish_unread_count(user2_id)
+            return deleted
+        except Exception as e:
+            db_session.rollback()
+            current_app.logger.error(f"Error deleting conversation: {str(e)}")
+            raise
+
+    @staticmethod
+    def reconcile_unread_counters(apply=True):
+        """
+        Compare unread counters with the messages table and optionally rebuild them
+
+        Args:
+            apply: Rewrite the counters from messages when True
+
+        Returns:
+            List of (recipient_id, sender_id, stored_count, actual_count) for
+            every pair that had drifted
+        """
+        actual = {
+            (recipient_id, sender_id): count
+            for recipient_id, sender_id, count in db.session.query(
+                Message.recipient_id, Message.sender_id, func.count(Message.id)
+            ).filter(
+                Message.is_read == False
+            ).group_by(Message.recipient_id, Message.sender_id).all()
+        }
+
+        stored = {
+            (counter.recipient_id, counter.sender_id): counter.count
+            for counter in UnreadCounter.query.all()
+        }
+
+        drift = [
+            (recipient_id, sender_id, stored.get((recipient_id, sender_id), 0), actual.get((recipient_id, sender_id), 0))
+            for recipient_id, sender_id in sorted(set(actual) | set(stored))
+            if stored.get((recipient_id, sender_id), 0) != actual.get((recipient_id, sender_id), 0)
+        ]
+
+        if apply and drift:
+            try:
+                UnreadCounter.query.delete(synchronize_session=False)
+                now = datetime.utcnow()
+                if actual:
+                    db.session.execute(UnreadCounter.__table__.insert(), [
+                        {'recipient_id': recipient_id, 'sender_id': sender_id, 'count': count, 'updated_at': now}
+                        for (recipient_id, sender_id), count in actual.items()
+                    ])
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                current_app.logger.error(f"Error rebuilding unread counters: {str(e)}")
+                raise
+
+        return drift
+
+    @staticmethod
+    def get_contact_summaries(user_id, role, company_id=None, operator_id=None):
+        """
+        Get everyone a user has exchanged messages with, in one query
+
+        Window functions over the user's messages give the last message time
+        per contact and the unread count comes from unread_counters. The same
+        rules as messages._can_message_user are applied in SQL: non-admins
+        only see contacts in their own company, and drivers don't see other
+        drivers or operators other than their own.
+
+        Args:
+            user_id: ID of the user
+            role: UserRole of the user
+            company_id: Company ID of the user (None for admins)
+            operator_id: Operator ID assigned to the user if they are a driver
+
+        Returns:
+            List of dicts with user, unread_count, last_message_time and role_name,
+            sorted like the original sidebar (unread count ascending, then most
+            recent conversation first)
+        """
+        if company_id is None and role != UserRole.ADMIN:
+            return []
+
+        contact_id = case(
+            (Message.sender_id == user_id, Message.recipient_id),
+            else_=Message.sender_id
+        )
+
+        conversation = db.session.query(
+            contact_id.label('contact_id'),
+            func.max(Message.sent_at).over(partition_by=contact_id).label('last_message_time'),
+            func.row_number().over(partition_by=contact_id, order_by=Message.id).label('row_number')
+        ).filter(
+            or_(Message.sender_id == user_id, Message.recipient_id == user_id),
+            Message.sender_id != Message.recipient_id
+        ).subquery()
+
+        unread_count = func.coalesce(UnreadCounter.count, 0)
+
+        query = db.session.query(
+            User,
+            unread_count,
+            conversation.c.last_message_time
+        ).join(
+            conversation, User.id == conversation.c.contact_id
+        ).outerjoin(
+            UnreadCounter, and_(
+                UnreadCounter.recipient_id == user_id,
+                UnreadCounter.sender_id == User.id
+            )
+        ).filter(
+            conversation.c.row_number == 1
+        )
+
+        if role != UserRole.ADMIN:
+            contact_company_id = case(
+                (User.role == UserRole.COMPANY_OWNER, CompanyOwner.company_id),
+                (User.role == UserRole.MANAGER, Manager.company_id),
+                (User.role == UserRole.OPERATOR, Operator.company_id),
+                (User.role == UserRole.DRIVER, Driver.company_id),
+                else_=None
+            )
+
+            query = query.outerjoin(CompanyOwner, CompanyOwner.id == User.id) \
+                .outerjoin(Manager, Manager.id == User.id) \
+                .outerjoin(Operator, Operator.id == User.id) \
+                .outerjoin(Driver, Driver.id == User.id) \
+                .filter(contact_company_id == company_id)
+
+            if role == UserRole.DRIVER:
+                query = query.filter(
+                    User.role != UserRole.DRIVER,
+                    or_(User.role != UserRole.OPERATOR, User.id == operator_id)
+                )
+
+        query = query.order_by(
+            unread_count.asc(),
+            conversation.c.last_message_time.desc(),
+            User.id
+        )
+
+        return [
+            {
+                'user': contact,
+                'unread_count': int(unread_count or 0),
+                'last_message_time': last_message_time,
+                'role_name': contact.role.value.replace('_', ' ').title()
+            }
+            for contact, unread_count, last_message_time in query.all()
+        ]
+
+
+class AuthService:
+    @staticmethod
+    def login_user(user, db_session):
+        """
+        Log user login
+
+        Args:
+            user: User object
+            db_session: SQLAlchemy session
+        """
+        try:
+            user.last_login = datetime.utcnow()
+            db_session.commit()  # Исправлено с db_session.session.commit()
+            log_action(ActionType.LOGIN, f"User {user.username} logged in", db_session)
+        except Exception as e:
+            db_session.rollback()  # Исправлено с db_session.session.rollback()
+            current_app.logger.error(f"Error logging user login: {str(e)}")
+
+    @staticmethod
+    def logout_user(user, db_session):
+        """
+        Log user logout
+
+        Args:
+            user: User object
+            db_session: SQLAlchemy session
+        """
+        try:
+            log_action(ActionType.LOGOUT, f"User {user.username} logged out", db_session)
+        except Exception as e:
+            current_app.logger.error(f"Error logging user logout: {str(e)}")
+
+
+class LogService:
+    @staticmethod
+    def get_recent_logs(limit=100, user_id=None, action_type=None, company_id=None):
+        """
+        Get recent log entries with filtering options
+
+        Args:
+            limit: Maximum number of logs to return
+            user_id: Filter by user ID (optional)
+            action_type: Filter by action type (optional)
+            company_id: Filter by company ID (optional)
+
+        Returns:
+            List of Log objects
+        """
+        logs_query = Log.query
+
+        # Apply filters
+        if user_id:
+            logs_query = logs_query.filter(Log.user_id == user_id)
+
+        if action_type:
+            logs_query = logs_query.filter(Log.action_type == action_type)
+
+        if company_id:
+            logs_query = logs_query.filter(Log.company_id == company_id)
+
+        # Order by timestamp (most recent first)
+        logs_query = logs_query.order_by(Log.timestamp.desc())
+
+        # Limit results
+        return logs_query.limit(limit).all()
+
+    @staticmethod
+    def get_paginated_logs(cursor=None, per_page=20, user_id=None, action_type=None, company_id=None, count=None):
+        """
+        Get a page of log entries, most recent first, with filtering options
+
+        Uses keyset pagination on (timestamp, id), so deep pages cost the
+        same as the first one.
+
+        Args:
+            cursor: Cursor from a previous page (optional)
+            per_page: Items per page
+            user_id: Filter by user ID (optional)
+            action_type: Filter by action type (optional)
+            company_id: Filter by company ID (optional)
+            count: None, 'exact' or 'estimate' (see keyset_paginate)
+
+        Returns:
+            KeysetPage with log results
+        """
+        logs_query = Log.query
+
+        # Apply filters
+        if user_id:
+            logs_query = logs_query.filter(Log.user_id == user_id)
+
+        if action_type:
+            logs_query = logs_query.filter(Log.action_type == action_type)
+
+        if company_id:
+            logs_query = logs_query.filter(Log.company_id == company_id)
+
+        return keyset_paginate(
+            logs_query,
+            [(Log.timestamp, True), (Log.id, True)],
+            cursor=cursor,
+            per_page=per_page,
+            count=count
+        )
+
+    @staticmethod
+    def get_user_logs(user_id, limit=100):
+        """
+        Get recent log entries for a specific user
+
+        Args:
+            user_id: User ID
+            limit: Maximum number of logs to return
+
+        Returns:
+            List of Log objects
+        """
+        return Log.query.filter_by(user_id=user_id).order_by(Log.timestamp.desc()).limit(limit).all()
+
+    @staticmethod
+    def get_log_archives():
+        """
+        List months that `flask archive-logs` moved out of the database
+
+        Returns:
+            List of dictionaries with month, files and size (bytes), oldest first
+        """
+        return [
+            {
+                'month': month,
+                'files': len(paths),
+                'size': sum(os.path.getsize(path) for path in paths)
+            }
+            for month, paths in list_log_archives(current_app.config['LOG_ARCHIVE_FOLDER'])
+        ]
+
+    @staticmethod
+    def iter_archived_logs(start=None, end=None, user_id=None, action_type=None, company_id=None):
+        """
+        Read archived log entries (read-only)
+
+        Archives are scanned month by month, so only the months overlapping
+        start and end are decompressed.
+
+        Args:
+            start: Only entries at or after this datetime (optional)
+            end: Only entries before this datetime (optional)
+            user_id: Filter by user ID (optional)
+            action_type: Filter by action type (optional)
+            company_id: Filter by company ID (optional)
+
+        Yields:
+            Dictionaries with the Log columns; action_type is an ActionType
+        """
+        for row in iter_log_archive(current_app.config['LOG_ARCHIVE_FOLDER'], start, end):
+            row['action_type'] = ActionType(row['action_type'])
+            if user_id and row['user_id'] != user_id:
+                continue
+            if action_type and row['action_type'] != action_type:
+                continue
+            if company_id and row['company_id'] != company_id:
+                continue
+            yield row
+
+    @staticmethod
+    def get_action_counts_by_user(company_id=None, days=30):
+        """
+        Get count of actions grouped by user within a time period
+
+        Args:
+            company_id: Filter by company ID (optional)
+            days: Number of days to include
+
+        Returns:
+            List of dictionaries with user_id, username, and action_count
+        """
+        from sqlalchemy import func
+        from datetime import datetime, timedelta
+
+        # Calculate the start date based on days parameter
+        start_date = datetime.utcnow() - timedelta(days=days)
+
+        # Base query
+        query = db.session.query(
+            Log.user_id,
+            User.username,
+            func.count(Log.id).label('action_count')
+        ).join(User, Log.user_id == User.id)
+
+        # Apply filters
+        query = query.filter(Log.timestamp >= start_date)
+
+        if company_id:
+            query = query.filter(Log.company_id == company_id)
+
+        # Group by user and order by count (descending)
+        query = query.group_by(Log.user_id, User.username).order_by(func.count(Log.id).desc())
 
         # Execute query and return results
         results = query.all()
@@ -1064,6 +2289,433 @@ class LogService:
 
 
 class StatisticsService:
+    @staticmethod
+    def _status_count_columns(status_column, status_enum, prefix, value):
+        """
+        Build a total plus one aggregate FILTER (WHERE status = ...) column per status
+
+        value is the aggregate to split, e.g. func.count(Task.id) on the raw
+        table or func.sum(TaskDailyRollup.task_count) on the rollup.
+        """
+        columns = [value.label(f'{prefix}_total')]
+        for status in status_enum:
+            columns.append(value.filter(status_column == status).label(f'{prefix}_{status.name.lower()}'))
+        return columns
+
+    @staticmethod
+    def _day_range(start_date, end_date):
+        """
+        Convert a datetime range into the inclusive range of rollup days
+        """
+        return start_date.date(), end_date.date()
+
+    @staticmethod
+    def _task_counts_select(company_id=None, start_date=None, end_date=None):
+        if start_date and end_date:
+            # Date ranges are answered from the daily rollup
+            query = select(*StatisticsService._status_count_columns(
+                TaskDailyRollup.status, TaskStatus, 'task', func.sum(TaskDailyRollup.task_count)
+            )).where(TaskDailyRollup.day.between(*StatisticsService._day_range(start_date, end_date)))
+
+            if company_id:
+                query = query.where(TaskDailyRollup.company_id == company_id)
+            return query
+
+        query = select(*StatisticsService._status_count_columns(
+            Task.status, TaskStatus, 'task', func.count(Task.id)
+        ))
+
+        if company_id:
+            query = query.where(Task.company_id == company_id)
+
+        return query
+
+    @staticmethod
+    def _route_counts_select(company_id=None, start_date=None, end_date=None):
+        if start_date and end_date:
+            # Date ranges are answered from the daily rollup
+            rollup = RouteDailyRollup
+            query = select(
+                *StatisticsService._status_count_columns(
+                    rollup.status, RouteStatus, 'route', func.sum(rollup.route_count)
+                ),
+                func.coalesce(func.sum(rollup.distance), 0).label('route_total_distance'),
+                func.coalesce(
+                    func.sum(rollup.distance).filter(rollup.status == RouteStatus.COMPLETED), 0
+                ).label('route_completed_distance')
+            ).where(rollup.day.between(*StatisticsService._day_range(start_date, end_date)))
+
+            if company_id:
+                query = query.where(rollup.company_id == company_id)
+            return query
+
+        query = select(
+            *StatisticsService._status_count_columns(Route.status, RouteStatus, 'route', func.count(Route.id)),
+            func.coalesce(func.sum(Route.distance), 0).label('route_total_distance'),
+            func.coalesce(
+                func.sum(Route.distance).filter(Route.status == RouteStatus.COMPLETED), 0
+            ).label('route_completed_distance')
+        )
+
+        if company_id:
+            query = query.where(Route.company_id == company_id)
+
+        return query
+
+    @staticmethod
+    def _team_counts_select(company_id=None):
+        columns = []
+        for model, name in ((Manager, 'managers'), (Operator, 'operators'), (Driver, 'drivers')):
+            count_query = select(func.count(model.id))
+            if company_id:
+                count_query = count_query.where(model.company_id == company_id)
+            columns.append(count_query.scalar_subquery().label(f'team_{name}'))
+
+        return select(*columns)
+
+    @staticmethod
+    def _extract_counts(row, prefix):
+        """
+        Pick the columns with the given prefix out of a result row
+        """
+        counts = {}
+        for key, value in row.items():
+            if key.startswith(prefix):
+                counts[key[len(prefix):]] = value or 0
+        return counts
+
+    @staticmethod
+    def _route_counts_from_row(row):
+        counts = StatisticsService._extract_counts(row, 'route_')
+        counts['total_distance'] = float(counts['total_distance'])
+        counts['completed_distance'] = float(counts['completed_distance'])
+        return counts
+
+    @staticmethod
+    def _team_counts_from_row(row):
+        counts = StatisticsService._extract_counts(row, 'team_')
+        counts['total'] = counts['managers'] + counts['operators'] + counts['drivers']
+        return counts
+
+    @staticmethod
+    def get_task_status_counts(company_id=None, start_date=None, end_date=None, db_session=None):
+        """
+        Count tasks per status in a single query
+
+        Args:
+            company_id: ID of the company (None for all companies)
+            start_date: Optional start of the created_at range, counted by whole days
+            end_date: Optional end of the created_at range, counted by whole days
+            db_session: SQLAlchemy session (defaults to db.session)
+
+        Returns:
+            Dictionary with 'total' and one lower-case key per TaskStatus
+        """
+        db_session = db_session or db.session
+        query = StatisticsService._task_counts_select(company_id, start_date, end_date)
+        row = db_session.execute(query).mappings().one()
+        return StatisticsService._extract_counts(row, 'task_')
+
+    @staticmethod
+    def get_route_status_counts(company_id=None, start_date=None, end_date=None, db_session=None):
+        """
+        Count routes per status and sum their distance in a single query
+
+        Args:
+            company_id: ID of the company (None for all companies)
+            start_date: Optional start of the start_time range, counted by whole days
+            end_date: Optional end of the start_time range, counted by whole days
+            db_session: SQLAlchemy session (defaults to db.session)
+
+        Returns:
+            Dictionary with 'total', one lower-case key per RouteStatus,
+            'total_distance' and 'completed_distance'
+        """
+        db_session = db_session or db.session
+        query = StatisticsService._route_counts_select(company_id, start_date, end_date)
+        row = db_session.execute(query).mappings().one()
+        return StatisticsService._route_counts_from_row(row)
+
+    @staticmethod
+    def get_team_counts(company_id=None, db_session=None):
+        """
+        Count managers, operators and drivers in a single query
+
+        Args:
+            company_id: ID of the company (None for all companies)
+            db_session: SQLAlchemy session (defaults to db.session)
+
+        Returns:
+            Dictionary with 'managers', 'operators', 'drivers' and 'total'
+        """
+        db_session = db_session or db.session
+        row = db_session.execute(StatisticsService._team_counts_select(company_id)).mappings().one()
+        return StatisticsService._team_counts_from_row(row)
+
+    @staticmethod
+    def get_company_overview(company_id=None, start_date=None, end_date=None, db_session=None):
+        """
+        Get task, route and team counts for a company in one round trip
+
+        The three aggregates are single-row subqueries joined together, so
+        the database returns everything in one row. With a date range the
+        task and route counts come from the daily rollups.
+
+        Args:
+            company_id: ID of the company (None for all companies)
+            start_date: Optional start of the date range
+            end_date: Optional end of the date range
+            db_session: SQLAlchemy session (defaults to db.session)
+
+        Returns:
+            Dictionary with 'tasks', 'routes' and 'team' count dictionaries
+        """
+        db_session = db_session or db.session
+
+        tasks = StatisticsService._task_counts_select(company_id, start_date, end_date).subquery('task_counts')
+        routes = StatisticsService._route_counts_select(company_id, start_date, end_date).subquery('route_counts')
+        team = StatisticsService._team_counts_select(company_id).subquery('team_counts')
+
+        query = select(tasks, routes, team).select_from(
+            tasks.join(routes, true()).join(team, true())
+        )
+        row = db_session.execute(query).mappings().one()
+
+        return {
+            'tasks': StatisticsService._extract_counts(row, 'task_'),
+            'routes': StatisticsService._route_counts_from_row(row),
+            'team': StatisticsService._team_counts_from_row(row)
+        }
+
+    @staticmethod
+    def get_driver_route_stats(start_date, end_date, company_id=None, driver_ids=None, db_session=None):
+        """
+        Get route totals per driver from the daily rollup
+
+        Args:
+            start_date: Start of the start_time range, counted by whole days
+            end_date: End of the start_time range, counted by whole days
+            company_id: Optional company filter
+            driver_ids: Optional list of driver IDs to restrict to
+            db_session: SQLAlchemy session (defaults to db.session)
+
+        Returns:
+            Dictionary of driver ID -> {'routes', 'completed_routes',
+            'completed_distance', 'avg_minutes'}; drivers without routes are missing
+        """
+        db_session = db_session or db.session
+        rollup = RouteDailyRollup
+        completed = rollup.status == RouteStatus.COMPLETED
+
+        query = select(
+            rollup.driver_id,
+            func.sum(rollup.route_count).label('routes'),
+            func.sum(rollup.route_count).filter(completed).label('completed_routes'),
+            func.sum(rollup.distance).filter(completed).label('completed_distance'),
+            func.sum(rollup.timed_count).filter(completed).label('timed_count'),
+            func.sum(rollup.duration_seconds).filter(completed).label('duration_seconds')
+        ).where(
+            rollup.day.between(*StatisticsService._day_range(start_date, end_date))
+        ).group_by(rollup.driver_id)
+
+        if company_id:
+            query = query.where(rollup.company_id == company_id)
+        if driver_ids is not None:
+            if not driver_ids:
+                return {}
+            query = query.where(rollup.driver_id.in_(driver_ids))
+
+        stats = {}
+        for row in db_session.execute(query):
+            timed_count = row.timed_count or 0
+            stats[row.driver_id] = {
+                'routes': row.routes or 0,
+                'completed_routes': row.completed_routes or 0,
+                'completed_distance': float(row.completed_distance or 0),
+                'avg_minutes': (row.duration_seconds or 0) / timed_count / 60 if timed_count else 0
+            }
+        return stats
+
+    @staticmethod
+    def get_creator_task_stats(start_date, end_date, company_id=None, creator_ids=None, db_session=None):
+        """
+        Get task totals per creator from the daily rollup
+
+        Args:
+            start_date: Start of the created_at range, counted by whole days
+            end_date: End of the created_at range, counted by whole days
+            company_id: Optional company filter
+            creator_ids: Optional list of user IDs to restrict to
+            db_session: SQLAlchemy session (defaults to db.session)
+
+        Returns:
+            Dictionary of user ID -> {'tasks', 'completed_tasks'}; users without tasks are missing
+        """
+        db_session = db_session or db.session
+        rollup = TaskDailyRollup
+
+        query = select(
+            rollup.creator_id,
+            func.sum(rollup.task_count).label('tasks'),
+            func.sum(rollup.task_count).filter(rollup.status == TaskStatus.COMPLETED).label('completed_tasks')
+        ).where(
+            rollup.day.between(*StatisticsService._day_range(start_date, end_date))
+        ).group_by(rollup.creator_id)
+
+        if company_id:
+            query = query.where(rollup.company_id == company_id)
+        if creator_ids is not None:
+            if not creator_ids:
+                return {}
+            query = query.where(rollup.creator_id.in_(creator_ids))
+
+        return {
+            row.creator_id: {'tasks': row.tasks or 0, 'completed_tasks': row.completed_tasks or 0}
+            for row in db_session.execute(query)
+        }
+
+    @staticmethod
+    def get_average_route_minutes(start_date, end_date, company_id=None, driver_id=None, db_session=None):
+        """
+        Get the average duration of completed routes from the daily rollup
+
+        Args:
+            start_date: Start of the start_time range, counted by whole days
+            end_date: End of the start_time range, counted by whole days
+            company_id: Optional company filter
+            driver_id: Optional driver filter
+            db_session: SQLAlchemy session (defaults to db.session)
+
+        Returns:
+            Average duration in minutes (0 if no completed route has an end time)
+        """
+        db_session = db_session or db.session
+        rollup = RouteDailyRollup
+
+        query = select(
+            func.sum(rollup.duration_seconds), func.sum(rollup.timed_count)
+        ).where(
+            rollup.status == RouteStatus.COMPLETED,
+            rollup.day.between(*StatisticsService._day_range(start_date, end_date))
+        )
+
+        if company_id:
+            query = query.where(rollup.company_id == company_id)
+        if driver_id:
+            query = query.where(rollup.driver_id == driver_id)
+
+        duration_seconds, timed_count = db_session.execute(query).one()
+        return (duration_seconds or 0) / timed_count / 60 if timed_count else 0
+
+    @staticmethod
+    def get_top_drivers_by_routes(start_date, end_date, company_id=None, status=None, limit=5, db_session=None):
+        """
+        Get the drivers with the most routes in a date range from the daily rollup
+
+        Args:
+            start_date: Start of the start_time range, counted by whole days
+            end_date: End of the start_time range, counted by whole days
+            company_id: Optional company filter
+            status: Optional RouteStatus to count
+            limit: Number of drivers to return
+            db_session: SQLAlchemy session (defaults to db.session)
+
+        Returns:
+            List of (driver_id, first_name, last_name, route_count) rows
+        """
+        db_session = db_session or db.session
+        rollup = RouteDailyRollup
+        route_count = func.sum(rollup.route_count)
+
+        query = db_session.query(
+            Driver.id,
+            User.first_name,
+            User.last_name,
+            route_count.label('route_count')
+        ).join(
+            User, Driver.id == User.id
+        ).join(
+            rollup, Driver.id == rollup.driver_id
+        ).filter(
+            rollup.day.between(*StatisticsService._day_range(start_date, end_date))
+        )
+
+        if company_id:
+            query = query.filter(rollup.company_id == company_id)
+        if status is not None:
+            query = query.filter(rollup.status == status)
+
+        return query.group_by(
+            Driver.id, User.first_name, User.last_name
+        ).order_by(
+            route_count.desc()
+        ).limit(limit).all()
+
+    @staticmethod
+    def rebuild_rollups(company_id=None, db_session=None):
+        """
+        Rebuild the daily task and route rollups from the raw tables
+
+        Args:
+            company_id: Optional company to rebuild (all companies if None)
+            db_session: SQLAlchemy session (defaults to db.session)
+
+        Returns:
+            Tuple of (task rollup rows, route rollup rows) written
+        """
+        db_session = db_session or db.session
+
+        try:
+            task_day = func.date(Task.created_at)
+            task_select = select(
+                Task.company_id, Task.creator_id, task_day, Task.status, func.count(Task.id)
+            ).where(
+                Task.created_at.isnot(None)
+            ).group_by(Task.company_id, Task.creator_id, task_day, Task.status)
+
+            route_day = func.date(Route.start_time)
+            timed = Route.end_time.isnot(None)
+            duration = func.extract('epoch', Route.end_time) - func.extract('epoch', Route.start_time)
+            route_select = select(
+                Route.company_id,
+                Route.driver_id,
+                route_day,
+                Route.status,
+                func.count(Route.id),
+                func.coalesce(func.sum(Route.distance), 0),
+                func.count(Route.id).filter(timed),
+                func.coalesce(func.sum(duration).filter(timed), 0)
+            ).where(
+                Route.start_time.isnot(None)
+            ).group_by(Route.company_id, Route.driver_id, route_day, Route.status)
+
+            task_delete = TaskDailyRollup.__table__.delete()
+            route_delete = RouteDailyRollup.__table__.delete()
+
+            if company_id:
+                task_select = task_select.where(Task.company_id == company_id)
+                route_select = route_select.where(Route.company_id == company_id)
+                task_delete = task_delete.where(TaskDailyRollup.company_id == company_id)
+                route_delete = route_delete.where(RouteDailyRollup.company_id == company_id)
+
+            db_session.execute(task_delete)
+            db_session.execute(route_delete)
+
+            task_rows = db_session.execute(TaskDailyRollup.__table__.insert().from_select(
+                ['company_id', 'creator_id', 'day', 'status', 'task_count'], task_select
+            )).rowcount
+            route_rows = db_session.execute(RouteDailyRollup.__table__.insert().from_select(
+                ['company_id', 'driver_id', 'day', 'status', 'route_count', 'distance',
+                 'timed_count', 'duration_seconds'], route_select
+            )).rowcount
+
+            db_session.commit()
+            return task_rows, route_rows
+        except Exception as e:
+            db_session.rollback()
+            current_app.logger.error(f"Error rebuilding statistics rollups: {str(e)}")
+            raise
+
     @staticmethod
     def update_company_statistics(company_id, db_session):
         """
@@ -1108,6 +2760,11 @@ class StatisticsService:
             # Get metrics
             metrics = CompanyService.get_company_metrics(company, db_session)
 
+            # Activity in the period, summed from the daily rollups
+            overview = StatisticsService.get_company_overview(company_id, period_start, period_end, db_session)
+            metrics['period_tasks'] = overview['tasks']
+            metrics['period_routes'] = overview['routes']
+
             # Update statistics
             stats.metrics = metrics
             stats.calculated_at = datetime.utcnow()
@@ -1141,15 +2798,7 @@ class StatisticsService:
                 raise ValueError(f"User with ID {user_id} not found")
 
             # Get company ID based on user role
-            company_id = None
-            if user.role == UserRole.COMPANY_OWNER and user.company_owner:
-                company_id = user.company_owner.company_id
-            elif user.role == UserRole.MANAGER and user.manager:
-                company_id = user.manager.company_id
-            elif user.role == UserRole.OPERATOR and user.operator:
-                company_id = user.operator.company_id
-            elif user.role == UserRole.DRIVER and user.driver:
-                company_id = user.driver.company_id
+            company_id = resolve_company_id(user)
 
             if not company_id:
                 raise ValueError(f"User with ID {user_id} is not associated with a company")
@@ -1193,11 +2842,10 @@ class StatisticsService:
                 metrics['operator_count'] = operator_count
 
                 # Count tasks created by this manager
-                task_count = db_session.query(func.count(Task.id)).filter(
-                    Task.creator_id == user_id,
-                    Task.created_at.between(period_start, period_end)
-                ).scalar()
-                metrics['task_count'] = task_count
+                task_stats = StatisticsService.get_creator_task_stats(
+                    period_start, period_end, creator_ids=[user_id], db_session=db_session
+                ).get(user_id, {})
+                metrics['task_count'] = task_stats.get('tasks', 0)
 
             elif user.role == UserRole.OPERATOR:
                 # Count drivers under this operator
@@ -1207,26 +2855,19 @@ class StatisticsService:
                 metrics['driver_count'] = driver_count
 
                 # Count tasks created by this operator
-                task_count = db_session.query(func.count(Task.id)).filter(
-                    Task.creator_id == user_id,
-                    Task.created_at.between(period_start, period_end)
-                ).scalar()
-                metrics['task_count'] = task_count
+                task_stats = StatisticsService.get_creator_task_stats(
+                    period_start, period_end, creator_ids=[user_id], db_session=db_session
+                ).get(user_id, {})
+                metrics['task_count'] = task_stats.get('tasks', 0)
 
             elif user.role == UserRole.DRIVER:
                 # Count routes assigned to this driver
-                route_count = db_session.query(func.count(Route.id)).filter(
-                    Route.driver_id == user.id,
-                    Route.created_at.between(period_start, period_end)
-                ).scalar()
+                route_stats = StatisticsService.get_driver_route_stats(
+                    period_start, period_end, driver_ids=[user.id], db_session=db_session
+                ).get(user.id, {})
+                route_count = route_stats.get('routes', 0)
+                completed_routes = route_stats.get('completed_routes', 0)
                 metrics['route_count'] = route_count
-
-                # Count completed routes
-                completed_routes = db_session.query(func.count(Route.id)).filter(
-                    Route.driver_id == user.id,
-                    Route.status == RouteStatus.COMPLETED,
-                    Route.created_at.between(period_start, period_end)
-                ).scalar()
                 metrics['completed_routes'] = completed_routes
 
                 # Calculate completion rate
@@ -1241,4 +2882,412 @@ class StatisticsService:
         except Exception as e:
             db_session.rollback()
             current_app.logger.error(f"Error updating user statistics: {str(e)}")
-            raise
\ No newline at end of file
+            raise
+
+
+class ReportService:
+    # Report ID -> file name prefix
+    REPORT_PREFIXES = {
+        'tasks_summary': 'tasks_report',
+        'routes_performance': 'routes_report',
+        'driver_performance': 'driver_performance',
+        'company_overview': 'company_report'
+    }
+
+    # Rows fetched per round trip when streaming large reports
+    STREAM_BATCH_SIZE = 1000
+
+    @staticmethod
+    def stream_report(report_id, company_id, start_date, end_date, format_type='csv'):
+        """
+        Prepare a report as a stream of CSV or XLSX chunks
+
+        Rows are read with a server-side cursor and encoded as they arrive, so
+        memory use does not grow with the size of the report. Excel reports
+        keep numbers and dates as typed cells. PDF is not implemented and
+        falls back to CSV.
+
+        Args:
+            report_id: One of REPORT_PREFIXES
+            company_id: ID of the company (None for all companies)
+            start_date: Start of the reporting period
+            end_date: End of the reporting period
+            format_type: Requested format ('csv', 'excel' or 'pdf')
+
+        Returns:
+            Tuple of (filename, mimetype, iterator of bytes chunks)
+        """
+        row_generators = {
+            'tasks_summary': ReportService.tasks_report_rows,
+            'routes_performance': ReportService.routes_report_rows,
+            'driver_performance': ReportService.drivers_report_rows,
+            'company_overview': ReportService.company_report_rows
+        }
+        if report_id not in row_generators:
+            raise ValueError(f"Unknown report type: {report_id}")
+
+        company = Company.query.get(company_id) if company_id else None
+        if report_id == 'company_overview' and company is None:
+            raise ValueError('Company ID is required for company report.')
+
+        company_name = company.name if company else "All"
+        filename = f"{ReportService.REPORT_PREFIXES[report_id]}_{company_name}_" \
+                   f"{start_date.strftime('%Y%m%d')}_to_{end_date.strftime('%Y%m%d')}"
+
+        rows = row_generators[report_id](company_id, start_date, end_date)
+
+        if format_type == 'excel':
+            return f"{filename}.xlsx", XLSX_MIMETYPE, iter_xlsx(rows, sheet_name=report_id)
+        return f"{filename}.csv", 'text/csv', iter_csv(rows)
+
+    @staticmethod
+    def _stream(query):
+        """
+        Execute a column query with a server-side cursor, fetching rows in batches
+        """
+        return db.session.execute(query.execution_options(yield_per=ReportService.STREAM_BATCH_SIZE))
+
+    @staticmethod
+    def tasks_report_rows(company_id, start_date, end_date):
+        """
+        Generate tasks report rows
+
+        Creator and assignee names come from the same query, so no task
+        triggers a lazy load.
+        """
+        creator = aliased(User)
+        assignee = aliased(User)
+
+        # Get tasks for report
+        query = select(
+            Task.id, Task.title, Task.status, Task.created_at, Task.deadline,
+            creator.first_name, creator.last_name,
+            assignee.first_name, assignee.last_name
+        ).outerjoin(
+            creator, Task.creator_id == creator.id
+        ).outerjoin(
+            assignee, Task.assignee_id == assignee.id
+        ).where(
+            Task.created_at.between(start_date, end_date)
+        ).order_by(Task.id)
+
+        if company_id:
+            query = query.where(Task.company_id == company_id)
+
+        # Write header
+        yield ['Task ID', 'Title', 'Status', 'Created At', 'Deadline', 'Creator', 'Assignee']
+
+        # Write data
+        for (task_id, title, status, created_at, deadline,
+             creator_first, creator_last, assignee_first, assignee_last) in ReportService._stream(query):
+            creator_name = f"{creator_first} {creator_last}" if creator_first is not None else "Unknown"
+            assignee_name = f"{assignee_first} {assignee_last}" if assignee_first is not None else "Unassigned"
+
+            yield [
+                task_id,
+                title,
+                status.value,
+                created_at,
+                deadline if deadline else "None",
+                creator_name,
+                assignee_name
+            ]
+
+    @staticmethod
+    def routes_report_rows(company_id, start_date, end_date):
+        """
+        Generate routes report rows
+
+        The task creation time and driver name are joined into the same query.
+        """
+        # Get routes for report
+        query = select(
+            Route.id, Route.start_point, Route.end_point, Route.distance, Route.status,
+            Task.created_at, Route.start_time, Route.end_time,
+            User.first_name, User.last_name
+        ).outerjoin(
+            Task, Route.task_id == Task.id
+        ).outerjoin(
+            User, Route.driver_id == User.id
+        ).where(
+            Route.start_time.between(start_date, end_date)
+        ).order_by(Route.id)
+
+        if company_id:
+            query = query.where(Route.company_id == company_id)
+
+        # Write header
+        yield ['Route ID', 'Start Point', 'End Point', 'Distance (km)', 'Status',
+               'Created At', 'Start Time', 'End Time', 'Duration (min)', 'Driver']
+
+        # Write data
+        for (route_id, start_point, end_point, distance, status, created_at,
+             start_time, end_time, first_name, last_name) in ReportService._stream(query):
+            # Calculate duration if available
+            duration = None
+            if start_time and end_time:
+                duration = (end_time - start_time).total_seconds() / 60  # in minutes
+
+            driver_name = f"{first_name} {last_name}" if first_name is not None else "Unassigned"
+
+            yield [
+                route_id,
+                start_point,
+                end_point,
+                round(distance, 2) if distance else "N/A",
+                status.value,
+                created_at if created_at else "N/A",
+                start_time if start_time else "Not started",
+                end_time if end_time else "Not completed",
+                round(duration) if duration else "N/A",
+                driver_name
+            ]
+
+    @staticmethod
+    def drivers_report_rows(company_id, start_date, end_date):
+        """
+        Generate drivers performance report rows
+        """
+        # Get drivers for report
+        query = select(
+            Driver.id, User.first_name, User.last_name
+        ).outerjoin(
+            User, Driver.id == User.id
+        ).order_by(Driver.id)
+
+        if company_id:
+            query = query.where(Driver.company_id == company_id)
+
+        # Route totals per driver, summed from the daily rollup
+        driver_stats = StatisticsService.get_driver_route_stats(start_date, end_date, company_id)
+
+        # Write header
+        yield ['Driver ID', 'Name', 'Total Routes', 'Completed Routes', 'Completion Rate',
+               'Total Distance (km)', 'Avg Duration (min)', 'On-time Delivery Rate']
+
+        # Write data
+        for driver_id, first_name, last_name in ReportService._stream(query):
+            # Get route statistics for this driver
+            stats_for_driver = driver_stats.get(driver_id, {})
+            total_routes = stats_for_driver.get('routes', 0)
+            completed_routes = stats_for_driver.get('completed_routes', 0)
+            completion_rate = (completed_routes / total_routes * 100) if total_routes > 0 else 0
+
+            total_distance = stats_for_driver.get('completed_distance', 0)
+            avg_duration = stats_for_driver.get('avg_minutes', 0)
+
+            # Calculate on-time delivery rate
+            # For demo purposes, we'll use a random value
+            on_time_rate = random.randint(75, 100)
+
+            driver_name = f"{first_name} {last_name}" if first_name is not None else f"Driver {driver_id}"
+
+            yield [
+                driver_id,
+                driver_name,
+                total_routes,
+                completed_routes,
+                f"{round(completion_rate, 2)}%",
+                round(total_distance, 2),
+                round(avg_duration),
+                f"{on_time_rate}%"
+            ]
+
+    @staticmethod
+    def company_report_rows(company_id, start_date, end_date):
+        """
+        Generate company overview report rows
+        """
+        company = Company.query.get(company_id) if company_id else None
+        if not company:
+            raise ValueError('Company ID is required for company report.')
+
+        # Write company information
+        yield ['Company Report']
+        yield []
+        yield ['Company Name', company.name]
+        yield ['Legal Name', company.legal_name]
+        yield ['Tax ID', company.tax_id]
+        yield ['Date Range', f"{start_date.strftime('%Y-%m-%d')} to {end_date.strftime('%Y-%m-%d')}"]
+        yield []
+
+        # Write user statistics
+        yield ['User Statistics']
+        yield ['Role', 'Count']
+
+        # Team, task and route counts in one round trip
+        overview = StatisticsService.get_company_overview(company_id, start_date, end_date)
+        task_counts = overview['tasks']
+        route_counts = overview['routes']
+
+        manager_count = overview['team']['managers']
+        operator_count = overview['team']['operators']
+        driver_count = overview['team']['drivers']
+
+        yield ['Managers', manager_count]
+        yield ['Operators', operator_count]
+        yield ['Drivers', driver_count]
+        yield ['Total', manager_count + operator_count + driver_count]
+        yield []
+
+        # Write task statistics
+        total_tasks = task_counts['total']
+        completed_tasks = task_counts['completed']
+        in_progress_tasks = task_counts['in_progress']
+        new_tasks = task_counts['new']
+
+        completion_rate = (completed_tasks / total_tasks * 100) if total_tasks > 0 else 0
+
+        yield ['Task Statistics']
+        yield ['Status', 'Count', 'Percentage']
+        yield ['Completed', completed_tasks,
+                         f"{round(completed_tasks / total_tasks * 100 if total_tasks > 0 else 0, 2)}%"]
+        yield ['In Progress', in_progress_tasks,
+                         f"{round(in_progress_tasks / total_tasks * 100 if total_tasks > 0 else 0, 2)}%"]
+        yield ['New', new_tasks, f"{round(new_tasks / total_tasks * 100 if total_tasks > 0 else 0, 2)}%"]
+        yield ['Total', total_tasks, '100%']
+        yield ['Completion Rate', '', f"{round(completion_rate, 2)}%"]
+        yield []
+
+        # Write route statistics
+        total_routes = route_counts['total']
+        completed_routes = route_counts['completed']
+        in_progress_routes = route_counts['in_progress']
+        planned_routes = route_counts['planned']
+
+        route_completion_rate = (completed_routes / total_routes * 100) if total_routes > 0 else 0
+
+        total_distance = route_counts['completed_distance']
+
+        yield ['Route Statistics']
+        yield ['Status', 'Count', 'Percentage']
+        yield ['Completed', completed_routes,
+                         f"{round(completed_routes / total_routes * 100 if total_routes > 0 else 0, 2)}%"]
+        yield ['In Progress', in_progress_routes,
+                         f"{round(in_progress_routes / total_routes * 100 if total_routes > 0 else 0, 2)}%"]
+        yield ['Planned', planned_routes, f"{round(planned_routes / total_routes * 100 if total_routes > 0 else 0, 2)}%"]
+        yield ['Total', total_routes, '100%']
+        yield ['Completion Rate', '', f"{round(route_completion_rate, 2)}%"]
+        yield ['Total Distance (km)', round(total_distance, 2), '']
+        yield []
+
+        # Write top drivers
+        yield ['Top Drivers by Completed Routes']
+        yield ['Driver Name', 'Completed Routes', 'Total Distance (km)', 'Avg Duration (min)']
+
+        top_drivers = StatisticsService.get_top_drivers_by_routes(
+            start_date, end_date, company_id, status=RouteStatus.COMPLETED
+        )
+        driver_stats = StatisticsService.get_driver_route_stats(
+            start_date, end_date, company_id, driver_ids=[row[0] for row in top_drivers]
+        )
+
+        for driver_id, first_name, last_name, route_count in top_drivers:
+            stats_for_driver = driver_stats.get(driver_id, {})
+            driver_distance = stats_for_driver.get('completed_distance', 0)
+            avg_duration = stats_for_driver.get('avg_minutes', 0)
+
+            yield [
+                f"{first_name} {last_name}",
+                route_count,
+                round(driver_distance, 2),
+                round(avg_duration)
+            ]
+
+
+# Background job handlers, run by `flask run-worker`
+def _report_job_roles(job):
+    # Same roles that may request the report; the company overview is owner-only
+    if job.payload.get('report_id') == 'company_overview':
+        return (UserRole.COMPANY_OWNER,)
+    return (UserRole.COMPANY_OWNER, UserRole.MANAGER)
+
+
+@job_queue.handler('reports.generate', shared_with=_report_job_roles)
+def generate_report_job(job):
+    payload = job.payload
+    filename, mimetype, chunks = ReportService.stream_report(
+        payload['report_id'],
+        payload.get('company_id'),
+        datetime.fromisoformat(payload['start_date']),
+        datetime.fromisoformat(payload['end_date']),
+        payload.get('format', 'csv')
+    )
+    size = job_queue.save_artifact(job, filename, mimetype, chunks)
+    return {'filename': filename, 'size': size}
+
+
+@job_queue.handler('statistics.update_company')
+def update_company_statistics_job(job):
+    stats = StatisticsService.update_company_statistics(job.payload['company_id'], db.session)
+    return {'statistics_id': stats.id}
+
+
+@job_queue.handler('statistics.update_user')
+def update_user_statistics_job(job):
+    stats = StatisticsService.update_user_statistics(job.payload['user_id'], db.session)
+    return {'statistics_id': stats.id}
+
+
+@job_queue.handler('routes.simplify_track')
+def simplify_route_track_job(job):
+    pings = RouteService.build_track(job.payload['route_id'], db.session)
+    return {'pings': pings}
+
+
+@job_queue.handler('routes.update_metrics')
+def update_route_metrics_job(job):
+    route = Route.query.get(job.payload['route_id'])
+    if route is None:
+        return {'updated': False}
+    points = [route.start_point, route.end_point]
+
+    # The geocoder writes its cache on its own connection; don't hold a transaction meanwhile
+    db.session.rollback()
+    geocoder.resolve_many(points)
+
+    route = Route.query.get(job.payload['route_id'])
+    updated = RouteService.update_metrics(route)
+    db.session.commit()
+    return {'updated': updated}
+
+
+@job_queue.handler('routes.fit_speed_model')
+def fit_speed_model_job(job):
+    model = RouteService.fit_speed_model(job.payload['company_id'], db.session)
+    return {'sample_count': model.sample_count}
+
+
+@job_queue.handler('analytics.export')
+def export_analytics_job(job):
+    payload = job.payload
+    company_id = payload['company_id']
+    since = datetime.fromisoformat(payload['since']) if payload.get('since') else None
+    output_dir = current_app.config['ANALYTICS_EXPORT_FOLDER']
+
+    summary = export_company_analytics(
+        company_id,
+        output_dir,
+        since=since,
+        batch_size=current_app.config.get('ANALYTICS_EXPORT_BATCH_SIZE', 10000)
+    )
+
+    # Offer the partitions written by this export as one download
+    with tempfile.TemporaryFile() as archive_file:
+        with zipfile.ZipFile(archive_file, 'w', compression=zipfile.ZIP_STORED) as archive:
+            for table in EXPORT_TABLES:
+                table_dir = os.path.join(output_dir, table, f'company_id={company_id}')
+                for month in summary[table]['partitions']:
+                    path = os.path.join(table_dir, f'month={month}', 'part-0.parquet')
+                    archive.write(path, os.path.relpath(path, output_dir))
+
+        archive_file.seek(0)
+        since_label = since.strftime('%Y%m') if since else 'all'
+        job_queue.save_artifact(
+            job,
+            f"analytics_company_{company_id}_{since_label}.zip",
+            'application/zip',
+            iter(lambda: archive_file.read(64 * 1024), b'')
+        )
+
+    return {table: table_summary['rows'] for table, table_summary in summary.items()}
@@ -361,6 +361,150 @@ function geocodeWithNominatim(address) {
     });
 }
 
+/**
+ * Geocode many addresses and Google Maps URLs in one request
+ * Items the server could not get to within its time budget come back pending and are sent again.
+ * @param {Array} items - Addresses or Google Maps URLs
+ * @returns {Promise} Promise that resolves to an array, in input order, of {lat, lng, display_name} or null
+ */
+function geocodeBatch(items) {
+    return requestGeocodeBatch(items).then(results => results.map((result, index) => {
+        if (!result.success) {
+            console.log('Could not geocode', items[index], '-', result.error);
+            return null;
+        }
+        return { lat: result.lat, lng: result.lng, display_name: result.display_name };
+    }));
+}
+
+function requestGeocodeBatch(items) {
+    return fetch('/routes/geocode-batch', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+            'X-Requested-With': 'XMLHttpRequest'
+        },
+        body: JSON.stringify({ items: items })
+    })
+        .then(response => response.json())
+        .then(data => {
+            if (!data.success) {
+                throw new Error(data.error || 'Batch geocoding failed');
+            }
+            const results = data.results;
+            const pending = results.map((result, index) => result.pending ? index : -1).filter(index => index >= 0);
+            // Stop when a request made no progress at all
+            if (pending.length === 0 || pending.length === items.length) {
+                return results;
+            }
+            return requestGeocodeBatch(pending.map(index => items[index])).then(retried => {
+                pending.forEach((index, position) => {
+                    results[index] = retried[position];
+                });
+                return results;
+            });
+        });
+}
+
+/**
+ * Reorder waypoints into a shorter route on the server
+ * @param {Object} request - start_point, end_point, waypoints and optionally start_time and company_id
+ * @returns {Promise} Promise that resolves to {waypoints, distance, original_distance, distance_saved, late_stops}
+ */
+function optimizeRoute(request) {
+    return fetch('/routes/optimize', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+            'X-Requested-With': 'XMLHttpRequest'
+        },
+        body: JSON.stringify(request)
+    })
+        .then(response => response.json())
+        .then(data => {
+            if (!data.success) {
+                throw new Error(data.error || 'Route optimization failed');
+            }
+            return data;
+        });
+}
+
+/**
+ * Decode a Google encoded polyline
+ * @param {string} encoded - Encoded polyline
+ * @param {number} precision - Decimal digits the polyline was encoded with
+ * @returns {Array} Array of [lat, lng] points
+ */
+function decodePolyline(encoded, precision = 5) {
+    const factor = Math.pow(10, precision);
+    const points = [];
+    let index = 0, lat = 0, lng = 0;
+
+    while (index < encoded.length) {
+        const deltas = [];
+        for (let i = 0; i < 2; i++) {
+            let result = 0, shift = 0, byte;
+            do {
+                byte = encoded.charCodeAt(index++) - 63;
+                result |= (byte & 0x1f) << shift;
+                shift += 5;
+            } while (byte >= 0x20);
+            deltas.push(result & 1 ? ~(result >> 1) : result >> 1);
+        }
+        lat += deltas[0];
+        lng += deltas[1];
+        points.push([lat / factor, lng / factor]);
+    }
+
+    return points;
+}
+
+/**
+ * Show the recorded GPS track of a route, reloading simplified geometry when the zoom changes
+ * @param {object} map - Leaflet map instance
+ * @param {string} trackUrl - URL of the route's track endpoint
+ * @param {object} options - Polyline options
+ * @returns {Promise} Promise that resolves to true if the route has a track
+ */
+function showRouteTrack(map, trackUrl, options = {}) {
+    const lineOptions = { color: '#6f42c1', weight: 4, opacity: 0.8, ...options };
+    let trackLine = null;
+    let shownLevel = null;
+
+    function load() {
+        return fetch(`${trackUrl}?zoom=${map.getZoom()}`, {
+            headers: { 'X-Requested-With': 'XMLHttpRequest' }
+        })
+            .then(response => response.json())
+            .then(data => {
+                if (!data.success) {
+                    return false;
+                }
+                if (data.level !== shownLevel) {
+                    const points = decodePolyline(data.polyline);
+                    if (trackLine) {
+                        trackLine.setLatLngs(points);
+                    } else {
+                        trackLine = L.polyline(points, lineOptions).addTo(map);
+                    }
+                    shownLevel = data.level;
+                }
+                return true;
+            })
+            .catch(error => {
+                console.error('Error loading route track:', error);
+                return false;
+            });
+    }
+
+    return load().then(found => {
+        if (found) {
+            map.on('zoomend', load);
+        }
+        return found;
+    });
+}
+
 /**
  * Initialize a route creation map with start and end markers that can be dragged
  * @param {string} containerId - Map container element ID
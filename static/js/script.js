@@ -68,4 +68,96 @@ document.addEventListener('DOMContentLoaded', function() {
             console.log("Search submitted:", this.querySelector('input').value);
         });
     }
-});
\ No newline at end of file
+});
+
+// Live message notifications over Server-Sent Events.
+// Other scripts can listen for the 'crm:message' and 'crm:unread' DOM events.
+// base.html only sets CRM_EVENT_STREAM_URL on messaging pages.
+document.addEventListener('DOMContentLoaded', function() {
+    if (!window.CRM_EVENT_STREAM_URL || !window.EventSource) {
+        return;
+    }
+
+    const source = new EventSource(window.CRM_EVENT_STREAM_URL);
+    window.CRM_EVENT_SOURCE = source;
+
+    source.addEventListener('unread', function(e) {
+        const data = JSON.parse(e.data);
+        document.querySelectorAll('[data-unread-badge]').forEach(function(badge) {
+            badge.textContent = data.count;
+            badge.classList.toggle('d-none', data.count === 0);
+        });
+        document.dispatchEvent(new CustomEvent('crm:unread', { detail: data }));
+    });
+
+    source.addEventListener('message', function(e) {
+        document.dispatchEvent(new CustomEvent('crm:message', { detail: JSON.parse(e.data) }));
+    });
+});
+
+// Autocomplete for search inputs with data-autocomplete-url.
+// The endpoint returns {results: [{label, url, ...}]}; picking one opens its url.
+document.addEventListener('DOMContentLoaded', function() {
+    document.querySelectorAll('input[data-autocomplete-url]').forEach(function(input) {
+        const menu = document.createElement('div');
+        menu.className = 'dropdown-menu';
+        input.parentNode.style.position = 'relative';
+        input.setAttribute('autocomplete', 'off');
+        input.insertAdjacentElement('afterend', menu);
+
+        let timer = null;
+        let controller = null;
+
+        function hide() {
+            menu.classList.remove('show');
+        }
+
+        function render(results) {
+            menu.innerHTML = '';
+            results.forEach(function(result) {
+                const item = document.createElement('a');
+                item.className = 'dropdown-item';
+                item.href = result.url;
+                item.textContent = result.label;
+                if (result.username || result.tax_id) {
+                    const detail = document.createElement('small');
+                    detail.className = 'text-muted ms-2';
+                    detail.textContent = result.username || result.tax_id;
+                    item.appendChild(detail);
+                }
+                menu.appendChild(item);
+            });
+            menu.style.top = input.offsetTop + input.offsetHeight + 'px';
+            menu.style.left = input.offsetLeft + 'px';
+            menu.classList.toggle('show', results.length > 0);
+        }
+
+        input.addEventListener('input', function() {
+            clearTimeout(timer);
+            const query = input.value.trim();
+            if (query.length < 2) {
+                hide();
+                return;
+            }
+
+            timer = setTimeout(function() {
+                if (controller) {
+                    controller.abort();
+                }
+                controller = new AbortController();
+
+                const url = new URL(input.dataset.autocompleteUrl, window.location.origin);
+                url.searchParams.set('q', query);
+                fetch(url, { signal: controller.signal, headers: { 'Accept': 'application/json' } })
+                    .then(response => response.json())
+                    .then(data => render(data.results || []))
+                    .catch(() => {});
+            }, 150);
+        });
+
+        input.addEventListener('blur', function() {
+            // Let clicks on a suggestion land first
+            setTimeout(hide, 200);
+        });
+    });
+});
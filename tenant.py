@@ -0,0 +1,169 @@
+from flask import g, has_request_context, request
+from flask_login import current_user
+from sqlalchemy import inspect
+from sqlalchemy.orm import joinedload
+
+from models import User, UserRole
+
+
+# Role -> name of the User relationship that holds the role row
+ROLE_ATTRIBUTES = {
+    UserRole.ADMIN: 'admin',
+    UserRole.COMPANY_OWNER: 'company_owner',
+    UserRole.MANAGER: 'manager',
+    UserRole.OPERATOR: 'operator',
+    UserRole.DRIVER: 'driver'
+}
+
+
+class TenantContext:
+    """
+    Role and company of the current user, resolved once per request
+
+    Views, services and permission helpers read the company from here instead
+    of walking company_owner/manager/operator/driver themselves.
+    """
+
+    def __init__(self, user_id=None, role=None, role_record=None, company_id=None):
+        self.user_id = user_id
+        self.role = role
+        self.role_record = role_record
+        self.company_id = company_id
+
+    @property
+    def is_authenticated(self):
+        return self.user_id is not None
+
+    @property
+    def is_admin(self):
+        return self.role == UserRole.ADMIN
+
+    @property
+    def is_company_owner(self):
+        return self.role == UserRole.COMPANY_OWNER
+
+    @property
+    def is_manager(self):
+        return self.role == UserRole.MANAGER
+
+    @property
+    def is_operator(self):
+        return self.role == UserRole.OPERATOR
+
+    @property
+    def is_driver(self):
+        return self.role == UserRole.DRIVER
+
+    def owns(self, obj):
+        """
+        Check if an object with a company_id belongs to the current company
+
+        Args:
+            obj: Model instance with a company_id attribute
+
+        Returns:
+            True if the object is in the current user's company
+        """
+        return self.company_id is not None and getattr(obj, 'company_id', None) == self.company_id
+
+    def __repr__(self):
+        role = self.role.value if self.role else None
+        return f'<TenantContext user={self.user_id} role={role} company={self.company_id}>'
+
+
+def resolve_company_id(user):
+    """
+    Get the company ID of any user from their role row
+
+    Args:
+        user: User instance
+
+    Returns:
+        Company ID or None for admins and users without a role row
+    """
+    if user is None or user.role == UserRole.ADMIN:
+        return None
+
+    attribute = ROLE_ATTRIBUTES.get(user.role)
+    role_record = getattr(user, attribute, None) if attribute else None
+    return role_record.company_id if role_record else None
+
+
+def build_tenant_context(user):
+    """
+    Build the tenant context for a user
+
+    The user's role row is loaded together with the user in one joined
+    query, so later access to current_user.driver, .operator and so on
+    does not trigger another lazy load.
+
+    Args:
+        user: User instance (usually current_user)
+
+    Returns:
+        TenantContext instance
+    """
+    if user is None or not getattr(user, 'is_authenticated', False):
+        return TenantContext()
+
+    attribute = ROLE_ATTRIBUTES.get(user.role)
+    if attribute is None:
+        return TenantContext(user_id=user.id, role=user.role)
+
+    # The cached user loader already has the role row; otherwise refresh the
+    # loaded user with its role relationship populated in one joined query
+    if attribute in inspect(user).unloaded:
+        User.query.options(joinedload(getattr(User, attribute))) \
+            .populate_existing() \
+            .filter(User.id == user.id) \
+            .one_or_none()
+
+    role_record = getattr(user, attribute, None)
+    company_id = getattr(role_record, 'company_id', None) if role_record else None
+
+    return TenantContext(
+        user_id=user.id,
+        role=user.role,
+        role_record=role_record,
+        company_id=company_id
+    )
+
+
+def get_tenant():
+    """
+    Get the tenant context for the current request
+
+    Builds and caches it on g on first use, so it also works outside the
+    before_request hook (e.g. in error handlers).
+
+    Returns:
+        TenantContext instance
+    """
+    if not has_request_context():
+        return TenantContext()
+
+    tenant = g.get('tenant')
+    if tenant is None:
+        tenant = build_tenant_context(current_user._get_current_object())
+        g.tenant = tenant
+    return tenant
+
+
+def init_tenant_context(app):
+    """
+    Register the per-request tenant hooks
+
+    Args:
+        app: Flask application instance
+    """
+
+    @app.before_request
+    def load_tenant_context():
+        # Static files never need the role row
+        if request.endpoint == 'static':
+            return
+        get_tenant()
+
+    @app.context_processor
+    def inject_tenant():
+        return {'tenant': get_tenant()}
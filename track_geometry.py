@@ -0,0 +1,193 @@
+import math
+
+import numpy as np
+
+EARTH_RADIUS_M = 6371008.8
+
+# Simplification levels as (highest map zoom served, tolerance in metres), coarsest first;
+# the last level serves every zoom above the previous one
+TRACK_LEVELS = (
+    (10, 250.0),
+    (13, 40.0),
+    (15, 10.0),
+    (None, 3.0),
+)
+
+# Digits kept by the encoded polyline format, ~1 m at precision 5
+POLYLINE_PRECISION = 5
+
+
+def level_for_zoom(zoom):
+    """
+    Index into TRACK_LEVELS of the geometry to serve at a map zoom level
+    """
+    for level, (max_zoom, _) in enumerate(TRACK_LEVELS):
+        if max_zoom is None or zoom <= max_zoom:
+            return level
+    return len(TRACK_LEVELS) - 1
+
+
+def to_seconds(times):
+    """
+    Datetimes as float seconds since the epoch
+    """
+    return np.asarray(times, dtype='datetime64[ms]').astype(np.int64) / 1000.0
+
+
+def project(lat, lng):
+    """
+    Equirectangular projection to metres around the track's first point
+
+    Accurate to well under a percent over the extent of a single route,
+    which is all a simplification tolerance needs.
+    """
+    lat = np.asarray(lat, dtype=np.float64)
+    lng = np.asarray(lng, dtype=np.float64)
+    scale = EARTH_RADIUS_M * math.pi / 180
+    x = (lng - lng[0]) * scale * math.cos(math.radians(lat[0]))
+    y = (lat - lat[0]) * scale
+    return x, y
+
+
+def time_buckets(seconds, bucket_seconds):
+    """
+    Indices of the first ping of each time bucket, plus the last ping
+
+    Args:
+        seconds: Sorted ping times in seconds
+        bucket_seconds: Bucket width
+
+    Returns:
+        Sorted array of indices
+    """
+    seconds = np.asarray(seconds, dtype=np.float64)
+    if len(seconds) == 0:
+        return np.zeros(0, dtype=np.int64)
+    if bucket_seconds <= 0:
+        return np.arange(len(seconds))
+
+    buckets = np.floor((seconds - seconds[0]) / bucket_seconds).astype(np.int64)
+    first = np.flatnonzero(np.diff(buckets, prepend=buckets[0] - 1))
+    if first[-1] != len(seconds) - 1:
+        first = np.append(first, len(seconds) - 1)
+    return first
+
+
+def douglas_peucker(x, y, tolerance):
+    """
+    Douglas-Peucker simplification
+
+    Each segment's interior points are measured in one vectorized pass;
+    distances are to the segment rather than the infinite line, so tracks
+    that double back keep their turning point.
+
+    Args:
+        x: Projected x coordinates in metres
+        y: Projected y coordinates in metres
+        tolerance: Largest deviation allowed, in metres
+
+    Returns:
+        Boolean mask of the points to keep
+    """
+    count = len(x)
+    keep = np.zeros(count, dtype=bool)
+    if count <= 2:
+        keep[:] = True
+        return keep
+
+    keep[0] = keep[-1] = True
+    stack = [(0, count - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+
+        dx = x[end] - x[start]
+        dy = y[end] - y[start]
+        px = x[start + 1:end] - x[start]
+        py = y[start + 1:end] - y[start]
+        length_sq = dx * dx + dy * dy
+        if length_sq > 0:
+            t = np.clip((px * dx + py * dy) / length_sq, 0.0, 1.0)
+            distances = np.hypot(px - t * dx, py - t * dy)
+        else:
+            distances = np.hypot(px, py)
+
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            index = start + 1 + farthest
+            keep[index] = True
+            stack.append((start, index))
+            stack.append((index, end))
+    return keep
+
+
+def encode_polyline(lat, lng, precision=POLYLINE_PRECISION):
+    """
+    Encode coordinates in the Google encoded polyline format
+
+    Args:
+        lat: Latitudes
+        lng: Longitudes
+        precision: Decimal digits kept
+
+    Returns:
+        Encoded string
+    """
+    factor = 10 ** precision
+    points = np.column_stack((
+        np.round(np.asarray(lat, dtype=np.float64) * factor),
+        np.round(np.asarray(lng, dtype=np.float64) * factor)
+    )).astype(np.int64)
+    if len(points) == 0:
+        return ''
+
+    deltas = np.diff(points, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).ravel()
+    values = np.where(deltas < 0, ~(deltas << 1), deltas << 1)
+
+    chars = []
+    for value in values.tolist():
+        while value >= 0x20:
+            chars.append(chr((0x20 | (value & 0x1f)) + 63))
+            value >>= 5
+        chars.append(chr(value + 63))
+    return ''.join(chars)
+
+
+def simplify_track(times, lat, lng, bucket_seconds=5.0, levels=TRACK_LEVELS):
+    """
+    Build the pre-simplified geometries of a GPS track
+
+    Pings are first reduced to one per time bucket, then each level is
+    simplified with Douglas-Peucker from the next finer one, finest first.
+
+    Args:
+        times: Ping times (datetimes), sorted
+        lat: Latitudes
+        lng: Longitudes
+        bucket_seconds: Time bucket width for the initial downsampling
+        levels: (max zoom, tolerance) pairs, coarsest first
+
+    Returns:
+        List with one dictionary per level, in the order of levels, with
+        level, tolerance, point_count and polyline
+    """
+    if len(times) == 0:
+        return []
+
+    selected = time_buckets(to_seconds(times), bucket_seconds)
+    lat = np.asarray(lat, dtype=np.float64)[selected]
+    lng = np.asarray(lng, dtype=np.float64)[selected]
+    x, y = project(lat, lng)
+
+    results = [None] * len(levels)
+    for level in range(len(levels) - 1, -1, -1):
+        keep = douglas_peucker(x, y, levels[level][1])
+        lat, lng, x, y = lat[keep], lng[keep], x[keep], y[keep]
+        results[level] = {
+            'level': level,
+            'tolerance': levels[level][1],
+            'point_count': int(len(lat)),
+            'polyline': encode_polyline(lat, lng)
+        }
+    return results
@@ -0,0 +1,539 @@
+import atexit
+import math
+import queue
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from flask import current_app
+from sqlalchemy import select, text
+
+from pubsub import MemoryBroker
+
+# PostgreSQL: daily partitions of driver_positions are named driver_positions_YYYYMMDD
+PARTITION_PREFIX = 'driver_positions_'
+
+# Broker channel carrying the newest position of each ingest batch to every worker
+POSITION_CHANNEL = 'crm:driver-positions'
+
+
+def day_start(value):
+    return datetime(value.year, value.month, value.day)
+
+
+def partition_name(day):
+    return f'{PARTITION_PREFIX}{day:%Y%m%d}'
+
+
+def partition_day(name):
+    """
+    Day stored in a partition table, or None if name is not a partition
+    """
+    try:
+        return datetime.strptime(name[len(PARTITION_PREFIX):], '%Y%m%d') if name.startswith(PARTITION_PREFIX) else None
+    except ValueError:
+        return None
+
+
+def ensure_partition(connection, day):
+    """
+    Create the partition holding day's pings if it doesn't exist (PostgreSQL only)
+    """
+    if connection.dialect.name != 'postgresql':
+        return
+    start = day_start(day)
+    end = start + timedelta(days=1)
+    connection.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {partition_name(start)} PARTITION OF driver_positions "
+        f"FOR VALUES FROM ('{start:%Y-%m-%d}') TO ('{end:%Y-%m-%d}')"
+    ))
+
+
+def ensure_partitions(connection, days_ahead=None, now=None):
+    """
+    Create partitions from the oldest accepted ping age up to days_ahead days from now
+
+    Args:
+        connection: SQLAlchemy connection
+        days_ahead: Days to create in advance (defaults to GPS_PARTITIONS_AHEAD)
+        now: Current time, for tests
+    """
+    if connection.dialect.name != 'postgresql':
+        return
+    if days_ahead is None:
+        days_ahead = int(current_app.config.get('GPS_PARTITIONS_AHEAD', 3))
+    now = now or datetime.utcnow()
+    max_age = int(current_app.config.get('GPS_MAX_PING_AGE', 86400))
+
+    day = day_start(now - timedelta(seconds=max_age))
+    last = day_start(now) + timedelta(days=days_ahead)
+    while day <= last:
+        ensure_partition(connection, day)
+        day += timedelta(days=1)
+
+
+def list_partitions(connection):
+    """
+    Daily partitions of driver_positions
+
+    Returns:
+        List of (day, table name) tuples, oldest first; empty if not partitioned
+    """
+    if connection.dialect.name != 'postgresql':
+        return []
+    names = connection.execute(text(
+        "SELECT child.relname FROM pg_inherits "
+        "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+        "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+        "WHERE parent.relname = 'driver_positions'"
+    )).scalars()
+    return sorted((partition_day(name), name) for name in names if partition_day(name))
+
+
+def drop_expired(connection, retention_days=None, now=None):
+    """
+    Remove pings older than the retention window
+
+    PostgreSQL drops whole daily partitions; other databases delete rows.
+
+    Args:
+        connection: SQLAlchemy connection inside a transaction
+        retention_days: Days kept, including today (defaults to GPS_TRACK_RETENTION_DAYS)
+        now: Current time, for tests
+
+    Returns:
+        Dictionary with the number of partitions dropped and rows deleted
+    """
+    from models import DriverPosition
+
+    if retention_days is None:
+        retention_days = int(current_app.config.get('GPS_TRACK_RETENTION_DAYS', 90))
+    cutoff = day_start(now or datetime.utcnow()) - timedelta(days=max(retention_days, 1) - 1)
+
+    if connection.dialect.name != 'postgresql':
+        table = DriverPosition.__table__
+        deleted = connection.execute(table.delete().where(table.c.recorded_at < cutoff)).rowcount
+        return {'partitions': 0, 'rows': deleted}
+
+    dropped = 0
+    for day, name in list_partitions(connection):
+        if day < cutoff:
+            connection.execute(text(f'DROP TABLE {name}'))
+            dropped += 1
+    return {'partitions': dropped, 'rows': 0}
+
+
+def _parse_timestamp(value):
+    # Epoch seconds or milliseconds, or ISO 8601; stored as naive UTC like every other timestamp
+    if isinstance(value, bool):
+        raise ValueError('Invalid timestamp')
+    if isinstance(value, (int, float)):
+        if not math.isfinite(value):
+            raise ValueError('Invalid timestamp')
+        seconds = value / 1000 if value > 1e11 else value
+        return datetime.fromtimestamp(seconds, timezone.utc).replace(tzinfo=None)
+    if isinstance(value, str):
+        try:
+            parsed = datetime.fromisoformat(value.strip().replace('Z', '+00:00'))
+        except ValueError:
+            raise ValueError('Invalid timestamp')
+        if parsed.tzinfo is not None:
+            parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+        return parsed
+    raise ValueError('Missing timestamp')
+
+
+def _parse_number(value, name, low, high, required=True):
+    if value is None and not required:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise ValueError(f'Invalid {name}')
+    number = float(value)
+    if not math.isfinite(number) or not low <= number <= high:
+        raise ValueError(f'{name} out of range')
+    return number
+
+
+def parse_ping(ping, now, max_age, max_future, max_speed):
+    """
+    Validate one ping from the driver app
+
+    Args:
+        ping: Dictionary with timestamp, lat, lng and optional speed (km/h)
+        now: Current UTC time
+        max_age: Oldest accepted ping, in seconds
+        max_future: Tolerated clock skew of the device, in seconds
+        max_speed: Highest plausible speed in km/h
+
+    Returns:
+        Dictionary with recorded_at, lat, lng and speed
+
+    Raises:
+        ValueError: The ping is malformed or implausible
+    """
+    if not isinstance(ping, dict):
+        raise ValueError('Ping must be an object')
+
+    try:
+        recorded_at = _parse_timestamp(ping.get('timestamp'))
+    except (OverflowError, OSError):
+        raise ValueError('Invalid timestamp')
+    if recorded_at < now - timedelta(seconds=max_age):
+        raise ValueError('Timestamp is too old')
+    if recorded_at > now + timedelta(seconds=max_future):
+        raise ValueError('Timestamp is in the future')
+
+    return {
+        'recorded_at': recorded_at,
+        'lat': _parse_number(ping.get('lat'), 'lat', -90, 90),
+        'lng': _parse_number(ping.get('lng'), 'lng', -180, 180),
+        'speed': _parse_number(ping.get('speed'), 'speed', 0, max_speed, required=False)
+    }
+
+
+class LastPositionCache:
+    """
+    Newest known position of each driver, kept in memory for the operator map
+    """
+
+    def __init__(self):
+        self._positions = {}
+        self._lock = threading.Lock()
+
+    def update(self, positions):
+        """
+        Store positions that are newer than the ones already known
+
+        Args:
+            positions: Iterable of dictionaries with driver_id, recorded_at, lat, lng, speed and route_id
+        """
+        with self._lock:
+            for position in positions:
+                known = self._positions.get(position['driver_id'])
+                if known is None or known['recorded_at'] < position['recorded_at']:
+                    self._positions[position['driver_id']] = position
+
+    def get_many(self, driver_ids):
+        """
+        Positions of the given drivers
+
+        Returns:
+            Dictionary of driver_id -> position, drivers without a position are left out
+        """
+        with self._lock:
+            return {driver_id: self._positions[driver_id] for driver_id in driver_ids if driver_id in self._positions}
+
+
+class TrackWriter:
+    """
+    Buffered ingestion of driver GPS pings
+
+    ingest() validates a batch from the driver app, updates the last known
+    positions and queues the rows; a background thread writes them to
+    driver_positions in bulk when GPS_BATCH_SIZE rows are waiting or every
+    GPS_FLUSH_INTERVAL seconds. When the queue is full the remaining pings
+    are rejected so the app resends them later. Last known positions are
+    shared with the other workers through the event broker; with the
+    in-process broker they are also read back from driver_positions.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.enabled = False
+        self.batch_size = 1000
+        self.flush_interval = 1.0
+        self.max_pings = 500
+        self.max_age = 86400
+        self.max_future = 300
+        self.max_speed = 250.0
+        self.positions = LastPositionCache()
+        self.broker = None
+
+        self._queue = None
+        self._known_days = set()
+        self._thread = None
+        self._listener = None
+        self._thread_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'accepted': 0,
+            'rejected': 0,
+            'flushed': 0,
+            'failed': 0,
+            'batches': 0
+        }
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Configure the writer from application settings
+
+        Args:
+            app: Flask application instance
+        """
+        self.app = app
+        self.enabled = app.config.get('GPS_INGEST_ASYNC', True)
+        self.batch_size = max(1, int(app.config.get('GPS_BATCH_SIZE', 1000)))
+        self.flush_interval = float(app.config.get('GPS_FLUSH_INTERVAL', 1.0))
+        self.max_pings = int(app.config.get('GPS_MAX_PINGS_PER_REQUEST', 500))
+        self.max_age = int(app.config.get('GPS_MAX_PING_AGE', 86400))
+        self.max_future = int(app.config.get('GPS_MAX_CLOCK_SKEW', 300))
+        self.max_speed = float(app.config.get('GPS_MAX_SPEED', 250.0))
+        self._queue = queue.Queue(maxsize=int(app.config.get('GPS_QUEUE_SIZE', 100000)))
+
+        event_bus = app.extensions.get('event_bus')
+        self.broker = event_bus.broker if event_bus is not None else None
+
+        app.extensions['track_writer'] = self
+        atexit.register(self.shutdown)
+
+    def ingest(self, driver_id, route_id, pings, now=None):
+        """
+        Validate and buffer a batch of pings from one driver
+
+        Args:
+            driver_id: ID of the driver sending the pings
+            route_id: ID of the route being driven, or None
+            pings: List of dictionaries with timestamp, lat, lng and optional speed
+            now: Current time, for tests and benchmarks
+
+        Returns:
+            Tuple (accepted count, list of {'index', 'error'} for rejected pings)
+        """
+        now = now or datetime.utcnow()
+        rows = []
+        rejected = []
+        for index, ping in enumerate(pings):
+            try:
+                row = parse_ping(ping, now, self.max_age, self.max_future, self.max_speed)
+            except ValueError as e:
+                rejected.append({'index': index, 'error': str(e)})
+                continue
+            row['driver_id'] = driver_id
+            row['route_id'] = route_id
+            rows.append((index, row))
+
+        accepted = [row for _, row in rows]
+        if self.enabled:
+            self._ensure_thread()
+            for position, (index, row) in enumerate(rows):
+                try:
+                    self._queue.put_nowait(row)
+                except queue.Full:
+                    accepted = accepted[:position]
+                    rejected.extend({'index': i, 'error': 'Ingest buffer is full, retry later'}
+                                    for i, _ in rows[position:])
+                    break
+        elif accepted and not self._write_batch(accepted):
+            # Synchronous mode (testing, CLI): the caller learns about a failed write
+            rejected.extend({'index': i, 'error': 'Could not store ping'} for i, _ in rows)
+            accepted = []
+
+        self._bump('accepted', len(accepted))
+        self._bump('rejected', len(rejected))
+
+        if accepted:
+            latest = max(accepted, key=lambda row: row['recorded_at'])
+            self.positions.update([latest])
+            self._publish(latest)
+
+        rejected.sort(key=lambda item: item['index'])
+        return len(accepted), rejected
+
+    def last_positions(self, driver_ids):
+        """
+        Last known positions of drivers
+
+        Served from memory when the broker shares positions between
+        processes (Redis). Otherwise, and for drivers this process has no
+        position of (e.g. after a restart), the newest ping of the last
+        GPS_MAX_PING_AGE seconds is read from driver_positions and the newer
+        of the two is used.
+
+        Args:
+            driver_ids: Iterable of driver IDs
+
+        Returns:
+            Dictionary of driver_id -> dictionary with recorded_at, lat, lng, speed and route_id
+        """
+        driver_ids = list(driver_ids)
+        self._ensure_listener()
+        positions = self.positions.get_many(driver_ids)
+
+        shared = self.broker is not None and not isinstance(self.broker, MemoryBroker)
+        missing = [driver_id for driver_id in driver_ids if not shared or driver_id not in positions]
+        if missing:
+            self.positions.update(self._stored_positions(missing).values())
+            positions = self.positions.get_many(driver_ids)
+        return positions
+
+    def flush(self):
+        """
+        Write everything currently in the buffer
+
+        Returns:
+            Number of rows written
+        """
+        written = 0
+        with self._flush_lock:
+            while True:
+                batch = self._drain(self.batch_size)
+                if not batch:
+                    break
+                if self._write_batch(batch):
+                    written += len(batch)
+        return written
+
+    def shutdown(self):
+        """
+        Stop the background threads and flush remaining pings
+        """
+        self._stop_event.set()
+        for thread in (self._thread, self._listener):
+            if thread is not None and thread.is_alive():
+                thread.join(timeout=max(self.flush_interval * 2, 5))
+        if self._queue is not None:
+            self.flush()
+
+    def stats(self):
+        """
+        Get writer counters
+
+        Returns:
+            Dictionary with accepted, rejected, flushed, failed and batches counts
+            plus the current queue depth
+        """
+        with self._stats_lock:
+            result = dict(self._stats)
+        result['pending'] = self._queue.qsize() if self._queue is not None else 0
+        return result
+
+    def _stored_positions(self, driver_ids):
+        from app import db
+        from models import DriverPosition
+
+        since = datetime.utcnow() - timedelta(seconds=self.max_age)
+        try:
+            with db.engine.connect() as connection:
+                return DriverPosition.latest(connection, driver_ids, since)
+        except Exception as e:
+            self.app.logger.error(f"Error reading stored driver positions: {str(e)}")
+            return {}
+
+    def _publish(self, position):
+        if self.broker is None:
+            return
+        try:
+            self.broker.publish(POSITION_CHANNEL, dict(position, recorded_at=position['recorded_at'].isoformat()))
+        except Exception as e:
+            self.app.logger.error(f"Error publishing driver position: {str(e)}")
+
+    def _ensure_thread(self):
+        # Started lazily so the reloader parent and forked workers each get their own
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._thread_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name='gps-track-writer', daemon=True)
+            self._thread.start()
+
+    def _ensure_listener(self):
+        if self.broker is None or (self._listener is not None and self._listener.is_alive()):
+            return
+        with self._thread_lock:
+            if self._listener is not None and self._listener.is_alive():
+                return
+            self._listener = threading.Thread(target=self._listen, name='gps-position-listener', daemon=True)
+            self._listener.start()
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            deadline = time.monotonic() + self.flush_interval
+            batch = []
+
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self._stop_event.is_set():
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            if batch:
+                with self._flush_lock:
+                    self._write_batch(batch)
+
+    def _listen(self):
+        try:
+            subscription = self.broker.subscribe(POSITION_CHANNEL)
+        except Exception as e:
+            self.app.logger.error(f"Error subscribing to driver positions: {str(e)}")
+            return
+
+        try:
+            while not self._stop_event.is_set():
+                position = subscription.get(timeout=1.0)
+                if position is None:
+                    continue
+                try:
+                    position['recorded_at'] = datetime.fromisoformat(position['recorded_at'])
+                    self.positions.update([position])
+                except (KeyError, TypeError, ValueError):
+                    continue
+        finally:
+            subscription.close()
+
+    def _drain(self, limit):
+        batch = []
+        while len(batch) < limit:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write_batch(self, batch):
+        from app import db
+        from models import DriverPosition, Route, RouteStatus
+
+        route_ids = {row['route_id'] for row in batch if row['route_id'] is not None}
+
+        # Dedicated connection so the caller's session is never committed or rolled back
+        with self.app.app_context():
+            try:
+                with db.engine.begin() as connection:
+                    days = {day_start(row['recorded_at']) for row in batch} - self._known_days
+                    for day in days:
+                        ensure_partition(connection, day)
+                    DriverPosition.insert_many(connection, batch)
+
+                    # Pings uploaded after their route was completed
+                    completed = connection.execute(
+                        select(Route.id, Route.company_id)
+                        .where(Route.id.in_(route_ids), Route.status == RouteStatus.COMPLETED)
+                    ).all() if route_ids else []
+                self._known_days |= days
+            except Exception as e:
+                self._bump('failed', len(batch))
+                self.app.logger.error(f"Error writing {len(batch)} GPS pings: {str(e)}")
+                return False
+
+            if completed:
+                from services import RouteService
+                for route_id, company_id in completed:
+                    RouteService.schedule_track_build(route_id, company_id)
+
+        self._bump('flushed', len(batch))
+        self._bump('batches')
+        return True
+
+    def _bump(self, key, amount=1):
+        with self._stats_lock:
+            self._stats[key] += amount
@@ -0,0 +1,170 @@
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session, joinedload, object_session
+
+from models import User, Admin, CompanyOwner, Manager, Operator, Driver
+from tenant import ROLE_ATTRIBUTES
+
+
+class UserCache:
+    """
+    In-process TTL/LRU cache for the Flask-Login user loader
+
+    Each entry is a detached User loaded together with all of its role
+    relationships, so the role row and company_id are known without further
+    queries. load() merges the snapshot into the request session with
+    load=False, which attaches a copy without touching the database.
+    Entries are dropped when a User or role row is inserted, updated or
+    deleted through the ORM.
+    """
+
+    WATCHED_MODELS = (User, Admin, CompanyOwner, Manager, Operator, Driver)
+
+    _events_registered = False
+
+    def __init__(self, app=None):
+        self.app = None
+        self.enabled = True
+        self.ttl = 60
+        self.max_size = 1024
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Configure the cache from application settings
+
+        Args:
+            app: Flask application instance
+        """
+        self.app = app
+        self.enabled = app.config.get('USER_CACHE_ENABLED', True)
+        self.ttl = float(app.config.get('USER_CACHE_TTL', 60))
+        self.max_size = max(1, int(app.config.get('USER_CACHE_SIZE', 1024)))
+
+        app.extensions['user_cache'] = self
+        self._register_events()
+
+    def load(self, user_id):
+        """
+        Get a session-bound User for the given ID
+
+        Args:
+            user_id: User ID
+
+        Returns:
+            User instance attached to db.session or None if it doesn't exist
+        """
+        from app import db
+
+        if not self.enabled:
+            return db.session.get(User, user_id)
+
+        snapshot = self._get(user_id)
+        if snapshot is None:
+            snapshot = self._fetch(user_id)
+            if snapshot is None:
+                return None
+            self._set(user_id, snapshot)
+
+        return db.session.merge(snapshot, load=False)
+
+    def invalidate(self, user_id):
+        """
+        Drop the cached entry for a user
+
+        Args:
+            user_id: User ID
+        """
+        with self._lock:
+            if self._entries.pop(user_id, None) is not None:
+                self._stats['invalidations'] += 1
+
+    def clear(self):
+        """
+        Drop all cached entries
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """
+        Get cache counters
+
+        Returns:
+            Dictionary with hits, misses, invalidations and current size
+        """
+        with self._lock:
+            result = dict(self._stats)
+            result['size'] = len(self._entries)
+        return result
+
+    def _get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+
+            expires_at, snapshot = entry
+            if expires_at < time.monotonic():
+                del self._entries[user_id]
+                self._stats['misses'] += 1
+                return None
+
+            self._entries.move_to_end(user_id)
+            self._stats['hits'] += 1
+            return snapshot
+
+    def _set(self, user_id, snapshot):
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + self.ttl, snapshot)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def _fetch(self, user_id):
+        from app import db
+
+        # Load in a private session so the snapshot is detached once it closes
+        with Session(bind=db.engine) as session:
+            options = [joinedload(getattr(User, attribute)) for attribute in ROLE_ATTRIBUTES.values()]
+            return session.query(User).options(*options).filter(User.id == user_id).one_or_none()
+
+    def _register_events(self):
+        if UserCache._events_registered:
+            return
+        UserCache._events_registered = True
+
+        def on_change(mapper, connection, target):
+            user_id = target.id
+            if user_id is None:
+                return
+            self.invalidate(user_id)
+
+            # Invalidate again after commit so a concurrent request can't re-cache the old row
+            session = object_session(target)
+            if session is not None:
+                session.info.setdefault('user_cache_invalidate', set()).add(user_id)
+
+        for model in self.WATCHED_MODELS:
+            event.listen(model, 'after_insert', on_change)
+            event.listen(model, 'after_update', on_change)
+            event.listen(model, 'after_delete', on_change)
+
+        @event.listens_for(Session, 'after_commit')
+        def on_commit(session):
+            for user_id in session.info.pop('user_cache_invalidate', ()):
+                self.invalidate(user_id)
+
+        @event.listens_for(Session, 'after_rollback')
+        def on_rollback(session):
+            session.info.pop('user_cache_invalidate', None)
@@ -1,19 +1,27 @@
+import base64
+import csv
+import io
+import json
 import os
 import re
 import uuid
 import shutil
+from contextlib import contextmanager
 from functools import wraps
 from urllib.parse import urlparse, parse_qs
 
-import requests
-from flask import abort, flash, redirect, url_for, request, current_app, g
+from flask import abort, flash, redirect, url_for, request, current_app, g, Response, stream_with_context
 from flask_login import current_user
 from werkzeug.utils import secure_filename
+from sqlalchemy import event, and_, or_, tuple_
 import logging
 import time
 import traceback
+from datetime import datetime, date
 
-from models import ActionType, Log
+from models import ActionType
+from tenant import get_tenant
+from geocoding import GeocodingError, is_short_maps_url
 
 
 def save_profile_image(file):
@@ -113,83 +121,38 @@ def role_required(roles):
     return decorator
 
 
-def company_access_required(f):
-    """
-    Decorator that checks if the current user has access to a specific company
-    Used for views that receive company_id as a parameter
-    """
-    @wraps(f)
-    def decorated_function(company_id, *args, **kwargs):
-        # Admin has access to all companies
-        if current_user.role.value == 'admin':
-            return f(company_id, *args, **kwargs)
-
-        # Company owner, manager, operator, driver must be associated with the company
-        if current_user.role.value == 'company_owner' and current_user.company_owner.company_id != company_id:
-            flash('You do not have access to this company.', 'danger')
-            return redirect(url_for('main.index'))
-
-        if current_user.role.value == 'manager' and current_user.manager.company_id != company_id:
-            flash('You do not have access to this company.', 'danger')
-            return redirect(url_for('main.index'))
-
-        if current_user.role.value == 'operator' and current_user.operator.company_id != company_id:
-            flash('You do not have access to this company.', 'danger')
-            return redirect(url_for('main.index'))
-
-        if current_user.role.value == 'driver' and current_user.driver.company_id != company_id:
-            flash('You do not have access to this company.', 'danger')
-            return redirect(url_for('main.index'))
-
-        return f(company_id, *args, **kwargs)
-    return decorated_function
-
-
-def log_action(action_type, description, db_session):
+def log_action(action_type, description, db_session=None):
     """
     Log user action to database
 
+    The entry is handed to the buffered audit writer and inserted in a
+    batch by its background thread, so the caller's transaction is not
+    committed here. The writer interns the IP address and user agent into
+    lookup tables, so no extra query runs in the request.
+
     Args:
         action_type: Type of action (from ActionType enum)
         description: Description of the action
-        db_session: SQLAlchemy session or db instance
+        db_session: Unused, kept for backwards compatibility with existing callers
     """
     if current_user.is_authenticated:
-        company_id = None
-
-        # Get the user's company ID based on their role
-        if current_user.role.value == 'company_owner' and current_user.company_owner:
-            company_id = current_user.company_owner.company_id
-        elif current_user.role.value == 'manager' and current_user.manager:
-            company_id = current_user.manager.company_id
-        elif current_user.role.value == 'operator' and current_user.operator:
-            company_id = current_user.operator.company_id
-        elif current_user.role.value == 'driver' and current_user.driver:
-            company_id = current_user.driver.company_id
-
-        log_entry = Log(
-            action_type=action_type,
-            description=description,
-            user_id=current_user.id,
-            company_id=company_id,
-            ip_address=request.remote_addr,
-            user_agent=request.user_agent.string if request.user_agent else None
-        )
+        company_id = get_tenant().company_id
+
+        # Werkzeug's UserAgent object is falsy, so read the header itself
+        user_agent = request.headers.get('User-Agent')
 
         try:
-            # Handle both cases - when db instance or db.session is passed
-            if hasattr(db_session, 'session'):
-                db_session.session.add(log_entry)
-                db_session.session.commit()
-            else:
-                db_session.add(log_entry)
-                db_session.commit()
+            from app import audit_writer
+            audit_writer.enqueue({
+                'action_type': action_type,
+                'description': description,
+                'timestamp': datetime.utcnow(),
+                'ip_address': request.remote_addr,
+                'user_agent': user_agent[:256] if user_agent else None,
+                'user_id': current_user.id,
+                'company_id': company_id
+            })
         except Exception as e:
-            # Handle both cases for rollback as well
-            if hasattr(db_session, 'session'):
-                db_session.session.rollback()
-            else:
-                db_session.rollback()
             current_app.logger.error(f"Error logging action: {str(e)}")
 
 
@@ -284,18 +247,258 @@ def delete_file(file_path):
         return False
 
 
+class KeysetPage:
+    """
+    One page of keyset (cursor) pagination results
+
+    Works like a Flask-SQLAlchemy pagination object for templates (items,
+    has_prev, has_next, per_page, total) but has no page numbers: prev_url
+    and next_url link to the neighbouring pages with an opaque cursor and
+    keep the current request's other query parameters, so filters and sort
+    options survive paging.
+    """
+
+    def __init__(self, items, per_page, prev_cursor=None, next_cursor=None, total=None, total_is_estimate=False):
+        self.items = items
+        self.per_page = per_page
+        self.prev_cursor = prev_cursor
+        self.next_cursor = next_cursor
+        self.total = total
+        self.total_is_estimate = total_is_estimate
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def prev_url(self):
+        return self.url_for_cursor(self.prev_cursor)
+
+    @property
+    def next_url(self):
+        return self.url_for_cursor(self.next_cursor)
+
+    def url_for_cursor(self, cursor, endpoint=None, **kwargs):
+        """
+        URL of the page starting at cursor
+
+        Args:
+            cursor: prev_cursor or next_cursor
+            endpoint: Endpoint name (defaults to the current request's)
+            **kwargs: URL parameters (default to the current request's)
+
+        Returns:
+            URL string, or None if cursor is None
+        """
+        if cursor is None:
+            return None
+        if endpoint is None:
+            endpoint = request.endpoint
+            kwargs = {**(request.view_args or {}), **request.args.to_dict(), **kwargs}
+        kwargs.pop('page', None)
+        kwargs['cursor'] = cursor
+        return url_for(endpoint, **kwargs)
+
+    def __iter__(self):
+        return iter(self.items)
+
+
+def encode_cursor(direction, values):
+    """
+    Build an opaque cursor from a row's sort key
+
+    Args:
+        direction: 'next' or 'prev'
+        values: Sort key values (str, int, float, bool, None, date, datetime or Enum)
+
+    Returns:
+        URL-safe cursor string
+    """
+    encoded = []
+    for value in values:
+        if isinstance(value, datetime):
+            value = {'dt': value.isoformat()}
+        elif isinstance(value, date):
+            value = {'d': value.isoformat()}
+        elif hasattr(value, 'value') and not isinstance(value, (str, int, float)):
+            value = value.value
+        encoded.append(value)
+
+    payload = json.dumps([direction[0], encoded], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, key_length):
+    """
+    Parse a cursor built by encode_cursor
+
+    Args:
+        cursor: Cursor string
+        key_length: Expected number of sort key values
+
+    Returns:
+        Tuple of (direction, values) or None if the cursor is missing or malformed
+    """
+    if not cursor:
+        return None
+    try:
+        payload = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        direction, encoded = json.loads(payload)
+        if direction not in ('n', 'p') or len(encoded) != key_length:
+            return None
+
+        values = []
+        for value in encoded:
+            if isinstance(value, dict) and 'dt' in value:
+                value = datetime.fromisoformat(value['dt'])
+            elif isinstance(value, dict) and 'd' in value:
+                value = date.fromisoformat(value['d'])
+            values.append(value)
+        return ('next' if direction == 'n' else 'prev'), values
+    except (ValueError, TypeError):
+        return None
+
+
+def _keyset_condition(order_by, values, backwards):
+    """
+    Filter selecting the rows that sort after (or before) the given key
+    """
+    descending = {is_descending for _, is_descending in order_by}
+    if len(descending) == 1:
+        # Uniform direction: a row-value comparison the database can seek on an index
+        after = descending.pop() == backwards
+        columns = tuple_(*[column for column, _ in order_by])
+        return columns > tuple_(*values) if after else columns < tuple_(*values)
+
+    clauses = []
+    for index, (column, is_descending) in enumerate(order_by):
+        greater = is_descending == backwards
+        equal_prefix = [
+            previous == value for (previous, _), value in zip(order_by[:index], values[:index])
+        ]
+        clauses.append(and_(*equal_prefix, column > values[index] if greater else column < values[index]))
+    return or_(*clauses)
+
+
+def estimate_count(query):
+    """
+    Approximate number of rows a query returns
+
+    On PostgreSQL the planner's row estimate is used, so no rows are
+    scanned; other databases run an exact COUNT.
+
+    Args:
+        query: SQLAlchemy Query
+
+    Returns:
+        Tuple of (count, is_estimate)
+    """
+    query = query.order_by(None)
+    session = query.session
+    bind = session.get_bind()
+
+    if bind.dialect.name == 'postgresql':
+        compiled = query.statement.compile(dialect=bind.dialect)
+        plan = session.connection().exec_driver_sql(
+            f'EXPLAIN (FORMAT JSON) {compiled}', compiled.params
+        ).scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows']), True
+
+    return query.count(), False
+
+
+def keyset_paginate(query, order_by, cursor=None, per_page=20, count=None, key=None):
+    """
+    Paginate a query by seeking past the last row's sort key instead of OFFSET
+
+    Each page is one indexed range scan regardless of how deep it is, and
+    no COUNT is run unless asked for.
+
+    Args:
+        query: SQLAlchemy Query without ORDER BY
+        order_by: Sequence of (column, descending) pairs; the last column must be
+            unique (normally the primary key) and none may be NULL
+        cursor: Cursor from a previous page's prev_cursor or next_cursor
+        per_page: Items per page
+        count: None for no total, 'exact' for COUNT(*) or 'estimate' for the
+            planner's estimate where available
+        key: Function returning an item's sort key values, for items that are
+            not model instances with the order_by columns as attributes
+
+    Returns:
+        KeysetPage
+    """
+    order_by = list(order_by)
+    if key is None:
+        def key(item):
+            return [getattr(item, column.key) for column, _ in order_by]
+
+    parsed = decode_cursor(cursor, len(order_by))
+    backwards = parsed is not None and parsed[0] == 'prev'
+
+    page_query = query.order_by(None)
+    if parsed is not None:
+        page_query = page_query.filter(_keyset_condition(order_by, parsed[1], backwards))
+
+    page_query = page_query.order_by(*[
+        column.desc() if is_descending != backwards else column.asc()
+        for column, is_descending in order_by
+    ])
+
+    rows = page_query.limit(per_page + 1).all()
+    has_more = len(rows) > per_page
+    items = rows[:per_page]
+    if backwards:
+        items.reverse()
+
+    prev_cursor = next_cursor = None
+    if items:
+        if (backwards and has_more) or (not backwards and parsed is not None):
+            prev_cursor = encode_cursor('prev', key(items[0]))
+        if backwards or has_more:
+            next_cursor = encode_cursor('next', key(items[-1]))
+
+    total, total_is_estimate = None, False
+    if count == 'exact':
+        total = query.order_by(None).count()
+    elif count == 'estimate':
+        total, total_is_estimate = estimate_count(query)
+
+    return KeysetPage(items, per_page, prev_cursor, next_cursor, total, total_is_estimate)
+
+
 def create_pagination_dict(pagination, endpoint, **kwargs):
     """
     Create a dictionary with pagination information
 
     Args:
-        pagination: SQLAlchemy pagination object
+        pagination: KeysetPage or SQLAlchemy pagination object
         endpoint: Name of the endpoint for generating URLs
         **kwargs: Additional URL parameters
 
     Returns:
         Dictionary with pagination information
     """
+    if isinstance(pagination, KeysetPage):
+        return {
+            'items': pagination.items,
+            'per_page': pagination.per_page,
+            'total': pagination.total,
+            'total_is_estimate': pagination.total_is_estimate,
+            'has_prev': pagination.has_prev,
+            'has_next': pagination.has_next,
+            'prev_cursor': pagination.prev_cursor,
+            'next_cursor': pagination.next_cursor,
+            'prev_url': pagination.url_for_cursor(pagination.prev_cursor, endpoint, **kwargs),
+            'next_url': pagination.url_for_cursor(pagination.next_cursor, endpoint, **kwargs)
+        }
+
     return {
         'items': pagination.items,
         'page': pagination.page,
@@ -309,6 +512,63 @@ def create_pagination_dict(pagination, endpoint, **kwargs):
     }
 
 
+def _csv_value(value):
+    """
+    Format dates the way CSV reports have always shown them
+    """
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M')
+    if isinstance(value, date):
+        return value.strftime('%Y-%m-%d')
+    return value
+
+
+def iter_csv(rows, chunk_size=64 * 1024):
+    """
+    Encode rows as CSV without building the whole file in memory
+
+    Args:
+        rows: Iterable of row sequences; date and datetime values are formatted
+        chunk_size: Approximate number of characters per yielded chunk
+
+    Yields:
+        UTF-8 encoded chunks of CSV data
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    for row in rows:
+        writer.writerow([_csv_value(value) for value in row])
+        if buffer.tell() >= chunk_size:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate(0)
+
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def stream_csv_response(rows, filename):
+    """
+    Create a streaming CSV download response
+
+    Rows are produced while the response is sent, so the generator can keep
+    reading from the database inside the request context.
+
+    Args:
+        rows: Iterable of row sequences
+        filename: Download file name
+
+    Returns:
+        Flask Response
+    """
+    return Response(
+        stream_with_context(iter_csv(rows)),
+        mimetype='text/csv',
+        headers={'Content-Disposition': f'attachment; filename="{secure_filename(filename)}"'}
+    )
+
+
 # Added from simple_log_utils.py
 def log_function(func):
     """
@@ -342,6 +602,35 @@ def log_function(func):
     return wrapper
 
 
+@contextmanager
+def count_queries(engine):
+    """
+    Count the SQL statements executed on an engine inside the block
+
+    Usage:
+        with count_queries(db.engine) as counter:
+            ...
+        print(counter['count'])
+
+    Args:
+        engine: SQLAlchemy engine to watch
+
+    Yields:
+        Dictionary with 'count' and the list of 'statements'
+    """
+    counter = {'count': 0, 'statements': []}
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        counter['count'] += 1
+        counter['statements'].append(statement)
+
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield counter
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+
 def log_db_operation(operation_type, entity_name, entity_id=None, details=None):
     """
     Log database operations for auditing
@@ -434,13 +723,13 @@ def extract_coordinates_from_maps_url(url):
         if not url or not isinstance(url, str):
             return {'success': False, 'error': 'Invalid URL format'}
 
-        # Handle shortened URLs by following redirects
-        if 'goo.gl' in url or 'maps.app.goo.gl' in url:
+        # Handle shortened URLs by following redirects (cached by the geocoder)
+        if is_short_maps_url(url):
+            from app import geocoder
             try:
-                response = requests.head(url, allow_redirects=True, timeout=5)
-                url = response.url
-            except Exception as e:
-                return {'success': False, 'error': f'Error expanding shortened URL: {str(e)}'}
+                url = geocoder.expand_url(url)
+            except GeocodingError as e:
+                return {'success': False, 'error': str(e)}
 
         # Try all patterns to extract coordinates
         for pattern in coords_patterns:
@@ -1,13 +1,15 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request, current_app
+from datetime import datetime
+
+from flask import Blueprint, render_template, redirect, url_for, flash, request, current_app, jsonify
+from flask_login import current_user
 from werkzeug.exceptions import NotFound
-from sqlalchemy import or_
 
-from app import db
+from app import db, job_queue
 from forms import (
     UserForm, EditUserForm, CompanyForm, AdminRegistrationForm,
     CompanyOwnerRegistrationForm, SearchForm
 )
-from models import User, Company, UserRole, Admin, Log, ActionType
+from models import User, Company, UserRole, Admin, ActionType
 from services import UserService, LogService, CompanyService
 from utils import admin_required, log_action
 
@@ -39,17 +41,7 @@ def user_list():
     search_form = SearchForm()
     search_term = request.args.get('search', '')
 
-    if search_term:
-        users = User.query.filter(
-            or_(
-                User.username.ilike(f'%{search_term}%'),
-                User.email.ilike(f'%{search_term}%'),
-                User.first_name.ilike(f'%{search_term}%'),
-                User.last_name.ilike(f'%{search_term}%')
-            )
-        ).paginate(page=page, per_page=10)
-    else:
-        users = User.query.paginate(page=page, per_page=10)
+    users = UserService.search_users(search_term, page=page, per_page=10)
 
     return render_template(
         'admin/user_list.html',
@@ -60,6 +52,36 @@ def user_list():
     )
 
 
+@admin.route('/autocomplete')
+@admin_required
+def autocomplete():
+    """
+    Top fuzzy matches for the admin search boxes as JSON
+
+    Query parameters: q (at least 2 characters), type ('users' or
+    'companies') and limit (at most 20).
+    """
+    search_term = request.args.get('q', '').strip()
+    search_type = request.args.get('type', 'users')
+    limit = min(max(request.args.get('limit', 8, type=int), 1), 20)
+
+    if len(search_term) < 2:
+        return jsonify({'results': []})
+
+    if search_type == 'companies':
+        results = CompanyService.autocomplete_companies(search_term, limit)
+        for result in results:
+            result['url'] = url_for('admin.view_company', company_id=result['id'])
+    elif search_type == 'users':
+        results = UserService.autocomplete_users(search_term, limit)
+        for result in results:
+            result['url'] = url_for('admin.view_user', user_id=result['id'])
+    else:
+        return jsonify({'error': 'Unknown search type'}), 400
+
+    return jsonify({'results': results})
+
+
 @admin.route('/users/create', methods=['GET', 'POST'])
 @admin_required
 def create_user():
@@ -161,17 +183,7 @@ def company_list():
     search_form = SearchForm()
     search_term = request.args.get('search', '')
 
-    if search_term:
-        companies = Company.query.filter(
-            or_(
-                Company.name.ilike(f'%{search_term}%'),
-                Company.legal_name.ilike(f'%{search_term}%'),
-                Company.tax_id.ilike(f'%{search_term}%'),
-                Company.email.ilike(f'%{search_term}%')
-            )
-        ).paginate(page=page, per_page=10)
-    else:
-        companies = Company.query.paginate(page=page, per_page=10)
+    companies = CompanyService.search_companies(search_term, page=page, per_page=10)
 
     return render_template(
         'admin/company_list.html',
@@ -256,6 +268,39 @@ def view_company(company_id):
     )
 
 
+@admin.route('/companies/<int:company_id>/export-analytics', methods=['POST'])
+@admin_required
+def export_company_analytics(company_id):
+    """
+    Queue a columnar analytics export of the company and show its progress
+    """
+    company = Company.query.get_or_404(company_id)
+
+    since = None
+    if request.form.get('since'):
+        try:
+            since = datetime.strptime(request.form['since'], '%Y-%m-%d')
+        except ValueError:
+            flash('Invalid date format. Use YYYY-MM-DD.', 'danger')
+            return redirect(url_for('admin.view_company', company_id=company.id))
+
+    try:
+        job = job_queue.enqueue(
+            'analytics.export',
+            {'company_id': company.id, 'since': since.isoformat() if since else None},
+            dedup_key=f"analytics:{company.id}:{since.strftime('%Y%m%d') if since else 'all'}",
+            user_id=current_user.id,
+            company_id=company.id
+        )
+        log_action(ActionType.CREATE, f"Requested analytics export for company {company.name}", db)
+    except Exception as e:
+        current_app.logger.error(f"Error queueing analytics export: {str(e)}")
+        flash(f'Error starting analytics export: {str(e)}', 'danger')
+        return redirect(url_for('admin.view_company', company_id=company.id))
+
+    return redirect(url_for('jobs.job_page', job_id=job.id))
+
+
 @admin.route('/company-owners/create', methods=['GET', 'POST'])
 @admin_required
 def create_company_owner():
@@ -280,8 +325,11 @@ def create_company_owner():
 @admin.route('/logs')
 @admin_required
 def log_list():
-    page = request.args.get('page', 1, type=int)
-    logs = Log.query.order_by(Log.timestamp.desc()).paginate(page=page, per_page=20)
+    logs = LogService.get_paginated_logs(
+        cursor=request.args.get('cursor'),
+        per_page=20,
+        count='estimate'
+    )
 
     return render_template(
         'admin/logs.html',
@@ -1,9 +1,9 @@
 import traceback
-from operator import or_
 
 from flask import Blueprint, render_template, redirect, url_for, flash, request, send_file, current_app
 from flask_login import login_required, current_user
 from werkzeug.utils import secure_filename
+from sqlalchemy import or_
 import os
 from datetime import datetime
 from utils import log_action
@@ -11,7 +11,9 @@ from utils import log_action
 from app import db
 from models import Document, User, UserRole, Task, TaskStatus, Route, RouteStatus, ActionType, Company, DocumentCategory
 from forms import DocumentUploadForm, DocumentSearchForm
-from utils import role_required, company_access_required, log_action, save_document, delete_file
+from utils import role_required, log_action, save_document, delete_file, create_pagination_dict
+from services import DocumentSearchService
+from tenant import get_tenant
 
 documents = Blueprint('documents', __name__, url_prefix='/documents')
 
@@ -28,15 +30,7 @@ def list_documents():
     category = request.args.get('category', None)
 
     # Get company ID based on user role
-    company_id = None
-    if current_user.role == UserRole.COMPANY_OWNER and current_user.company_owner:
-        company_id = current_user.company_owner.company_id
-    elif current_user.role == UserRole.MANAGER and current_user.manager:
-        company_id = current_user.manager.company_id
-    elif current_user.role == UserRole.OPERATOR and current_user.operator:
-        company_id = current_user.operator.company_id
-    elif current_user.role == UserRole.DRIVER and current_user.driver:
-        company_id = current_user.driver.company_id
+    company_id = get_tenant().company_id
 
     # For admins, they can filter by company
     if current_user.role == UserRole.ADMIN:
@@ -56,16 +50,15 @@ def list_documents():
     # Apply category filter
     if category:
         try:
-            # Fix: Convert to enum but use value for database filtering
+            # document_category is a plain string column holding the enum value
             doc_category = DocumentCategory(category.lower())
-            doc_query = doc_query.filter(Document.document_category.has(value=doc_category.value))
+            doc_query = doc_query.filter(Document.document_category == doc_category.value)
         except ValueError:
             # Invalid category, ignore filter
             pass
 
-    # Apply search filter
-    if search_term:
-        doc_query = doc_query.filter(Document.title.ilike(f'%{search_term}%'))
+    # Apply search filter, best matches first
+    doc_query = DocumentSearchService.apply_search(doc_query, search_term)
 
     # Order by upload time (newest first)
     doc_query = doc_query.order_by(Document.uploaded_at.desc())
@@ -105,18 +98,10 @@ def upload_document():
     if form.validate_on_submit():
         try:
             # Get company ID based on user role
-            company_id = None
-            if current_user.company_owner:
-                company_id = current_user.company_owner.company_id
-            elif current_user.manager:
-                company_id = current_user.manager.company_id
-            elif current_user.operator:
-                company_id = current_user.operator.company_id
-            elif current_user.driver:
-                company_id = current_user.driver.company_id
+            company_id = get_tenant().company_id
 
             # For admins, they can select a company
-            if current_user.role.value == 'admin':
+            if get_tenant().is_admin:
                 company_id = form.company_id.data if hasattr(form, 'company_id') else None
 
             # Validate company existence
@@ -361,15 +346,7 @@ def edit_document(document_id):
     delattr(form, 'document')
 
     # Get company ID based on user role
-    company_id = None
-    if current_user.role == UserRole.COMPANY_OWNER and current_user.company_owner:
-        company_id = current_user.company_owner.company_id
-    elif current_user.role == UserRole.MANAGER and current_user.manager:
-        company_id = current_user.manager.company_id
-    elif current_user.role == UserRole.OPERATOR and current_user.operator:
-        company_id = current_user.operator.company_id
-    elif current_user.role == UserRole.DRIVER and current_user.driver:
-        company_id = current_user.driver.company_id
+    company_id = get_tenant().company_id
 
     # For admins, they can select a company
     if current_user.role == UserRole.ADMIN:
@@ -510,15 +487,7 @@ def task_documents(task_id):
     task = Task.query.get_or_404(task_id)
 
     # Check if user can access this task
-    company_id = None
-    if current_user.role == UserRole.COMPANY_OWNER and current_user.company_owner:
-        company_id = current_user.company_owner.company_id
-    elif current_user.role == UserRole.MANAGER and current_user.manager:
-        company_id = current_user.manager.company_id
-    elif current_user.role == UserRole.OPERATOR and current_user.operator:
-        company_id = current_user.operator.company_id
-    elif current_user.role == UserRole.DRIVER and current_user.driver:
-        company_id = current_user.driver.company_id
+    company_id = get_tenant().company_id
 
     # Check if user has access to this task's company
     if current_user.role != UserRole.ADMIN and (not company_id or task.company_id != company_id):
@@ -551,15 +520,7 @@ def route_documents(route_id):
     route = Route.query.get_or_404(route_id)
 
     # Check if user can access this route
-    company_id = None
-    if current_user.role == UserRole.COMPANY_OWNER and current_user.company_owner:
-        company_id = current_user.company_owner.company_id
-    elif current_user.role == UserRole.MANAGER and current_user.manager:
-        company_id = current_user.manager.company_id
-    elif current_user.role == UserRole.OPERATOR and current_user.operator:
-        company_id = current_user.operator.company_id
-    elif current_user.role == UserRole.DRIVER and current_user.driver:
-        company_id = current_user.driver.company_id
+    company_id = get_tenant().company_id
 
     # Check if user has access to this route's company
     if current_user.role != UserRole.ADMIN and (not company_id or route.company_id != company_id):
@@ -599,19 +560,11 @@ def category_documents(category):
         return redirect(url_for('documents.list_documents'))
 
     # Get company ID based on user role
-    company_id = None
-    if current_user.role == UserRole.COMPANY_OWNER and current_user.company_owner:
-        company_id = current_user.company_owner.company_id
-    elif current_user.role == UserRole.MANAGER and current_user.manager:
-        company_id = current_user.manager.company_id
-    elif current_user.role == UserRole.OPERATOR and current_user.operator:
-        company_id = current_user.operator.company_id
-    elif current_user.role == UserRole.DRIVER and current_user.driver:
-        company_id = current_user.driver.company_id
+    company_id = get_tenant().company_id
 
     # Build query
-    # Fix: Use value for database filtering
-    doc_query = Document.query.filter(Document.document_category.has(value=doc_category.value))
+    # document_category is a plain string column holding the enum value
+    doc_query = Document.query.filter(Document.document_category == doc_category.value)
 
     # Apply company filter if not admin
     if current_user.role != UserRole.ADMIN and company_id:
@@ -654,18 +607,12 @@ def search_documents():
     """
     Advanced search for documents
     """
-    form = DocumentSearchForm()
+    # Searches are submitted by POST; result pages link back with GET parameters
+    form = DocumentSearchForm(formdata=request.args if request.method == 'GET' else None)
+    page = request.args.get('page', 1, type=int)
 
     # Get company ID based on user role
-    company_id = None
-    if current_user.role == UserRole.COMPANY_OWNER and current_user.company_owner:
-        company_id = current_user.company_owner.company_id
-    elif current_user.role == UserRole.MANAGER and current_user.manager:
-        company_id = current_user.manager.company_id
-    elif current_user.role == UserRole.OPERATOR and current_user.operator:
-        company_id = current_user.operator.company_id
-    elif current_user.role == UserRole.DRIVER and current_user.driver:
-        company_id = current_user.driver.company_id
+    company_id = get_tenant().company_id
 
     # For admins, they can filter by company
     if current_user.role == UserRole.ADMIN:
@@ -689,6 +636,7 @@ def search_documents():
 
     # Initialize results
     results = []
+    pagination = None
     searched = False
 
     if form.validate_on_submit() or request.args.get('search'):
@@ -703,21 +651,20 @@ def search_documents():
         elif not hasattr(form, 'company_id') and company_id:
             search_query = search_query.filter(Document.company_id == company_id)
 
-        # Apply title filter
-        if form.title.data:
-            search_query = search_query.filter(Document.title.ilike(f'%{form.title.data}%'))
+        # Apply full-text search on title, file type, category, task and uploader
+        search_query = DocumentSearchService.apply_search(search_query, form.title.data)
 
         # Apply file type filter
         if form.file_type.data:
             search_query = search_query.filter(Document.file_type == form.file_type.data)
 
         # Apply category filter
-        category = request.form.get('category', '')
+        category = request.values.get('category', '')
         if category:
             try:
-                # Fix: Use value for database filtering
+                # document_category is a plain string column holding the enum value
                 doc_category = DocumentCategory(category.lower())
-                search_query = search_query.filter(Document.document_category.has(value=doc_category.value))
+                search_query = search_query.filter(Document.document_category == doc_category.value)
             except ValueError:
                 # Invalid category, ignore
                 pass
@@ -749,13 +696,29 @@ def search_documents():
                 )
             )
 
-        # Order by upload time (newest first)
+        # Order by relevance when searching text, then by upload time (newest first)
         search_query = search_query.order_by(Document.uploaded_at.desc())
 
-        # Execute query
-        results = search_query.all()
+        # Paginate results
+        search_args = {
+            'search': 1,
+            'title': form.title.data or None,
+            'file_type': form.file_type.data or None,
+            'category': category or None,
+            'date_from': form.date_from.data.strftime('%Y-%m-%d') if form.date_from.data else None,
+            'date_to': form.date_to.data.strftime('%Y-%m-%d') if form.date_to.data else None,
+            'uploader_id': form.uploader_id.data or None if hasattr(form, 'uploader_id') else None,
+            'company_id': form.company_id.data or None if hasattr(form, 'company_id') else None
+        }
+        pagination = create_pagination_dict(
+            search_query.paginate(page=page, per_page=20),
+            'documents.search_documents',
+            **{key: value for key, value in search_args.items() if value is not None}
+        )
+        results = pagination['items']
 
-        log_action(ActionType.VIEW, "Performed document search", db)
+        if page == 1:
+            log_action(ActionType.VIEW, "Performed document search", db)
 
     # Get uploaders list for dropdown (for admins/managers/owners)
     uploaders = []
@@ -780,6 +743,7 @@ def search_documents():
         title='Document Search',
         form=form,
         results=results,
+        pagination=pagination,
         searched=searched,
         categories=categories
     )
@@ -795,15 +759,7 @@ def _can_access_document(document):
         return True
 
     # Get company ID based on user role
-    company_id = None
-    if current_user.role == UserRole.COMPANY_OWNER and current_user.company_owner:
-        company_id = current_user.company_owner.company_id
-    elif current_user.role == UserRole.MANAGER and current_user.manager:
-        company_id = current_user.manager.company_id
-    elif current_user.role == UserRole.OPERATOR and current_user.operator:
-        company_id = current_user.operator.company_id
-    elif current_user.role == UserRole.DRIVER and current_user.driver:
-        company_id = current_user.driver.company_id
+    company_id = get_tenant().company_id
 
     # Must be in same company
     if document.company_id != company_id:
@@ -839,10 +795,10 @@ def _can_edit_document(document):
         return True
 
     # Company owner and manager can edit company documents
-    if current_user.role == UserRole.COMPANY_OWNER and current_user.company_owner and document.company_id == current_user.company_owner.company_id:
+    if current_user.role == UserRole.COMPANY_OWNER and get_tenant().owns(document):
         return True
 
-    if current_user.role == UserRole.MANAGER and current_user.manager and document.company_id == current_user.manager.company_id:
+    if current_user.role == UserRole.MANAGER and get_tenant().owns(document):
         return True
 
     return False
@@ -861,10 +817,10 @@ def _can_delete_document(document):
         return True
 
     # Company owner and manager can delete company documents
-    if current_user.role == UserRole.COMPANY_OWNER and current_user.company_owner and document.company_id == current_user.company_owner.company_id:
+    if current_user.role == UserRole.COMPANY_OWNER and get_tenant().owns(document):
         return True
 
-    if current_user.role == UserRole.MANAGER and current_user.manager and document.company_id == current_user.manager.company_id:
+    if current_user.role == UserRole.MANAGER and get_tenant().owns(document):
         return True
 
     return False
\ No newline at end of file
@@ -1,15 +1,17 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request, current_app
+from flask import Blueprint, render_template, redirect, url_for, flash, request, current_app, jsonify
 from flask_login import login_required, current_user
 from datetime import datetime, timedelta
 from sqlalchemy import func, or_, and_
 
-from app import db
+from app import db, track_writer
 from models import (
     Route, RouteStatus, User, UserRole, Task, TaskStatus, Driver, Message,
     Document, Operator, ActionType, Manager, CompanyOwner, DocumentCategory
 )
 from forms import DocumentUploadForm, MessageForm
 from utils import role_required, log_action
+from services import MessageService, RouteService
+from tenant import get_tenant
 from werkzeug.utils import secure_filename
 import os
 
@@ -66,10 +68,7 @@ def routes_dashboard():
     ).order_by(Message.sent_at.desc()).limit(5).all()
 
     # Get unread message count
-    unread_count = Message.query.filter_by(
-        recipient_id=current_user.id,
-        is_read=False
-    ).count()
+    unread_count = MessageService.get_unread_messages_count(current_user.id)
 
     # Get operator info
     operator = None
@@ -238,8 +237,9 @@ def documents():
     query = Document.query
 
     # Filter by company
-    if current_user.driver and current_user.driver.company_id:
-        query = query.filter(Document.company_id == current_user.driver.company_id)
+    company_id = get_tenant().company_id
+    if company_id:
+        query = query.filter(Document.company_id == company_id)
 
     # Filter by driver-specific access
     # Documents are visible if:
@@ -447,7 +447,7 @@ def upload_document():
                 uploader_id=current_user.id,
                 task_id=task_id,
                 route_id=route_id,
-                company_id=current_user.driver.company_id,
+                company_id=get_tenant().company_id,
                 document_category=DocumentCategory(document_category)
             )
 
@@ -472,10 +472,7 @@ def unread_messages():
     Show unread messages for driver
     """
     # Get unread messages count
-    unread_count = Message.query.filter_by(
-        recipient_id=current_user.id,
-        is_read=False
-    ).count()
+    unread_count = MessageService.get_unread_messages_count(current_user.id)
 
     # If no unread messages, redirect to inbox
     if unread_count == 0:
@@ -491,6 +488,42 @@ def unread_messages():
     return redirect(url_for('messages.chat', user_id=first_unread.sender_id))
 
 
+@driver.route('/locations', methods=['POST'])
+@login_required
+@role_required("DRIVER")
+def ingest_locations():
+    """
+    Accept a batch of GPS pings from the driver app
+
+    Expects {"route_id": 12, "pings": [{"timestamp": "2024-05-01T08:00:00Z", "lat": 52.23, "lng": 21.01,
+    "speed": 48.5}, ...]}; route_id is optional. Valid pings are buffered and
+    written in bulk, the response lists the index and reason of each rejected one.
+    """
+    data = request.get_json(silent=True) or {}
+    pings = data.get('pings')
+
+    if not isinstance(pings, list) or not pings:
+        return jsonify({'success': False, 'error': 'Expected a non-empty list of pings'}), 400
+
+    if len(pings) > track_writer.max_pings:
+        return jsonify({
+            'success': False,
+            'error': f'At most {track_writer.max_pings} pings can be sent at once'
+        }), 400
+
+    route_id = data.get('route_id')
+    if route_id is not None:
+        own_route = isinstance(route_id, int) and db.session.query(Route.id).filter_by(
+            id=route_id, driver_id=current_user.id
+        ).first()
+        if not own_route:
+            return jsonify({'success': False, 'error': 'Unknown route'}), 400
+
+    accepted, rejected = track_writer.ingest(current_user.id, route_id, pings)
+
+    return jsonify({'success': True, 'accepted': accepted, 'rejected': rejected}), 202
+
+
 @driver.route('/tasks/<int:task_id>/start', methods=['POST'])
 @login_required
 @role_required("DRIVER")
@@ -555,11 +588,14 @@ def complete_task(task_id):
         task.updated_at = datetime.utcnow()
 
         # Update related route if exists
-        if task.route and task.route.status == RouteStatus.IN_PROGRESS:
+        route_completed = task.route is not None and task.route.status == RouteStatus.IN_PROGRESS
+        if route_completed:
             task.route.status = RouteStatus.COMPLETED
             task.route.end_time = datetime.utcnow()
 
         db.session.commit()
+        if route_completed:
+            RouteService.schedule_completion_jobs(task.route)
         log_action(ActionType.UPDATE, f"Completed task {task.title}", db)
         flash('Task completed successfully!', "SUCCESS")
     except Exception as e:
@@ -0,0 +1,103 @@
+import os
+
+from flask import Blueprint, render_template, redirect, url_for, flash, send_file, jsonify, abort
+from flask_login import login_required, current_user
+
+from app import db, job_queue
+from models import Job, JobStatus, ActionType
+from utils import log_action
+from tenant import get_tenant
+
+jobs = Blueprint('jobs', __name__, url_prefix='/jobs')
+
+
+@jobs.route('/<int:job_id>')
+@login_required
+def job_page(job_id):
+    """
+    Show job progress and start the download once it is ready
+    """
+    job = _get_job_or_404(job_id)
+
+    return render_template(
+        'jobs/status.html',
+        title='Preparing Report',
+        job=job,
+        job_data=_serialize_job(job)
+    )
+
+
+@jobs.route('/<int:job_id>/status')
+@login_required
+def job_status(job_id):
+    """
+    Job status as JSON, polled by the status page
+    """
+    job = _get_job_or_404(job_id)
+    return jsonify(_serialize_job(job))
+
+
+@jobs.route('/<int:job_id>/download')
+@login_required
+def download(job_id):
+    """
+    Download the file produced by a job
+    """
+    job = _get_job_or_404(job_id)
+
+    if job.status != JobStatus.SUCCEEDED or not job.artifact_path:
+        flash('This file is not ready yet.', 'warning')
+        return redirect(url_for('jobs.job_page', job_id=job.id))
+
+    if not os.path.exists(job.artifact_path):
+        flash('This file has expired. Please request it again.', 'warning')
+        return redirect(url_for('statistics.reports'))
+
+    # Log the download
+    log_action(ActionType.DOWNLOAD, f"Downloaded {job.artifact_name}", db)
+
+    return send_file(
+        job.artifact_path,
+        mimetype=job.artifact_mimetype,
+        as_attachment=True,
+        download_name=job.artifact_name
+    )
+
+
+def _get_job_or_404(job_id):
+    job = Job.query.get_or_404(job_id)
+    if not _can_access_job(job):
+        abort(403)
+    return job
+
+
+def _can_access_job(job):
+    """
+    Admins see every job, others the jobs they requested and the company
+    jobs their role is allowed to share (identical reports are deduplicated)
+    """
+    tenant = get_tenant()
+    if tenant.is_admin or job.user_id == current_user.id:
+        return True
+    if job.company_id is None or not tenant.owns(job):
+        return False
+    return current_user.role in job_queue.shared_roles(job)
+
+
+def _serialize_job(job):
+    data = {
+        'id': job.id,
+        'name': job.name,
+        'status': job.status.value,
+        'attempts': job.attempts,
+        'max_attempts': job.max_attempts,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+        'error': job.error if job.status == JobStatus.FAILED else None,
+        'download_url': None
+    }
+
+    if job.status == JobStatus.SUCCEEDED and job.artifact_path:
+        data['download_url'] = url_for('jobs.download', job_id=job.id)
+
+    return data
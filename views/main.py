@@ -6,11 +6,17 @@ from sqlalchemy import or_, func
 from app import db
 from models import UserRole, User, Manager, Operator, Driver, Company, CompanyOwner, Admin, Message
 from models import Task, TaskStatus, Route, RouteStatus, ActionType, Log
-from utils import role_required, log_action
+from utils import role_required, log_action, keyset_paginate
+from services import MessageService, StatisticsService
 from forms import CompanyForm, UserForm, EditUserForm
+from tenant import get_tenant
 
 main = Blueprint('main', __name__)
 
+# Deadline sort keys for tasks without a deadline (see manager_tasks)
+NO_DEADLINE_ASC = datetime(9999, 12, 31)
+NO_DEADLINE_DESC = datetime(1970, 1, 1)
+
 
 @main.route('/')
 def index():
@@ -42,33 +48,37 @@ def owner_dashboard():
     """
     Dashboard for company owner with analytics and stats
     """
-    if not current_user.company_owner or not current_user.company_owner.company_id:
+    company_id = get_tenant().company_id
+    if not company_id:
         flash('You are not associated with a company.', "DANGER")
         return redirect(url_for('main.index'))
 
-    company_id = current_user.company_owner.company_id
     company = Company.query.get(company_id)
 
+    # Team, task and route counts in one round trip
+    overview = StatisticsService.get_company_overview(company_id)
+    team = overview['team']
+    tasks = overview['tasks']
+    routes = overview['routes']
+
     # Get team statistics
-    manager_count = Manager.query.filter_by(company_id=company_id).count()
-    operator_count = Operator.query.filter_by(company_id=company_id).count()
-    driver_count = Driver.query.filter_by(company_id=company_id).count()
-    team_count = manager_count + operator_count + driver_count
+    manager_count = team['managers']
+    operator_count = team['operators']
+    driver_count = team['drivers']
+    team_count = team['total']
 
     # Get task statistics
-    task_query = Task.query.filter_by(company_id=company_id)
-    task_count = task_query.count()
-    completed_tasks = task_query.filter_by(status=TaskStatus.COMPLETED).count()
-    in_progress_tasks = task_query.filter_by(status=TaskStatus.IN_PROGRESS).count()
-    new_tasks = task_query.filter_by(status=TaskStatus.NEW).count()
+    task_count = tasks['total']
+    completed_tasks = tasks['completed']
+    in_progress_tasks = tasks['in_progress']
+    new_tasks = tasks['new']
     active_tasks = in_progress_tasks + new_tasks
 
     # Get route statistics
-    route_query = Route.query.filter_by(company_id=company_id)
-    route_count = route_query.count()
-    completed_routes = route_query.filter_by(status=RouteStatus.COMPLETED).count()
-    in_progress_routes = route_query.filter_by(status=RouteStatus.IN_PROGRESS).count()
-    planned_routes = route_query.filter_by(status=RouteStatus.PLANNED).count()
+    route_count = routes['total']
+    completed_routes = routes['completed']
+    in_progress_routes = routes['in_progress']
+    planned_routes = routes['planned']
     active_routes = in_progress_routes + planned_routes
 
     # Calculate efficiency score (simplified example)
@@ -120,11 +130,11 @@ def owner_managers():
     """
     Managers list for company owner
     """
-    if not current_user.company_owner or not current_user.company_owner.company_id:
+    company_id = get_tenant().company_id
+    if not company_id:
         flash('You are not associated with a company.', "DANGER")
         return redirect(url_for('main.index'))
 
-    company_id = current_user.company_owner.company_id
     page = request.args.get("PAGE", 1, type=int)
 
     # Get all managers for this company
@@ -152,11 +162,11 @@ def add_manager():
     """
     Add a new manager
     """
-    if not current_user.company_owner or not current_user.company_owner.company_id:
+    company_id = get_tenant().company_id
+    if not company_id:
         flash('You are not associated with a company.', "DANGER")
         return redirect(url_for('main.index'))
 
-    company_id = current_user.company_owner.company_id
 
     # Create form
     form = UserForm()
@@ -214,11 +224,11 @@ def view_manager(manager_id):
     """
     View manager details including their team and performance
     """
-    if not current_user.company_owner or not current_user.company_owner.company_id:
+    company_id = get_tenant().company_id
+    if not company_id:
         flash('You are not associated with a company.', "DANGER")
         return redirect(url_for('main.index'))
 
-    company_id = current_user.company_owner.company_id
 
     # Get manager
     manager = Manager.query.get_or_404(manager_id)
@@ -294,11 +304,11 @@ def edit_manager(manager_id):
     """
     Edit manager details
     """
-    if not current_user.company_owner or not current_user.company_owner.company_id:
+    company_id = get_tenant().company_id
+    if not company_id:
         flash('You are not associated with a company.', "DANGER")
         return redirect(url_for('main.index'))
 
-    company_id = current_user.company_owner.company_id
 
     # Get manager
     manager = Manager.query.get_or_404(manager_id)
@@ -361,11 +371,11 @@ def delete_manager(manager_id):
     """
     Delete a manager
     """
-    if not current_user.company_owner or not current_user.company_owner.company_id:
+    company_id = get_tenant().company_id
+    if not company_id:
         flash('You are not associated with a company.', "DANGER")
         return redirect(url_for('main.index'))
 
-    company_id = current_user.company_owner.company_id
 
     # Get manager
     manager = Manager.query.get_or_404(manager_id)
@@ -405,11 +415,11 @@ def assign_operators_to_manager(manager_id):
     """
     Assign operators to a manager
     """
-    if not current_user.company_owner or not current_user.company_owner.company_id:
+    company_id = get_tenant().company_id
+    if not company_id:
         flash('You are not associated with a company.', "DANGER")
         return redirect(url_for('main.index'))
 
-    company_id = current_user.company_owner.company_id
 
     # Get manager
     manager = Manager.query.get_or_404(manager_id)
@@ -453,11 +463,11 @@ def remove_operator_from_manager(operator_id, manager_id):
     """
     Remove an operator from a manager
     """
-    if not current_user.company_owner or not current_user.company_owner.company_id:
+    company_id = get_tenant().company_id
+    if not company_id:
         flash('You are not associated with a company.', "DANGER")
         return redirect(url_for('main.index'))
 
-    company_id = current_user.company_owner.company_id
 
     # Get operator and manager
     operator = Operator.query.get_or_404(operator_id)
@@ -496,18 +506,19 @@ def owner_company_settings():
     """
     Company settings page for owner
     """
-    if not current_user.company_owner or not current_user.company_owner.company_id:
+    company_id = get_tenant().company_id
+    if not company_id:
         flash('You are not associated with a company.', "DANGER")
         return redirect(url_for('main.index'))
 
-    company_id = current_user.company_owner.company_id
     company = Company.query.get(company_id)
 
     # Get team statistics
-    manager_count = Manager.query.filter_by(company_id=company_id).count()
-    operator_count = Operator.query.filter_by(company_id=company_id).count()
-    driver_count = Driver.query.filter_by(company_id=company_id).count()
-    total_team_count = manager_count + operator_count + driver_count
+    team = StatisticsService.get_team_counts(company_id)
+    manager_count = team['managers']
+    operator_count = team['operators']
+    driver_count = team['drivers']
+    total_team_count = team['total']
 
     # Get mock company settings
     # In a real app, this would be from a settings table
@@ -540,11 +551,11 @@ def edit_company():
     """
     Edit company details
     """
-    if not current_user.company_owner or not current_user.company_owner.company_id:
+    company_id = get_tenant().company_id
+    if not company_id:
         flash('You are not associated with a company.', "DANGER")
         return redirect(url_for('main.index'))
 
-    company_id = current_user.company_owner.company_id
     company = Company.query.get(company_id)
 
     # Create form
@@ -594,7 +605,7 @@ def update_company_settings():
     """
     Update company settings
     """
-    if not current_user.company_owner or not current_user.company_owner.company_id:
+    if not get_tenant().company_id:
         flash('You are not associated with a company.', "DANGER")
         return redirect(url_for('main.index'))
 
@@ -627,11 +638,11 @@ def manager_dashboard():
     """
     Dashboard for manager with team overview and tasks
     """
-    if not current_user.manager or not current_user.manager.company_id:
+    company_id = get_tenant().company_id
+    if not company_id:
         flash('You are not associated with a company.', "DANGER")
         return redirect(url_for('main.index'))
 
-    company_id = current_user.manager.company_id
 
     # Get operator statistics
     operators = Operator.query.filter_by(
@@ -720,11 +731,11 @@ def manager_operators():
     """
     Show the operators assigned to this manager
     """
-    if not current_user.manager or not current_user.manager.company_id:
+    company_id = get_tenant().company_id
+    if not company_id:
         flash('You are not associated with a company.', "DANGER")
         return redirect(url_for('main.index'))
 
-    company_id = current_user.manager.company_id
     page = request.args.get("PAGE", 1, type=int)
 
     # Get operators assigned to this manager
@@ -756,7 +767,7 @@ def view_operator(operator_id):
     """
     View details of a specific operator
     """
-    if not current_user.manager or not current_user.manager.company_id:
+    if not get_tenant().company_id:
         flash('You are not associated with a company.', "DANGER")
         return redirect(url_for('main.index'))
 
@@ -775,12 +786,12 @@ def view_operator(operator_id):
 
     # Get available drivers for assignment
     available_drivers = Driver.query.filter_by(
-        company_id=current_user.manager.company_id
+        company_id=get_tenant().company_id
     ).all()
 
     # Get all operators for reassignment options
     operators = Operator.query.filter_by(
-        company_id=current_user.manager.company_id
+        company_id=get_tenant().company_id
     ).all()
 
     log_action(ActionType.VIEW, f"Viewed operator {operator.user.username}", db)
@@ -802,11 +813,11 @@ def add_operator():
     """
     Add a new operator to the team
     """
-    if not current_user.manager or not current_user.manager.company_id:
+    company_id = get_tenant().company_id
+    if not company_id:
         flash('You are not associated with a company.', "DANGER")
         return redirect(url_for('main.index'))
 
-    company_id = current_user.manager.company_id
 
     # Get existing operators without a manager
     available_users_query = User.query.join(
@@ -856,11 +867,11 @@ def request_operator():
     """
     Request a new operator account to be created
     """
-    if not current_user.manager or not current_user.manager.company_id:
+    company_id = get_tenant().company_id
+    if not company_id:
         flash('You are not associated with a company.', "DANGER")
         return redirect(url_for('main.index'))
 
-    company_id = current_user.manager.company_id
 
     # Get form data
     first_name = request.form.get("FIRST_NAME")
@@ -991,7 +1002,7 @@ def assign_drivers(operator_id):
 
         # Get all drivers in the company
         company_drivers = Driver.query.filter_by(
-            company_id=current_user.manager.company_id
+            company_id=get_tenant().company_id
         ).all()
 
         # Update driver assignments
@@ -1063,12 +1074,11 @@ def manager_tasks():
     """
     Show task management interface for manager
     """
-    if not current_user.manager or not current_user.manager.company_id:
+    company_id = get_tenant().company_id
+    if not company_id:
         flash('You are not associated with a company.', "danger")
         return redirect(url_for('main.index'))
 
-    company_id = current_user.manager.company_id
-    page = request.args.get("page", 1, type=int)
     status = request.args.get("status")
     view = request.args.get("view", "team")  # team or my
     sort = request.args.get("sort", "deadline_asc")
@@ -1100,25 +1110,23 @@ def manager_tasks():
             )
         )
 
-    # Apply sorting
+    # Apply sorting; keyset columns can't be NULL, so tasks without a
+    # deadline get a sentinel that keeps them last in either direction
     if sort == "deadline_asc":
-        # Nulls last for deadline
-        task_query = task_query.order_by(
-            Task.deadline.is_(None).asc(),  # Not null deadlines first
-            Task.deadline.asc()  # Then by deadline (soonest first)
-        )
+        order_by = [(func.coalesce(Task.deadline, NO_DEADLINE_ASC), False), (Task.id, False)]
+        key = lambda task: [task.deadline or NO_DEADLINE_ASC, task.id]
     elif sort == "deadline_desc":
-        task_query = task_query.order_by(
-            Task.deadline.is_(None).asc(),  # Not null deadlines first
-            Task.deadline.desc()  # Then by deadline (latest first)
-        )
-    elif sort == "created_desc":
-        task_query = task_query.order_by(Task.created_at.desc())
+        order_by = [(func.coalesce(Task.deadline, NO_DEADLINE_DESC), True), (Task.id, True)]
+        key = lambda task: [task.deadline or NO_DEADLINE_DESC, task.id]
     elif sort == "created_asc":
-        task_query = task_query.order_by(Task.created_at.asc())
+        order_by = [(Task.created_at, False), (Task.id, False)]
+        key = None
+    else:
+        order_by = [(Task.created_at, True), (Task.id, True)]
+        key = None
 
     # Paginate results
-    tasks = task_query.paginate(page=page, per_page=10)
+    tasks = keyset_paginate(task_query, order_by, cursor=request.args.get("cursor"), per_page=10, key=key)
 
     # Get task statistics
     all_tasks = Task.query.filter_by(company_id=company_id).all()
@@ -1182,7 +1190,7 @@ def manager_reports():
     """
     Show performance reports for the manager's team
     """
-    if not current_user.manager or not current_user.manager.company_id:
+    if not get_tenant().company_id:
         flash('You are not associated with a company.', "DANGER")
         return redirect(url_for('main.index'))
 
@@ -1210,7 +1218,7 @@ def manager_reports():
         end_date = datetime.utcnow()
         start_date = end_date - timedelta(days=days)
 
-    company_id = current_user.manager.company_id
+    company_id = get_tenant().company_id
 
     # Get key performance indicators
     # In a real application, this would query the database for actual stats
@@ -1330,7 +1338,7 @@ def edit_operator(operator_id):
     """
     Edit operator details
     """
-    if not current_user.manager or not current_user.manager.company_id:
+    if not get_tenant().company_id:
         flash('You are not associated with a company.', "DANGER")
         return redirect(url_for('main.index'))
 
@@ -1399,7 +1407,7 @@ def request_password_reset(user_id):
     """
     Request password reset for an operator
     """
-    if not current_user.manager or not current_user.manager.company_id:
+    if not get_tenant().company_id:
         flash('You are not associated with a company.', "DANGER")
         return redirect(url_for('main.index'))
 
@@ -1431,7 +1439,7 @@ def request_password_reset(user_id):
             sender_id=current_user.id,
             recipient_id=user.id,
             task_id=None,
-            company_id=current_user.manager.company_id,
+            company_id=get_tenant().company_id,
             is_read=False,
             sent_at=datetime.utcnow()
         )
@@ -1462,7 +1470,7 @@ def unassign_driver_from_operator(operator_id, driver_id):
     """
     Remove a driver from an operator
     """
-    if not current_user.manager or not current_user.manager.company_id:
+    if not get_tenant().company_id:
         flash('You are not authorized to perform this action.', "DANGER")
         return redirect(url_for('main.index'))
 
@@ -1505,7 +1513,7 @@ def assign_drivers_to_operator(operator_id):
     """
     Assign drivers to an operator
     """
-    if not current_user.manager or not current_user.manager.company_id:
+    if not get_tenant().company_id:
         flash('You are not authorized to perform this action.', "DANGER")
         return redirect(url_for('main.index'))
 
@@ -1523,7 +1531,7 @@ def assign_drivers_to_operator(operator_id):
 
         # Get all drivers in the company
         company_drivers = Driver.query.filter_by(
-            company_id=current_user.manager.company_id
+            company_id=get_tenant().company_id
         ).all()
 
         # Update driver assignments
@@ -1553,11 +1561,11 @@ def operator_dashboard():
     """
     Dashboard for operator showing their tasks and assigned drivers
     """
-    if not current_user.operator or not current_user.operator.company_id:
+    company_id = get_tenant().company_id
+    if not company_id:
         flash('You are not associated with a company.', "danger")
         return redirect(url_for('main.index'))
 
-    company_id = current_user.operator.company_id
 
     # Get assigned drivers
     drivers = Driver.query.filter_by(operator_id=current_user.operator.id).all()
@@ -1589,10 +1597,7 @@ def operator_dashboard():
     completed_routes = route_query.filter_by(status=RouteStatus.COMPLETED).count()
 
     # Get unread messages count
-    unread_count = Message.query.filter_by(
-        recipient_id=current_user.id,
-        is_read=False
-    ).count()
+    unread_count = MessageService.get_unread_messages_count(current_user.id)
 
     # Get manager info
     manager = None
@@ -1631,11 +1636,11 @@ def driver_dashboard():
     """
     Dashboard for driver showing their tasks and routes
     """
-    if not current_user.driver or not current_user.driver.company_id:
+    company_id = get_tenant().company_id
+    if not company_id:
         flash('You are not associated with a company.', "danger")
         return redirect(url_for('main.index'))
 
-    company_id = current_user.driver.company_id
 
     # Get task statistics for driver
     task_query = Task.query.filter_by(
@@ -1677,10 +1682,7 @@ def driver_dashboard():
     next_route = route_query.filter_by(status=RouteStatus.PLANNED).order_by(Route.start_time).first()
 
     # Get unread messages count
-    unread_count = Message.query.filter_by(
-        recipient_id=current_user.id,
-        is_read=False
-    ).count()
+    unread_count = MessageService.get_unread_messages_count(current_user.id)
 
     # Get operator info
     operator = None
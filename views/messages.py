@@ -1,15 +1,20 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request
+import json
+import time
+
+from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify, current_app, Response
 from flask_login import login_required, current_user
 from datetime import datetime
 from sqlalchemy import or_, and_, desc, func, case
 from wtforms import SelectField, StringField
 from wtforms.validators import DataRequired
 
-from app import db
+from app import db, event_bus
 from forms import MessageForm
 from models import Message, User, UserRole, Task, Company, ActionType
 from models import CompanyOwner, Manager, Operator, Driver
+from services import MessageService
 from utils import log_action
+from tenant import get_tenant, resolve_company_id
 
 messages = Blueprint('messages', __name__, url_prefix='/messages')
 
@@ -38,7 +43,7 @@ def inbox():
     messages_pagination = query.paginate(page=page, per_page=10)
 
     # Get unread message count for badge
-    unread_count = Message.query.filter_by(recipient_id=current_user.id, is_read=False).count()
+    unread_count = MessageService.get_unread_messages_count(current_user.id)
 
     # Get current datetime for relative time display
     now = datetime.utcnow()
@@ -79,7 +84,7 @@ def sent():
     messages_pagination = query.paginate(page=page, per_page=10)
 
     # Get unread message count for badge
-    unread_count = Message.query.filter_by(recipient_id=current_user.id, is_read=False).count()
+    unread_count = MessageService.get_unread_messages_count(current_user.id)
 
     # Get current datetime for relative time display
     now = datetime.utcnow()
@@ -108,15 +113,7 @@ def compose():
         pass
 
     # Get company ID based on user role
-    company_id = None
-    if current_user.role == UserRole.COMPANY_OWNER and current_user.company_owner:
-        company_id = current_user.company_owner.company_id
-    elif current_user.role == UserRole.MANAGER and current_user.manager:
-        company_id = current_user.manager.company_id
-    elif current_user.role == UserRole.OPERATOR and current_user.operator:
-        company_id = current_user.operator.company_id
-    elif current_user.role == UserRole.DRIVER and current_user.driver:
-        company_id = current_user.driver.company_id
+    company_id = get_tenant().company_id
 
     # Get available recipients based on role
     available_recipients = []
@@ -263,6 +260,7 @@ def compose():
             db.session.add(message)
             db.session.commit()
             log_action(ActionType.CREATE, f"Sent message to user ID {recipient_id}", db)
+            MessageService.publish_new_message(message)
             flash('Message sent successfully!', 'success')
 
             # Redirect to chat with recipient
@@ -272,7 +270,7 @@ def compose():
             flash(f'Error sending message: {str(e)}', 'danger')
 
     # Get unread count for navbar
-    unread_count = Message.query.filter_by(recipient_id=current_user.id, is_read=False).count()
+    unread_count = MessageService.get_unread_messages_count(current_user.id)
 
     return render_template(
         'messages/compose.html',
@@ -296,15 +294,16 @@ def chat(user_id):
         flash('You cannot message this user.', 'danger')
         return redirect(url_for('messages.inbox'))
 
-    # Get chat history
-    messages_query = Message.query.filter(
-        or_(
-            and_(Message.sender_id == current_user.id, Message.recipient_id == user_id),
-            and_(Message.sender_id == user_id, Message.recipient_id == current_user.id)
-        )
-    ).order_by(Message.sent_at.asc())
+    # Mark received messages as read with a single UPDATE. This runs before the
+    # history is loaded so its commit doesn't expire the loaded messages.
+    try:
+        MessageService.mark_conversation_read(current_user.id, user_id, db.session)
+    except Exception:
+        pass
 
-    messages_list = messages_query.all()
+    # Get the most recent page of chat history; older pages are loaded via chat_history
+    page_size = current_app.config.get('CHAT_PAGE_SIZE', 50)
+    messages_list, has_older = MessageService.get_conversation(current_user.id, user_id, limit=page_size)
 
     # Create form for sending new message
     form = MessageForm()
@@ -324,11 +323,6 @@ def chat(user_id):
         form.task_id.data = task_id
         is_task_related = True
 
-    # Mark received messages as read
-    unread_messages = [m for m in messages_list if m.recipient_id == current_user.id and not m.is_read]
-    for message in unread_messages:
-        message.is_read = True
-
     # Get contacts for sidebar
     contacts = _get_user_contacts()
 
@@ -338,15 +332,7 @@ def chat(user_id):
         task_id = form.task_id.data if hasattr(form, 'task_id') else None
 
         # Get company ID based on user role
-        company_id = None
-        if current_user.role == UserRole.COMPANY_OWNER and current_user.company_owner:
-            company_id = current_user.company_owner.company_id
-        elif current_user.role == UserRole.MANAGER and current_user.manager:
-            company_id = current_user.manager.company_id
-        elif current_user.role == UserRole.OPERATOR and current_user.operator:
-            company_id = current_user.operator.company_id
-        elif current_user.role == UserRole.DRIVER and current_user.driver:
-            company_id = current_user.driver.company_id
+        company_id = get_tenant().company_id
 
         # Create and save message
         message = Message(
@@ -361,13 +347,9 @@ def chat(user_id):
 
         try:
             db.session.add(message)
-
-            # Also update read status for unread messages
-            if unread_messages:
-                db.session.bulk_save_objects(unread_messages)
-
             db.session.commit()
             log_action(ActionType.CREATE, f"Sent message to user ID {user_id}", db)
+            MessageService.publish_new_message(message)
 
             # Clear form
             form.content.data = ""
@@ -380,13 +362,15 @@ def chat(user_id):
             flash(f'Error sending message: {str(e)}', 'danger')
 
     # Get unread count for navbar
-    unread_count = Message.query.filter_by(recipient_id=current_user.id, is_read=False).count()
+    unread_count = MessageService.get_unread_messages_count(current_user.id)
 
     return render_template(
         'messages/chat.html',
         title=f'Chat with {other_user.first_name} {other_user.last_name}',
         other_user=other_user,
         messages=messages_list,
+        older_cursor=MessageService.make_cursor(messages_list[0]) if has_older and messages_list else None,
+        latest_cursor=MessageService.make_cursor(messages_list[-1]) if messages_list else None,
         form=form,
         unread_count=unread_count,
         contacts=contacts,
@@ -396,6 +380,93 @@ def chat(user_id):
     )
 
 
+@messages.route('/chat/<int:user_id>/history')
+@login_required
+def chat_history(user_id):
+    """
+    Get chat messages as JSON using keyset cursors
+
+    Query parameters:
+        before: "<sent_at>,<id>" cursor, returns the page of older messages
+        since: "<sent_at>,<id>" cursor, returns messages newer than it
+        limit: Page size (capped at MAX_PAGE_SIZE)
+    """
+    other_user = User.query.get_or_404(user_id)
+
+    if not _can_message_user(other_user):
+        return jsonify({'success': False, 'error': 'You cannot message this user.'}), 403
+
+    before = MessageService.parse_cursor(request.args.get('before'))
+    since = MessageService.parse_cursor(request.args.get('since'))
+
+    if (request.args.get('before') and before is None) or (request.args.get('since') and since is None):
+        return jsonify({'success': False, 'error': 'Invalid cursor'}), 400
+
+    limit = request.args.get('limit', current_app.config.get('CHAT_PAGE_SIZE', 50), type=int)
+    limit = max(1, min(limit, current_app.config.get('MAX_PAGE_SIZE', 100)))
+
+    messages_list, has_more = MessageService.get_conversation(
+        current_user.id, user_id, before=before, since=since, limit=limit
+    )
+
+    payload = {
+        'success': True,
+        'messages': [_serialize_message(m) for m in messages_list],
+        'has_more': has_more,
+        'before': MessageService.make_cursor(messages_list[0]) if messages_list else None,
+        'since': MessageService.make_cursor(messages_list[-1]) if messages_list else request.args.get('since')
+    }
+
+    # New incoming messages are being displayed, so mark them as read
+    if since is not None and any(m.recipient_id == current_user.id and not m.is_read for m in messages_list):
+        try:
+            MessageService.mark_conversation_read(current_user.id, user_id, db.session)
+        except Exception:
+            pass
+
+    return jsonify(payload)
+
+
+@messages.route('/stream')
+@login_required
+def stream():
+    """
+    Server-Sent Events stream of new messages and unread counts
+
+    Each connection holds a worker thread, so the stream ends after
+    EVENT_STREAM_MAX_DURATION seconds and the browser reconnects.
+    """
+    user_id = current_user.id
+    unread_count = MessageService.get_unread_messages_count(user_id)
+    heartbeat = current_app.config.get('EVENT_STREAM_HEARTBEAT', 15)
+    max_duration = current_app.config.get('EVENT_STREAM_MAX_DURATION', 300)
+
+    subscription = event_bus.subscribe(user_id)
+
+    # Don't hold a database connection for the lifetime of the stream
+    db.session.remove()
+
+    def generate():
+        try:
+            yield 'retry: 5000\n\n'
+            yield _format_event('unread', {'count': unread_count})
+
+            deadline = time.monotonic() + max_duration
+            while time.monotonic() < deadline:
+                payload = subscription.get(timeout=heartbeat)
+                if payload is None:
+                    yield ': keep-alive\n\n'
+                    continue
+                yield _format_event(payload['event'], payload['data'])
+        finally:
+            subscription.close()
+
+    response = Response(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
 @messages.route('/clear-chat/<int:user_id>', methods=['POST'])
 @login_required
 def clear_chat(user_id):
@@ -411,14 +482,8 @@ def clear_chat(user_id):
 
     try:
         # Delete all messages between the two users
-        Message.query.filter(
-            or_(
-                and_(Message.sender_id == current_user.id, Message.recipient_id == user_id),
-                and_(Message.sender_id == user_id, Message.recipient_id == current_user.id)
-            )
-        ).delete(synchronize_session=False)
+        MessageService.delete_conversation(current_user.id, user_id, db.session)
 
-        db.session.commit()
         log_action(ActionType.DELETE, f"Cleared chat history with user ID {user_id}", db)
         flash('Chat history cleared successfully!', 'success')
     except Exception as e:
@@ -458,15 +523,7 @@ def send_message(user_id):
         task_id = None
 
     # Get company ID based on user role
-    company_id = None
-    if current_user.role == UserRole.COMPANY_OWNER and current_user.company_owner:
-        company_id = current_user.company_owner.company_id
-    elif current_user.role == UserRole.MANAGER and current_user.manager:
-        company_id = current_user.manager.company_id
-    elif current_user.role == UserRole.OPERATOR and current_user.operator:
-        company_id = current_user.operator.company_id
-    elif current_user.role == UserRole.DRIVER and current_user.driver:
-        company_id = current_user.driver.company_id
+    company_id = get_tenant().company_id
 
     try:
         # Create and save message
@@ -483,6 +540,7 @@ def send_message(user_id):
         db.session.add(message)
         db.session.commit()
         log_action(ActionType.CREATE, f"Sent message to user ID {user_id}", db)
+        MessageService.publish_new_message(message)
 
         # No flash message - users don't need confirmation for each sent message
     except Exception as e:
@@ -502,26 +560,8 @@ def _can_message_user(other_user):
         return True
 
     # Get company IDs
-    current_company_id = None
-    other_company_id = None
-
-    if current_user.role == UserRole.COMPANY_OWNER and current_user.company_owner:
-        current_company_id = current_user.company_owner.company_id
-    elif current_user.role == UserRole.MANAGER and current_user.manager:
-        current_company_id = current_user.manager.company_id
-    elif current_user.role == UserRole.OPERATOR and current_user.operator:
-        current_company_id = current_user.operator.company_id
-    elif current_user.role == UserRole.DRIVER and current_user.driver:
-        current_company_id = current_user.driver.company_id
-
-    if other_user.role == UserRole.COMPANY_OWNER and other_user.company_owner:
-        other_company_id = other_user.company_owner.company_id
-    elif other_user.role == UserRole.MANAGER and other_user.manager:
-        other_company_id = other_user.manager.company_id
-    elif other_user.role == UserRole.OPERATOR and other_user.operator:
-        other_company_id = other_user.operator.company_id
-    elif other_user.role == UserRole.DRIVER and other_user.driver:
-        other_company_id = other_user.driver.company_id
+    current_company_id = get_tenant().company_id
+    other_company_id = resolve_company_id(other_user)
 
     # Users must be in the same company
     if current_company_id is None or other_company_id is None or current_company_id != other_company_id:
@@ -538,79 +578,32 @@ def _can_message_user(other_user):
     return True
 
 
-def _get_user_contacts():
+def _format_event(event, data):
     """
-    Get all contacts for current user with unread message counts
+    Format one Server-Sent Events frame
     """
-    # Get company ID based on user role
-    company_id = None
-    if current_user.role == UserRole.COMPANY_OWNER and current_user.company_owner:
-        company_id = current_user.company_owner.company_id
-    elif current_user.role == UserRole.MANAGER and current_user.manager:
-        company_id = current_user.manager.company_id
-    elif current_user.role == UserRole.OPERATOR and current_user.operator:
-        company_id = current_user.operator.company_id
-    elif current_user.role == UserRole.DRIVER and current_user.driver:
-        company_id = current_user.driver.company_id
-
-    contacts = []
-
-    if not company_id and current_user.role != UserRole.ADMIN:
-        return contacts
-
-    # Get all distinct users with whom the current user has exchanged messages
-    senders = db.session.query(Message.sender_id).filter(
-        Message.recipient_id == current_user.id,
-        Message.sender_id != current_user.id
-    ).distinct().all()
-
-    recipients = db.session.query(Message.recipient_id).filter(
-        Message.sender_id == current_user.id,
-        Message.recipient_id != current_user.id
-    ).distinct().all()
-
-    # Объединяем уникальные ID
-    contact_ids = set([sender[0] for sender in senders] + [recipient[0] for recipient in recipients])
-
-    # Get user objects for all contacts
-    for contact_id in contact_ids:
-        contact = User.query.get(contact_id)
-
-        if not contact:
-            continue
-
-        # Check if this is a valid contact (same company, etc.)
-        if not _can_message_user(contact):
-            continue
-
-        # Count unread messages from this contact
-        unread_count = Message.query.filter_by(
-            sender_id=contact_id,
-            recipient_id=current_user.id,
-            is_read=False
-        ).count()
-
-        # Get last message time
-        last_message = Message.query.filter(
-            or_(
-                and_(Message.sender_id == current_user.id, Message.recipient_id == contact_id),
-                and_(Message.sender_id == contact_id, Message.recipient_id == current_user.id)
-            )
-        ).order_by(Message.sent_at.desc()).first()
-
-        last_message_time = last_message.sent_at if last_message else None
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
-        # Get role name
-        role_name = contact.role.value.replace('_', ' ').title()
 
-        contacts.append({
-            'user': contact,
-            'unread_count': unread_count,
-            'last_message_time': last_message_time,
-            'role_name': role_name
-        })
+def _serialize_message(message):
+    """
+    Convert a message to a JSON-friendly dict for the chat API
+    """
+    data = MessageService.serialize_message(message)
+    data['is_mine'] = message.sender_id == current_user.id
+    return data
 
-    # Sort by unread count (descending), then by last message time (descending)
-    contacts.sort(key=lambda x: (-x['unread_count'], x['last_message_time'] or datetime.min), reverse=True)
 
-    return contacts
\ No newline at end of file
+def _get_user_contacts():
+    """
+    Get all contacts for current user with unread message counts
+    """
+    tenant = get_tenant()
+    operator_id = current_user.driver.operator_id if tenant.is_driver and current_user.driver else None
+
+    return MessageService.get_contact_summaries(
+        current_user.id,
+        current_user.role,
+        company_id=tenant.company_id,
+        operator_id=operator_id
+    )
@@ -1,16 +1,21 @@
 from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify
 from flask_login import login_required, current_user
 from datetime import datetime, timedelta
-from sqlalchemy import func, or_, and_
+from sqlalchemy import func, or_, and_, select
+from sqlalchemy.orm import contains_eager, selectinload
 
-from app import db
+from app import db, track_writer
 from models import (
     User, Route, RouteStatus, Task, TaskStatus, Driver, Message,
     Document, UserRole, ActionType, Log, Company
 )
 from forms import DocumentUploadForm, TaskForm, MessageForm
-from utils import role_required, log_action
+from utils import role_required, log_action, stream_csv_response, keyset_paginate
 from services import TaskService, RouteService
+from tenant import get_tenant
+
+# Sort key for drivers who have never logged in
+NEVER_LOGGED_IN = datetime(1970, 1, 1)
 
 # Create blueprint
 operator = Blueprint('operator', __name__, url_prefix='/operator')
@@ -23,21 +28,23 @@ def drivers():
     """
     Show drivers assigned to this operator
     """
-    if not current_user.operator or not current_user.operator.company_id:
+    if not get_tenant().company_id:
         flash('You are not associated with a company.', 'danger')
         return redirect(url_for('main.index'))
 
-    page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor')
     status = request.args.get('status', None)
     sort = request.args.get('sort', 'name_asc')
     search_term = request.args.get('search', '')
 
-    # Get drivers assigned to this operator
-    driver_query = Driver.query.filter_by(operator_id=current_user.operator.id)
+    # Get drivers assigned to this operator; User is joined once for filters and sorting
+    driver_query = Driver.query.join(User, User.id == Driver.id).filter(
+        Driver.operator_id == current_user.operator.id
+    ).options(contains_eager(Driver.user))
 
     # Apply status filter
     if status == 'active':
-        driver_query = driver_query.join(User, User.id == Driver.id).filter(User.is_active == True)
+        driver_query = driver_query.filter(User.is_active == True)
     elif status == 'idle':
         # Idle drivers are those not on a route
         driver_query = driver_query.outerjoin(
@@ -57,7 +64,7 @@ def drivers():
 
     # Apply search filter
     if search_term:
-        driver_query = driver_query.join(User, User.id == Driver.id).filter(
+        driver_query = driver_query.filter(
             or_(
                 User.first_name.ilike(f'%{search_term}%'),
                 User.last_name.ilike(f'%{search_term}%'),
@@ -67,21 +74,21 @@ def drivers():
             )
         )
 
-    # Apply sorting
-    if sort == 'name_asc':
-        driver_query = driver_query.join(User, User.id == Driver.id).order_by(User.first_name, User.last_name)
-    elif sort == 'name_desc':
-        driver_query = driver_query.join(User, User.id == Driver.id).order_by(User.first_name.desc(),
-                                                                              User.last_name.desc())
-    elif sort == 'tasks_desc':
-        # This would need a more complex query with task counts
-        driver_query = driver_query.join(User, User.id == Driver.id).order_by(User.first_name, User.last_name)
+    # Apply sorting; Driver.id breaks ties so the keyset is unique
+    if sort == 'name_desc':
+        order_by = [(User.first_name, True), (User.last_name, True), (Driver.id, True)]
+        key = lambda driver: [driver.user.first_name, driver.user.last_name, driver.id]
     elif sort == 'last_active_desc':
-        # Could use last login time or last activity from logs
-        driver_query = driver_query.join(User, User.id == Driver.id).order_by(User.last_login.desc().nullslast())
+        # Could use last activity from logs; drivers who never logged in go last
+        order_by = [(func.coalesce(User.last_login, NEVER_LOGGED_IN), True), (Driver.id, True)]
+        key = lambda driver: [driver.user.last_login or NEVER_LOGGED_IN, driver.id]
+    else:
+        # name_asc, and tasks_desc which would need a more complex query with task counts
+        order_by = [(User.first_name, False), (User.last_name, False), (Driver.id, False)]
+        key = lambda driver: [driver.user.first_name, driver.user.last_name, driver.id]
 
     # Paginate results
-    drivers = driver_query.paginate(page=page, per_page=10)
+    drivers = keyset_paginate(driver_query, order_by, cursor=cursor, per_page=10, key=key)
 
     # Get stats for top drivers (for chart)
     top_drivers = []
@@ -135,6 +142,42 @@ def drivers():
     )
 
 
+@operator.route('/driver-positions')
+@login_required
+@role_required(UserRole.OPERATOR.value)
+def driver_positions():
+    """
+    Last known GPS positions of this operator's drivers, for the live map
+
+    Positions come from the in-memory cache fed by the ingest endpoint; see
+    TrackWriter.last_positions for when driver_positions is read instead.
+    """
+    if not current_user.operator:
+        return jsonify({'success': False, 'error': 'Not an operator'}), 403
+
+    drivers = db.session.query(Driver.id, User.first_name, User.last_name).join(
+        User, User.id == Driver.id
+    ).filter(Driver.operator_id == current_user.operator.id).all()
+
+    positions = track_writer.last_positions(driver.id for driver in drivers)
+
+    return jsonify({
+        'success': True,
+        'positions': [
+            {
+                'driver_id': driver.id,
+                'name': f'{driver.first_name} {driver.last_name}',
+                'lat': positions[driver.id]['lat'],
+                'lng': positions[driver.id]['lng'],
+                'speed': positions[driver.id]['speed'],
+                'route_id': positions[driver.id]['route_id'],
+                'recorded_at': positions[driver.id]['recorded_at'].isoformat() + 'Z'
+            }
+            for driver in drivers if driver.id in positions
+        ]
+    })
+
+
 @operator.route('/tasks')
 @login_required
 @role_required(UserRole.OPERATOR.value)
@@ -142,7 +185,7 @@ def tasks():
     """
     Show tasks created by this operator
     """
-    if not current_user.operator or not current_user.operator.company_id:
+    if not get_tenant().company_id:
         flash('You are not associated with a company.', 'danger')
         return redirect(url_for('main.index'))
 
@@ -241,7 +284,7 @@ def routes():
     """
     Show routes for drivers managed by this operator
     """
-    if not current_user.operator or not current_user.operator.company_id:
+    if not get_tenant().company_id:
         flash('You are not associated with a company.', 'danger')
         return redirect(url_for('main.index'))
 
@@ -302,8 +345,8 @@ def routes():
     # Order by start time
     route_query = route_query.order_by(Route.start_time.desc())
 
-    # Paginate results
-    routes = route_query.paginate(page=page, per_page=10)
+    # Paginate results; the list shows waypoint progress per route
+    routes = route_query.options(selectinload(Route.waypoint_rows)).paginate(page=page, per_page=10)
 
     # Get all drivers for filter dropdown
     drivers = Driver.query.filter_by(operator_id=current_user.operator.id).all()
@@ -355,7 +398,7 @@ def documents():
     """
     Show documents related to this operator's tasks and drivers
     """
-    if not current_user.operator or not current_user.operator.company_id:
+    if not get_tenant().company_id:
         flash('You are not associated with a company.', 'danger')
         return redirect(url_for('main.index'))
 
@@ -429,7 +472,7 @@ def statistics():
     """
     Show performance statistics for drivers and tasks
     """
-    if not current_user.operator or not current_user.operator.company_id:
+    if not get_tenant().company_id:
         flash('You are not associated with a company.', 'danger')
         return redirect(url_for('main.index'))
 
@@ -930,7 +973,7 @@ def download_report():
     """
     Download statistics report as CSV
     """
-    if not current_user.operator or not current_user.operator.company_id:
+    if not get_tenant().company_id:
         flash('You are not associated with a company.', 'danger')
         return redirect(url_for('main.index'))
 
@@ -966,57 +1009,114 @@ def download_report():
         end_date = datetime.utcnow()
         start_date = end_date - timedelta(days=days)
 
-    # Get driver IDs for this operator
-    operator_driver_ids = [d.id for d in Driver.query.filter_by(operator_id=current_user.operator.id).all()]
-
     # Only CSV format is implemented
     if report_format != 'csv':
         flash('Only CSV format is currently supported.', 'warning')
         return redirect(url_for('operator.statistics', period=period, report_type=report_type, driver_id=driver_id))
 
-    # Create CSV file
-    import io
-    import csv
-    from flask import send_file
+    log_action(ActionType.DOWNLOAD, f"Downloaded {report_type} report", db)
+
+    rows = _download_report_rows(
+        report_type,
+        current_user.operator.id,
+        current_user.id,
+        f"{current_user.first_name} {current_user.last_name}",
+        start_date,
+        end_date
+    )
+
+    return stream_csv_response(rows, f"{report_type}_report_{datetime.utcnow().strftime('%Y%m%d')}.csv")
+
+
+def _download_report_rows(report_type, operator_id, user_id, user_name, start_date, end_date):
+    """
+    Generate operator report rows while the response is streamed
+
+    Counts are aggregated in the database and per-row data is read with a
+    server-side cursor, so memory use stays flat however large the period is.
 
-    output = io.StringIO()
-    writer = csv.writer(output)
+    Args:
+        report_type: 'drivers', 'routes' or 'tasks'
+        operator_id: ID of the operator the drivers belong to
+        user_id: ID of the requesting user (task creator)
+        user_name: Name shown as report author
+        start_date: Start of the reporting period
+        end_date: End of the reporting period
+
+    Yields:
+        CSV rows as lists
+    """
+    operator_driver_ids = select(Driver.id).where(Driver.operator_id == operator_id)
 
     # Write header with report info
-    writer.writerow(['Report Type', report_type.capitalize()])
-    writer.writerow(['Period', f"{start_date.strftime('%Y-%m-%d')} to {end_date.strftime('%Y-%m-%d')}"])
-    writer.writerow(['Generated', datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')])
-    writer.writerow(['Generated By', f"{current_user.first_name} {current_user.last_name}"])
-    writer.writerow([])
+    yield ['Report Type', report_type.capitalize()]
+    yield ['Period', f"{start_date.strftime('%Y-%m-%d')} to {end_date.strftime('%Y-%m-%d')}"]
+    yield ['Generated', datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')]
+    yield ['Generated By', user_name]
+    yield []
 
     # Write report based on type
     if report_type == 'drivers':
-        writer.writerow(['Driver Performance Report'])
-        writer.writerow([])
+        yield ['Driver Performance Report']
+        yield []
 
         # Write headers
-        writer.writerow(['Driver Name', 'Total Tasks', 'Completed Tasks', 'Completion Rate',
-                         'Avg Completion Time (min)', 'Total Distance (km)', 'On-Time Rate'])
-
-        # Write data for each driver
-        for driver in Driver.query.filter_by(operator_id=current_user.operator.id).all():
-            if not driver.user:
-                continue
+        yield ['Driver Name', 'Total Tasks', 'Completed Tasks', 'Completion Rate',
+               'Avg Completion Time (min)', 'Total Distance (km)', 'On-Time Rate']
+
+        # Task counts per driver
+        task_counts = dict(
+            (assignee_id, (total, completed))
+            for assignee_id, total, completed in db.session.execute(
+                select(
+                    Task.assignee_id,
+                    func.count(Task.id),
+                    func.count(Task.id).filter(Task.status == TaskStatus.COMPLETED)
+                ).where(
+                    Task.assignee_id.in_(operator_driver_ids),
+                    Task.created_at.between(start_date, end_date)
+                ).group_by(Task.assignee_id)
+            )
+        )
 
-            # Get completed tasks
-            driver_tasks = Task.query.filter(
-                Task.assignee_id == driver.id,
-                Task.created_at.between(start_date, end_date)
-            ).all()
+        # Completed distance per driver
+        driver_distances = dict(db.session.execute(
+            select(
+                Route.driver_id,
+                func.coalesce(func.sum(Route.distance), 0)
+            ).where(
+                Route.driver_id.in_(operator_driver_ids),
+                Route.status == RouteStatus.COMPLETED,
+                Route.start_time.between(start_date, end_date)
+            ).group_by(Route.driver_id)
+        ).all())
+
+        # Completion times, accumulated per driver from a server-side cursor
+        completion_minutes = {}
+        completed_tasks = db.session.execute(
+            select(Task.assignee_id, Task.created_at, Task.updated_at).where(
+                Task.assignee_id.in_(operator_driver_ids),
+                Task.status == TaskStatus.COMPLETED,
+                Task.created_at.between(start_date, end_date),
+                Task.updated_at.isnot(None)
+            ).execution_options(yield_per=1000)
+        )
+        for assignee_id, created_at, updated_at in completed_tasks:
+            minutes_sum, minutes_count = completion_minutes.get(assignee_id, (0, 0))
+            completion_minutes[assignee_id] = (
+                minutes_sum + (updated_at - created_at).total_seconds() / 60,
+                minutes_count + 1
+            )
 
-            total_tasks_count = len(driver_tasks)
-            completed_tasks_count = sum(1 for t in driver_tasks if t.status == TaskStatus.COMPLETED)
+        # Write data for each driver
+        drivers_query = select(Driver.id, User.first_name, User.last_name).join(
+            User, Driver.id == User.id
+        ).where(
+            Driver.operator_id == operator_id
+        ).order_by(User.first_name, User.last_name)
 
-            # Get completed routes
-            driver_routes = Route.query.filter(
-                Route.driver_id == driver.id,
-                Route.created_at.between(start_date, end_date)
-            ).all()
+        for driver_id, first_name, last_name in db.session.execute(drivers_query):
+            total_tasks_count, completed_tasks_count = task_counts.get(driver_id, (0, 0))
 
             # Calculate completion rate
             completion_rate = (completed_tasks_count / total_tasks_count * 100) if total_tasks_count > 0 else 0
@@ -1025,187 +1125,137 @@ def download_report():
             import random
             on_time_rate = random.randint(60, 100)
 
-            # Calculate total distance
-            driver_distance = sum(r.distance or 0 for r in driver_routes if r.status == RouteStatus.COMPLETED)
+            minutes_sum, minutes_count = completion_minutes.get(driver_id, (0, 0))
+            avg_completion_time = minutes_sum / minutes_count if minutes_count else 0
 
-            # Calculate average completion time
-            completion_times = []
-            for task in driver_tasks:
-                if task.status == TaskStatus.COMPLETED and task.created_at and task.updated_at:
-                    duration = (task.updated_at - task.created_at).total_seconds() / 60  # in minutes
-                    completion_times.append(duration)
-
-            avg_completion_time = sum(completion_times) / len(completion_times) if completion_times else 0
-
-            writer.writerow([
-                f"{driver.user.first_name} {driver.user.last_name}",
+            yield [
+                f"{first_name} {last_name}",
                 total_tasks_count,
                 completed_tasks_count,
                 f"{round(completion_rate, 1)}%",
                 round(avg_completion_time),
-                round(driver_distance, 1),
+                round(driver_distances.get(driver_id, 0) or 0, 1),
                 f"{on_time_rate}%"
-            ])
+            ]
 
     elif report_type == 'routes':
-        writer.writerow(['Route Analysis Report'])
-        writer.writerow([])
+        yield ['Route Analysis Report']
+        yield []
 
         # Write route status summary
-        writer.writerow(['Route Status Summary'])
-        writer.writerow(['Status', 'Count', 'Percentage'])
-
-        # Get route stats
-        planned = Route.query.filter(
-            Route.driver_id.in_(operator_driver_ids) if operator_driver_ids else False,
-            Route.status == RouteStatus.PLANNED,
-            Route.created_at.between(start_date, end_date)
-        ).count()
-
-        in_progress = Route.query.filter(
-            Route.driver_id.in_(operator_driver_ids) if operator_driver_ids else False,
-            Route.status == RouteStatus.IN_PROGRESS,
-            Route.created_at.between(start_date, end_date)
-        ).count()
-
-        completed = Route.query.filter(
-            Route.driver_id.in_(operator_driver_ids) if operator_driver_ids else False,
-            Route.status == RouteStatus.COMPLETED,
-            Route.created_at.between(start_date, end_date)
-        ).count()
-
-        cancelled = Route.query.filter(
-            Route.driver_id.in_(operator_driver_ids) if operator_driver_ids else False,
-            Route.status == RouteStatus.CANCELLED,
-            Route.created_at.between(start_date, end_date)
-        ).count()
+        yield ['Route Status Summary']
+        yield ['Status', 'Count', 'Percentage']
+
+        # Get route stats in one query
+        route_counts = dict(db.session.execute(
+            select(Route.status, func.count(Route.id)).where(
+                Route.driver_id.in_(operator_driver_ids),
+                Route.start_time.between(start_date, end_date)
+            ).group_by(Route.status)
+        ).all())
+
+        planned = route_counts.get(RouteStatus.PLANNED, 0)
+        in_progress = route_counts.get(RouteStatus.IN_PROGRESS, 0)
+        completed = route_counts.get(RouteStatus.COMPLETED, 0)
+        cancelled = route_counts.get(RouteStatus.CANCELLED, 0)
 
         total_routes = planned + in_progress + completed + cancelled
 
-        writer.writerow(['Planned', planned, f"{(planned / total_routes * 100) if total_routes > 0 else 0:.1f}%"])
-        writer.writerow(
-            ['In Progress', in_progress, f"{(in_progress / total_routes * 100) if total_routes > 0 else 0:.1f}%"])
-        writer.writerow(['Completed', completed, f"{(completed / total_routes * 100) if total_routes > 0 else 0:.1f}%"])
-        writer.writerow(['Cancelled', cancelled, f"{(cancelled / total_routes * 100) if total_routes > 0 else 0:.1f}%"])
-        writer.writerow(['Total', total_routes, '100.0%'])
-
-        writer.writerow([])
-        writer.writerow(['Recent Routes'])
-        writer.writerow(['Start Point', 'End Point', 'Driver', 'Status', 'Distance (km)', 'Duration (min)'])
-
-        # Get recent routes
-        recent_routes = Route.query.filter(
-            Route.driver_id.in_(operator_driver_ids) if operator_driver_ids else False,
-            Route.created_at.between(start_date, end_date)
-        ).order_by(Route.created_at.desc()).limit(20).all()
-
-        for route in recent_routes:
-            driver_name = f"{route.driver.user.first_name} {route.driver.user.last_name}" if route.driver and route.driver.user else "Unassigned"
+        yield ['Planned', planned, f"{(planned / total_routes * 100) if total_routes > 0 else 0:.1f}%"]
+        yield ['In Progress', in_progress, f"{(in_progress / total_routes * 100) if total_routes > 0 else 0:.1f}%"]
+        yield ['Completed', completed, f"{(completed / total_routes * 100) if total_routes > 0 else 0:.1f}%"]
+        yield ['Cancelled', cancelled, f"{(cancelled / total_routes * 100) if total_routes > 0 else 0:.1f}%"]
+        yield ['Total', total_routes, '100.0%']
+
+        yield []
+        yield ['Recent Routes']
+        yield ['Start Point', 'End Point', 'Driver', 'Status', 'Distance (km)', 'Duration (min)']
+
+        # Get recent routes with driver names in the same query
+        recent_routes = select(
+            Route.start_point, Route.end_point, Route.status, Route.distance,
+            Route.start_time, Route.end_time, User.first_name, User.last_name
+        ).outerjoin(
+            User, Route.driver_id == User.id
+        ).where(
+            Route.driver_id.in_(operator_driver_ids),
+            Route.start_time.between(start_date, end_date)
+        ).order_by(Route.start_time.desc()).limit(20)
+
+        for (start_point, end_point, status, distance, start_time, end_time,
+             first_name, last_name) in db.session.execute(recent_routes):
+            driver_name = f"{first_name} {last_name}" if first_name is not None else "Unassigned"
 
             duration = "N/A"
-            if route.actual_start_time and route.end_time:
-                duration_min = int((route.end_time - route.actual_start_time).total_seconds() / 60)
+            if start_time and end_time:
+                duration_min = int((end_time - start_time).total_seconds() / 60)
                 duration = f"{duration_min}"
 
-            writer.writerow([
-                route.start_point,
-                route.end_point,
+            yield [
+                start_point,
+                end_point,
                 driver_name,
-                route.status.value.replace('_', ' ').title(),
-                f"{route.distance:.1f}" if route.distance else "N/A",
+                status.value.replace('_', ' ').title(),
+                f"{distance:.1f}" if distance else "N/A",
                 duration
-            ])
+            ]
 
     elif report_type == 'tasks':
-        writer.writerow(['Task Metrics Report'])
-        writer.writerow([])
+        yield ['Task Metrics Report']
+        yield []
 
         # Write task status summary
-        writer.writerow(['Task Status Summary'])
-        writer.writerow(['Status', 'Count', 'Percentage'])
-
-        # Get task stats
-        new_tasks = Task.query.filter(
-            Task.creator_id == current_user.id,
-            Task.status == TaskStatus.NEW,
-            Task.created_at.between(start_date, end_date)
-        ).count()
-
-        in_progress = Task.query.filter(
-            Task.creator_id == current_user.id,
-            Task.status == TaskStatus.IN_PROGRESS,
-            Task.created_at.between(start_date, end_date)
-        ).count()
-
-        on_hold = Task.query.filter(
-            Task.creator_id == current_user.id,
-            Task.status == TaskStatus.ON_HOLD,
-            Task.created_at.between(start_date, end_date)
-        ).count()
+        yield ['Task Status Summary']
+        yield ['Status', 'Count', 'Percentage']
 
-        completed = Task.query.filter(
-            Task.creator_id == current_user.id,
-            Task.status == TaskStatus.COMPLETED,
-            Task.created_at.between(start_date, end_date)
-        ).count()
+        # Get task stats in one query
+        task_counts = dict(db.session.execute(
+            select(Task.status, func.count(Task.id)).where(
+                Task.creator_id == user_id,
+                Task.created_at.between(start_date, end_date)
+            ).group_by(Task.status)
+        ).all())
 
-        cancelled = Task.query.filter(
-            Task.creator_id == current_user.id,
-            Task.status == TaskStatus.CANCELLED,
-            Task.created_at.between(start_date, end_date)
-        ).count()
+        new_tasks = task_counts.get(TaskStatus.NEW, 0)
+        in_progress = task_counts.get(TaskStatus.IN_PROGRESS, 0)
+        on_hold = task_counts.get(TaskStatus.ON_HOLD, 0)
+        completed = task_counts.get(TaskStatus.COMPLETED, 0)
+        cancelled = task_counts.get(TaskStatus.CANCELLED, 0)
 
         total_tasks = new_tasks + in_progress + on_hold + completed + cancelled
 
-        writer.writerow(['New', new_tasks, f"{(new_tasks / total_tasks * 100) if total_tasks > 0 else 0:.1f}%"])
-        writer.writerow(
-            ['In Progress', in_progress, f"{(in_progress / total_tasks * 100) if total_tasks > 0 else 0:.1f}%"])
-        writer.writerow(['On Hold', on_hold, f"{(on_hold / total_tasks * 100) if total_tasks > 0 else 0:.1f}%"])
-        writer.writerow(['Completed', completed, f"{(completed / total_tasks * 100) if total_tasks > 0 else 0:.1f}%"])
-        writer.writerow(['Cancelled', cancelled, f"{(cancelled / total_tasks * 100) if total_tasks > 0 else 0:.1f}%"])
-        writer.writerow(['Total', total_tasks, '100.0%'])
+        yield ['New', new_tasks, f"{(new_tasks / total_tasks * 100) if total_tasks > 0 else 0:.1f}%"]
+        yield ['In Progress', in_progress, f"{(in_progress / total_tasks * 100) if total_tasks > 0 else 0:.1f}%"]
+        yield ['On Hold', on_hold, f"{(on_hold / total_tasks * 100) if total_tasks > 0 else 0:.1f}%"]
+        yield ['Completed', completed, f"{(completed / total_tasks * 100) if total_tasks > 0 else 0:.1f}%"]
+        yield ['Cancelled', cancelled, f"{(cancelled / total_tasks * 100) if total_tasks > 0 else 0:.1f}%"]
+        yield ['Total', total_tasks, '100.0%']
 
-        writer.writerow([])
-        writer.writerow(['Task Assignment By Driver'])
-        writer.writerow(['Driver Name', 'Tasks Assigned', 'Percentage'])
+        yield []
+        yield ['Task Assignment By Driver']
+        yield ['Driver Name', 'Tasks Assigned', 'Percentage']
 
         # Get task distribution by driver
-        driver_task_counts = []
-
-        for driver in Driver.query.filter_by(operator_id=current_user.operator.id).all():
-            if not driver.user:
-                continue
-
-            task_count = Task.query.filter(
-                Task.creator_id == current_user.id,
-                Task.assignee_id == driver.id,
-                Task.created_at.between(start_date, end_date)
-            ).count()
-
-            if task_count > 0:
-                driver_task_counts.append({
-                    'name': f"{driver.user.first_name} {driver.user.last_name}",
-                    'count': task_count
-                })
-
-        for driver_data in driver_task_counts:
-            writer.writerow([
-                driver_data['name'],
-                driver_data['count'],
-                f"{(driver_data['count'] / total_tasks * 100) if total_tasks > 0 else 0:.1f}%"
-            ])
-
-    # Prepare file for download
-    output.seek(0)
-
-    log_action(ActionType.DOWNLOAD, f"Downloaded {report_type} report", db)
+        driver_task_counts = select(
+            User.first_name, User.last_name, func.count(Task.id)
+        ).join(
+            Driver, Task.assignee_id == Driver.id
+        ).join(
+            User, Driver.id == User.id
+        ).where(
+            Driver.operator_id == operator_id,
+            Task.creator_id == user_id,
+            Task.created_at.between(start_date, end_date)
+        ).group_by(
+            Driver.id, User.first_name, User.last_name
+        ).order_by(User.first_name, User.last_name)
 
-    return send_file(
-        io.BytesIO(output.getvalue().encode('utf-8')),
-        mimetype='text/csv',
-        as_attachment=True,
-        download_name=f"{report_type}_report_{datetime.utcnow().strftime('%Y%m%d')}.csv"
-    )
+        for first_name, last_name, task_count in db.session.execute(driver_task_counts):
+            yield [
+                f"{first_name} {last_name}",
+                task_count,
+                f"{(task_count / total_tasks * 100) if total_tasks > 0 else 0:.1f}%"
+            ]
 
 
 @operator.route('/view-driver/<int:driver_id>')
@@ -1215,7 +1265,7 @@ def view_driver(driver_id):
     """
     View detailed information about a driver
     """
-    if not current_user.operator or not current_user.operator.company_id:
+    if not get_tenant().company_id:
         flash('You are not associated with a company.', 'danger')
         return redirect(url_for('main.index'))
 
@@ -1325,7 +1375,7 @@ def edit_driver(driver_id):
     """
     Edit driver information
     """
-    if not current_user.operator or not current_user.operator.company_id:
+    if not get_tenant().company_id:
         flash('You are not associated with a company.', 'danger')
         return redirect(url_for('main.index'))
 
@@ -1389,7 +1439,7 @@ def edit_driver(driver_id):
                     recipient_id=driver.id,
                     sent_at=datetime.utcnow(),
                     is_read=False,
-                    company_id=current_user.operator.company_id
+                    company_id=get_tenant().company_id
                 )
                 db.session.add(message)
 
@@ -1420,7 +1470,7 @@ def request_driver():
     """
     Request a new driver to be added
     """
-    if not current_user.operator or not current_user.operator.company_id:
+    if not get_tenant().company_id:
         flash('You are not associated with a company.', 'danger')
         return redirect(url_for('main.index'))
 
@@ -1447,7 +1497,7 @@ def request_driver():
                 company_owner = db.session.query(User).join(
                     User.company_owner
                 ).filter(
-                    User.company_owner.has(company_id=current_user.operator.company_id)
+                    User.company_owner.has(company_id=get_tenant().company_id)
                 ).first()
 
                 if company_owner:
@@ -1481,7 +1531,7 @@ Requested by: {current_user.first_name} {current_user.last_name}
                 recipient_id=recipient_id,
                 sent_at=datetime.utcnow(),
                 is_read=False,
-                company_id=current_user.operator.company_id
+                company_id=get_tenant().company_id
             )
 
             db.session.add(message)
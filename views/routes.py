@@ -1,16 +1,19 @@
 import re
 
-import requests
 from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify, current_app
 from flask_login import login_required, current_user
 from datetime import datetime
 from sqlalchemy import or_
+from sqlalchemy.orm import selectinload
 
-from app import db
+from app import db, geocoder
 from forms import RouteForm
 from models import Route, RouteStatus, User, UserRole, Driver, Task, TaskStatus
 from services import RouteService
-from utils import role_required, company_access_required, log_action, extract_coordinates_from_maps_url
+from geocoding import GeocodingError
+from route_optimizer import OptimizationError
+from utils import role_required, log_action, extract_coordinates_from_maps_url
+from tenant import get_tenant
 from models import ActionType
 import json
 
@@ -23,21 +26,13 @@ def list_routes():
     """
     List routes with filtering options
     """
-    page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor')
     status = request.args.get('status', None)
     search_term = request.args.get('search', '')
     driver_id = request.args.get('driver_id', None, type=int)
 
     # Get company ID based on user role
-    company_id = None
-    if current_user.role == UserRole.COMPANY_OWNER and current_user.company_owner:
-        company_id = current_user.company_owner.company_id
-    elif current_user.role == UserRole.MANAGER and current_user.manager:
-        company_id = current_user.manager.company_id
-    elif current_user.role == UserRole.OPERATOR and current_user.operator:
-        company_id = current_user.operator.company_id
-    elif current_user.role == UserRole.DRIVER and current_user.driver:
-        company_id = current_user.driver.company_id
+    company_id = get_tenant().company_id
 
     # Admin can see all routes if no company filter
     if current_user.role == UserRole.ADMIN and not company_id:
@@ -77,11 +72,8 @@ def list_routes():
             )
         )
 
-    # Order by creation date (newest first)
-    routes_query = routes_query.order_by(Route.start_time.desc())
-
-    # Paginate results
-    routes = routes_query.paginate(page=page, per_page=10)
+    # Latest start first
+    routes = RouteService.paginate_by_start_time(routes_query, cursor, per_page=10, descending=True)
 
     # Get all available statuses
     statuses = [status.value for status in RouteStatus]
@@ -124,14 +116,8 @@ def create_route():
     form = RouteForm()
 
     # Get company ID based on user role
-    company_id = None
-    if current_user.role == UserRole.COMPANY_OWNER and current_user.company_owner:
-        company_id = current_user.company_owner.company_id
-    elif current_user.role == UserRole.MANAGER and current_user.manager:
-        company_id = current_user.manager.company_id
-    elif current_user.role == UserRole.OPERATOR and current_user.operator:
-        company_id = current_user.operator.company_id
-    elif current_user.role == UserRole.ADMIN:
+    company_id = get_tenant().company_id
+    if current_user.role == UserRole.ADMIN:
         # Admin must select a company
         company_id = request.args.get('company_id', None, type=int)
 
@@ -171,14 +157,8 @@ def create_route():
 
     if form.validate_on_submit():
         try:
-            # Parse waypoints if provided
-            waypoints = None
-            if form.waypoints.data:
-                try:
-                    waypoints = json.loads(form.waypoints.data)
-                except json.JSONDecodeError:
-                    # If not valid JSON, keep as None
-                    pass
+            # Parse waypoints if provided; invalid JSON is ignored
+            waypoints = RouteService.parse_waypoints(form.waypoints.data)
 
             # Create route directly instead of using RouteService
             route = Route(
@@ -193,6 +173,7 @@ def create_route():
                 company_id=company_id,
                 waypoints=waypoints,
             )
+            RouteService.update_metrics(route)
 
             db.session.add(route)
 
@@ -203,6 +184,7 @@ def create_route():
                     task.status = TaskStatus.IN_PROGRESS
 
             db.session.commit()
+            RouteService.schedule_metrics_update(route)
             log_action(ActionType.CREATE, f"Created route from {route.start_point} to {route.end_point}", db)
 
             flash(f'Route from {route.start_point} to {route.end_point} created successfully!', 'success')
@@ -224,20 +206,14 @@ def view_route(route_id):
     """
     View route details
     """
-    route = Route.query.get_or_404(route_id)
+    route = Route.query.options(selectinload(Route.waypoint_rows)).filter_by(id=route_id).first_or_404()
 
     # Check if user has access to this route
     if not _can_access_route(route):
         flash('You do not have permission to access this route.', 'danger')
         return redirect(url_for('routes.list_routes'))
 
-    # Parse waypoints and add status
-    waypoint_progress = {"total": 0, "completed": 0, "percentage": 0}
-    if route.waypoints:
-        waypoint_progress["total"] = len(route.waypoints)
-        waypoint_progress["completed"] = sum(1 for w in route.waypoints if w.get('completed', False))
-        if waypoint_progress["total"] > 0:
-            waypoint_progress["percentage"] = int(waypoint_progress["completed"] / waypoint_progress["total"] * 100)
+    waypoint_progress = RouteService.get_waypoint_progress(route)
 
     log_action(ActionType.VIEW, f"Viewed route {route.id}", db)
 
@@ -290,14 +266,8 @@ def edit_route(route_id):
 
     if form.validate_on_submit():
         try:
-            # Parse waypoints if provided
-            waypoints = None
-            if form.waypoints.data:
-                try:
-                    waypoints = json.loads(form.waypoints.data)
-                except json.JSONDecodeError:
-                    # If not valid JSON, keep as None
-                    pass
+            # Parse waypoints if provided; invalid JSON is ignored
+            waypoints = RouteService.parse_waypoints(form.waypoints.data)
 
             # Update route details
             route.start_point = form.start_point.data
@@ -305,6 +275,7 @@ def edit_route(route_id):
             route.distance = form.distance.data
             route.estimated_time = form.estimated_time.data
             route.start_time = form.start_time.data
+            was_completed = route.status == RouteStatus.COMPLETED
             route.status = RouteStatus(form.status.data)
             route.driver_id = form.driver_id.data
 
@@ -312,6 +283,8 @@ def edit_route(route_id):
             if waypoints is not None:
                 route.waypoints = waypoints
 
+            RouteService.update_metrics(route)
+
             # If route status changed to completed, update related task
             if form.status.data == RouteStatus.COMPLETED.value and route.task and route.task.status != TaskStatus.COMPLETED:
                 route.task.status = TaskStatus.COMPLETED
@@ -321,6 +294,9 @@ def edit_route(route_id):
                     route.end_time = datetime.utcnow()
 
             db.session.commit()
+            if route.status == RouteStatus.COMPLETED and not was_completed:
+                RouteService.schedule_completion_jobs(route)
+            RouteService.schedule_metrics_update(route)
             log_action(ActionType.UPDATE, f"Updated route from {route.start_point} to {route.end_point}", db)
 
             flash('Route updated successfully!', 'success')
@@ -383,30 +359,90 @@ def geocode_address():
         return jsonify({'success': False, 'error': 'No address provided'})
 
     try:
-        import requests
+        result = geocoder.geocode(address)
+    except GeocodingError as e:
+        return jsonify({'success': False, 'error': str(e)})
 
-        encoded_address = address.replace(' ', '+')
-        response = requests.get(
-            f"https://nominatim.openstreetmap.org/search?format=json&q={encoded_address}&limit=1",
-            headers={'User-Agent': 'Logistics CRM'}
-        )
+    if result is None:
+        return jsonify({'success': False, 'error': 'Location not found'})
 
-        if response.status_code == 200:
-            data = response.json()
-            if data and len(data) > 0:
-                return jsonify({
-                    'success': True,
-                    'lat': float(data[0]['lat']),
-                    'lng': float(data[0]['lon']),
-                    'display_name': data[0]['display_name']
-                })
-            else:
-                return jsonify({'success': False, 'error': 'Location not found'})
-        else:
-            return jsonify({'success': False, 'error': f'Geocoding API error: {response.status_code}'})
+    return jsonify({
+        'success': True,
+        'lat': result['lat'],
+        'lng': result['lng'],
+        'display_name': result['display_name']
+    })
 
-    except Exception as e:
-        return jsonify({'success': False, 'error': str(e)})
+
+@routes.route('/geocode-batch', methods=['POST'])
+@login_required
+def geocode_batch():
+    """
+    API endpoint to geocode a list of addresses and Google Maps URLs at once
+
+    Expects {"items": [...]} and returns {"success": true, "results": [...]}
+    with one result per item, in the same order, each shaped like the
+    response of geocode_address. Items the provider's rate limit didn't
+    allow within GEOCODING_BATCH_TIME_BUDGET have pending set and should be
+    sent again.
+    """
+    data = request.get_json(silent=True) or {}
+    items = data.get('items')
+
+    if not isinstance(items, list):
+        return jsonify({'success': False, 'error': 'Expected a list of items'}), 400
+
+    if len(items) > geocoder.batch_limit:
+        return jsonify({
+            'success': False,
+            'error': f'At most {geocoder.batch_limit} items can be geocoded at once'
+        }), 400
+
+    results = geocoder.resolve_many(items, time_budget=geocoder.batch_time_budget)
+
+    return jsonify({'success': True, 'results': results})
+
+
+@routes.route('/optimize', methods=['POST'])
+@login_required
+@role_required(["ADMIN", "COMPANY_OWNER", "MANAGER", "OPERATOR"])
+def optimize_route():
+    """
+    API endpoint to reorder waypoints into a shorter route
+
+    Expects {"start_point", "end_point", "waypoints": [...]} and optionally
+    "start_time" ("YYYY-MM-DDTHH:MM", needed when waypoints have
+    window_start or window_end) and "company_id" for admins. Returns the
+    waypoints in the new order with distance, original_distance and
+    distance_saved in km.
+    """
+    data = request.get_json(silent=True) or {}
+    waypoints = data.get('waypoints')
+
+    if not data.get('start_point') or not data.get('end_point'):
+        return jsonify({'success': False, 'error': 'Start and end points are required'}), 400
+    if not isinstance(waypoints, list):
+        return jsonify({'success': False, 'error': 'Expected a list of waypoints'}), 400
+
+    company_id = get_tenant().company_id
+    if current_user.role == UserRole.ADMIN:
+        company_id = data.get('company_id')
+
+    start_time = None
+    if data.get('start_time'):
+        try:
+            start_time = datetime.strptime(data['start_time'], '%Y-%m-%dT%H:%M')
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'error': 'Invalid start time'}), 400
+
+    try:
+        result = RouteService.optimize_waypoints(
+            data['start_point'], data['end_point'], waypoints, company_id, start_time=start_time
+        )
+    except OptimizationError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+    return jsonify(dict(result, success=True))
 
 
 @routes.route('/<int:route_id>/start', methods=['POST'])
@@ -474,6 +510,7 @@ def complete_route(route_id):
             route.task.status = TaskStatus.COMPLETED
 
         db.session.commit()
+        RouteService.schedule_completion_jobs(route)
         log_action(ActionType.UPDATE, f"Completed route {route.id}", db)
         flash('Route completed successfully!', 'success')
     except Exception as e:
@@ -525,30 +562,58 @@ def route_map(route_id):
     """
     Show route on map
     """
-    route = Route.query.get_or_404(route_id)
+    # Waypoints only; the event history stays in route_events
+    route = Route.query.options(selectinload(Route.waypoint_rows)).filter_by(id=route_id).first_or_404()
 
     # Check if user has access to this route
     if not _can_access_route(route):
         flash('You do not have permission to access this route.', 'danger')
         return redirect(url_for('routes.list_routes'))
 
-    # In a real application, process waypoints and geo data
-    # Here we'll just pass the raw data to the template
-
     log_action(ActionType.VIEW, f"Viewed map for route {route.id}", db)
 
     return render_template(
         'routes/map.html',
         title=f'Route Map: {route.start_point} to {route.end_point}',
         route=route,
-        waypoint_progress={"total": len(route.waypoints) if route.waypoints else 0,
-                           "completed": sum(
-                               1 for w in route.waypoints if w.get('completed', False)) if route.waypoints else 0,
-                           "percentage": int(sum(1 for w in route.waypoints if w.get('completed', False)) / len(
-                               route.waypoints) * 100) if route.waypoints and len(route.waypoints) > 0 else 0}
+        waypoint_progress=RouteService.get_waypoint_progress(route)
     )
 
 
+@routes.route('/<int:route_id>/track')
+@login_required
+def route_track(route_id):
+    """
+    API endpoint returning the recorded GPS track of a completed route
+
+    The geometry is pre-simplified for the requested zoom (?zoom=, default 13)
+    and returned as a Google encoded polyline.
+    """
+    route = Route.query.get_or_404(route_id)
+
+    if not _can_access_route(route):
+        return jsonify({'success': False, 'error': 'Permission denied'}), 403
+
+    zoom = request.args.get('zoom', 13, type=int)
+    track = RouteService.get_track(route.id, zoom)
+
+    if track is None:
+        return jsonify({'success': False, 'error': 'No track recorded for this route'}), 404
+
+    response = jsonify({
+        'success': True,
+        'level': track.level,
+        'tolerance': track.tolerance,
+        'point_count': track.point_count,
+        'polyline': track.polyline
+    })
+    # Late pings rebuild the track, so the browser revalidates against its build time
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.last_modified = track.created_at
+    return response.make_conditional(request)
+
+
 @routes.route('/<int:route_id>/add-status-update', methods=['POST'])
 @login_required
 def add_status_update(route_id):
@@ -573,39 +638,7 @@ def add_status_update(route_id):
         return redirect(url_for('routes.view_route', route_id=route.id))
 
     try:
-        # In a real app, this would add to a status_updates table
-        # For now we'll just add it to the route's log or waypoints
-        if not route.waypoints:
-            route.waypoints = []
-
-        # Find active waypoint or add status to the route itself
-        active_waypoint = None
-        for i, waypoint in enumerate(route.waypoints):
-            if not waypoint.get('completed', False):
-                active_waypoint = i
-                break
-
-        if active_waypoint is not None:
-            if 'status_updates' not in route.waypoints[active_waypoint]:
-                route.waypoints[active_waypoint]['status_updates'] = []
-
-            route.waypoints[active_waypoint]['status_updates'].append({
-                'message': status_message,
-                'timestamp': datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
-            })
-        else:
-            # Add to route status updates
-            if not hasattr(route, 'status_updates'):
-                route.status_updates = []
-
-            # In a real app, this would use a proper model
-            # For now, we'll update the route directly
-            route.status_updates.append({
-                'message': status_message,
-                'timestamp': datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
-            })
-
-        db.session.commit()
+        RouteService.add_status_update(route, status_message, current_user.id, db.session)
         log_action(ActionType.UPDATE, f"Added status update to route {route.id}", db)
         flash('Status update added successfully!', 'success')
     except Exception as e:
@@ -638,39 +671,23 @@ def complete_waypoint(route_id, waypoint_index):
         return redirect(url_for('routes.view_route', route_id=route.id))
 
     try:
+        result = RouteService.complete_waypoint(route, waypoint_index, current_user.id, db.session)
+
         # Check if waypoint exists
-        if not route.waypoints or waypoint_index >= len(route.waypoints):
+        if result is None:
             if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
                 return jsonify({'success': False, 'error': 'Invalid waypoint'})
             flash('Invalid waypoint.', 'danger')
             return redirect(url_for('routes.view_route', route_id=route.id))
 
-        # Mark waypoint as completed
-        route.waypoints[waypoint_index]['completed'] = True
-        route.waypoints[waypoint_index]['completion_time'] = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
-
-        # Set next waypoint as active
-        next_waypoint_index = None
-        for i, waypoint in enumerate(route.waypoints):
-            waypoint['active'] = False
-            if i > waypoint_index and not waypoint.get('completed', False) and next_waypoint_index is None:
-                next_waypoint_index = i
-
-        if next_waypoint_index is not None:
-            route.waypoints[next_waypoint_index]['active'] = True
-
-        # Check if all waypoints are completed
-        all_completed = all(w.get('completed', False) for w in route.waypoints)
-
         # Update response data
         response_data = {
             'success': True,
             'waypointIndex': waypoint_index,
-            'allCompleted': all_completed,
-            'nextWaypointIndex': next_waypoint_index
+            'allCompleted': result['all_completed'],
+            'nextWaypointIndex': result['next_seq']
         }
 
-        db.session.commit()
         log_action(ActionType.UPDATE, f"Completed waypoint {waypoint_index} for route {route.id}", db)
 
         # If AJAX request, return JSON response
@@ -697,15 +714,7 @@ def _can_access_route(route):
         return True
 
     # Get company ID based on user role
-    company_id = None
-    if current_user.role == UserRole.COMPANY_OWNER and current_user.company_owner:
-        company_id = current_user.company_owner.company_id
-    elif current_user.role == UserRole.MANAGER and current_user.manager:
-        company_id = current_user.manager.company_id
-    elif current_user.role == UserRole.OPERATOR and current_user.operator:
-        company_id = current_user.operator.company_id
-    elif current_user.role == UserRole.DRIVER and current_user.driver:
-        company_id = current_user.driver.company_id
+    company_id = get_tenant().company_id
 
     # Must be in same company
     if route.company_id != company_id:
@@ -726,14 +735,14 @@ def _can_edit_route(route):
     if current_user.role == UserRole.ADMIN:
         return True
 
-    if current_user.role == UserRole.COMPANY_OWNER and current_user.company_owner and route.company_id == current_user.company_owner.company_id:
+    if current_user.role == UserRole.COMPANY_OWNER and get_tenant().owns(route):
         return True
 
     # Manager, operator in same company can edit
-    if current_user.role == UserRole.MANAGER and current_user.manager and route.company_id == current_user.manager.company_id:
+    if current_user.role == UserRole.MANAGER and get_tenant().owns(route):
         return True
 
-    if current_user.role == UserRole.OPERATOR and current_user.operator and route.company_id == current_user.operator.company_id:
+    if current_user.role == UserRole.OPERATOR and get_tenant().owns(route):
         return True
 
     # Driver can edit their own route if it's not completed
@@ -751,10 +760,10 @@ def _can_delete_route(route):
     if current_user.role == UserRole.ADMIN:
         return True
 
-    if current_user.role == UserRole.COMPANY_OWNER and current_user.company_owner and route.company_id == current_user.company_owner.company_id:
+    if current_user.role == UserRole.COMPANY_OWNER and get_tenant().owns(route):
         return True
 
-    if current_user.role == UserRole.MANAGER and current_user.manager and route.company_id == current_user.manager.company_id:
+    if current_user.role == UserRole.MANAGER and get_tenant().owns(route):
         return True
 
     return False
@@ -768,14 +777,14 @@ def _can_cancel_route(route):
     if current_user.role == UserRole.ADMIN:
         return True
 
-    if current_user.role == UserRole.COMPANY_OWNER and current_user.company_owner and route.company_id == current_user.company_owner.company_id:
+    if current_user.role == UserRole.COMPANY_OWNER and get_tenant().owns(route):
         return True
 
-    if current_user.role == UserRole.MANAGER and current_user.manager and route.company_id == current_user.manager.company_id:
+    if current_user.role == UserRole.MANAGER and get_tenant().owns(route):
         return True
 
     # Operator in same company can cancel
-    if current_user.role == UserRole.OPERATOR and current_user.operator and route.company_id == current_user.operator.company_id:
+    if current_user.role == UserRole.OPERATOR and get_tenant().owns(route):
         return True
 
     # Driver can cancel their own route if it's not completed
@@ -848,12 +857,8 @@ def get_coordinates(short_url):
         tuple: (latitude, longitude) or (None, None) if extraction failed
     """
     try:
-        # Add timeout and user agent for better reliability
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
-        response = requests.get(short_url, allow_redirects=True, timeout=10, headers=headers)
-        full_url = response.url
+        # Short links are expanded once and cached by the geocoder
+        full_url = geocoder.expand_url(short_url)
 
         # Log for debugging
         current_app.logger.info(f"Processing URL: {short_url} -> {full_url}")
@@ -883,6 +888,6 @@ def get_coordinates(short_url):
         # If we reach here, we couldn't extract coordinates
         return None, None
 
-    except requests.RequestException as e:
+    except GeocodingError as e:
         current_app.logger.error(f"Error processing URL {short_url}: {e}")
         return None, None
\ No newline at end of file
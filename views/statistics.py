@@ -1,17 +1,17 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request, send_file
+from flask import Blueprint, render_template, redirect, url_for, flash, request, current_app
 from flask_login import login_required, current_user
 from datetime import datetime, timedelta
-from sqlalchemy import func, distinct, case, extract, or_
+from sqlalchemy import distinct, case, or_
 
-from app import db
+from app import db, job_queue
 from models import (
-    User, UserRole, Company, Task, TaskStatus, Route, RouteStatus,
+    User, UserRole, Company, Route,
     Driver, Operator, Manager, CompanyOwner, Document, Message,
     Statistics, Log, ActionType
 )
 from utils import role_required, log_action
-import io
-import csv
+from tenant import get_tenant
+from services import StatisticsService, ReportService
 import random  # For demo data
 
 statistics = Blueprint('statistics', __name__, url_prefix='/statistics')
@@ -49,54 +49,32 @@ def dashboard():
         start_date = end_date - timedelta(days=days)
 
     # Get company ID based on user role
-    company_id = None
-    if current_user.role == UserRole.COMPANY_OWNER and current_user.company_owner:
-        company_id = current_user.company_owner.company_id
-    elif current_user.role == UserRole.MANAGER and current_user.manager:
-        company_id = current_user.manager.company_id
+    tenant = get_tenant()
+    company_id = tenant.company_id
 
     # For admins, they can filter by company
-    if current_user.role == UserRole.ADMIN:
+    if tenant.is_admin:
         company_id = request.args.get('company_id', None, type=int)
 
     # Get statistics for the dashboard
     # In a real application, this would query the database for actual stats
     # Here we'll generate some sample data for demonstration
 
-    # Task statistics
-    task_query = Task.query
+    # Task and route counts per status in one round trip
+    overview = StatisticsService.get_company_overview(company_id, start_date, end_date)
+    task_counts = overview['tasks']
+    route_counts = overview['routes']
 
-    if company_id:
-        task_query = task_query.filter(Task.company_id == company_id)
-
-    task_query = task_query.filter(Task.created_at.between(start_date, end_date))
-
-    task_count = task_query.count()
-    new_tasks = task_query.filter(Task.status == TaskStatus.NEW).count()
-    in_progress_tasks = task_query.filter(Task.status == TaskStatus.IN_PROGRESS).count()
-    completed_tasks = task_query.filter(Task.status == TaskStatus.COMPLETED).count()
-    cancelled_tasks = task_query.filter(Task.status == TaskStatus.CANCELLED).count()
-
-    # Route statistics
-    route_query = Route.query
+    task_count = task_counts['total']
+    new_tasks = task_counts['new']
+    in_progress_tasks = task_counts['in_progress']
+    completed_tasks = task_counts['completed']
+    cancelled_tasks = task_counts['cancelled']
 
-    if company_id:
-        route_query = route_query.filter(Route.company_id == company_id)
+    route_count = route_counts['total']
 
-    route_query = route_query.filter(Route.start_time.between(start_date, end_date))
-
-    route_count = route_query.count()
-
-    # Calculate total distance of completed routes
-    total_distance = db.session.query(func.sum(Route.distance)).filter(
-        Route.status == RouteStatus.COMPLETED,
-        Route.start_time.between(start_date, end_date)
-    )
-
-    if company_id:
-        total_distance = total_distance.filter(Route.company_id == company_id)
-
-    total_distance = total_distance.scalar() or 0
+    # Total distance of completed routes
+    total_distance = route_counts['completed_distance']
 
     # Calculate task completion rate
     if task_count > 0:
@@ -110,7 +88,7 @@ def dashboard():
         'in_progress': in_progress_tasks,
         'completed': completed_tasks,
         'cancelled': cancelled_tasks,
-        'on_hold': task_count - (new_tasks + in_progress_tasks + completed_tasks + cancelled_tasks)
+        'on_hold': task_counts['on_hold']
     }
 
     # Get top performing drivers
@@ -122,35 +100,16 @@ def dashboard():
 
     drivers = drivers_query.limit(5).all()
 
-    for driver in drivers:
-        # In a real app, this would use actual metrics
-        routes_completed = route_query.filter(
-            Route.driver_id == driver.id,
-            Route.status == RouteStatus.COMPLETED
-        ).count()
-
-        # Calculate metrics for this driver
-        driver_distance = db.session.query(func.sum(Route.distance)).filter(
-            Route.status == RouteStatus.COMPLETED,
-            Route.driver_id == driver.id,
-            Route.start_time.between(start_date, end_date)
-        ).scalar() or 0
-
-        # Calculate average completion time
-        avg_time_query = db.session.query(
-            func.avg(
-                func.extract('epoch', Route.end_time) -
-                func.extract('epoch', Route.start_time)
-            ) / 60  # Convert to minutes
-        ).filter(
-            Route.status == RouteStatus.COMPLETED,
-            Route.driver_id == driver.id,
-            Route.start_time.isnot(None),
-            Route.end_time.isnot(None),
-            Route.start_time.between(start_date, end_date)
-        )
+    # Route totals for all listed drivers, summed from the daily rollup
+    driver_stats = StatisticsService.get_driver_route_stats(
+        start_date, end_date, company_id, driver_ids=[driver.id for driver in drivers]
+    )
 
-        avg_time = avg_time_query.scalar() or 0
+    for driver in drivers:
+        stats_for_driver = driver_stats.get(driver.id, {})
+        routes_completed = stats_for_driver.get('completed_routes', 0)
+        driver_distance = stats_for_driver.get('completed_distance', 0)
+        avg_time = stats_for_driver.get('avg_minutes', 0)
 
         # In a real app, on-time percentage would be calculated from actual data
         # For demo, generate a random score between 80-100%
@@ -228,14 +187,11 @@ def company():
         start_date = end_date - timedelta(days=days)
 
     # Get company ID based on user role
-    company_id = None
-    if current_user.role == UserRole.COMPANY_OWNER and current_user.company_owner:
-        company_id = current_user.company_owner.company_id
-    elif current_user.role == UserRole.MANAGER and current_user.manager:
-        company_id = current_user.manager.company_id
+    tenant = get_tenant()
+    company_id = tenant.company_id
 
     # For admins, they can filter by company
-    if current_user.role == UserRole.ADMIN:
+    if tenant.is_admin:
         company_id = request.args.get('company_id', None, type=int)
 
         # Get all companies for admin dropdown
@@ -252,9 +208,12 @@ def company():
 
     # User counts by role
     user_count = User.query.count()
-    managers_count = Manager.query.filter_by(company_id=company_id).count() if company_id else 0
-    operators_count = Operator.query.filter_by(company_id=company_id).count() if company_id else 0
-    drivers_count = Driver.query.filter_by(company_id=company_id).count() if company_id else 0
+    managers_count = operators_count = drivers_count = 0
+    if company_id:
+        team = StatisticsService.get_team_counts(company_id)
+        managers_count = team['managers']
+        operators_count = team['operators']
+        drivers_count = team['drivers']
 
     # Calculate efficiency score (demo)
     efficiency_score = random.randint(70, 95)
@@ -262,20 +221,8 @@ def company():
     # Calculate average task completion time
     avg_completion_time = 0
     if company_id:
-        avg_time_query = db.session.query(
-            func.avg(
-                func.extract('epoch', Route.end_time) -
-                func.extract('epoch', Route.start_time)
-            ) / 3600  # Convert to hours
-        ).filter(
-            Route.company_id == company_id,
-            Route.status == RouteStatus.COMPLETED,
-            Route.start_time.isnot(None),
-            Route.end_time.isnot(None),
-            Route.start_time.between(start_date, end_date)
-        )
-
-        avg_completion_time = round(avg_time_query.scalar() or 0, 1)
+        avg_minutes = StatisticsService.get_average_route_minutes(start_date, end_date, company_id)
+        avg_completion_time = round(avg_minutes / 60, 1)  # Convert to hours
 
     # Generate sample department performance data
     departments = [
@@ -367,16 +314,11 @@ def routes():
         start_date = end_date - timedelta(days=days)
 
     # Get company ID based on user role
-    company_id = None
-    if current_user.role == UserRole.COMPANY_OWNER and current_user.company_owner:
-        company_id = current_user.company_owner.company_id
-    elif current_user.role == UserRole.MANAGER and current_user.manager:
-        company_id = current_user.manager.company_id
-    elif current_user.role == UserRole.OPERATOR and current_user.operator:
-        company_id = current_user.operator.company_id
+    tenant = get_tenant()
+    company_id = tenant.company_id
 
     # For admins, they can filter by company
-    if current_user.role == UserRole.ADMIN:
+    if tenant.is_admin:
         company_id = request.args.get('company_id', None, type=int)
 
     # Get route statistics
@@ -387,43 +329,21 @@ def routes():
 
     route_query = route_query.filter(Route.start_time.between(start_date, end_date))
 
-    # Basic counts
-    total_routes = route_query.count()
-    completed_routes = route_query.filter(Route.status == RouteStatus.COMPLETED).count()
-    in_progress_routes = route_query.filter(Route.status == RouteStatus.IN_PROGRESS).count()
-    planned_routes = route_query.filter(Route.status == RouteStatus.PLANNED).count()
-    cancelled_routes = route_query.filter(Route.status == RouteStatus.CANCELLED).count()
-
-    # Calculate total distance
-    total_distance = db.session.query(func.sum(Route.distance)).filter(
-        Route.start_time.between(start_date, end_date)
-    )
+    # Counts per status and total distance in one query
+    route_counts = StatisticsService.get_route_status_counts(company_id, start_date, end_date)
 
-    if company_id:
-        total_distance = total_distance.filter(Route.company_id == company_id)
-
-    total_distance = total_distance.scalar() or 0
+    total_routes = route_counts['total']
+    completed_routes = route_counts['completed']
+    in_progress_routes = route_counts['in_progress']
+    planned_routes = route_counts['planned']
+    cancelled_routes = route_counts['cancelled']
+    total_distance = route_counts['total_distance']
 
     # Calculate completion rate
     completion_rate = (completed_routes / total_routes * 100) if total_routes > 0 else 0
 
     # Calculate average time per route
-    avg_time_query = db.session.query(
-        func.avg(
-            func.extract('epoch', Route.end_time) -
-            func.extract('epoch', Route.start_time)
-        ) / 60  # Convert to minutes
-    ).filter(
-        Route.status == RouteStatus.COMPLETED,
-        Route.start_time.isnot(None),
-        Route.end_time.isnot(None),
-        Route.start_time.between(start_date, end_date)
-    )
-
-    if company_id:
-        avg_time_query = avg_time_query.filter(Route.company_id == company_id)
-
-    avg_time = avg_time_query.scalar() or 0
+    avg_time = StatisticsService.get_average_route_minutes(start_date, end_date, company_id)
 
     # Get top routes by distance
     top_routes = route_query.filter(
@@ -431,27 +351,7 @@ def routes():
     ).order_by(Route.distance.desc()).limit(5).all()
 
     # Get most active drivers
-    active_drivers = db.session.query(
-        Driver.id,
-        User.first_name,
-        User.last_name,
-        func.count(Route.id).label('route_count')
-    ).join(
-        User, Driver.id == User.id
-    ).join(
-        Route, Driver.id == Route.driver_id
-    ).filter(
-        Route.start_time.between(start_date, end_date)
-    )
-
-    if company_id:
-        active_drivers = active_drivers.filter(Driver.company_id == company_id)
-
-    active_drivers = active_drivers.group_by(
-        Driver.id, User.first_name, User.last_name
-    ).order_by(
-        func.count(Route.id).desc()
-    ).limit(5).all()
+    active_drivers = StatisticsService.get_top_drivers_by_routes(start_date, end_date, company_id)
 
     # Combine all stats into a single object
     stats = {
@@ -525,14 +425,11 @@ def users():
         start_date = end_date - timedelta(days=days)
 
     # Get company ID based on user role
-    company_id = None
-    if current_user.role == UserRole.COMPANY_OWNER and current_user.company_owner:
-        company_id = current_user.company_owner.company_id
-    elif current_user.role == UserRole.MANAGER and current_user.manager:
-        company_id = current_user.manager.company_id
+    tenant = get_tenant()
+    company_id = tenant.company_id
 
     # For admins, they can filter by company
-    if current_user.role == UserRole.ADMIN:
+    if tenant.is_admin:
         company_id = request.args.get('company_id', None, type=int)
 
     # Default user role to filter by
@@ -587,6 +484,11 @@ def users():
     # Get users
     users = users_query.all()
 
+    # Task and route totals for all listed users, summed from the daily rollups
+    user_ids = [user.id for user in users]
+    task_stats = StatisticsService.get_creator_task_stats(start_date, end_date, creator_ids=user_ids)
+    route_stats = StatisticsService.get_driver_route_stats(start_date, end_date, driver_ids=user_ids)
+
     # Get activity statistics for each user
     user_stats = []
 
@@ -597,12 +499,9 @@ def users():
 
         if user.role == UserRole.MANAGER or user.role == UserRole.OPERATOR:
             # Tasks created by this user
-            task_query = Task.query.filter(
-                Task.creator_id == user.id,
-                Task.created_at.between(start_date, end_date)
-            )
-            task_count = task_query.count()
-            completed_task_count = task_query.filter(Task.status == TaskStatus.COMPLETED).count()
+            stats_for_user = task_stats.get(user.id, {})
+            task_count = stats_for_user.get('tasks', 0)
+            completed_task_count = stats_for_user.get('completed_tasks', 0)
 
         # Get route counts for drivers
         route_count = 0
@@ -610,20 +509,10 @@ def users():
         total_distance = 0
 
         if user.role == UserRole.DRIVER and user.driver:
-            route_query = Route.query.filter(
-                Route.driver_id == user.driver.id,
-                Route.start_time.between(start_date, end_date)
-            )
-            route_count = route_query.count()
-            completed_route_count = route_query.filter(Route.status == RouteStatus.COMPLETED).count()
-
-            # Calculate total distance
-            total_distance_query = db.session.query(func.sum(Route.distance)).filter(
-                Route.driver_id == user.driver.id,
-                Route.status == RouteStatus.COMPLETED,
-                Route.start_time.between(start_date, end_date)
-            )
-            total_distance = total_distance_query.scalar() or 0
+            stats_for_user = route_stats.get(user.driver.id, {})
+            route_count = stats_for_user.get('routes', 0)
+            completed_route_count = stats_for_user.get('completed_routes', 0)
+            total_distance = stats_for_user.get('completed_distance', 0)
 
         # Get login activity
         login_count = Log.query.filter(
@@ -698,14 +587,11 @@ def reports():
     Show available reports
     """
     # Get company ID based on user role
-    company_id = None
-    if current_user.role == UserRole.COMPANY_OWNER and current_user.company_owner:
-        company_id = current_user.company_owner.company_id
-    elif current_user.role == UserRole.MANAGER and current_user.manager:
-        company_id = current_user.manager.company_id
+    tenant = get_tenant()
+    company_id = tenant.company_id
 
     # For admins, they can filter by company
-    if current_user.role == UserRole.ADMIN:
+    if tenant.is_admin:
         company_id = request.args.get('company_id', None, type=int)
 
         # Get all companies for admin dropdown
@@ -755,34 +641,43 @@ def reports():
     )
 
 
+# Custom report form value -> report ID
+CUSTOM_REPORT_TYPES = {
+    'tasks': 'tasks_summary',
+    'routes': 'routes_performance',
+    'drivers': 'driver_performance'
+}
+
+
 @statistics.route('/download_report/<report_id>')
 @login_required
 @role_required(["ADMIN", "COMPANY_OWNER", "MANAGER"])
 def download_report(report_id):
     """
-    Download a specific report
+    Queue a report for generation and show its progress
     """
     # Get parameters
     format_type = request.args.get('format', 'csv')
     start_date = request.args.get('start_date')
     end_date = request.args.get('end_date')
 
+    # The custom report form picks the report with a separate field
+    if report_id == 'custom':
+        report_id = CUSTOM_REPORT_TYPES.get(request.args.get('report_type'), report_id)
+
     # Get company ID based on user role
-    company_id = None
-    if current_user.role == UserRole.COMPANY_OWNER and current_user.company_owner:
-        company_id = current_user.company_owner.company_id
-    elif current_user.role == UserRole.MANAGER and current_user.manager:
-        company_id = current_user.manager.company_id
+    tenant = get_tenant()
+    company_id = tenant.company_id
 
     # For admins, they can filter by company
-    if current_user.role == UserRole.ADMIN:
+    if tenant.is_admin:
         company_id = request.args.get('company_id', None, type=int)
 
     # Parse dates
     if not start_date or not end_date:
-        # Default to last 30 days
-        end_date_obj = datetime.utcnow()
-        start_date_obj = end_date_obj - timedelta(days=30)
+        # Default to the last 30 days, in whole days so repeated requests share a cached report
+        end_date_obj = datetime.utcnow().replace(hour=23, minute=59, second=59, microsecond=0)
+        start_date_obj = (end_date_obj - timedelta(days=30)).replace(hour=0, minute=0, second=0)
     else:
         # Parse dates from string
         start_date_obj = datetime.strptime(start_date, '%Y-%m-%d')
@@ -790,473 +685,81 @@ def download_report(report_id):
         # Set end_date to end of day
         end_date_obj = end_date_obj.replace(hour=23, minute=59, second=59)
 
-    # Generate appropriate report based on report_id
-    if report_id == 'tasks_summary':
-        return _generate_tasks_report(company_id, start_date_obj, end_date_obj, format_type)
-    elif report_id == 'routes_performance':
-        return _generate_routes_report(company_id, start_date_obj, end_date_obj, format_type)
-    elif report_id == 'driver_performance':
-        return _generate_drivers_report(company_id, start_date_obj, end_date_obj, format_type)
-    elif report_id == 'company_overview':
-        return _generate_company_report(company_id, start_date_obj, end_date_obj, format_type)
-    else:
+    if report_id not in ReportService.REPORT_PREFIXES:
         flash('Invalid report type.', 'danger')
         return redirect(url_for('statistics.reports'))
 
+    return _enqueue_report(report_id, company_id, start_date_obj, end_date_obj, format_type)
+
 
 @statistics.route('/download_company_report')
 @login_required
 @role_required(["ADMIN", "COMPANY_OWNER"])
 def download_company_report():
     """
-    Download company report
+    Queue the company report for generation and show its progress
     """
     # Get parameters
     format_type = request.args.get('format', 'csv')
     company_id = request.args.get('company_id', None, type=int)
 
     # Check if user has access to this company
+    tenant = get_tenant()
     if not company_id:
-        if current_user.role == UserRole.COMPANY_OWNER and current_user.company_owner:
-            company_id = current_user.company_owner.company_id
+        company_id = tenant.company_id
 
     # For admins, they can select any company
-    if current_user.role != UserRole.ADMIN and current_user.role == UserRole.COMPANY_OWNER:
-        if current_user.company_owner.company_id != company_id:
+    if not tenant.is_admin:
+        if tenant.company_id != company_id:
             flash('You do not have access to this company.', 'danger')
             return redirect(url_for('statistics.company'))
 
-    # Default to last 30 days
-    end_date = datetime.utcnow()
-    start_date = end_date - timedelta(days=30)
+    # Default to the last 30 days
+    end_date = datetime.utcnow().replace(hour=23, minute=59, second=59, microsecond=0)
+    start_date = (end_date - timedelta(days=30)).replace(hour=0, minute=0, second=0)
 
-    return _generate_company_report(company_id, start_date, end_date, format_type)
+    return _enqueue_report('company_overview', company_id, start_date, end_date, format_type)
 
 
-# Helper report generation functions
-def _generate_tasks_report(company_id, start_date, end_date, format_type):
+def _enqueue_report(report_id, company_id, start_date, end_date, format_type):
     """
-    Generate tasks report based on specified parameters
-    """
-    # Get tasks for report
-    task_query = Task.query.filter(Task.created_at.between(start_date, end_date))
-
-    if company_id:
-        task_query = task_query.filter(Task.company_id == company_id)
-
-    tasks = task_query.all()
-
-    # Log the report generation
-    log_action(ActionType.DOWNLOAD, f"Downloaded tasks report ({format_type})", db)
-
-    if format_type == 'csv':
-        # Create CSV file
-        output = io.StringIO()
-        writer = csv.writer(output)
-
-        # Write header
-        writer.writerow(['Task ID', 'Title', 'Status', 'Created At', 'Deadline', 'Creator', 'Assignee'])
-
-        # Write data
-        for task in tasks:
-            creator_name = f"{task.creator.first_name} {task.creator.last_name}" if task.creator else "Unknown"
-            assignee_name = f"{task.assignee.first_name} {task.assignee.last_name}" if task.assignee else "Unassigned"
-
-            writer.writerow([
-                task.id,
-                task.title,
-                task.status.value,
-                task.created_at.strftime('%Y-%m-%d %H:%M'),
-                task.deadline.strftime('%Y-%m-%d %H:%M') if task.deadline else "None",
-                creator_name,
-                assignee_name
-            ])
-
-        # Prepare response
-        output.seek(0)
-        company_name = Company.query.get(company_id).name if company_id else "All"
-        filename = f"tasks_report_{company_name}_{start_date.strftime('%Y%m%d')}_to_{end_date.strftime('%Y%m%d')}.csv"
-
-        return send_file(
-            io.BytesIO(output.getvalue().encode('utf-8')),
-            mimetype='text/csv',
-            as_attachment=True,
-            download_name=filename
-        )
-
-    elif format_type == 'excel':
-        # For excel format, we would use openpyxl or xlsxwriter
-        # This is a placeholder that returns CSV instead
-        flash('Excel export is not implemented yet. Returning CSV format instead.', 'warning')
-        return _generate_tasks_report(company_id, start_date, end_date, 'csv')
-
-    elif format_type == 'pdf':
-        # For PDF format, we would use a library like ReportLab
-        # This is a placeholder that returns CSV instead
-        flash('PDF export is not implemented yet. Returning CSV format instead.', 'warning')
-        return _generate_tasks_report(company_id, start_date, end_date, 'csv')
+    Queue a report job and redirect to its status page
 
-    else:
-        flash('Invalid export format.', 'danger')
-        return redirect(url_for('statistics.reports'))
-
-
-def _generate_routes_report(company_id, start_date, end_date, format_type):
-    """
-    Generate routes report based on specified parameters
+    Identical requests within JOB_RESULT_TTL share one job and its file.
     """
-    # Get routes for report
-    route_query = Route.query.filter(Route.start_time.between(start_date, end_date))
-
-    if company_id:
-        route_query = route_query.filter(Route.company_id == company_id)
-
-    routes = route_query.all()
-
-    # Log the report generation
-    log_action(ActionType.DOWNLOAD, f"Downloaded routes report ({format_type})", db)
-
-    if format_type == 'csv':
-        # Create CSV file
-        output = io.StringIO()
-        writer = csv.writer(output)
-
-        # Write header
-        writer.writerow(['Route ID', 'Start Point', 'End Point', 'Distance (km)', 'Status',
-                         'Created At', 'Start Time', 'End Time', 'Duration (min)', 'Driver'])
-
-        # Write data
-        for route in routes:
-            # Calculate duration if available
-            duration = None
-            if route.actual_start_time and route.end_time:
-                duration = (route.end_time - route.actual_start_time).total_seconds() / 60  # in minutes
-
-            driver_name = f"{route.driver.user.first_name} {route.driver.user.last_name}" if route.driver and route.driver.user else "Unassigned"
-
-            writer.writerow([
-                route.id,
-                route.start_point,
-                route.end_point,
-                round(route.distance, 2) if route.distance else "N/A",
-                route.status.value,
-                route.created_at.strftime('%Y-%m-%d %H:%M'),
-                route.actual_start_time.strftime('%Y-%m-%d %H:%M') if route.actual_start_time else "Not started",
-                route.end_time.strftime('%Y-%m-%d %H:%M') if route.end_time else "Not completed",
-                round(duration) if duration else "N/A",
-                driver_name
-            ])
-
-        # Prepare response
-        output.seek(0)
-        company_name = Company.query.get(company_id).name if company_id else "All"
-        filename = f"routes_report_{company_name}_{start_date.strftime('%Y%m%d')}_to_{end_date.strftime('%Y%m%d')}.csv"
-
-        return send_file(
-            io.BytesIO(output.getvalue().encode('utf-8')),
-            mimetype='text/csv',
-            as_attachment=True,
-            download_name=filename
-        )
-
-    elif format_type == 'excel':
-        # For excel format, we would use openpyxl or xlsxwriter
-        # This is a placeholder that returns CSV instead
-        flash('Excel export is not implemented yet. Returning CSV format instead.', 'warning')
-        return _generate_routes_report(company_id, start_date, end_date, 'csv')
-
-    elif format_type == 'pdf':
+    if format_type == 'pdf':
         # For PDF format, we would use a library like ReportLab
-        # This is a placeholder that returns CSV instead
         flash('PDF export is not implemented yet. Returning CSV format instead.', 'warning')
-        return _generate_routes_report(company_id, start_date, end_date, 'csv')
-
-    else:
+        format_type = 'csv'
+    elif format_type not in ('csv', 'excel'):
         flash('Invalid export format.', 'danger')
         return redirect(url_for('statistics.reports'))
 
-
-def _generate_drivers_report(company_id, start_date, end_date, format_type):
-    """
-    Generate drivers performance report based on specified parameters
-    """
-    # Get drivers for report
-    driver_query = Driver.query
-
-    if company_id:
-        driver_query = driver_query.filter(Driver.company_id == company_id)
-
-    drivers = driver_query.all()
-
-    # Log the report generation
-    log_action(ActionType.DOWNLOAD, f"Downloaded drivers performance report ({format_type})", db)
-
-    if format_type == 'csv':
-        # Create CSV file
-        output = io.StringIO()
-        writer = csv.writer(output)
-
-        # Write header
-        writer.writerow(['Driver ID', 'Name', 'Total Routes', 'Completed Routes', 'Completion Rate',
-                         'Total Distance (km)', 'Avg Duration (min)', 'On-time Delivery Rate'])
-
-        # Write data
-        for driver in drivers:
-            # Get route statistics for this driver
-            route_query = Route.query.filter(
-                Route.driver_id == driver.id,
-                Route.start_time.between(start_date, end_date)
-            )
-
-            total_routes = route_query.count()
-            completed_routes = route_query.filter(Route.status == RouteStatus.COMPLETED).count()
-            completion_rate = (completed_routes / total_routes * 100) if total_routes > 0 else 0
-
-            # Calculate total distance
-            total_distance_query = db.session.query(func.sum(Route.distance)).filter(
-                Route.driver_id == driver.id,
-                Route.status == RouteStatus.COMPLETED,
-                Route.start_time.between(start_date, end_date)
-            )
-            total_distance = total_distance_query.scalar() or 0
-
-            # Calculate average duration
-            avg_duration_query = db.session.query(
-                func.avg(
-                    func.extract('epoch', Route.end_time) -
-                    func.extract('epoch', Route.start_time)
-                ) / 60  # Convert to minutes
-            ).filter(
-                Route.driver_id == driver.id,
-                Route.status == RouteStatus.COMPLETED,
-                Route.start_time.isnot(None),
-                Route.end_time.isnot(None),
-                Route.start_time.between(start_date, end_date)
-            )
-            avg_duration = avg_duration_query.scalar() or 0
-
-            # Calculate on-time delivery rate
-            # For demo purposes, we'll use a random value
-            on_time_rate = random.randint(75, 100)
-
-            driver_name = f"{driver.user.first_name} {driver.user.last_name}" if driver.user else f"Driver {driver.id}"
-
-            writer.writerow([
-                driver.id,
-                driver_name,
-                total_routes,
-                completed_routes,
-                f"{round(completion_rate, 2)}%",
-                round(total_distance, 2),
-                round(avg_duration),
-                f"{on_time_rate}%"
-            ])
-
-        # Prepare response
-        output.seek(0)
-        company_name = Company.query.get(company_id).name if company_id else "All"
-        filename = f"driver_performance_{company_name}_{start_date.strftime('%Y%m%d')}_to_{end_date.strftime('%Y%m%d')}.csv"
-
-        return send_file(
-            io.BytesIO(output.getvalue().encode('utf-8')),
-            mimetype='text/csv',
-            as_attachment=True,
-            download_name=filename
-        )
-
-    elif format_type == 'excel':
-        # For excel format, we would use openpyxl or xlsxwriter
-        # This is a placeholder that returns CSV instead
-        flash('Excel export is not implemented yet. Returning CSV format instead.', 'warning')
-        return _generate_drivers_report(company_id, start_date, end_date, 'csv')
-
-    elif format_type == 'pdf':
-        # For PDF format, we would use a library like ReportLab
-        # This is a placeholder that returns CSV instead
-        flash('PDF export is not implemented yet. Returning CSV format instead.', 'warning')
-        return _generate_drivers_report(company_id, start_date, end_date, 'csv')
-
-    else:
-        flash('Invalid export format.', 'danger')
-        return redirect(url_for('statistics.reports'))
-
-
-def _generate_company_report(company_id, start_date, end_date, format_type):
-    """
-    Generate company overview report
-    """
-    # Validate company ID
-    if not company_id:
+    if report_id == 'company_overview' and not company_id:
         flash('Company ID is required for company report.', 'danger')
         return redirect(url_for('statistics.reports'))
 
-    company = Company.query.get_or_404(company_id)
-
-    # Log the report generation
-    log_action(ActionType.DOWNLOAD, f"Downloaded company report ({format_type})", db)
-
-    if format_type == 'csv':
-        # Create CSV file
-        output = io.StringIO()
-        writer = csv.writer(output)
-
-        # Write company information
-        writer.writerow(['Company Report'])
-        writer.writerow([])
-        writer.writerow(['Company Name', company.name])
-        writer.writerow(['Legal Name', company.legal_name])
-        writer.writerow(['Tax ID', company.tax_id])
-        writer.writerow(['Date Range', f"{start_date.strftime('%Y-%m-%d')} to {end_date.strftime('%Y-%m-%d')}"])
-        writer.writerow([])
-
-        # Write user statistics
-        writer.writerow(['User Statistics'])
-        writer.writerow(['Role', 'Count'])
-
-        manager_count = Manager.query.filter_by(company_id=company_id).count()
-        operator_count = Operator.query.filter_by(company_id=company_id).count()
-        driver_count = Driver.query.filter_by(company_id=company_id).count()
-
-        writer.writerow(['Managers', manager_count])
-        writer.writerow(['Operators', operator_count])
-        writer.writerow(['Drivers', driver_count])
-        writer.writerow(['Total', manager_count + operator_count + driver_count])
-        writer.writerow([])
-
-        # Write task statistics
-        task_query = Task.query.filter(
-            Task.company_id == company_id,
-            Task.created_at.between(start_date, end_date)
-        )
-
-        total_tasks = task_query.count()
-        completed_tasks = task_query.filter(Task.status == TaskStatus.COMPLETED).count()
-        in_progress_tasks = task_query.filter(Task.status == TaskStatus.IN_PROGRESS).count()
-        new_tasks = task_query.filter(Task.status == TaskStatus.NEW).count()
-
-        completion_rate = (completed_tasks / total_tasks * 100) if total_tasks > 0 else 0
-
-        writer.writerow(['Task Statistics'])
-        writer.writerow(['Status', 'Count', 'Percentage'])
-        writer.writerow(['Completed', completed_tasks,
-                         f"{round(completed_tasks / total_tasks * 100 if total_tasks > 0 else 0, 2)}%"])
-        writer.writerow(['In Progress', in_progress_tasks,
-                         f"{round(in_progress_tasks / total_tasks * 100 if total_tasks > 0 else 0, 2)}%"])
-        writer.writerow(['New', new_tasks, f"{round(new_tasks / total_tasks * 100 if total_tasks > 0 else 0, 2)}%"])
-        writer.writerow(['Total', total_tasks, '100%'])
-        writer.writerow(['Completion Rate', '', f"{round(completion_rate, 2)}%"])
-        writer.writerow([])
-
-        # Write route statistics
-        route_query = Route.query.filter(
-            Route.company_id == company_id,
-            Route.start_time.between(start_date, end_date)
-        )
-
-        total_routes = route_query.count()
-        completed_routes = route_query.filter(Route.status == RouteStatus.COMPLETED).count()
-        in_progress_routes = route_query.filter(Route.status == RouteStatus.IN_PROGRESS).count()
-        planned_routes = route_query.filter(Route.status == RouteStatus.PLANNED).count()
-
-        route_completion_rate = (completed_routes / total_routes * 100) if total_routes > 0 else 0
-
-        total_distance_query = db.session.query(func.sum(Route.distance)).filter(
-            Route.company_id == company_id,
-            Route.status == RouteStatus.COMPLETED,
-            Route.start_time.between(start_date, end_date)
-        )
-        total_distance = total_distance_query.scalar() or 0
-
-        writer.writerow(['Route Statistics'])
-        writer.writerow(['Status', 'Count', 'Percentage'])
-        writer.writerow(['Completed', completed_routes,
-                         f"{round(completed_routes / total_routes * 100 if total_routes > 0 else 0, 2)}%"])
-        writer.writerow(['In Progress', in_progress_routes,
-                         f"{round(in_progress_routes / total_routes * 100 if total_routes > 0 else 0, 2)}%"])
-        writer.writerow(
-            ['Planned', planned_routes, f"{round(planned_routes / total_routes * 100 if total_routes > 0 else 0, 2)}%"])
-        writer.writerow(['Total', total_routes, '100%'])
-        writer.writerow(['Completion Rate', '', f"{round(route_completion_rate, 2)}%"])
-        writer.writerow(['Total Distance', f"{round(total_distance, 2)} km", ''])
-        writer.writerow([])
-
-        # Write top drivers
-        writer.writerow(['Top Drivers by Completed Routes'])
-        writer.writerow(['Driver Name', 'Completed Routes', 'Total Distance (km)', 'Avg Duration (min)'])
-
-        top_drivers = db.session.query(
-            Driver.id,
-            User.first_name,
-            User.last_name,
-            func.count(Route.id).label('route_count')
-        ).join(
-            User, Driver.id == User.id
-        ).join(
-            Route, Driver.id == Route.driver_id
-        ).filter(
-            Route.company_id == company_id,
-            Route.status == RouteStatus.COMPLETED,
-            Route.start_time.between(start_date, end_date)
-        ).group_by(
-            Driver.id, User.first_name, User.last_name
-        ).order_by(
-            func.count(Route.id).desc()
-        ).limit(5).all()
-
-        for driver_id, first_name, last_name, route_count in top_drivers:
-            # Calculate total distance
-            driver_distance_query = db.session.query(func.sum(Route.distance)).filter(
-                Route.driver_id == driver_id,
-                Route.status == RouteStatus.COMPLETED,
-                Route.start_time.between(start_date, end_date)
-            )
-            driver_distance = driver_distance_query.scalar() or 0
-
-            # Calculate average duration
-            avg_duration_query = db.session.query(
-                func.avg(
-                    func.extract('epoch', Route.end_time) -
-                    func.extract('epoch', Route.start_time)
-                ) / 60  # Convert to minutes
-            ).filter(
-                Route.driver_id == driver_id,
-                Route.status == RouteStatus.COMPLETED,
-                Route.start_time.isnot(None),
-                Route.end_time.isnot(None),
-                Route.start_time.between(start_date, end_date)
-            )
-            avg_duration = avg_duration_query.scalar() or 0
-
-            writer.writerow([
-                f"{first_name} {last_name}",
-                route_count,
-                round(driver_distance, 2),
-                round(avg_duration)
-            ])
-
-        # Prepare response
-        output.seek(0)
-        filename = f"company_report_{company.name}_{start_date.strftime('%Y%m%d')}_to_{end_date.strftime('%Y%m%d')}.csv"
-
-        return send_file(
-            io.BytesIO(output.getvalue().encode('utf-8')),
-            mimetype='text/csv',
-            as_attachment=True,
-            download_name=filename
+    payload = {
+        'report_id': report_id,
+        'company_id': company_id,
+        'start_date': start_date.isoformat(),
+        'end_date': end_date.isoformat(),
+        'format': format_type
+    }
+    dedup_key = f"report:{report_id}:{company_id or 'all'}:" \
+                f"{start_date.strftime('%Y%m%d%H%M%S')}:{end_date.strftime('%Y%m%d%H%M%S')}:{format_type}"
+
+    try:
+        job = job_queue.enqueue(
+            'reports.generate',
+            payload,
+            dedup_key=dedup_key,
+            user_id=current_user.id,
+            company_id=company_id
         )
+    except Exception as e:
+        current_app.logger.error(f"Error queueing {report_id} report: {str(e)}")
+        flash('Error generating report. Please try again.', 'danger')
+        return redirect(url_for('statistics.reports'))
 
-    elif format_type == 'excel':
-        # For excel format, we would use openpyxl or xlsxwriter
-        # This is a placeholder that returns CSV instead
-        flash('Excel export is not implemented yet. Returning CSV format instead.', 'warning')
-        return _generate_company_report(company_id, start_date, end_date, 'csv')
-
-    elif format_type == 'pdf':
-        # For PDF format, we would use a library like ReportLab
-        # This is a placeholder that returns CSV instead
-        flash('PDF export is not implemented yet. Returning CSV format instead.', 'warning')
-        return _generate_company_report(company_id, start_date, end_date, 'csv')
-
-    else:
-        flash('Invalid export format.', 'danger')
-        return redirect(url_for('statistics.reports'))
\ No newline at end of file
+    return redirect(url_for('jobs.job_page', job_id=job.id))
@@ -8,13 +8,14 @@ from app import db
 from forms import TaskForm, DocumentUploadForm, MessageForm
 from models import User, Task, TaskStatus, Route, Document, Message, UserRole, ActionType, Company
 from services import TaskService, MessageService
-from utils import role_required, company_access_required, log_action, save_document
+from utils import role_required, log_action, save_document
+from tenant import get_tenant
 
 from app import db
 from forms import TaskForm, DocumentUploadForm, MessageForm
 from models import User, Task, TaskStatus, Route, Document, Message, UserRole, ActionType
 from services import TaskService, MessageService
-from utils import role_required, company_access_required, log_action
+from utils import role_required, log_action
 from flask_wtf import FlaskForm
 from wtforms import (
     StringField, PasswordField, BooleanField, SubmitField,
@@ -38,21 +39,13 @@ def list_tasks():
     """
     List tasks with filters based on user role
     """
-    page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor')
     status = request.args.get('status', None)
     search_term = request.args.get('search', '')
     now = datetime.utcnow()  # Add this line to define 'now'
 
     # Get company ID based on user role
-    company_id = None
-    if current_user.role == UserRole.COMPANY_OWNER and current_user.company_owner:
-        company_id = current_user.company_owner.company_id
-    elif current_user.role == UserRole.MANAGER and current_user.manager:
-        company_id = current_user.manager.company_id
-    elif current_user.role == UserRole.OPERATOR and current_user.operator:
-        company_id = current_user.operator.company_id
-    elif current_user.role == UserRole.DRIVER and current_user.driver:
-        company_id = current_user.driver.company_id
+    company_id = get_tenant().company_id
 
     # Admin can see all tasks if no company filter
     if current_user.role == UserRole.ADMIN and not company_id:
@@ -81,7 +74,7 @@ def list_tasks():
 
     # Search tasks
     tasks = TaskService.search_tasks(
-        search_term, company_id, task_status, creator_id, assignee_id, page
+        search_term, company_id, task_status, creator_id, assignee_id, cursor
     )
 
     # Get available statuses for filtering
@@ -118,14 +111,8 @@ def create_task():
         form.company_id.choices = []
 
     # Get company ID based on user role
-    company_id = None
-    if current_user.role == UserRole.COMPANY_OWNER and current_user.company_owner:
-        company_id = current_user.company_owner.company_id
-    elif current_user.role == UserRole.MANAGER and current_user.manager:
-        company_id = current_user.manager.company_id
-    elif current_user.role == UserRole.OPERATOR and current_user.operator:
-        company_id = current_user.operator.company_id
-    elif current_user.role == UserRole.ADMIN:
+    company_id = get_tenant().company_id
+    if current_user.role == UserRole.ADMIN:
         # Admin must select a company
         form.company_id.choices = [(c.id, c.name) for c in Company.query.all()]
         if form.validate_on_submit():
@@ -431,15 +418,7 @@ def _can_access_task(task):
         return True
 
     # Get company ID based on user role
-    company_id = None
-    if current_user.role == UserRole.COMPANY_OWNER and current_user.company_owner:
-        company_id = current_user.company_owner.company_id
-    elif current_user.role == UserRole.MANAGER and current_user.manager:
-        company_id = current_user.manager.company_id
-    elif current_user.role == UserRole.OPERATOR and current_user.operator:
-        company_id = current_user.operator.company_id
-    elif current_user.role == UserRole.DRIVER and current_user.driver:
-        company_id = current_user.driver.company_id
+    company_id = get_tenant().company_id
 
     # Must be in same company
     if task.company_id != company_id:
@@ -460,14 +439,14 @@ def _can_edit_task(task):
     if current_user.role == UserRole.ADMIN:
         return True
 
-    if current_user.role == UserRole.COMPANY_OWNER and current_user.company_owner and task.company_id == current_user.company_owner.company_id:
+    if current_user.role == UserRole.COMPANY_OWNER and get_tenant().owns(task):
         return True
 
     if task.creator_id == current_user.id:
         return True
 
     # Manager can edit any task in their company
-    if current_user.role == UserRole.MANAGER and current_user.manager and task.company_id == current_user.manager.company_id:
+    if current_user.role == UserRole.MANAGER and get_tenant().owns(task):
         return True
 
     return False
@@ -481,7 +460,7 @@ def _can_delete_task(task):
     if current_user.role == UserRole.ADMIN:
         return True
 
-    if current_user.role == UserRole.COMPANY_OWNER and current_user.company_owner and task.company_id == current_user.company_owner.company_id:
+    if current_user.role == UserRole.COMPANY_OWNER and get_tenant().owns(task):
         return True
 
     if task.creator_id == current_user.id:
@@ -498,7 +477,7 @@ def _can_complete_task(task):
     if current_user.role == UserRole.ADMIN:
         return True
 
-    if current_user.role == UserRole.COMPANY_OWNER and current_user.company_owner and task.company_id == current_user.company_owner.company_id:
+    if current_user.role == UserRole.COMPANY_OWNER and get_tenant().owns(task):
         return True
 
     if task.creator_id == current_user.id:
@@ -508,7 +487,7 @@ def _can_complete_task(task):
         return True
 
     # Manager can complete any task in their company
-    if current_user.role == UserRole.MANAGER and current_user.manager and task.company_id == current_user.manager.company_id:
+    if current_user.role == UserRole.MANAGER and get_tenant().owns(task):
         return True
 
     return False
@@ -527,7 +506,7 @@ def _can_delete_document(document):
         return True
 
     # Company owner can delete any document in their company
-    if current_user.role == UserRole.COMPANY_OWNER and current_user.company_owner and document.company_id == current_user.company_owner.company_id:
+    if current_user.role == UserRole.COMPANY_OWNER and get_tenant().owns(document):
         return True
 
     # Task creator can delete documents on their tasks
@@ -555,14 +534,8 @@ def edit_task(task_id):
     form = TaskForm()
 
     # Get company ID based on user role
-    company_id = None
-    if current_user.role == UserRole.COMPANY_OWNER and current_user.company_owner:
-        company_id = current_user.company_owner.company_id
-    elif current_user.role == UserRole.MANAGER and current_user.manager:
-        company_id = current_user.manager.company_id
-    elif current_user.role == UserRole.OPERATOR and current_user.operator:
-        company_id = current_user.operator.company_id
-    elif current_user.role == UserRole.ADMIN:
+    company_id = get_tenant().company_id
+    if current_user.role == UserRole.ADMIN:
         company_id = task.company_id
 
     # Get available drivers for this company
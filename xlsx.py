@@ -0,0 +1,219 @@
+import math
+import re
+import zipfile
+from datetime import datetime, date
+from decimal import Decimal
+from xml.sax.saxutils import escape
+
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+# Day zero of the Excel 1900 date system (accounts for the 1900 leap year bug)
+EXCEL_EPOCH = datetime(1899, 12, 30)
+
+# Characters that are not allowed in XML 1.0 documents
+_ILLEGAL_XML_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+# Style indexes in _STYLES cellXfs
+STYLE_DEFAULT = 0
+STYLE_DATETIME = 1
+STYLE_DATE = 2
+
+_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '<Override PartName="/xl/styles.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+    '</Types>'
+)
+
+_ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+
+_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="{sheet_name}" sheetId="1" r:id="rId1"/></sheets>'
+    '</workbook>'
+)
+
+_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+    'Target="worksheets/sheet1.xml"/>'
+    '<Relationship Id="rId2" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" '
+    'Target="styles.xml"/>'
+    '</Relationships>'
+)
+
+_STYLES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<numFmts count="2">'
+    '<numFmt numFmtId="164" formatCode="yyyy-mm-dd hh:mm"/>'
+    '<numFmt numFmtId="165" formatCode="yyyy-mm-dd"/>'
+    '</numFmts>'
+    '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+    '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+    '<fill><patternFill patternType="gray125"/></fill></fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="3">'
+    '<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    '<xf numFmtId="165" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    '</cellXfs>'
+    '</styleSheet>'
+)
+
+_SHEET_HEADER = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+)
+
+_SHEET_FOOTER = '</sheetData></worksheet>'
+
+
+class _ChunkBuffer:
+    """
+    Write-only, non-seekable file object collecting zip output between reads
+
+    zipfile falls back to data descriptors when it can't seek, which lets
+    the archive be produced front to back.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self.size = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        """
+        Return the bytes written since the last drain
+        """
+        data = b''.join(self._chunks)
+        self._chunks = []
+        self.size = 0
+        return data
+
+
+def column_letter(index):
+    """
+    Convert a zero-based column index to its spreadsheet letter (0 -> A, 27 -> AB)
+    """
+    letters = ''
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+
+def excel_serial(value):
+    """
+    Convert a date or datetime to an Excel serial day number
+    """
+    if not isinstance(value, datetime):
+        value = datetime(value.year, value.month, value.day)
+    elapsed = value.replace(tzinfo=None) - EXCEL_EPOCH
+    return elapsed.days + elapsed.seconds / 86400 + elapsed.microseconds / 86400000000
+
+
+def _cell_xml(ref, value):
+    """
+    Render one typed cell; returns '' for empty values
+
+    NaN and infinity have no spreadsheet representation and are left empty;
+    Decimal values (Numeric columns) are written as numbers.
+    """
+    if value is None or value == '':
+        return ''
+    if isinstance(value, bool):
+        return f'<c r="{ref}" t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, Decimal):
+        value = float(value)
+    if isinstance(value, float):
+        if not math.isfinite(value):
+            return ''
+        return f'<c r="{ref}"><v>{float(value)!r}</v></c>'
+    if isinstance(value, int):
+        return f'<c r="{ref}"><v>{int(value)}</v></c>'
+    if isinstance(value, datetime):
+        return f'<c r="{ref}" s="{STYLE_DATETIME}"><v>{excel_serial(value)!r}</v></c>'
+    if isinstance(value, date):
+        return f'<c r="{ref}" s="{STYLE_DATE}"><v>{excel_serial(value)!r}</v></c>'
+
+    if hasattr(value, 'value') and not isinstance(value, str):
+        # Enum members are written by value
+        value = value.value
+    text = escape(_ILLEGAL_XML_CHARS.sub('', str(value)))
+    return f'<c r="{ref}" t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def _row_xml(row_number, row):
+    cells = ''.join(
+        _cell_xml(f'{column_letter(index)}{row_number}', value)
+        for index, value in enumerate(row)
+    )
+    return f'<row r="{row_number}">{cells}</row>'
+
+
+def iter_xlsx(rows, sheet_name='Report', chunk_size=64 * 1024):
+    """
+    Encode rows as a single-sheet XLSX workbook without building it in memory
+
+    Cells keep their Python types: numbers become numeric cells, dates and
+    datetimes become formatted date cells and everything else is written as
+    an inline string. The sheet XML is deflated as rows arrive and the zip
+    is emitted front to back, so memory use does not depend on the row count.
+
+    Args:
+        rows: Iterable of row sequences
+        sheet_name: Worksheet name (Excel allows at most 31 characters)
+        chunk_size: Approximate number of compressed bytes per yielded chunk
+
+    Yields:
+        Bytes chunks of the XLSX file
+    """
+    sheet_name = escape(re.sub(r'[\[\]:*?/\\]', '', sheet_name)[:31] or 'Report', {'"': '&quot;'})
+    buffer = _ChunkBuffer()
+
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('[Content_Types].xml', _CONTENT_TYPES)
+        archive.writestr('_rels/.rels', _ROOT_RELS)
+        archive.writestr('xl/workbook.xml', _WORKBOOK.format(sheet_name=sheet_name))
+        archive.writestr('xl/_rels/workbook.xml.rels', _WORKBOOK_RELS)
+        archive.writestr('xl/styles.xml', _STYLES)
+
+        # force_zip64 because the sheet size isn't known before it is written
+        with archive.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as sheet:
+            sheet.write(_SHEET_HEADER.encode('utf-8'))
+            for row_number, row in enumerate(rows, start=1):
+                sheet.write(_row_xml(row_number, row).encode('utf-8'))
+                if buffer.size >= chunk_size:
+                    yield buffer.drain()
+            sheet.write(_SHEET_FOOTER.encode('utf-8'))
+
+    yield buffer.drain()